@@ -1,23 +1,24 @@
+import json
 import os
-import mysql.connector
+import sys
+import time
+import click
 from dotenv import load_dotenv
-from flask import Flask, render_template_string, redirect, url_for, flash, request
-from .multipart import assemble_inbox_rows
+from flask import Flask, render_template_string, redirect, url_for, flash, request, jsonify, session, Response, abort
+from markupsafe import Markup
+from .cache import shared_cache
+from . import assets, contacts, conversations, export, extract, inbox, outbox, rollups, sources, stats
 
 # Load environment variables from .env file
 load_dotenv()
 
 # --- Configuration ---
-# Securely load credentials from environment variables
-DB_CONFIG = {
-    'host': os.environ.get('DB_HOST', 'localhost'),
-    'user': os.environ.get('DB_USER'),
-    'password': os.environ.get('DB_PASSWORD'),
-    'database': os.environ.get('DB_NAME'),
-}
+# Database credentials come from the environment; see sources.py for
+# declaring several Gammu databases (one per modem) with DB_SOURCES.
 
 # --- Flask Application ---
-app = Flask(__name__)
+# Static files are served by `asset` below under content-hashed names
+app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-default') # Used for flashing messages
 
 # Securely set SECRET_KEY: require in production, allow default in development
@@ -31,17 +32,84 @@ if not secret_key:
         raise RuntimeError("SECRET_KEY environment variable must be set in production.")
 app.config['SECRET_KEY'] = secret_key  # Used for flashing messages
 # --- Database Connection ---
-def get_db_connection():
-    """Establishes a connection to the MySQL database."""
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Error connecting to database: {err}")
-        return None
+get_db_connection = sources.get_db_connection
+
+# Messages per request of the dashboard's scrolling list
+LIST_PAGE_SIZE = 100
+
+
+@app.before_request
+def route_reads():
+    # Right after a write (read/delete), this browser reads from the primaries
+    # until replicas have had time to catch up; see sources.py.
+    sources.prefer_primary(session.get('primary_until', 0.0))
+
+
+def pin_primary():
+    until = time.time() + sources.replica_max_lag()
+    session['primary_until'] = until
+    sources.prefer_primary(until)
+
+
+@app.context_processor
+def inject_sources():
+    # Source badges are only shown when several Gammu databases are configured
+    return {'show_source': len(sources.all_sources()) > 1}
+
+
+def asset_url(name):
+    return url_for('asset', filename=assets.manifest.url_name(name))
+
+
+def icon(name, classes=''):
+    """Reference to a symbol of static/icons.svg; sizes are icon-lg, icon-xl and icon-4x."""
+    return Markup('<svg class="icon {}" aria-hidden="true"><use href="{}#{}"></use></svg>').format(
+        classes, asset_url('icons.svg'), name)
+
+
+@app.context_processor
+def inject_assets():
+    return {'asset_url': asset_url, 'icon': icon}
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Stylesheet, scripts and icons; hashed names are cached by browsers for a year."""
+    item, current = assets.manifest.lookup(filename)
+    if item is None:
+        abort(404)
+    body, encoding = item.variant(request.headers.get('Accept-Encoding', ''))
+    response = Response(body, mimetype=item.mimetype)
+    response.headers['Cache-Control'] = assets.IMMUTABLE if current else assets.REVALIDATE
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """ETag and gzip/brotli for HTML and JSON; assets and streamed exports pass through."""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in assets.DYNAMIC_TYPES):
+        return response
+    if request.method == 'GET':
+        # Pages change with every new SMS, so browsers revalidate; unchanged ones cost a 304
+        response.add_etag(weak=True)
+        response.headers.setdefault('Cache-Control', assets.REVALIDATE)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = assets.choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding and len(body) >= assets.MIN_COMPRESS_SIZE:
+        response.set_data(assets.compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 # --- HTML Template ---
-# This template uses Tailwind CSS and JavaScript for a modern, interactive UI.
+# Styles (Tailwind utility classes, precompiled) and scripts live in static/.
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -49,27 +117,8 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Gammu SMS Manager</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.2.0/css/all.min.css" rel="stylesheet">
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        body { font-family: 'Inter', sans-serif; }
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(10px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        .message-card {
-            animation: fadeIn 0.5s ease-out forwards;
-        }
-        .modal-overlay {
-            transition: opacity 0.3s ease;
-        }
-        .modal-panel {
-            transition: transform 0.3s ease, opacity 0.3s ease;
-        }
-    </style>
+    <link href="{{ asset_url('app.css') }}" rel="stylesheet">
+    <script src="{{ asset_url('inbox.js') }}" defer></script>
 </head>
 <body class="bg-gray-50 text-gray-800">
 
@@ -77,6 +126,14 @@ HTML_TEMPLATE = """
         <header class="mb-8 text-center">
             <h1 class="text-4xl md:text-5xl font-bold text-gray-900">SMS Inbox</h1>
             <p class="text-lg text-gray-500 mt-2">Manage messages from your Gammu database</p>
+            {% if counts %}
+            <p class="text-sm text-gray-400 mt-1">{{ counts.unread }} unread &middot; {{ counts.today }} today &middot; {{ counts.total }} total</p>
+            {% if counts.top_senders %}
+            <p class="text-xs text-gray-400 mt-1">Top senders:
+                {% for s in counts.top_senders %}{{ s.sender }} ({{ s.total }}){{ ', ' if not loop.last }}{% endfor %}
+            </p>
+            {% endif %}
+            {% endif %}
         </header>
 
         <!-- Flash Messages -->
@@ -84,89 +141,113 @@ HTML_TEMPLATE = """
           {% if messages %}
             {% for category, message in messages %}
               <div class="mb-4 p-4 rounded-lg shadow-md {{ 'bg-green-100 text-green-800' if category == 'success' else 'bg-red-100 text-red-800' }}" role="alert">
-                <i class="fas {{ 'fa-check-circle' if category == 'success' else 'fa-exclamation-triangle' }} mr-2"></i>{{ message }}
+                {{ icon('check-circle' if category == 'success' else 'exclamation-triangle', 'mr-2') }}{{ message }}
               </div>
             {% endfor %}
           {% endif %}
         {% endwith %}
 
-        <form id="bulk-action-form" action="{{ url_for('bulk_action') }}" method="POST">
-            <!-- Main Actions Header -->
-            <div class="flex items-center justify-between bg-white p-4 rounded-lg shadow-sm mb-6 sticky top-4 z-10">
-                <div class="flex items-center space-x-3">
-                    <input type="checkbox" id="select-all" class="h-5 w-5 rounded border-gray-300 text-indigo-600 focus:ring-indigo-500">
-                    <label for="select-all" class="text-gray-700 font-medium">Select All</label>
-                </div>
-                <a href="{{ url_for('index') }}" class="text-gray-500 hover:text-indigo-600 transition-colors duration-200" title="Refresh Messages">
-                    <i class="fas fa-sync-alt fa-lg"></i>
+        <!-- Main Actions Header -->
+        <div class="flex items-center justify-between bg-white p-4 rounded-lg shadow-sm mb-6 sticky top-4 z-10">
+            <div class="flex items-center space-x-3">
+                <input type="checkbox" id="select-all" class="h-5 w-5 rounded border-gray-300 text-indigo-600 focus:ring-indigo-500">
+                <label for="select-all" class="text-gray-700 font-medium">Select all matching</label>
+            </div>
+            <div class="flex items-center space-x-4">
+                <form id="filter-form" method="GET" action="{{ url_for('index') }}">
+                    {% if filters.sender %}<input type="hidden" name="sender" value="{{ filters.sender }}">{% endif %}
+                    <select id="state-filter" name="state" class="rounded-lg border border-gray-300 bg-white p-2 text-sm" title="Show">
+                        {% for value, label in [('all', 'All'), ('unread', 'Unread'), ('read', 'Read')] %}
+                        <option value="{{ value }}" {{ 'selected' if filters.state == value }}>{{ label }}</option>
+                        {% endfor %}
+                    </select>
+                </form>
+                <a href="{{ url_for('send_page') }}" class="text-gray-500 hover:text-indigo-600 transition-colors duration-200" title="Send SMS">
+                    {{ icon('paper-plane', 'icon-lg') }}
+                </a>
+                <a href="{{ url_for('conversations_page') }}" class="text-gray-500 hover:text-indigo-600 transition-colors duration-200" title="Conversations">
+                    {{ icon('comments', 'icon-lg') }}
+                </a>
+                <a href="{{ url_for('traffic_page') }}" class="text-gray-500 hover:text-indigo-600 transition-colors duration-200" title="Traffic">
+                    {{ icon('bar-chart', 'icon-lg') }}
+                </a>
+                <a href="{{ url_for('index', **filters) }}" class="text-gray-500 hover:text-indigo-600 transition-colors duration-200" title="Refresh Messages">
+                    {{ icon('sync', 'icon-lg') }}
                 </a>
             </div>
+        </div>
 
-            <!-- Messages Grid -->
-            <div class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6 pb-24">
-                {% if messages %}
-                    {% for message in messages %}
-                    <div class="message-card bg-white rounded-xl shadow-lg p-6 flex flex-col justify-between border-l-4 {{ 'border-indigo-500' if message.Processed == 'false' else 'border-gray-200' }} hover:shadow-xl transition-shadow duration-300">
-                        <div>
-                            <div class="flex justify-between items-start mb-4">
-                                <span class="font-bold text-xl text-gray-800">{{ message.SenderNumber }}</span>
-                                <input type="checkbox" name="message_ids" value="{{ message.ID }}" class="message-checkbox h-5 w-5 rounded border-gray-300 text-indigo-600 focus:ring-indigo-500">
-                            </div>
-                            <p class="text-gray-600 mb-5 break-words">{{ message.TextDecoded }}</p>
-                        </div>
-                        <div class="border-t border-gray-100 pt-4">
-                            <p class="text-xs text-gray-400 mb-4 text-left">{{ message.ReceivingDateTime.strftime('%B %d, %Y at %I:%M %p') }}</p>
-                             <div class="flex justify-between items-center">
-                                {% if message.Processed == 'false' %}
-                                    <span class="text-xs bg-indigo-100 text-indigo-800 font-semibold py-1 px-3 rounded-full">Unread</span>
-                                {% else %}
-                                     <span class="text-xs bg-gray-100 text-gray-600 font-semibold py-1 px-3 rounded-full">Read</span>
-                                {% endif %}
-                                <div class="flex items-center space-x-3">
-                                    <a href="{{ url_for('mark_as_read', message_id=message.ID) }}" class="text-gray-400 hover:text-green-500 transition-colors" title="Mark as Read">
-                                        <i class="fas fa-check-circle fa-lg"></i>
-                                    </a>
-                                    <button type="button" onclick="showDeleteModal('{{ url_for('delete_message', message_id=message.ID) }}')" class="text-gray-400 hover:text-red-500 transition-colors" title="Delete Message">
-                                        <i class="fas fa-trash-alt fa-lg"></i>
-                                    </button>
-                                </div>
-                            </div>
-                        </div>
+        <!-- Message list: only the cards in view exist; pages are fetched while scrolling (inbox.js) -->
+        <div id="message-list" class="virtual-list pb-24"
+             data-api="{{ url_for('messages_json') }}"
+             data-send-url="{{ url_for('send_page') }}"
+             data-read-url="{{ url_for('mark_as_read', message_ids='REF') }}"
+             data-delete-url="{{ url_for('delete_message', message_ids='REF') }}"></div>
+        <div id="empty-state" class="{{ 'hidden' if first_page.messages }} text-center py-16 bg-white rounded-lg shadow-sm">
+            {{ icon('inbox', 'icon-4x text-gray-300 mb-4') }}
+            <h2 class="text-2xl font-semibold text-gray-700">Inbox is Empty</h2>
+            <p class="text-gray-500 mt-1">New messages will appear here.</p>
+        </div>
+        <script type="application/json" id="inbox-data">{{ {'page': first_page, 'snapshot': snapshot, 'filters': filters}|tojson }}</script>
+
+        <template id="message-card">
+            <div class="message-card bg-white rounded-xl shadow-lg p-6 flex flex-col justify-between border-l-4 hover:shadow-xl transition-shadow duration-300">
+                <div>
+                    <div class="flex justify-between items-start mb-4">
+                        <span class="font-bold text-xl text-gray-800"><span data-field="sender"></span>
+                            {% if show_source %}<span data-field="source" class="ml-2 text-xs font-medium bg-gray-100 text-gray-500 py-1 px-2 rounded-full"></span>{% endif %}
+                        </span>
+                        <input type="checkbox" class="message-checkbox h-5 w-5 rounded border-gray-300 text-indigo-600 focus:ring-indigo-500">
                     </div>
-                    {% endfor %}
-                {% else %}
-                    <div class="col-span-full text-center py-16 bg-white rounded-lg shadow-sm">
-                         <i class="fas fa-inbox fa-4x text-gray-300 mb-4"></i>
-                         <h2 class="text-2xl font-semibold text-gray-700">Inbox is Empty</h2>
-                         <p class="text-gray-500 mt-1">New messages will appear here.</p>
+                    <p data-field="text" class="text-gray-600 mb-5 break-words line-clamp-3"></p>
+                    <div data-field="extracted" class="copy-chips hidden"></div>
+                </div>
+                <div class="border-t border-gray-100 pt-4">
+                    <p data-field="time" class="text-xs text-gray-400 mb-4 text-left"></p>
+                    <div class="flex justify-between items-center">
+                        <span data-field="unread" class="text-xs bg-indigo-100 text-indigo-800 font-semibold py-1 px-3 rounded-full">Unread</span>
+                        <span data-field="read" class="text-xs bg-gray-100 text-gray-600 font-semibold py-1 px-3 rounded-full">Read</span>
+                        <div class="flex items-center space-x-3">
+                            <a data-field="reply" href="#" class="text-gray-400 hover:text-indigo-500 transition-colors" title="Reply">
+                                {{ icon('reply', 'icon-lg') }}
+                            </a>
+                            <a data-field="mark-read" href="#" class="text-gray-400 hover:text-green-500 transition-colors" title="Mark as Read">
+                                {{ icon('check-circle', 'icon-lg') }}
+                            </a>
+                            <button type="button" data-field="delete" class="text-gray-400 hover:text-red-500 transition-colors" title="Delete Message">
+                                {{ icon('trash', 'icon-lg') }}
+                            </button>
+                        </div>
                     </div>
-                {% endif %}
+                </div>
             </div>
-
-            <!-- Floating Action Bar -->
-            <div id="floating-bar" class="hidden fixed bottom-0 left-0 right-0 bg-white/80 backdrop-blur-sm border-t border-gray-200 shadow-lg p-4 z-50 transition-transform duration-300 translate-y-full">
-                <div class="container mx-auto flex justify-between items-center">
-                    <span id="selection-count" class="font-semibold text-gray-700">0 items selected</span>
-                    <div class="space-x-3">
-                        <button type="submit" name="action" value="read" class="bg-green-500 hover:bg-green-600 text-white font-bold py-2 px-5 rounded-lg transition-colors shadow-sm hover:shadow-md">
-                            <i class="fas fa-check-circle mr-2"></i>Mark as Read
-                        </button>
-                        <button type="button" onclick="showBulkDeleteModal()" class="bg-red-500 hover:bg-red-600 text-white font-bold py-2 px-5 rounded-lg transition-colors shadow-sm hover:shadow-md">
-                            <i class="fas fa-trash-alt mr-2"></i>Delete
-                        </button>
-                    </div>
+        </template>
+
+        <!-- Floating Action Bar -->
+        <div id="floating-bar" class="hidden fixed bottom-0 left-0 right-0 bg-white/80 backdrop-blur-sm border-t border-gray-200 shadow-lg p-4 z-50 transition-transform duration-300 translate-y-full">
+            <div class="container mx-auto flex justify-between items-center">
+                <span id="selection-count" class="font-semibold text-gray-700">0 items selected</span>
+                <div class="space-x-3">
+                    <button type="button" id="bulk-read" class="bg-green-500 hover:bg-green-600 text-white font-bold py-2 px-5 rounded-lg transition-colors shadow-sm hover:shadow-md">
+                        {{ icon('check-circle', 'mr-2') }}Mark as Read
+                    </button>
+                    <button type="button" id="bulk-delete" class="bg-red-500 hover:bg-red-600 text-white font-bold py-2 px-5 rounded-lg transition-colors shadow-sm hover:shadow-md">
+                        {{ icon('trash', 'mr-2') }}Delete
+                    </button>
                 </div>
             </div>
-        </form>
+        </div>
+        <!-- Filled by inbox.js from the selection: message_ids, or select_all with the filter -->
+        <form id="bulk-action-form" action="{{ url_for('bulk_action') }}" method="POST" class="hidden"></form>
     </div>
 
     <!-- Delete Confirmation Modal -->
     <div id="delete-modal" class="fixed inset-0 z-50 hidden items-center justify-center p-4">
-        <div class="modal-overlay fixed inset-0 bg-black/50" onclick="hideDeleteModal()"></div>
+        <div class="modal-overlay fixed inset-0 bg-black/50"></div>
         <div class="modal-panel bg-white rounded-lg shadow-xl p-6 w-full max-w-md transform scale-95 opacity-0">
             <div class="text-center">
                 <div class="mx-auto flex items-center justify-center h-12 w-12 rounded-full bg-red-100">
-                    <i class="fas fa-exclamation-triangle fa-xl text-red-600"></i>
+                    {{ icon('exclamation-triangle', 'icon-xl text-red-600') }}
                 </div>
                 <h3 class="text-lg leading-6 font-medium text-gray-900 mt-4">Delete Message(s)</h3>
                 <div class="mt-2">
@@ -179,212 +260,573 @@ HTML_TEMPLATE = """
                         Confirm Delete
                     </button>
                 </form>
-                <button type="button" onclick="hideDeleteModal()" class="w-full inline-flex justify-center rounded-md border border-gray-300 shadow-sm px-4 py-2 bg-white text-base font-medium text-gray-700 hover:bg-gray-50 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-indigo-500">
+                <button type="button" id="delete-cancel" class="w-full inline-flex justify-center rounded-md border border-gray-300 shadow-sm px-4 py-2 bg-white text-base font-medium text-gray-700 hover:bg-gray-50 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-indigo-500">
                     Cancel
                 </button>
             </div>
         </div>
     </div>
 
-    <script>
-        document.addEventListener('DOMContentLoaded', function () {
-            const selectAllCheckbox = document.getElementById('select-all');
-            const messageCheckboxes = document.querySelectorAll('.message-checkbox');
-            const floatingBar = document.getElementById('floating-bar');
-            const selectionCount = document.getElementById('selection-count');
-            const bulkActionForm = document.getElementById('bulk-action-form');
-            const deleteModal = document.getElementById('delete-modal');
-            const modalOverlay = deleteModal.querySelector('.modal-overlay');
-            const modalPanel = deleteModal.querySelector('.modal-panel');
-            const deleteConfirmForm = document.getElementById('delete-confirm-form');
-
-            function updateFloatingBar() {
-                const selectedCount = document.querySelectorAll('.message-checkbox:checked').length;
-                if (selectedCount > 0) {
-                    floatingBar.classList.remove('hidden');
-                    floatingBar.classList.remove('translate-y-full');
-                    selectionCount.textContent = `${selectedCount} item${selectedCount > 1 ? 's' : ''} selected`;
-                } else {
-                    floatingBar.classList.add('translate-y-full');
-                }
-            }
-
-            selectAllCheckbox.addEventListener('change', function () {
-                messageCheckboxes.forEach(checkbox => {
-                    checkbox.checked = selectAllCheckbox.checked;
-                });
-                updateFloatingBar();
-            });
-
-            messageCheckboxes.forEach(checkbox => {
-                checkbox.addEventListener('change', function () {
-                    selectAllCheckbox.checked = (document.querySelectorAll('.message-checkbox:checked').length === messageCheckboxes.length);
-                    updateFloatingBar();
-                });
-            });
-
-            window.showDeleteModal = function(deleteUrl) {
-                deleteConfirmForm.action = deleteUrl;
-                deleteModal.classList.remove('hidden');
-                deleteModal.classList.add('flex');
-                setTimeout(() => {
-                    modalOverlay.classList.remove('opacity-0');
-                    modalPanel.classList.remove('opacity-0', 'scale-95');
-                }, 10);
-            }
-
-            window.hideDeleteModal = function() {
-                modalOverlay.classList.add('opacity-0');
-                modalPanel.classList.add('opacity-0', 'scale-95');
-                setTimeout(() => {
-                    deleteModal.classList.add('hidden');
-                    deleteModal.classList.remove('flex');
-                }, 300);
-            }
-            
-            window.showBulkDeleteModal = function() {
-                // Set form to submit with 'delete' action, then show modal
-                const hiddenInputAction = document.createElement('input');
-                hiddenInputAction.type = 'hidden';
-                hiddenInputAction.name = 'action';
-                hiddenInputAction.value = 'delete';
-                
-                // Remove any existing hidden action input to avoid duplicates
-                const existingInput = bulkActionForm.querySelector('input[name="action"]');
-                if(existingInput) existingInput.remove();
-
-                bulkActionForm.appendChild(hiddenInputAction);
-                
-                // The modal's confirm button will now submit the main form
-                deleteConfirmForm.action = 'javascript:document.getElementById("bulk-action-form").submit()';
-                
-                deleteModal.classList.remove('hidden');
-                deleteModal.classList.add('flex');
-                 setTimeout(() => {
-                    modalOverlay.classList.remove('opacity-0');
-                    modalPanel.classList.remove('opacity-0', 'scale-95');
-                }, 10);
-            }
-
-            updateFloatingBar();
-        });
-    </script>
+</body>
+</html>
+"""
+
+# Conversation view: the sender list is rendered server-side from the index
+# table; threads are fetched page by page from the JSON endpoint on click.
+CONVERSATIONS_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Conversations - Gammu SMS Manager</title>
+    <link href="{{ asset_url('app.css') }}" rel="stylesheet">
+    <script src="{{ asset_url('conversations.js') }}" defer></script>
+</head>
+<body class="bg-gray-50 text-gray-800">
+    <div class="container mx-auto p-4 sm:p-6 lg:p-8">
+        <header class="mb-8 flex items-center justify-between">
+            <h1 class="text-3xl md:text-4xl font-bold text-gray-900">Conversations</h1>
+            <a href="{{ url_for('index') }}" class="text-gray-500 hover:text-indigo-600 transition-colors" title="Inbox">
+                {{ icon('inbox', 'icon-lg') }}
+            </a>
+        </header>
+
+        <div class="grid grid-cols-1 md:grid-cols-3 gap-6">
+            <ul id="sender-list" class="bg-white rounded-xl shadow-lg divide-y divide-gray-100 md:col-span-1 max-h-[80vh] overflow-y-auto">
+                {% for c in conversations %}
+                <li>
+                    <button type="button" data-senders="{{ c.numbers|tojson|forceescape }}" data-title="{{ c.name ~ ' · ' if c.name }}{{ c.sender }}" class="sender-item w-full text-left p-4 hover:bg-gray-50 transition-colors">
+                        <div class="flex justify-between items-center">
+                            <span class="font-semibold text-gray-800">{{ c.name or c.sender }}{% if c.name %} <span class="text-xs font-medium text-gray-500">{{ c.sender }}</span>{% endif %}</span>
+                            {% if c.unread > 0 %}
+                            <span class="text-xs bg-indigo-100 text-indigo-800 font-semibold py-1 px-2 rounded-full">{{ c.unread }}</span>
+                            {% endif %}
+                        </div>
+                        <p class="text-sm text-gray-500 truncate">{{ c.last_text }}</p>
+                        <p class="text-xs text-gray-400">{{ c.last_activity }}</p>
+                    </button>
+                </li>
+                {% else %}
+                <li class="p-6 text-center text-gray-500">No conversations yet.</li>
+                {% endfor %}
+            </ul>
+
+            <section class="md:col-span-2">
+                <h2 id="thread-title" class="text-xl font-semibold text-gray-700 mb-4">Select a sender</h2>
+                <div id="thread" class="space-y-4" data-url="{{ url_for('conversation_thread') }}"></div>
+                <button type="button" id="load-more" class="hidden mt-6 w-full bg-white hover:bg-gray-100 text-gray-700 font-medium py-2 rounded-lg shadow-sm">
+                    Load older messages
+                </button>
+            </section>
+        </div>
+    </div>
+
+</body>
+</html>
+"""
+
+# Traffic chart: bars are drawn by traffic.js from /api/traffic (rollup tables only).
+TRAFFIC_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Traffic - Gammu SMS Manager</title>
+    <link href="{{ asset_url('app.css') }}" rel="stylesheet">
+    <script src="{{ asset_url('traffic.js') }}" defer></script>
+</head>
+<body class="bg-gray-50 text-gray-800">
+    <div class="container mx-auto p-4 sm:p-6 lg:p-8">
+        <header class="mb-8 flex items-center justify-between">
+            <h1 class="text-3xl md:text-4xl font-bold text-gray-900">Traffic</h1>
+            <a href="{{ url_for('index') }}" class="text-gray-500 hover:text-indigo-600 transition-colors" title="Inbox">
+                {{ icon('inbox', 'icon-lg') }}
+            </a>
+        </header>
+
+        <form id="traffic-form" class="flex items-center gap-3 mb-6" data-api="{{ url_for('traffic_json') }}">
+            <select name="range" class="rounded-lg border border-gray-300 bg-white p-2 text-sm" title="Range">
+                {% for value, label in [('hour:48', 'Last 48 hours'), ('hour:168', 'Last 7 days, hourly'), ('day:30', 'Last 30 days'), ('day:365', 'Last 12 months')] %}
+                <option value="{{ value }}">{{ label }}</option>
+                {% endfor %}
+            </select>
+            <input type="text" name="sender" value="{{ sender }}" placeholder="All senders" class="rounded-lg border border-gray-300 bg-white p-2 text-sm">
+            <button type="submit" class="bg-white hover:bg-gray-100 text-gray-700 font-medium py-2 px-4 rounded-lg shadow-sm">Show</button>
+        </form>
+
+        <section class="bg-white rounded-xl shadow-lg p-6 mb-6">
+            <div class="flex justify-between items-center mb-4">
+                <h2 id="traffic-title" class="text-xl font-semibold text-gray-700">Messages</h2>
+                <p class="text-sm text-gray-500"><span class="traffic-legend-unread"></span> Unread <span class="traffic-legend-read ml-2"></span> Read</p>
+            </div>
+            <div id="traffic-chart" class="traffic-chart"></div>
+            <div class="flex justify-between text-xs text-gray-400 mt-2">
+                <span id="traffic-start"></span><span id="traffic-end"></span>
+            </div>
+        </section>
+
+        <section class="bg-white rounded-xl shadow-lg p-6">
+            <h2 class="text-xl font-semibold text-gray-700 mb-4">Top senders</h2>
+            <ul id="traffic-senders" class="divide-y divide-gray-100"></ul>
+        </section>
+    </div>
+
+</body>
+</html>
+"""
+
+# Send form: recipients and text are queued into Gammu's outbox (see outbox.py).
+# The part counter mirrors segmenter.py (GSM-7 160/153, UCS-2 70/67).
+SEND_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Send SMS - Gammu SMS Manager</title>
+    <link href="{{ asset_url('app.css') }}" rel="stylesheet">
+    <script src="{{ asset_url('send.js') }}" defer></script>
+</head>
+<body class="bg-gray-50 text-gray-800">
+    <div class="container mx-auto p-4 sm:p-6 lg:p-8 max-w-2xl">
+        <header class="mb-8 flex items-center justify-between">
+            <h1 class="text-3xl md:text-4xl font-bold text-gray-900">Send SMS</h1>
+            <a href="{{ url_for('index') }}" class="text-gray-500 hover:text-indigo-600 transition-colors" title="Inbox">
+                {{ icon('inbox', 'icon-lg') }}
+            </a>
+        </header>
+
+        {% with messages = get_flashed_messages(with_categories=true) %}
+          {% if messages %}
+            {% for category, message in messages %}
+              <div class="mb-4 p-4 rounded-lg shadow-md {{ 'bg-green-100 text-green-800' if category == 'success' else 'bg-red-100 text-red-800' }}" role="alert">
+                {{ icon('check-circle' if category == 'success' else 'exclamation-triangle', 'mr-2') }}{{ message }}
+              </div>
+            {% endfor %}
+          {% endif %}
+        {% endwith %}
+
+        <form method="POST" action="{{ url_for('send_page') }}" class="bg-white rounded-xl shadow-lg p-6 space-y-5">
+            <div>
+                <label for="to" class="block font-medium text-gray-700 mb-1">Recipients</label>
+                <textarea id="to" name="to" rows="2" required placeholder="+15551234567, +15557654321" class="w-full rounded-lg border border-gray-300 p-3 focus:ring-indigo-500 focus:border-indigo-500">{{ to }}</textarea>
+                <p class="text-xs text-gray-400 mt-1">Separate numbers with commas or new lines.</p>
+            </div>
+            {% if show_source %}
+            <div>
+                <label for="source" class="block font-medium text-gray-700 mb-1">Send via</label>
+                <select id="source" name="source" class="w-full rounded-lg border border-gray-300 p-3">
+                    {% for s in source_ids %}
+                    <option value="{{ s }}" {{ 'selected' if s == selected_source }}>{{ s }}</option>
+                    {% endfor %}
+                </select>
+            </div>
+            {% endif %}
+            <div>
+                <label for="text" class="block font-medium text-gray-700 mb-1">Message</label>
+                <textarea id="text" name="text" rows="6" required class="w-full rounded-lg border border-gray-300 p-3 focus:ring-indigo-500 focus:border-indigo-500">{{ text }}</textarea>
+                <p id="part-count" class="text-xs text-gray-400 mt-1"></p>
+            </div>
+            <button type="submit" class="w-full bg-indigo-600 hover:bg-indigo-700 text-white font-bold py-3 rounded-lg transition-colors shadow-sm">
+                {{ icon('paper-plane', 'mr-2') }}Queue for sending
+            </button>
+        </form>
+    </div>
+
 </body>
 </html>
 """
 
 # --- App Routes ---
 
+def _inbox_fingerprint(conn, source):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(ID) FROM inbox")
+        return cursor.fetchone()[0] or 0
+    finally:
+        cursor.close()
+
+
+def _list_filter(args):
+    """WHERE clause for the message list filters: sender and state=all|unread|read."""
+    return export.build_filter(sender=args.get('sender') or None, state=args.get('state') or 'all')
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness probe for the production supervisor; touches no database."""
+    return Response('ok', mimetype='text/plain')
+
+
 @app.route('/')
 def index():
-    """Main page, displays all messages from the inbox."""
-    conn = get_db_connection()
-    if not conn:
+    """Main page: the first page of the message list; the script fetches the rest while scrolling."""
+    filters = {'sender': request.args.get('sender', ''), 'state': request.args.get('state', 'all')}
+    try:
+        where, params = _list_filter(filters)
+    except ValueError as err:
+        flash(str(err), "error")
+        filters['state'] = 'all'
+        where, params = _list_filter(filters)
+
+    # Gammu only appends rows, so the newest ID per source fingerprints the inbox;
+    # reads and deletes bump the shared cache generation instead. The fingerprints
+    # also bound "select all matching" to the rows this page could have shown.
+    # Taken before reading, so a page built from pre-change rows is never stored as current
+    generation = shared_cache.version()
+    fingerprints = sources.fan_out(sources.with_connection(_inbox_fingerprint, None, read_only=True))
+    snapshot = {sid: fp for sid, fp in fingerprints.items() if fp is not None}
+    empty = {'messages': [], 'next': None}
+    if not snapshot:
         flash("Database connection failed. Check console for errors.", "error")
-        return render_template_string(HTML_TEMPLATE, messages=[])
+        return render_template_string(HTML_TEMPLATE, first_page=empty, counts=None, snapshot={}, filters=filters)
+    failed = [sid for sid, fp in fingerprints.items() if fp is None]
+    if failed:
+        flash(f"Failed to fetch messages from: {', '.join(failed)}", "error")
+
+    cache_key = "inbox:" + ",".join(f"{sid}={fp}" for sid, fp in sorted(fingerprints.items()))
+    cache_key += f":{filters['state']}:{filters['sender']}"
+    cached = shared_cache.get(cache_key)
+    if cached is None:
+        messages, next_cursor = sources.fetch_page(limit=LIST_PAGE_SIZE, where=where, params=params)
+        cached = {
+            'page': _page_json(messages, next_cursor),
+            'counts': load_stats(),
+        }
+        if not failed:
+            # A page read from a replica may miss a write made elsewhere just before;
+            # keep it no longer than the lag we tolerate.
+            ttl = sources.replica_max_lag() if sources.reads_may_lag() else None
+            shared_cache.set(cache_key, cached, ttl=ttl, version=generation)
 
-    cursor = conn.cursor(dictionary=True)
-    try:
-        # Include UDH and SequencePosition to support multipart assembly when available
-        cursor.execute("""
-            SELECT ID, SenderNumber, TextDecoded, ReceivingDateTime, Processed,
-                   UDH
-            FROM inbox
-            ORDER BY ReceivingDateTime DESC
-        """)
-        raw_messages = cursor.fetchall()
-        # Assemble multipart messages and drop empty/blank rows
-        messages = assemble_inbox_rows(raw_messages)
-    except mysql.connector.Error as err:
-        flash(f"Failed to fetch messages: {err}", "error")
-        messages = []
-    finally:
-        cursor.close()
-        conn.close()
+    return render_template_string(HTML_TEMPLATE, first_page=cached['page'], counts=cached['counts'],
+                                  snapshot=snapshot, filters=filters)
 
-    return render_template_string(HTML_TEMPLATE, messages=messages)
 
-@app.route('/read/<int:message_id>')
-def mark_as_read(message_id):
-    """Marks a single message as read."""
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection failed.", "error")
-        return redirect(url_for('index'))
+def _page_json(messages, next_cursor):
+    """A page of messages for the API and the inbox script, with contact names and extracted codes, amounts and links."""
+    found = extract.lookup_all(messages)
+    directory = contacts.directory()
+    items = []
+    for m in messages:
+        item = m.to_json()
+        item['sender'] = directory.label(m.SenderNumber)
+        item['extracted'] = found[(m.source, m.ID)].to_json()
+        items.append(item)
+    return {'messages': items, 'next': next_cursor}
 
-    cursor = conn.cursor()
+
+def _sync(conn, source):
+    stats.sync(conn)
+
+
+def _summarize(conn, source):
+    return stats.summary(conn)
+
+
+def load_stats():
+    """Bring every source's summary table up to date and return the combined counters, or None."""
+    # The incremental sync writes, so it runs on the primary; the summary is a read
+    sources.fan_out(sources.with_connection(_sync, None))
+    summaries = sources.fan_out(sources.with_connection(_summarize, None, read_only=True))
+    available = [s for s in summaries.values() if s is not None]
+    if not available:
+        return None
+    return stats.combine(available)
+
+
+def _list_conversations(conn, source):
+    return conversations.list_conversations(conn)
+
+
+def load_conversations(limit=5000):
+    """Conversation index merged across sources (one entry per sender)."""
+    sources.fan_out(sources.with_connection(_sync, None))
+    per_source = sources.fan_out(sources.with_connection(_list_conversations, [], read_only=True))
+    return conversations.merge(per_source.values(), limit=limit)
+
+
+@app.route('/stats')
+def stats_json():
+    """Inbox counters (total, unread, today, top senders) from the summary tables."""
+    summary = load_stats()
+    if summary is None:
+        return jsonify({'error': 'Failed to load stats.'}), 503
+    return jsonify(summary)
+
+@app.route('/conversations')
+def conversations_page():
+    """Conversation index: one entry per sender, threads loaded on demand."""
+    return render_template_string(CONVERSATIONS_TEMPLATE, conversations=load_conversations())
+
+@app.route('/api/conversations')
+def conversations_json():
+    """Conversation index as JSON."""
+    items = load_conversations(limit=max(1, min(request.args.get('limit', 5000, type=int), 5000)))
+    return jsonify({'conversations': items})
+
+@app.route('/api/conversations/thread')
+def conversation_thread():
+    """
+    One page of a sender's assembled messages; pass `next` back as `before`
+    for older ones. `sender` may be repeated, once per spelling of the number.
+    """
+    senders = list(dict.fromkeys(request.args.getlist('sender')))[:20]
+    if not senders:
+        return jsonify({'error': 'sender is required.'}), 400
+    messages, next_cursor = sources.fetch_page(
+        limit=max(1, min(request.args.get('limit', 20, type=int), 100)),
+        before=request.args.get('before'),
+        where=["SenderNumber = %s"] * len(senders),
+        params=[(sender,) for sender in senders],
+    )
+    return jsonify(_page_json(messages, next_cursor))
+
+
+def _traffic(granularity, start, end, senders):
+    def run(conn, source):
+        return (rollups.series(conn, granularity, start, end, senders),
+                rollups.top_senders(conn, granularity, start, end, senders=senders))
+    return run
+
+
+def load_traffic(granularity, count, sender=None):
+    """Per-bucket message counts for the last `count` hours or days, merged across sources."""
+    start, end = rollups.window(granularity, count)
+    sources.fan_out(sources.with_connection(_sync, None))
+    senders = contacts.spellings(sender) if sender else None
+    per_source = sources.fan_out(sources.with_connection(
+        _traffic(granularity, start, end, senders), ({}, []), read_only=True))
+    return rollups.combine(per_source.values(), granularity, start, end)
+
+
+@app.route('/traffic')
+def traffic_page():
+    """Message volume chart per hour or day, optionally for one sender."""
+    return render_template_string(TRAFFIC_TEMPLATE, sender=request.args.get('sender', ''))
+
+
+@app.route('/api/traffic')
+def traffic_json():
+    """
+    Message counts per bucket from the rollup tables: `granularity` is hour
+    or day, `count` the number of buckets up to now, `sender` optional.
+    """
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in rollups.TABLES:
+        return jsonify({'error': 'granularity must be hour or day.'}), 400
+    count = request.args.get('count', 48 if granularity == 'hour' else 30, type=int)
+    return jsonify(load_traffic(granularity, count, request.args.get('sender', '').strip() or None))
+
+
+@app.route('/api/messages')
+def messages_json():
+    """
+    One page of assembled messages merged across all sources, newest first.
+
+    Optional filters: sender and state=all|unread|read. Pass `next` back as
+    `before` for the following page.
+    """
     try:
-        cursor.execute("UPDATE inbox SET Processed = 'true' WHERE ID = %s", (message_id,))
-        conn.commit()
+        where, params = _list_filter(request.args)
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    messages, next_cursor = sources.fetch_page(
+        limit=max(1, min(request.args.get('limit', 50, type=int), 200)),
+        before=request.args.get('before'),
+        where=where,
+        params=params,
+    )
+    return jsonify(_page_json(messages, next_cursor))
+
+@app.route('/read/<message_ids>')
+def mark_as_read(message_ids):
+    """Marks a single message (all of its parts) as read."""
+    refs = sources.parse_refs([message_ids])
+    if not refs:
+        flash("Invalid message ID.", "error")
+        return redirect(url_for('index'))
+
+    _changed, errors = inbox.mark_read(refs)
+    pin_primary()
+    if errors:
+        flash(f"Error updating message: {'; '.join(errors)}", "error")
+    else:
         flash("Message marked as read.", "success")
-    except mysql.connector.Error as err:
-        flash(f"Error updating message: {err}", "error")
-    finally:
-        cursor.close()
-        conn.close()
 
     return redirect(url_for('index'))
 
-@app.route('/delete/<int:message_id>', methods=['POST'])
-def delete_message(message_id):
-    """Deletes a single message."""
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection failed.", "error")
+@app.route('/delete/<message_ids>', methods=['POST'])
+def delete_message(message_ids):
+    """Deletes a single message (all of its parts)."""
+    refs = sources.parse_refs([message_ids])
+    if not refs:
+        flash("Invalid message ID.", "error")
         return redirect(url_for('index'))
 
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM inbox WHERE ID = %s", (message_id,))
-        conn.commit()
+    _changed, errors = inbox.delete(refs)
+    pin_primary()
+    if errors:
+        flash(f"Error deleting message: {'; '.join(errors)}", "error")
+    else:
         flash("Message deleted successfully.", "success")
-    except mysql.connector.Error as err:
-        flash(f"Error deleting message: {err}", "error")
-    finally:
-        cursor.close()
-        conn.close()
 
     return redirect(url_for('index'))
 
 @app.route('/bulk_action', methods=['POST'])
 def bulk_action():
-    """Handles bulk actions (delete, mark as read) on selected messages."""
+    """
+    Handles bulk actions (delete, mark as read) on selected messages.
+
+    The form carries either the selected references (`message_ids`) or, for
+    "select all matching", `select_all=1` with the list filters, the page's
+    `snapshot` ({source: newest ID}) and the references unticked afterwards
+    (`exclude`).
+    """
     action = request.form.get('action')
-    message_ids = request.form.getlist('message_ids')
+    if request.form.get('select_all') == '1':
+        try:
+            where, params = _list_filter(request.form)
+            snapshot = json.loads(request.form.get('snapshot') or '{}')
+        except ValueError as err:
+            flash(f"Invalid selection: {err}", "error")
+            return redirect(url_for('index'))
+        exclude = sources.parse_refs(request.form.getlist('exclude'))
+        refs = inbox.select_matching(where, params, snapshot, exclude)
+        selected = "All matching"
+    else:
+        refs = sources.parse_refs(request.form.getlist('message_ids'))
+        selected = len(request.form.getlist('message_ids'))
 
-    if not action or not message_ids:
+    if not action or not refs:
         flash("No action or no messages selected.", "error")
         return redirect(url_for('index'))
 
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection failed.", "error")
+    if action == 'read':
+        _changed, errors = inbox.mark_read(refs)
+        done = f"{selected} message(s) marked as read."
+    elif action == 'delete':
+        _changed, errors = inbox.delete(refs)
+        done = f"{selected} message(s) deleted."
+    else:
+        flash("Unknown action.", "error")
         return redirect(url_for('index'))
 
-    cursor = conn.cursor()
-    try:
-        placeholders = ', '.join(['%s'] * len(message_ids))
-        
-        if action == 'read':
-            query = f"UPDATE inbox SET Processed = 'true' WHERE ID IN ({placeholders})"
-            cursor.execute(query, tuple(message_ids))
-            flash(f"{cursor.rowcount} message(s) marked as read.", "success")
-        elif action == 'delete':
-            query = f"DELETE FROM inbox WHERE ID IN ({placeholders})"
-            cursor.execute(query, tuple(message_ids))
-            flash(f"{cursor.rowcount} message(s) deleted.", "success")
-        
-        conn.commit()
-
-    except mysql.connector.Error as err:
-        flash(f"An error occurred: {err}", "error")
-    finally:
-        cursor.close()
-        conn.close()
+    pin_primary()
+    if errors:
+        flash(f"An error occurred: {'; '.join(errors)}", "error")
+    else:
+        flash(done, "success")
 
     return redirect(url_for('index'))
 
 
+@app.route('/send', methods=['GET', 'POST'])
+def send_page():
+    """Form to queue an SMS to one or more numbers through Gammu's outbox."""
+    source_ids = [s.id for s in sources.all_sources()]
+    to = request.values.get('to', '')
+    text = request.values.get('text', '')
+    source = request.values.get('source') or source_ids[0]
+    if request.method == 'POST':
+        numbers, invalid = outbox.parse_numbers(to)
+        if invalid:
+            flash(f"Invalid number(s): {', '.join(invalid)}", "error")
+        elif not numbers or not text.strip():
+            flash("Enter at least one recipient and a message.", "error")
+        elif source not in source_ids:
+            flash(f"Unknown source '{source}'.", "error")
+        else:
+            queued, errors = outbox.send(numbers, text, source_id=source)
+            if errors:
+                flash(f"Error queueing message: {'; '.join(errors)}", "error")
+            else:
+                flash(f"{queued} message(s) queued for sending.", "success")
+                return redirect(url_for('index'))
+    return render_template_string(SEND_TEMPLATE, to=to, text=text, selected_source=source, source_ids=source_ids)
+
+
+@app.route('/export')
+def export_messages():
+    """
+    Stream assembled messages as CSV or NDJSON.
+
+    Query parameters: format=csv|ndjson, gzip=1, sender, since/until
+    (YYYY-MM-DD or ISO datetime; a bare `until` date is inclusive) and
+    state=read|unread|all.
+    """
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '0') in ('1', 'true', 'yes')
+    try:
+        export.check_format(fmt)
+        where, params = export.build_filter(
+            sender=request.args.get('sender') or None,
+            since=export.parse_time(request.args.get('since')),
+            until=export.parse_time(request.args.get('until'), end=True),
+            state=request.args.get('state', 'all'),
+        )
+        messages = export.iter_messages(where, params)
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    except RuntimeError as err:
+        # Before any byte is sent, so the client never gets a silently truncated file
+        return jsonify({'error': str(err)}), 503
+
+    body = export.render(messages, fmt=fmt, compress=compress)
+    filename = f"messages.{fmt}" + (".gz" if compress else "")
+    return Response(
+        body,
+        mimetype='application/gzip' if compress else export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the statistics summary tables from each source's inbox (repairs drift)."""
+    for source in sources.all_sources():
+        conn = get_db_connection(source.id)
+        if not conn:
+            raise SystemExit(f"Database connection failed for source '{source.id}'.")
+        try:
+            scanned = stats.rebuild(conn)
+        finally:
+            conn.close()
+        print(f"[{source.id}] Rebuilt statistics from {scanned} inbox rows.")
+    shared_cache.invalidate()
+
+
+@app.cli.command('export-messages')
+@click.option('--format', 'fmt', type=click.Choice(sorted(export.FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--sender', default=None)
+@click.option('--since', default=None, help='YYYY-MM-DD or ISO datetime.')
+@click.option('--until', default=None, help='YYYY-MM-DD (inclusive) or ISO datetime.')
+@click.option('--state', type=click.Choice(['all', 'read', 'unread']), default='all')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help='File to write (default: stdout).')
+def export_messages_command(fmt, compress, sender, since, until, state, output):
+    """Stream assembled messages to a file or stdout as CSV/NDJSON."""
+    try:
+        where, params = export.build_filter(
+            sender=sender, since=export.parse_time(since), until=export.parse_time(until, end=True), state=state
+        )
+        messages = export.iter_messages(where, params)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    except RuntimeError as err:
+        raise click.ClickException(str(err))
+    out = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in export.render(messages, fmt=fmt, compress=compress):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+
+
 # --- Main Execution ---
 if __name__ == '__main__':
     print("Starting Flask server...")
@@ -0,0 +1,135 @@
+"""
+Static assets (stylesheet, scripts, icon sprite) and response compression.
+
+The files in static/ are read once per process and served under names that
+contain a hash of their content (`app.3f2a9c1d4e5b.css`). Those URLs never
+change meaning, so they are sent with a one-year immutable Cache-Control and
+a repeat page load fetches none of them; editing a file gives it a new URL.
+Each asset is compressed once when loaded: gzip, plus brotli when the
+optional `brotli` package is installed.
+
+A request for an outdated hash (a page rendered by a worker running the
+previous release) gets the current file without the long cache lifetime
+rather than a 404.
+
+HTML and JSON responses are compressed per request by the app (see
+`choose_encoding` and `compress`); they are small enough that a fast level
+costs less than sending them uncompressed.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import brotli  # optional dependency
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Responses smaller than this are sent as they are
+MIN_COMPRESS_SIZE = 512
+# Types compressed on the fly (static assets are compressed once when loaded)
+DYNAMIC_TYPES = ("text/html", "application/json")
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+_HASHED = re.compile(r"^(?P<stem>.+)\.[0-9a-f]{12}(?P<ext>\.[^.]+)$")
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """Body encoded as `encoding`; `static` spends more CPU for a smaller result."""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+    raise ValueError(f"Unsupported encoding '{encoding}'.")
+
+
+def choose_encoding(accept_encoding: str, available: Iterable[str] = ENCODINGS) -> Optional[str]:
+    """The preferred encoding of `available` that an Accept-Encoding header allows, or None."""
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def hashed_name(name: str, body: bytes) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+@dataclass(frozen=True)
+class Asset:
+    name: str
+    url_name: str
+    mimetype: str
+    body: bytes
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def variant(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """(body, Content-Encoding or None) for a request's Accept-Encoding."""
+        encoding = choose_encoding(accept_encoding, self.encoded)
+        return (self.encoded[encoding], encoding) if encoding else (self.body, None)
+
+
+def load_asset(path: str, name: str) -> Asset:
+    with open(path, "rb") as f:
+        body = f.read()
+    mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    encoded = {}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        for encoding in ENCODINGS:
+            packed = compress(body, encoding, static=True)
+            if len(packed) < len(body):
+                encoded[encoding] = packed
+    return Asset(name, hashed_name(name, body), mimetype, body, encoded)
+
+
+class Manifest:
+    """The assets of one directory, by plain name and by hashed URL name."""
+
+    def __init__(self, directory: str = STATIC_DIR):
+        self.directory = directory
+        self._by_name: Dict[str, Asset] = {}
+        self._by_url: Dict[str, Asset] = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                asset = load_asset(path, name)
+                self._by_name[name] = asset
+                self._by_url[asset.url_name] = asset
+
+    def url_name(self, name: str) -> str:
+        """Hashed file name to link to; raises KeyError for an unknown asset."""
+        return self._by_name[name].url_name
+
+    def lookup(self, url_name: str) -> Tuple[Optional[Asset], bool]:
+        """(asset, current) for a requested name; current is False for an outdated hash or a plain name."""
+        asset = self._by_url.get(url_name)
+        if asset is not None:
+            return asset, True
+        match = _HASHED.match(url_name)
+        name = match.group("stem") + match.group("ext") if match else url_name
+        return self._by_name.get(name), False
+
+
+manifest = Manifest()
@@ -1,17 +1,26 @@
+import asyncio
 import os
+import re
+import secrets
+import signal
 import socket
 import ipaddress
 import json
 import threading
 import time
+import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from urllib.parse import urlparse
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, CopyTextButton
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, CallbackQueryHandler
-import mysql.connector
 
-from .multipart import assemble_inbox_rows
+from .multipart import INBOX_COLUMNS, InboxMessage, assemble_inbox_rows, to_messages
+from .cache import shared_cache
+from .segmenter import count_parts
+from . import contacts, delivery, extract, inbox, memwatch, notifier, outbox, routing, search, sources, stats, tracing, webhook
 
 
 # Load .env
@@ -19,100 +28,122 @@ load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
+# Bot API server; point it at a local Bot API server or the load-test fake (see loadtest.py)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# Per-source poller cursors from older versions; only read once to seed the
+# database-held cursor (see notifier.py)
+POLLER_STATE_FILE = os.path.join(os.path.dirname(__file__), "poller_cursors.json")
+# How long an incomplete multipart message is held back waiting for its other parts
+MULTIPART_GRACE_SECONDS = int(os.environ.get("MULTIPART_GRACE_SECONDS", "120"))
+# How updates reach the bot: "polling" (default) or "webhook" (see webhook.py)
+TELEGRAM_MODE = os.environ.get("TELEGRAM_MODE", "polling").lower()
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member", "my_chat_member"]
+# Delivery-lag traces of the notifications this process sends (see tracing.py and /lag)
+lag_tracer = tracing.Tracer()
+# tracemalloc snapshots and RSS history with MEMORY_DIAGNOSTICS=1 (see memwatch.py and /debug)
+memory_watch = memwatch.from_env()
+# Notifications sent per source in one pass of the delivery loop, and its pause when none are due
+DELIVERY_BATCH = 20
+DELIVERY_IDLE_SECONDS = 1
+# Chats notified about each new SMS (see routing.py); the file is reloaded when it changes
+router = routing.RouterFile(os.environ.get("ROUTING_FILE"), [TELEGRAM_CHAT_ID] if TELEGRAM_CHAT_ID else [])
+# Chats one delivery pass sends to at the same time
+DELIVERY_PARALLEL_CHATS = 8
+# Notifier lease token per source while this process leads it (set by the poll loop)
+leader_tokens: dict[str, int] = {}
+# Set on shutdown: the background loops finish their current pass and return
+stopping = threading.Event()
+# How long shutdown waits for that pass before handing the leases back anyway
+SHUTDOWN_SECONDS = 20
+# Touched by every pass of the poll loop; the production supervisor reads it as a liveness probe
+HEALTH_FILE = os.environ.get("HEALTH_FILE")
+
+
+class AuthorizedChats(filters.Chat):
+    """
+    Chats allowed to use the bot: TELEGRAM_CHAT_ID and every chat the routing
+    rules notify, following reloads of ROUTING_FILE. The bot reads the inbox
+    and queues SMS through the modem, so any other chat is refused.
+    """
+
+    def __init__(self, routes: routing.RouterFile, always: tuple = ()):
+        super().__init__()
+        self.routes = routes
+        self.always = tuple(c for c in always if c)
+        self._loaded = None
+
+    def filter(self, message) -> bool:
+        current = self.routes.current()
+        if current is not self._loaded:
+            # Usernames (@channel) only receive notifications; commands come from numeric chat ids
+            self.chat_ids = {int(c) for c in current.chats().union(self.always) if c.lstrip("-").isdigit()}
+            self._loaded = current
+        return super().filter(message)
+
+
+authorized_chats = AuthorizedChats(router, (TELEGRAM_CHAT_ID,))
+
+# Database connections for each configured Gammu source (see sources.py)
+get_db_connection = sources.get_db_connection
+
+
+def mark_message_as_read(refs: dict[str, list[int]]) -> bool:
+    """Mark a message (all of its part IDs, per source) as read in the database."""
+    changed, errors = inbox.mark_read(refs)
+    for err in errors:
+        print(f"Error updating message: {err}")
+    return changed > 0
 
-# App context info (for verification)
-DB_HOST = os.environ.get("DB_HOST", "localhost")
-DB_NAME = os.environ.get("DB_NAME", "")
-DB_USER = os.environ.get("DB_USER")
-DB_PASSWORD = os.environ.get("DB_PASSWORD")
-SENT_IDS_FILE = os.path.join(os.path.dirname(__file__), "message_ids.txt")
 
+def delete_message(refs: dict[str, list[int]]) -> bool:
+    """Deletes a message (all of its part IDs, per source) from the database."""
+    changed, errors = inbox.delete(refs)
+    for err in errors:
+        print(f"Error deleting message: {err}")
+    return changed > 0
 
-def get_db_connection():
-    """Establishes a connection to the MySQL database."""
-    try:
-        conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Error connecting to database: {err}")
-        return None
 
+def callback_ids(message: InboxMessage) -> str:
+    """
+    Encode a message reference for callback_data ('sim1:40.41').
 
-def mark_message_as_read(message_id: int) -> bool:
-    """Mark a specific message ID as read in the database."""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE inbox SET Processed = 'true' WHERE ID = %s AND Processed = 'false'", (message_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-    except mysql.connector.Error as err:
-        print(f"Error updating message: {err}")
-        return False
-    finally:
-        cursor.close()
-        conn.close()
-
-
-def delete_message(message_id: int) -> bool:
-    """Deletes a specific message ID from the database."""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM inbox WHERE ID = %s", (message_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-    except mysql.connector.Error as err:
-        print(f"Error deleting message: {err}")
-        return False
-    finally:
-        cursor.close()
-        conn.close()
+    Telegram caps callback_data at 64 bytes; very long multipart messages fall
+    back to the newest part's ID (`/stats rebuild` repairs any drift).
+    """
+    ref = message.ref
+    if len(ref) <= 56:
+        return ref
+    return f"{message.source}:{message.ID}" if message.source else str(message.ID)
 
 
-def remove_sent_ids(ids_to_remove):
-    """Removes specified IDs from the sent IDs cache file."""
-    try:
-        if os.path.exists(SENT_IDS_FILE):
-            with open(SENT_IDS_FILE, "r") as f:
-                all_ids = [line.strip() for line in f if line.strip().isdigit()]
-            # Convert both lists to integers for comparison
-            ids_to_remove_set = set(int(i) for i in ids_to_remove)
-            remaining_ids = [msg_id for msg_id in all_ids if int(msg_id) not in ids_to_remove_set]
-            with open(SENT_IDS_FILE, "w") as f:
-                for msg_id in remaining_ids:
-                    f.write(f"{msg_id}\n")
-    except Exception as e:
-        print(f"Error removing IDs from sent_message_ids.txt: {e}")
+def parse_callback_ids(value: str) -> dict[str, list[int]]:
+    refs = sources.parse_refs([value])
+    if not refs:
+        raise ValueError(f"Invalid message reference: {value}")
+    return refs
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline keyboard button clicks."""
     query = update.callback_query
+    if not authorized_chats.check_update(update):
+        await query.answer("This chat is not authorized.")
+        return
     await query.answer()  # Acknowledge the button press
 
     action, _, message_id_str = query.data.partition('_')
 
     if action == 'read':
         try:
-            message_id = int(message_id_str)
-            if mark_message_as_read(message_id):
-                # Edit the original message to remove the button
+            message_ids = parse_callback_ids(message_id_str)
+            if await asyncio.to_thread(mark_message_as_read, message_ids):
+                # Edit the original message to remove the buttons (copy buttons stay)
                 await query.edit_message_text(
                     text=query.message.text + "\n\n---\n✅ Marked as Read",
-                    reply_markup=None  # Remove keyboard
+                    reply_markup=kept_copy_buttons(query.message.reply_markup)
                 )
-                print(f"Marked message ID {message_id} as read.")
-                remove_sent_ids([message_id])
+                print(f"Marked message ID(s) {message_ids} as read.")
             else:
                 await query.edit_message_text(
                     text=query.message.text + "\n\n---\n⚠️ Already marked as read or error.",
@@ -123,16 +154,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text=query.message.text + "\n\n---\n❌ Error processing command.",
                 reply_markup=None
             )
+    elif action == 'page':
+        await show_search_page(update, context, message_id_str)
     elif action == 'delete':
         try:
-            message_id = int(message_id_str)
-            if delete_message(message_id):
+            message_ids = parse_callback_ids(message_id_str)
+            if await asyncio.to_thread(delete_message, message_ids):
                 await query.edit_message_text(
                     text=query.message.text + "\n\n---\n🗑️ Message Deleted",
                     reply_markup=None
                 )
-                print(f"Deleted message ID {message_id}.")
-                remove_sent_ids([message_id])
+                print(f"Deleted message ID(s) {message_ids}.")
             else:
                 await query.edit_message_text(
                     text=query.message.text + "\n\n---\n⚠️ Error deleting message or already deleted.",
@@ -148,7 +180,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 MENU_KEYBOARD = ReplyKeyboardMarkup(
     [
         [KeyboardButton("📥 Last 5 Messages"), KeyboardButton("📥 Last 10 Messages")],
-        [KeyboardButton("📊 Dashboard"), KeyboardButton("❓ Help")]
+        [KeyboardButton("📈 Stats"), KeyboardButton("📊 Dashboard"), KeyboardButton("❓ Help")]
     ],
     resize_keyboard=True
 )
@@ -166,66 +198,55 @@ async def handle_menu_choice(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await cmd_last5(update, context)
     elif text == "📥 Last 10 Messages":
         await cmd_last10(update, context)
+    elif text == "📈 Stats":
+        await cmd_stats(update, context)
     elif text == "📊 Dashboard":
         app_url = os.environ.get("APP_PUBLIC_URL", "http://127.0.0.1:5000")
         await update.effective_message.reply_text(f"Dashboard: {app_url}")
     elif text == "❓ Help":
         await update.effective_message.reply_text(
-            "Available commands:\n/menu - Show menu\n/last5 - Last 5 messages\n/last10 - Last 10 messages\n/start - Bot info"
+            "Available commands:\n/menu - Show menu\n/last5 - Last 5 messages\n/last10 - Last 10 messages\n/stats - Inbox statistics\n/lag - Notification delay\n/queue - Notification queue\n/debug - Memory diagnostics\n/search - Search messages by text or sender\n/from - Messages from a number\n/reply - Reply to an SMS\n/start - Bot info"
         )
     else:
         await update.effective_message.reply_text("Unknown option. Use /menu to see available actions.")
 
 
 def fetch_last_messages(limit=5):
-    """Fetch the last N messages from the inbox table, skipping empty messages."""
-    conn = get_db_connection()
-    if not conn:
-        return []
-    cursor = conn.cursor(dictionary=True)
-    try:
-        # Fetch unread messages first, then read ones, up to the limit
-        cursor.execute(
-            """
-            (SELECT ID, SenderNumber, TextDecoded, ReceivingDateTime, Processed, UDH
-            FROM inbox
-            WHERE TextDecoded IS NOT NULL AND TextDecoded != ''
-            ORDER BY ReceivingDateTime DESC)
-            LIMIT %s
-            """,
-            (limit,)
-        )
-        rows = cursor.fetchall()
-        # Assemble multipart messages and drop empty/blank rows
-        messages = assemble_inbox_rows(rows)
-    except mysql.connector.Error as err:
-        print(f"Failed to fetch messages: {err}")
-        messages = []
-    finally:
-        cursor.close()
-        conn.close()
-    return messages
+    """Fetch the last N messages across all sources, skipping empty messages, with their extracted codes."""
+    messages, _next = sources.fetch_page(
+        limit=limit,
+        where="TextDecoded IS NOT NULL AND TextDecoded != ''",
+    )
+    return messages, extract.lookup_all(messages)
+
+
+def kept_copy_buttons(markup: InlineKeyboardMarkup | None) -> InlineKeyboardMarkup | None:
+    """The copy buttons of a message's keyboard, without the action buttons."""
+    rows = [row for row in (markup.inline_keyboard if markup else ()) if all(b.copy_text for b in row)]
+    return InlineKeyboardMarkup(rows) if rows else None
 
 
 async def send_messages_with_button(update: Update, context: ContextTypes.DEFAULT_TYPE, limit: int):
     """Helper to fetch and send messages with a 'Mark as Read' button."""
-    messages = fetch_last_messages(limit)
+    messages, found = await asyncio.to_thread(fetch_last_messages, limit)
     if not messages:
         await update.effective_message.reply_text("No recent messages found.")
         return
 
     for m in reversed(messages):
-        status = "✅" if m['Processed'] == 'true' else "🆕"
-        text = f"{status} From: {m['SenderNumber']}\n{m['TextDecoded']}\nReceived: {m['ReceivingDateTime']}"
-
-        keyboard = None
-        if m['Processed'] == 'false':
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("Mark as Read", callback_data=f"read_{m['ID']}"),
-                    InlineKeyboardButton("Delete", callback_data=f"delete_{m['ID']}")
-                ]
+        status = "✅" if m.Processed == 'true' else "🆕"
+        text = f"{status} From: {contacts.label(m.SenderNumber)}\n{m.TextDecoded}\nReceived: {m.ReceivingDateTime}"
+
+        rows = [
+            [InlineKeyboardButton(b["text"], copy_text=CopyTextButton(b["copy_text"]["text"])) for b in row]
+            for row in copy_buttons(found.get((m.source, m.ID)))
+        ]
+        if m.is_unread:
+            rows.append([
+                InlineKeyboardButton("Mark as Read", callback_data=f"read_{callback_ids(m)}"),
+                InlineKeyboardButton("Delete", callback_data=f"delete_{callback_ids(m)}")
             ])
+        keyboard = InlineKeyboardMarkup(rows) if rows else None
 
         await update.effective_message.reply_text(text, reply_markup=keyboard)
 
@@ -238,6 +259,225 @@ async def cmd_last5(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_messages_with_button(update, context, 5)
 
 
+# Searches kept per chat so page buttons only need to carry a token and a cursor
+MAX_SEARCHES_PER_CHAT = 20
+SEARCH_PREVIEW_CHARS = 300
+
+
+def _page_button(label: str, token: str, cursor: str, state: dict) -> InlineKeyboardButton:
+    data = f"page_{token}_{cursor}"
+    if len(data.encode("utf-8")) > 64:
+        # Long source ids: keep the cursor server-side and pass its index instead
+        state["cursors"].append(cursor)
+        data = f"page_{token}_#{len(state['cursors']) - 1}"
+    return InlineKeyboardButton(label, callback_data=data)
+
+
+def render_search_page(token: str, state: dict, before: str) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Text and prev/next keyboard for the page of `state` that starts at cursor `before`."""
+    messages, next_cursor = search.search_page(state["where"], state["params"], before=before)
+    if not messages:
+        return f"🔎 {state['title']}\n\nNo messages found.", None
+
+    lines = [f"🔎 {state['title']}", ""]
+    for m in messages:
+        status = "🆕" if m.is_unread else "✅"
+        text = (m.TextDecoded or "").strip()
+        if len(text) > SEARCH_PREVIEW_CHARS:
+            text = text[:SEARCH_PREVIEW_CHARS] + "…"
+        via = f" · {m.source}" if len(sources.all_sources()) > 1 else ""
+        lines.append(f"{status} {contacts.label(m.SenderNumber)} · {m.ReceivingDateTime:%Y-%m-%d %H:%M}{via}\n{text}\n")
+
+    buttons = []
+    if before:
+        buttons.append(_page_button("◀ Newer", token, state["back"].get(before, ""), state))
+    if next_cursor:
+        state["back"][next_cursor] = before
+        buttons.append(_page_button("Older ▶", token, next_cursor, state))
+    return "\n".join(lines), (InlineKeyboardMarkup([buttons]) if buttons else None)
+
+
+async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE, title: str, where: str, params: list):
+    searches = context.chat_data.setdefault("searches", {})
+    while len(searches) >= MAX_SEARCHES_PER_CHAT:
+        searches.pop(next(iter(searches)))
+    token = secrets.token_hex(3)
+    state = {"title": title, "where": where, "params": params, "back": {}, "cursors": []}
+    searches[token] = state
+    text, keyboard = await asyncio.to_thread(render_search_page, token, state, "")
+    await update.effective_message.reply_text(text, reply_markup=keyboard)
+
+
+async def show_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE, data: str):
+    """Page button: edit the results message in place with the requested page."""
+    query = update.callback_query
+    token, _, cursor = data.partition("_")
+    state = context.chat_data.get("searches", {}).get(token)
+    if state is None:
+        await query.edit_message_text(text=query.message.text + "\n\n---\n⌛ Search expired, run it again.", reply_markup=None)
+        return
+    if cursor.startswith("#"):
+        try:
+            cursor = state["cursors"][int(cursor[1:])]
+        except (ValueError, IndexError):
+            cursor = ""
+    text, keyboard = await asyncio.to_thread(render_search_page, token, state, cursor)
+    await query.edit_message_text(text=text, reply_markup=keyboard)
+
+
+async def cmd_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/search <text|number>: newest matching messages, 5 per page."""
+    query = " ".join(context.args or []).strip()
+    if not query:
+        await update.effective_message.reply_text("Usage: /search <text or phone number>")
+        return
+    where, params = await asyncio.to_thread(search.parse_query, query)
+    await start_search(update, context, f'Results for "{query}"', where, params)
+
+
+async def cmd_from(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/from <number>: messages from one sender, newest first."""
+    number = outbox.normalize_number(" ".join(context.args or []))
+    if number is None:
+        await update.effective_message.reply_text("Usage: /from <phone number>")
+        return
+    where, params = search.sender_filter(number)
+    await start_search(update, context, f"Messages from {number}", where, params)
+
+
+def fetch_stats(rebuild: bool = False):
+    """Sync (or fully rebuild) each source's statistics summary and return the combined counters."""
+    def refresh(conn, source):
+        if rebuild:
+            stats.rebuild(conn)
+        else:
+            stats.sync(conn)
+        return True
+
+    # Refresh on the primaries, then read the summaries (from replicas if configured)
+    refreshed = sources.fan_out(sources.with_connection(refresh, False))
+    if rebuild:
+        for source_id, ok in refreshed.items():
+            if ok:
+                sources.note_write(source_id)
+        shared_cache.invalidate()
+    summary = sources.with_connection(lambda conn, source: stats.summary(conn), None, read_only=True)
+    summaries = [s for s in sources.fan_out(summary).values() if s is not None]
+    return stats.combine(summaries) if summaries else None
+
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats shows counters; /stats rebuild recomputes them from the inbox first."""
+    rebuild = bool(context.args) and context.args[0] == "rebuild"
+    summary = await asyncio.to_thread(fetch_stats, rebuild)
+    if summary is None:
+        await update.effective_message.reply_text("Could not load statistics.")
+        return
+
+    lines = [
+        "📈 Inbox statistics" + (" (rebuilt)" if rebuild else ""),
+        "",
+        f"Unread: {summary['unread']}",
+        f"Today: {summary['today']} ({summary['today_unread']} unread)",
+        f"Total: {summary['total']} ({summary['multipart']} multipart)",
+    ]
+    if summary['top_senders']:
+        lines.append("")
+        lines.append("Top senders:")
+        for s in summary['top_senders']:
+            lines.append(f"• {s['sender']}: {s['total']} ({s['unread']} unread)")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def cmd_lag(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/lag: percentiles of the delay from SMS receipt to its Telegram notification."""
+    await update.effective_message.reply_text(tracing.format_lag(lag_tracer.summary()))
+
+
+async def cmd_debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/debug: memory of this bot process, and what grew since diagnostics started."""
+    counters = {
+        "extraction memo": extract.memo_size(),
+        "number cache": contacts.cache_size(),
+        "chats with state": len(context.application.chat_data),
+    }
+    text = await asyncio.to_thread(memwatch.status, memory_watch, counters)
+    await update.effective_message.reply_text(text)
+
+
+def fetch_queue(retry: bool = False):
+    """Per source: (queue depth, recent dead letters); dead letters are requeued first when `retry`."""
+    def load(conn, source):
+        if retry:
+            delivery.retry_dead(conn)
+        return delivery.depth(conn), delivery.dead_letters(conn)
+
+    return sources.fan_out(sources.with_connection(load, None))
+
+
+async def cmd_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/queue shows the notification queue; /queue retry requeues its dead letters."""
+    retry = bool(context.args) and context.args[0] == "retry"
+    results = await asyncio.to_thread(fetch_queue, retry)
+    lines = ["📬 Notification queue" + (" (dead letters requeued)" if retry else ""), ""]
+    for source_id, result in results.items():
+        if result is None:
+            lines.append(f"{source_id}: database connection failed")
+            continue
+        depth, dead = result
+        lines.append(f"{source_id}: {depth['pending']} pending (oldest {depth['oldest_seconds']:.0f}s), "
+                     f"{depth['dead']} dead")
+        for letter in dead:
+            lines.append(f"  ☠️ #{letter['ID']} {letter['sender']} → {letter['chat']} after {letter['attempts']} attempt(s): {letter['error']}")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+# Header and footer lines of notification_text()
+_FROM_RE = re.compile(r"^New SMS from: (\S+)", re.MULTILINE | re.IGNORECASE)
+_VIA_RE = re.compile(r"^Via: (\S+)$", re.MULTILINE)
+
+
+def notification_origin(text: str) -> tuple[str | None, str | None]:
+    """(sender number, source id) from the text of an SMS notification, if present."""
+    sender = _FROM_RE.search(text or "")
+    # The footer is the last line; an earlier "Via:" line belongs to the SMS text
+    via = _VIA_RE.findall(text or "")
+    return (sender.group(1) if sender else None), (via[-1] if via else None)
+
+
+REPLY_USAGE = "Usage: /reply <number> <text>\nOr reply to an SMS notification with /reply <text>"
+
+
+async def cmd_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /reply <number> <text> queues an SMS; sent as a reply to an SMS
+    notification, /reply <text> answers that sender through the same source.
+    """
+    message = update.effective_message
+    _cmd, _, rest = (message.text or "").partition(" ")
+    rest = rest.strip()
+    number, source_id = None, None
+    if message.reply_to_message:
+        # Never read the number from the text here: "/reply 1234 is the code" would go to 1234
+        number, source_id = notification_origin(message.reply_to_message.text)
+    else:
+        number, _, rest = rest.partition(" ")
+        rest = rest.strip()
+    destination = outbox.normalize_number(number or "")
+    if destination is None or not rest:
+        await message.reply_text(REPLY_USAGE)
+        return
+    if source_id not in {s.id for s in sources.all_sources()}:
+        source_id = None
+
+    queued, errors = await asyncio.to_thread(outbox.send, [destination], rest, source_id)
+    if errors:
+        await message.reply_text(f"❌ Could not queue SMS: {'; '.join(errors)}")
+        return
+    _coding, parts = count_parts(rest)
+    await message.reply_text(f"📤 Queued SMS to {destination} ({parts} part{'s' if parts > 1 else ''}).")
+
+
 def get_server_ip() -> str:
     env_ip = os.environ.get('SERVER_IP')
     if env_ip:
@@ -278,7 +518,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Bot: @{me.username} (id: {me.id})",
         f"Server: {host} ({ip})",
         f"Environment: {env}",
-        f"Database: {DB_NAME or 'unknown'} @ {DB_HOST}",
+        *(f"Database [{src.id}]: {src.database or 'unknown'} @ {src.host}" for src in sources.all_sources()),
         f"Dashboard: {app_url}",
         "",
         f"This chat id: {chat.id}",
@@ -295,9 +535,18 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_message.reply_text("\n".join(lines))
 
 
-def _http_send_telegram_message(token: str, chat_id: str, text: str, parse_mode: str | None = None, reply_markup: dict | None = None):
-    """Send a message via Telegram Bot API using standard library (no extra deps)."""
-    api_url = f"https://api.telegram.org/bot{token}/sendMessage"
+class TelegramSendError(Exception):
+    """A rejected sendMessage; `permanent` when sending it again cannot succeed."""
+
+    def __init__(self, message: str, permanent: bool = False, retry_after: float | None = None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+
+def _post_telegram_message(token: str, chat_id: str, text: str, parse_mode: str | None = None, reply_markup: dict | None = None) -> None:
+    """Send a message via Telegram Bot API using standard library (no extra deps); raises on failure."""
+    api_url = f"{TELEGRAM_API_URL}/bot{token}/sendMessage"
     payload = {"chat_id": chat_id, "text": text}
     if parse_mode:
         payload["parse_mode"] = parse_mode
@@ -308,111 +557,372 @@ def _http_send_telegram_message(token: str, chat_id: str, text: str, parse_mode:
     try:
         with urllib.request.urlopen(req, timeout=15) as resp:
             if resp.status != 200:
-                print(f"Telegram API non-200: {resp.status}")
+                raise TelegramSendError(f"Telegram API non-200: {resp.status}")
+    except urllib.error.HTTPError as e:
+        try:
+            body = json.loads(e.read() or b"{}")
+        except ValueError:
+            body = {}
+        retry_after = (body.get("parameters") or {}).get("retry_after")
+        # 400 (e.g. text too long) and 403 (bot blocked or removed) fail the same way every time
+        raise TelegramSendError(
+            f"HTTP {e.code}: {body.get('description') or e.reason}",
+            permanent=e.code in (400, 403), retry_after=retry_after,
+        ) from e
+
+
+def _http_send_telegram_message(token: str, chat_id: str, text: str, parse_mode: str | None = None, reply_markup: dict | None = None) -> bool:
+    """Like _post_telegram_message, but prints errors instead of raising; True once Telegram accepted it."""
+    try:
+        _post_telegram_message(token, chat_id, text, parse_mode, reply_markup)
+        return True
     except Exception as e:
         print(f"Telegram sendMessage error: {e}")
+        return False
 
 
-def send_message_to_telegram(message):
-    """Sends a formatted message to a Telegram chat for new SMS notifications."""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return  # Silently fail if not configured
+def copy_buttons(found: extract.Extracted | None) -> list[list[dict]]:
+    """Keyboard rows of copy-to-clipboard buttons for extracted codes, amounts and links."""
+    if not found:
+        return []
+    rows = []
+    for values in (found.codes + found.amounts, found.links):
+        row = [{"text": f"📋 {v if len(v) <= 40 else v[:39] + '…'}", "copy_text": {"text": v[:256]}} for v in values]
+        if row:
+            rows.append(row)
+    return rows
+
+
+def notification_text(message: InboxMessage) -> str:
+    """Text of an SMS notification; /reply reads the sender and source back from it (notification_origin)."""
+    text = (
+        f"New SMS from: {contacts.label(message.SenderNumber)}\n\n"
+        f"{message.TextDecoded}\n\n"
+        f"Received: {message.ReceivingDateTime.strftime('%B %d, %Y at %I:%M %p')}"
+    )
+    if len(sources.all_sources()) > 1:
+        text += f"\nVia: {message.source}"
+    return text
 
-    try:
-        text = (
-            f"New SMS from: {message['SenderNumber']}\n\n"
-            f"{message['TextDecoded']}\n\n"
-            f"Received: {message['ReceivingDateTime'].strftime('%B %d, %Y at %I:%M %p')}"
-        )
-        
-        # Create an inline keyboard with a "Mark as Read" button
-        keyboard = {
-            "inline_keyboard": [
-                [
-                    {"text": "Mark as Read", "callback_data": f"read_{message['ID']}"},
-                    {"text": "Delete", "callback_data": f"delete_{message['ID']}"}
-                ]
+
+def send_message_to_telegram(message: InboxMessage, chat_id: str, found: extract.Extracted | None = None) -> None:
+    """
+    Sends a formatted message to a Telegram chat for new SMS notifications; raises when it was not accepted.
+    `found` (see extract.py) adds one-tap copy buttons above Mark as Read / Delete.
+    """
+    if not TELEGRAM_BOT_TOKEN:
+        return  # Silently skip if not configured
+
+    text = notification_text(message)
+
+    # Create an inline keyboard with a "Mark as Read" button
+    keyboard = {
+        "inline_keyboard": copy_buttons(found) + [
+            [
+                {"text": "Mark as Read", "callback_data": f"read_{callback_ids(message)}"},
+                {"text": "Delete", "callback_data": f"delete_{callback_ids(message)}"}
             ]
-        }
+        ]
+    }
+
+    _post_telegram_message(
+        TELEGRAM_BOT_TOKEN,
+        chat_id,
+        text,
+        reply_markup=keyboard
+    )
+    print(f"Sent message to Telegram chat {chat_id} for SMS ID {message.ID}")
 
-        _http_send_telegram_message(
-            TELEGRAM_BOT_TOKEN,
-            TELEGRAM_CHAT_ID,
-            text,
-            reply_markup=keyboard
-        )
-        print(f"Sent message to Telegram for SMS ID {message['ID']}")
+
+def poll_source(conn, source: sources.Source, last_id: int):
+    """
+    One poll of one source: clean blank rows, sync stats, and collect unread
+    messages above the source's cursor.
+
+    Returns (messages ready to notify, new cursor). Multipart messages still
+    missing parts are held back (and the cursor kept below them) for up to
+    MULTIPART_GRACE_SECONDS so they are announced once, complete.
+    """
+    cursor = conn.cursor()
+    try:
+        # Clean up empty/blank messages first
+        cursor.execute("SELECT ID FROM inbox WHERE TextDecoded IS NULL OR TRIM(TextDecoded) = ''")
+        blank_ids = [row[0] for row in cursor.fetchall()]
+        if blank_ids:
+            placeholders = ', '.join(['%s'] * len(blank_ids))
+            stats.record_delete(cursor, blank_ids)
+            cursor.execute(f"DELETE FROM inbox WHERE ID IN ({placeholders})", tuple(blank_ids))
+            conn.commit()
+            shared_cache.invalidate()
+
+        # Count newly arrived rows into the statistics summary
+        stats.sync(conn)
+
+        # Fetch unread messages above this source's cursor
+        cursor.execute(f"""
+            SELECT {INBOX_COLUMNS}
+            FROM inbox
+            WHERE Processed = 'false' AND ID > %s
+            ORDER BY ID ASC
+        """, (last_id,))
+        raw_messages = sources.tag(to_messages(cursor.fetchall()), source.id)
+    finally:
+        cursor.close()
+    lag_tracer.picked_up(source.id, (m.ID for m in raw_messages))
+
+    messages = assemble_inbox_rows(raw_messages)
+    new_cursor = max((m.ID for m in raw_messages), default=last_id)
+    cutoff = datetime.now() - timedelta(seconds=MULTIPART_GRACE_SECONDS)
+    ready = []
+    for m in messages:
+        if m.missing_parts and m.ReceivingDateTime and m.ReceivingDateTime > cutoff:
+            new_cursor = min(new_cursor, min(m.ids) - 1)
+        else:
+            ready.append(m)
+            lag_tracer.assembled(m)
+    return ready, new_cursor
+
+
+def load_cursors() -> dict[str, int]:
+    try:
+        with open(POLLER_STATE_FILE, "r") as f:
+            return {str(k): int(v) for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
     except Exception as e:
-        print(f"Error sending message to Telegram: {e}")
+        print(f"Error loading poller cursors: {e}")
+        return {}
 
 
-def pull_new_messages():
-    """Pulls the database for new messages and sends them to Telegram, caching last sent ID."""
-    print("Starting background thread to pull for new messages...")
+def poll_as_leader(conn, source: sources.Source, legacy_cursors: dict[str, int]):
+    """
+    Take or renew this source's notifier lease and, as leader, poll it and
+    queue the new messages for delivery (see delivery.py), once for every
+    chat the routing rules pick (see routing.py).
 
-    def load_sent_ids():
-        if not os.path.exists(SENT_IDS_FILE):
-            return set()
+    Returns None on a standby replica, else the number of notifications queued.
+    """
+    token = notifier.acquire(conn, initial_cursor=legacy_cursors.get(source.id, 0))
+    if token is None:
+        leader_tokens.pop(source.id, None)
+        return None
+    leader_tokens[source.id] = token
+    last_id = notifier.load_cursor(conn)
+    messages, new_cursor = poll_source(conn, source, last_id)
+    # Sent by a version without the queue before it could move the cursor
+    notified = notifier.already_notified(conn, (m.ID for m in messages))
+    messages = [m for m in messages if m.ID not in notified]
+    try:
+        extract.store(conn, messages)
+    except Exception as e:
+        print(f"Error storing extracted codes for '{source.id}': {e}")
+    rules = router.current()
+    entries = [(m, chat_id) for m in messages for chat_id in rules.route(m.SenderNumber, m.TextDecoded)]
+    if not delivery.enqueue(conn, token, entries, last_id, new_cursor):
+        print(f"Notifier lease for '{source.id}' moved to another replica; nothing queued.")
+        return 0
+    delivery.purge_sent(conn)
+    return len(entries)
+
+
+def _send_to_chat(items: list, source_id: str, found: dict) -> list:
+    """
+    Send one chat's notifications in order: [(item, error or None)] for each
+    attempted. A failure that may be temporary ends the run for that chat.
+    """
+    results = []
+    for item in items:
         try:
-            with open(SENT_IDS_FILE, "r") as f:
-                return {line.strip() for line in f if line.strip().isdigit()}
+            send_message_to_telegram(item.message(source_id), item.chat_id, found.get(item.ID))
         except Exception as e:
-            print(f"Error loading sent IDs file: {e}")
-            return set()
+            results.append((item, e))
+            if not (isinstance(e, TelegramSendError) and e.permanent):
+                break
+            continue
+        results.append((item, None))
+    return results
+
+
+def deliver_due(conn, source: sources.Source):
+    """
+    Send this source's due notifications, recording each under the lease.
+
+    Notifications for different chats are sent concurrently, each chat's in
+    order; the database is only written from this thread. Returns None unless
+    this process leads the source, else the number of notifications due. A
+    failure that may be temporary ends the pass for that chat, so an
+    unreachable Telegram costs one timeout per pass, not one per message.
+    """
+    token = leader_tokens.get(source.id)
+    if token is None or not notifier.holds(conn, token):
+        return None
+    batch = delivery.due(conn, DELIVERY_BATCH)
+    found = extract.lookup(conn, [item.message(source.id) for item in batch])
+    by_chat: dict[str, list] = {}
+    for item in batch:
+        by_chat.setdefault(item.chat_id, []).append(item)
+    # The trace of an SMS sent to several chats ends with the first attempt
+    traces = {(item.ID, item.chat_id): lag_tracer.sending(item.message(source.id)) for item in batch}
+    if len(by_chat) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(by_chat), DELIVERY_PARALLEL_CHATS)) as pool:
+            runs = list(pool.map(lambda items: _send_to_chat(items, source.id, found), by_chat.values()))
+    else:
+        runs = [_send_to_chat(items, source.id, found) for items in by_chat.values()]
+
+    attempted = set()
+    for item, error in (result for run in runs for result in run):
+        attempted.add((item.ID, item.chat_id))
+        trace = traces[(item.ID, item.chat_id)]
+        if error is None:
+            lag_tracer.finish(trace, ok=True)
+            written = delivery.mark_sent(conn, token, item)
+        else:
+            permanent = isinstance(error, TelegramSendError) and error.permanent
+            retry_after = error.retry_after if isinstance(error, TelegramSendError) else None
+            state = delivery.mark_failed(conn, token, item, str(error), permanent, retry_after)
+            written = state is not None
+            if state == delivery.DEAD:
+                lag_tracer.finish(trace, ok=False)
+                print(f"Notification for SMS ID {item.ID} to chat {item.chat_id} moved to the dead letters: {error}")
+            else:
+                lag_tracer.retry(item.message(source.id), trace)
+                print(f"Notification for SMS ID {item.ID} to chat {item.chat_id} failed, will retry: {error}")
+        if not written:
+            print(f"Notifier lease for '{source.id}' moved to another replica; stopping here.")
+            break
+    # Not attempted this pass (their chat failed first): keep the traces waiting
+    for item in batch:
+        if (item.ID, item.chat_id) not in attempted:
+            lag_tracer.retry(item.message(source.id), traces[(item.ID, item.chat_id)])
+    return len(batch)
+
+
+def heartbeat():
+    """Touch HEALTH_FILE, if set, to show the poll loop is alive (see run_production.py)."""
+    if not HEALTH_FILE:
+        return
+    try:
+        with open(HEALTH_FILE, "a"):
+            os.utime(HEALTH_FILE)
+    except OSError as e:
+        print(f"Error touching health file: {e}")
 
-    def save_sent_ids(sent_ids):
-        try:
-            with open(SENT_IDS_FILE, "w") as f:
-                for msg_id in sent_ids:
-                    f.write(f"{msg_id}\n")
-        except Exception as e:
-            print(f"Error saving sent IDs file: {e}")
-    
-    sent_ids = load_sent_ids()
 
-    while True:
-        conn = get_db_connection()
-        if not conn:
+def pull_new_messages():
+    """
+    Poll every source for new messages and queue their notifications.
+
+    Any number of bot replicas may run this loop: per source, only the holder
+    of the database lease polls and notifies (see notifier.py), and the others
+    stand by to take over. Sending is left to deliver_notifications(), so a
+    slow Telegram never delays detection.
+    """
+    print("Starting background thread to pull for new messages...")
+    legacy_cursors = load_cursors()
+
+    while not stopping.is_set():
+        # Sources are read concurrently.
+        # False marks a database error, None a source led by another replica.
+        results = sources.fan_out(sources.with_connection(
+            lambda conn, source: poll_as_leader(conn, source, legacy_cursors), False
+        ))
+        heartbeat()
+        if all(r is False for r in results.values()):
             print("Pulling thread: Database connection failed. Retrying in 60s.")
-            time.sleep(60)
+            stopping.wait(60)
             continue
 
-        cursor = conn.cursor(dictionary=True)
+        stopping.wait(10) # Pulls every 10 seconds
+
+
+def deliver_notifications():
+    """Send queued notifications as they fall due, and export traces and queue metrics."""
+    print("Starting background thread to deliver notifications...")
+    while not stopping.is_set():
+        attempted = sources.fan_out(sources.with_connection(deliver_due, None))
+        queue_metrics = []
+        if tracing.metrics_file():
+            depths = sources.fan_out(sources.with_connection(lambda conn, source: delivery.depth(conn), None))
+            queue_metrics = delivery.metrics_lines({sid: d for sid, d in depths.items() if d is not None})
+        lag_tracer.flush(queue_metrics)
+        if not any(attempted.values()):
+            stopping.wait(DELIVERY_IDLE_SECONDS)
+
+
+def release_notifier_leases():
+    """Hand the notifier leases back on shutdown so a standby replica takes over at once."""
+    sources.fan_out(sources.with_connection(lambda conn, source: notifier.release(conn), None))
+
+
+def shut_down(threads: list[threading.Thread]):
+    """
+    Stop the background loops after their current pass, so every notification
+    sent so far is recorded and the cursor is saved, then hand the leases back
+    (a replacement bot takes over from exactly there).
+    """
+    stopping.set()
+    deadline = time.monotonic() + SHUTDOWN_SECONDS
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            print(f"{thread.name} did not finish within {SHUTDOWN_SECONDS}s; its writes are fenced by the lease.")
+    release_notifier_leases()
+    lag_tracer.flush()
+
+
+async def serve_webhook(app: Application, config: webhook.WebhookConfig):
+    """Run the application on updates pushed to the local webhook listener until SIGINT/SIGTERM."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    def dispatch(data: dict):
+        # Called from the listener's threads; hand the update to the event loop
+        update = Update.de_json(data, app.bot)
+        asyncio.run_coroutine_threadsafe(app.update_queue.put(update), loop).result(timeout=10)
+
+    async with app:
+        if config.webhook_url:
+            await app.bot.set_webhook(
+                url=config.webhook_url,
+                secret_token=config.secret,
+                allowed_updates=ALLOWED_UPDATES,
+                max_connections=min(max(config.concurrency, 1), 100),
+            )
+        await app.start()
+        server = webhook.WebhookServer(config.listen, config.port, config.path, config.secret, dispatch)
+        server.start()
+        print(f"Listening for webhook updates on {config.listen}:{config.port}{config.path}")
         try:
-            # Clean up empty/blank messages first
-            cursor.execute("DELETE FROM inbox WHERE TextDecoded IS NULL OR TRIM(TextDecoded) = ''")
-            deleted = cursor.rowcount
-            if deleted > 0:
-                conn.commit()
-
-            # Fetch unread messages that haven't been processed by the bot yet
-            cursor.execute("""
-                SELECT ID, SenderNumber, TextDecoded, ReceivingDateTime, Processed,
-                       UDH
-                FROM inbox
-                WHERE Processed = 'false'
-                ORDER BY ReceivingDateTime ASC
-            """)
-            raw_messages = cursor.fetchall()
-            messages = assemble_inbox_rows(raw_messages)
-
-            new_sent = False
-            for message in messages:
-                if str(message['ID']) not in sent_ids:
-                    send_message_to_telegram(message)
-                    sent_ids.add(str(message['ID']))
-                    new_sent = True
-
-            if new_sent:
-                save_sent_ids(sent_ids)
-
-        except mysql.connector.Error as err:
-            print(f"Pulling thread error: {err}")
+            await stop.wait()
         finally:
-            cursor.close()
-            conn.close()
+            server.stop()
+            await app.stop()
+
+
+COMMANDS = {
+    "start": cmd_start, "last10": cmd_last10, "last5": cmd_last5, "menu": cmd_menu, "stats": cmd_stats,
+    "lag": cmd_lag, "queue": cmd_queue, "debug": cmd_debug, "reply": cmd_reply, "search": cmd_search,
+    "from": cmd_from,
+}
+
+
+async def reject_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer chats that are not authorized with their id, so it can be added to the configuration."""
+    if update.effective_message and update.effective_chat:
+        await update.effective_message.reply_text(
+            f"⛔ This chat is not authorized to use the bot (chat id: {update.effective_chat.id})."
+        )
 
-        time.sleep(10) # Pulls every 10 seconds
+
+def add_handlers(app: Application) -> None:
+    """Commands and menu replies, from authorized chats only (see AuthorizedChats)."""
+    for name, callback in COMMANDS.items():
+        app.add_handler(CommandHandler(name, callback, filters=authorized_chats))
+    app.add_handler(CallbackQueryHandler(button_callback))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & authorized_chats, handle_menu_choice))
+    app.add_handler(MessageHandler(filters.COMMAND & ~authorized_chats, reject_chat))
 
 
 def main():
@@ -420,19 +930,25 @@ def main():
         raise SystemExit("TELEGRAM_BOT_TOKEN is not set")
 
     # Start the background thread for message polling
-    polling_thread = threading.Thread(target=pull_new_messages, daemon=True)
+    polling_thread = threading.Thread(target=pull_new_messages, name="poller", daemon=True)
     polling_thread.start()
-
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("last10", cmd_last10))
-    app.add_handler(CommandHandler("last5", cmd_last5))
-    app.add_handler(CommandHandler("menu", cmd_menu))
-    app.add_handler(CallbackQueryHandler(button_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu_choice))
-
-    # Send a startup ping via HTTP helper (works outside event loop)
-    if TELEGRAM_CHAT_ID:
+    delivery_thread = threading.Thread(target=deliver_notifications, name="delivery", daemon=True)
+    delivery_thread.start()
+    if memory_watch is not None:
+        threading.Thread(target=memory_watch.run, args=(stopping,), name="memwatch", daemon=True).start()
+
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN)
+    builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    webhook_config = None
+    if TELEGRAM_MODE == "webhook":
+        webhook_config = webhook.load_config()
+        # Handlers run their database work in threads, so updates can overlap
+        builder = builder.concurrent_updates(webhook_config.concurrency)
+    app = builder.build()
+    add_handlers(app)
+
+    # Send a startup ping via HTTP helper (works outside event loop); not for a rolling reload
+    if TELEGRAM_CHAT_ID and not os.environ.get("SUPERVISOR_RELOAD"):
         try:
             host = socket.gethostname()
             ip = get_server_ip()
@@ -448,8 +964,15 @@ def main():
         except Exception as e:
             print(f"Startup ping failed: {e}")
 
-    print("Starting Telegram bot (run_polling in main thread)...")
-    app.run_polling(allowed_updates=["message", "callback_query", "chat_member", "my_chat_member"])
+    try:
+        if webhook_config is not None:
+            print("Starting Telegram bot (webhook mode)...")
+            asyncio.run(serve_webhook(app, webhook_config))
+        else:
+            print("Starting Telegram bot (run_polling in main thread)...")
+            app.run_polling(allowed_updates=ALLOWED_UPDATES)
+    finally:
+        shut_down([polling_thread, delivery_thread])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,266 @@
+"""
+Shared cache tier for the dashboard and bot processes.
+
+Gunicorn runs several workers, each with its own memory, so a per-process
+cache only helps the worker that filled it and an invalidation issued by one
+worker never reaches the others. Values cached here live in a store every
+process can see, and every key is namespaced by a generation number:
+`invalidate()` bumps the generation, which retires all entries at once for
+all workers (and for the bot, which shares the same store).
+
+A value computed from the database is stored under the generation read
+*before* the query: pass `version()` taken then to `set()`. An invalidation
+that lands while the query runs then leaves the value in a retired
+generation instead of serving pre-change data for a whole TTL.
+
+Backends:
+- SQLiteCache: a local file in WAL mode. Default; stdlib only.
+- RedisCache: any Redis-compatible server (needs the `redis` package, or any
+  client object exposing get/set/incr).
+- NullCache: caching disabled.
+
+Select one with CACHE_BACKEND=sqlite|redis|none. Values are pickled, so the
+cache file must not be writable by untrusted users.
+"""
+from __future__ import annotations
+
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+DEFAULT_TTL = 60
+
+
+def default_cache_path() -> str:
+    """
+    cache.sqlite3 in a per-user directory under the system temp dir, used
+    when CACHE_PATH is not set. Values are pickled, so the directory must be
+    private: one owned by someone else is refused.
+    """
+    directory = os.path.join(tempfile.gettempdir(), f"sms-dashboard-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not private to this user; set CACHE_PATH")
+    return os.path.join(directory, "cache.sqlite3")
+
+
+class NullCache:
+    """Cache that stores nothing; every lookup misses."""
+
+    namespace = "sms"
+
+    def version(self) -> int:
+        return 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return default
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, version: Optional[int] = None) -> None:
+        return None
+
+    def invalidate(self) -> int:
+        return 0
+
+
+class SQLiteCache(NullCache):
+    """
+    Cache stored in a local SQLite file shared by all processes on the host.
+
+    WAL mode lets readers proceed while another worker writes. Connections are
+    kept per thread and re-opened after fork, so the object is safe to create
+    at import time in the gunicorn master.
+    """
+
+    def __init__(self, path: str, default_ttl: int = DEFAULT_TTL, namespace: str = "sms"):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.namespace = namespace
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_meta ("
+            " name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def version(self) -> int:
+        row = self._conn().execute(
+            "SELECT value FROM cache_meta WHERE name = ?", (self.namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _key(self, key: str, version: Optional[int] = None) -> str:
+        return f"{self.namespace}:{self.version() if version is None else version}:{key}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._conn().execute(
+            "SELECT value, expires FROM cache_entries WHERE key = ?", (self._key(key),)
+        ).fetchone()
+        if not row or row[1] < time.time():
+            return default
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, version: Optional[int] = None) -> None:
+        """Store `value`; with `version`, only if that is still the current generation."""
+        current = self.version()
+        if version is not None and version != current:
+            return
+        expires = time.time() + (self.default_ttl if ttl is None else ttl)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)",
+            (self._key(key, current), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires),
+        )
+
+    def invalidate(self) -> int:
+        """Bump the generation; returns the new version."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO cache_meta (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (self.namespace,),
+            )
+            row = conn.execute(
+                "SELECT value FROM cache_meta WHERE name = ?", (self.namespace,)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._purge_stale(row[0])
+        return row[0]
+
+    def _purge_stale(self, current: int) -> None:
+        # Entries of older generations are unreachable; drop them with expired ones.
+        prefix = f"{self.namespace}:{current}:"
+        self._conn().execute(
+            "DELETE FROM cache_entries WHERE expires < ?"
+            " OR (key LIKE ? AND substr(key, 1, ?) != ?)",
+            (time.time(), f"{self.namespace}:%", len(prefix), prefix),
+        )
+
+
+class RedisCache(NullCache):
+    """
+    Cache backed by a Redis-compatible server.
+
+    `client` may be any object with get/set(ex=)/incr, which is how tests plug
+    in a local stand-in without a server.
+    """
+
+    def __init__(self, client: Any = None, url: str = "redis://localhost:6379/0",
+                 default_ttl: int = DEFAULT_TTL, namespace: str = "sms"):
+        if client is None:
+            import redis  # optional dependency
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.default_ttl = default_ttl
+        self.namespace = namespace
+
+    def version(self) -> int:
+        raw = self.client.get(f"{self.namespace}:version")
+        return int(raw) if raw else 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raw = self.client.get(f"{self.namespace}:{self.version()}:{key}")
+        if raw is None:
+            return default
+        try:
+            return pickle.loads(raw)
+        except Exception:
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, version: Optional[int] = None) -> None:
+        """Store `value`; with `version`, under that generation (unreachable once it is retired)."""
+        self.client.set(
+            f"{self.namespace}:{self.version() if version is None else version}:{key}",
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            ex=self.default_ttl if ttl is None else ttl,
+        )
+
+    def invalidate(self) -> int:
+        # Old generations are left to expire through their TTL.
+        return int(self.client.incr(f"{self.namespace}:version"))
+
+
+def make_cache(backend: Optional[str] = None) -> NullCache:
+    """Build the cache configured in the environment; falls back to NullCache if unavailable."""
+    backend = (backend or os.environ.get("CACHE_BACKEND", "sqlite")).lower()
+    ttl = int(os.environ.get("CACHE_TTL", DEFAULT_TTL))
+    try:
+        if backend == "sqlite":
+            return SQLiteCache(os.environ.get("CACHE_PATH") or default_cache_path(), default_ttl=ttl)
+        if backend == "redis":
+            return RedisCache(url=os.environ.get("REDIS_URL", "redis://localhost:6379/0"), default_ttl=ttl)
+    except Exception as e:
+        print(f"Cache backend '{backend}' unavailable, caching disabled: {e}")
+    return NullCache()
+
+
+class _SafeCache(NullCache):
+    """
+    Wrapper that turns cache failures into misses so requests never fail on the cache.
+
+    The backend is built on first use, after the entry point has loaded .env.
+    """
+
+    def __init__(self):
+        self._inner: Optional[NullCache] = None
+
+    @property
+    def inner(self) -> NullCache:
+        if self._inner is None:
+            self._inner = make_cache()
+        return self._inner
+
+    def version(self) -> int:
+        try:
+            return self.inner.version()
+        except Exception as e:
+            print(f"Cache error: {e}")
+            return 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self.inner.get(key, default)
+        except Exception as e:
+            print(f"Cache error: {e}")
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, version: Optional[int] = None) -> None:
+        try:
+            self.inner.set(key, value, ttl, version)
+        except Exception as e:
+            print(f"Cache error: {e}")
+
+    def invalidate(self) -> int:
+        try:
+            return self.inner.invalidate()
+        except Exception as e:
+            print(f"Cache error: {e}")
+            return 0
+
+
+shared_cache = _SafeCache()
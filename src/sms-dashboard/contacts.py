@@ -0,0 +1,288 @@
+"""
+Contact names for sender numbers, and one normalized form for each number.
+
+Gammu stores `SenderNumber` as the network delivered it, so one phone shows
+up as `+989121234567`, `09121234567` or `989121234567`. `normalize()` turns
+all of them into E.164 (`+989121234567`):
+
+- `+...` and `00...` are already international.
+- With DEFAULT_COUNTRY_CODE set (e.g. `98`), a national number with a
+  leading 0 gets the country code instead of the 0, and 11 or more digits
+  starting with the country code get a `+`.
+- Short codes and alphanumeric senders (`BANKCO`) are left as they are,
+  apart from spaces and dashes.
+
+Results are memoized, since the same few thousand senders repeat across the
+inbox.
+
+Names come from the file named by CONTACTS_FILE: a vCard file (.vcf) or a
+CSV with a name column and one or more phone/number columns (Google and
+Outlook exports work as they are). The file is read into a dict keyed by
+normalized number at first use and reloaded when it changes, so resolving a
+name never touches the database. `sms-contacts import` merges CSV and vCard
+files into a CONTACTS_FILE CSV:
+
+    sms-contacts import phone.vcf google.csv   # add or update names
+    sms-contacts import --replace phone.vcf    # start over from these files
+    sms-contacts lookup 09121234567            # what a number normalizes and resolves to
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+# How often the contacts file is checked for changes
+RELOAD_CHECK_SECONDS = 2.0
+
+_SEPARATORS = re.compile(r"[\s\-().]")
+_NAME_COLUMNS = ("name", "full name", "display name", "fn")
+_NUMBER_HINTS = ("phone", "number", "mobile", "tel")
+
+
+def default_country_code() -> str:
+    return os.environ.get("DEFAULT_COUNTRY_CODE", "").strip().lstrip("+")
+
+
+def contacts_file() -> Optional[str]:
+    return os.environ.get("CONTACTS_FILE") or None
+
+
+def normalize(number: Optional[str]) -> str:
+    """E.164 form of a phone number when it can be told; otherwise the sender without separators."""
+    return _normalize(number or "", default_country_code())
+
+
+@lru_cache(maxsize=65536)
+def _normalize(number: str, country_code: str) -> str:
+    compact = _SEPARATORS.sub("", number)
+    digits = compact[1:] if compact.startswith("+") else compact
+    if not digits.isdigit():
+        return compact  # alphanumeric sender
+    if compact.startswith("+"):
+        result = digits
+    elif digits.startswith("00"):
+        result = digits[2:]
+    elif country_code and digits.startswith("0"):
+        result = country_code + digits[1:]
+    elif country_code and digits.startswith(country_code) and len(digits) >= 11:
+        result = digits
+    else:
+        return digits  # a short code, or a national number without a known country
+    return "+" + result if len(result) <= 15 else compact
+
+
+def cache_size() -> int:
+    """Normalized numbers memoized in this process."""
+    return _normalize.cache_info().currsize
+
+
+def spellings(number: Optional[str]) -> List[str]:
+    """The forms a number may be stored in (as given, E.164, 00..., national), to match SenderNumber."""
+    normalized = normalize(number)
+    forms = [_SEPARATORS.sub("", number or ""), normalized]
+    if normalized.startswith("+"):
+        digits = normalized[1:]
+        forms += [digits, "00" + digits]
+        country_code = default_country_code()
+        if country_code and digits.startswith(country_code):
+            forms.append("0" + digits[len(country_code):])
+    return [f for f in dict.fromkeys(forms) if f]
+
+
+def _rows(text: str) -> Iterator[Tuple[str, str]]:
+    """(name, number) pairs from a CSV export."""
+    reader = csv.reader(io.StringIO(text))
+    header = [h.strip().lower() for h in next(reader, [])]
+    name_cols = [i for i, h in enumerate(header) if h in _NAME_COLUMNS]
+    if not name_cols:
+        # Google/Outlook split names: join the given/middle/family columns
+        name_cols = [i for i, h in enumerate(header) if h.endswith("name") and "phonetic" not in h][:3]
+    number_cols = [i for i, h in enumerate(header) if any(k in h for k in _NUMBER_HINTS) and "type" not in h]
+    if not name_cols or not number_cols:
+        raise ValueError("The CSV needs a header with a name column and a phone or number column.")
+    for row in reader:
+        name = " ".join(row[i].strip() for i in name_cols if i < len(row) and row[i].strip())
+        for i in number_cols:
+            if i < len(row):
+                # Google packs several numbers in one cell: "a ::: b"
+                for number in row[i].split(":::"):
+                    if name and number.strip():
+                        yield name, number.strip()
+
+
+def _vcards(text: str) -> Iterator[Tuple[str, str]]:
+    """(name, number) pairs from vCard 2.1-4.0 text."""
+    unfolded = re.sub(r"\r?\n[ \t]", "", text)
+    name, numbers = "", []
+    for line in unfolded.splitlines():
+        key, _, value = line.partition(":")
+        prop = key.split(";")[0].split(".")[-1].upper()  # "item1.TEL;TYPE=CELL" -> TEL
+        if prop == "BEGIN":
+            name, numbers = "", []
+        elif prop == "FN":
+            name = value.strip()
+        elif prop == "N" and not name:
+            family, given = (value.split(";") + [""])[:2]
+            name = " ".join(p for p in (given.strip(), family.strip()) if p)
+        elif prop == "TEL":
+            numbers.append(value.strip().removeprefix("tel:"))
+        elif prop == "END":
+            for number in numbers:
+                if name and number:
+                    yield name, number
+
+
+def parse(text: str, vcard: Optional[bool] = None) -> Dict[str, str]:
+    """{E.164 number: name} from CSV or vCard text; a later entry for a number wins."""
+    if vcard is None:
+        vcard = text.lstrip().upper().startswith("BEGIN:VCARD")
+    return {normalize(number): name for name, number in (_vcards(text) if vcard else _rows(text))}
+
+
+def load(path: str) -> Dict[str, str]:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return parse(f.read(), vcard=path.lower().endswith((".vcf", ".vcard")) or None)
+
+
+class Directory:
+    """Names by normalized number: one dict lookup per sender."""
+
+    def __init__(self, names: Optional[Dict[str, str]] = None):
+        self.names = dict(names or {})
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def name(self, number: Optional[str]) -> Optional[str]:
+        return self.names.get(normalize(number))
+
+    def label(self, number: Optional[str]) -> str:
+        """
+        '+989121234567 (Ali)' for a known contact (number first: /reply reads
+        it back), else the normalized number; other senders as they are.
+        """
+        normalized = normalize(number)
+        name = self.names.get(normalized)
+        if name:
+            return f"{normalized} ({name})"
+        return normalized if normalized.startswith("+") else (number or "")
+
+
+class ContactsFile:
+    """The directory of a contacts file, reloaded when the file changes (checked every few seconds)."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._directory = Directory()
+        self._mtime: Optional[float] = None
+        self._checked: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Directory:
+        now = time.monotonic()
+        if not self.path or (self._checked is not None and now - self._checked < RELOAD_CHECK_SECONDS):
+            return self._directory
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if self._mtime is not None:
+                    print(f"Contacts file unavailable, keeping the loaded contacts: {e}")
+                    self._mtime = None
+                return self._directory
+            if mtime != self._mtime:
+                try:
+                    self._directory = Directory(load(self.path))
+                    print(f"Loaded {len(self._directory)} contact number(s) from {self.path}")
+                except (OSError, ValueError, csv.Error) as e:
+                    print(f"Error loading contacts file {self.path}: {e}")
+                self._mtime = mtime
+        return self._directory
+
+
+_shared: Optional[ContactsFile] = None
+
+
+def directory() -> Directory:
+    """The process-wide directory of CONTACTS_FILE."""
+    global _shared
+    if _shared is None or _shared.path != contacts_file():
+        _shared = ContactsFile(contacts_file())
+    return _shared.current()
+
+
+def name(number: Optional[str]) -> Optional[str]:
+    return directory().name(number)
+
+
+def label(number: Optional[str]) -> str:
+    return directory().label(number)
+
+
+def write(path: str, names: Dict[str, str]) -> None:
+    """Write a contacts CSV atomically, so a reader never sees half a file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "number"])
+        for number, contact in sorted(names.items(), key=lambda item: (item[1].casefold(), item[0])):
+            writer.writerow([contact, number])
+    os.replace(tmp, path)
+
+
+def import_files(paths: Iterable[str], target: str, replace: bool = False) -> Tuple[int, int]:
+    """Merge contact files into the CSV at `target`; returns (numbers added, numbers updated)."""
+    names = {} if replace or not os.path.exists(target) else load(target)
+    added = updated = 0
+    for path in paths:
+        for number, contact in load(path).items():
+            if number not in names:
+                added += 1
+            elif names[number] != contact:
+                updated += 1
+            names[number] = contact
+    write(target, names)
+    return added, updated
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="sms-contacts", description="Manage the contact names shown for senders.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("import", help="Merge CSV or vCard files into CONTACTS_FILE")
+    cmd.add_argument("files", nargs="+")
+    cmd.add_argument("--replace", action="store_true", help="Drop the current contacts first")
+    cmd.add_argument("--to", default=contacts_file(), help="Target CSV (default: CONTACTS_FILE)")
+    lookup = commands.add_parser("lookup", help="Show how numbers normalize and which names they resolve to")
+    lookup.add_argument("numbers", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "lookup":
+        for number in args.numbers:
+            print(f"{number} -> {label(number)}")
+        return 0
+    if not args.to:
+        print("Set CONTACTS_FILE or pass --to.", file=sys.stderr)
+        return 2
+    try:
+        added, updated = import_files(args.files, args.to, args.replace)
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.to}: {added} number(s) added, {updated} updated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Per-sender conversation index and lazily loaded threads.
+
+`sms_conversations` holds one row per sender with the last message preview,
+last activity and total/unread counts. It is fed by the same incremental
+paths as the statistics summary (see `stats.py`), so listing every sender is
+a single query on a small, indexed table rather than a scan of `inbox`.
+
+Threads are read page by page through `sources.fetch_page` with a keyset
+cursor over (ReceivingDateTime, ID); an index on inbox (SenderNumber,
+ReceivingDateTime, ID) keeps each page a short range read.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import contacts, storage
+from .multipart import INBOX_COLUMNS, InboxMessage, _parse_udh_concat
+
+CONVERSATIONS_TABLE = "sms_conversations"
+
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS {CONVERSATIONS_TABLE} (
+        SenderNumber VARCHAR(20) NOT NULL PRIMARY KEY,
+        LastID INT UNSIGNED NOT NULL,
+        LastActivity DATETIME NOT NULL,
+        LastText VARCHAR(160) NOT NULL DEFAULT '',
+        Total INT NOT NULL DEFAULT 0,
+        Unread INT NOT NULL DEFAULT 0,
+        KEY idx_sms_conversations_activity (LastActivity)
+    )
+"""
+
+PREVIEW_LENGTH = 160
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _newer(a: InboxMessage, b: Optional[InboxMessage]) -> bool:
+    return b is None or (a.ReceivingDateTime or _EPOCH, a.ID or 0) > (b.ReceivingDateTime or _EPOCH, b.ID or 0)
+
+
+def compute_deltas(rows: Iterable[InboxMessage], sign: int = 1,
+                   unread_only: bool = False) -> Dict[str, Tuple[List[int], Optional[InboxMessage]]]:
+    """
+    Per-sender changes: {sender: ([total, unread], newest row or None)}.
+
+    Like the daily counters, a multipart message counts once through its
+    first part; the newest row of any part becomes the preview.
+    """
+    deltas: Dict[str, Tuple[List[int], Optional[InboxMessage]]] = {}
+    for m in rows:
+        sender = m.SenderNumber or ""
+        counts, newest = deltas.get(sender, ([0, 0], None))
+        if sign > 0 and not unread_only and _newer(m, newest):
+            newest = m
+        deltas[sender] = (counts, newest)
+        parsed = _parse_udh_concat(m.UDH)
+        if parsed is not None and parsed[2] != 1:
+            continue
+        if not unread_only:
+            counts[0] += sign
+        if m.is_unread:
+            counts[1] += sign
+    return deltas
+
+
+def ensure_schema(cursor) -> None:
+    for statement in storage.dialect(cursor).ddl(SCHEMA):
+        cursor.execute(statement)
+
+
+def _preview(m: InboxMessage) -> str:
+    return (m.TextDecoded or "").strip()[:PREVIEW_LENGTH]
+
+
+def apply_rows(cursor, rows: Sequence[InboxMessage], sign: int = 1, unread_only: bool = False) -> None:
+    """Fold inbox rows into the index (arrivals, or reads/deletes with sign=-1)."""
+    deltas = compute_deltas(rows, sign=sign, unread_only=unread_only)
+    if not deltas:
+        return
+    if sign > 0:
+        # MySQL evaluates SET left to right, so preview columns are compared
+        # against LastActivity before it is overwritten (SQLite always uses
+        # the old row).
+        d = storage.dialect(cursor)
+        newer = f"{d.new('LastActivity')} >= LastActivity"
+        cursor.executemany(
+            f"""
+            INSERT INTO {CONVERSATIONS_TABLE}
+                (SenderNumber, LastID, LastActivity, LastText, Total, Unread)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            {d.upsert("SenderNumber")}
+                LastID = CASE WHEN {newer} THEN {d.new('LastID')} ELSE LastID END,
+                LastText = CASE WHEN {newer} THEN {d.new('LastText')} ELSE LastText END,
+                LastActivity = CASE WHEN {newer} THEN {d.new('LastActivity')} ELSE LastActivity END,
+                Total = Total + {d.new('Total')},
+                Unread = Unread + {d.new('Unread')}
+            """,
+            [
+                (sender, newest.ID, newest.ReceivingDateTime or _EPOCH, _preview(newest), total, unread)
+                for sender, ((total, unread), newest) in deltas.items()
+            ],
+        )
+        return
+    cursor.executemany(
+        f"UPDATE {CONVERSATIONS_TABLE} SET Total = Total + %s, Unread = Unread + %s WHERE SenderNumber = %s",
+        [(total, unread, sender) for sender, ((total, unread), _n) in deltas.items()],
+    )
+    if not unread_only:
+        _refresh_previews(cursor, rows)
+
+
+def _refresh_previews(cursor, deleted: Sequence[InboxMessage]) -> None:
+    """Before rows are deleted: move previews that point at them to the sender's next newest row."""
+    deleted_ids = tuple(m.ID for m in deleted)
+    placeholders = ", ".join(["%s"] * len(deleted_ids))
+    for sender in {m.SenderNumber or "" for m in deleted}:
+        cursor.execute(
+            f"SELECT LastID, Total FROM {CONVERSATIONS_TABLE} WHERE SenderNumber = %s", (sender,)
+        )
+        row = cursor.fetchone()
+        if row is None or row[0] not in deleted_ids:
+            continue
+        cursor.execute(
+            f"""
+            SELECT {INBOX_COLUMNS} FROM inbox
+            WHERE SenderNumber = %s AND ID NOT IN ({placeholders})
+            ORDER BY ReceivingDateTime DESC, ID DESC
+            LIMIT 1
+            """,
+            (sender, *deleted_ids),
+        )
+        nxt = cursor.fetchone()
+        if nxt is None or row[1] <= 0:
+            cursor.execute(f"DELETE FROM {CONVERSATIONS_TABLE} WHERE SenderNumber = %s", (sender,))
+            continue
+        m = InboxMessage(*nxt)
+        cursor.execute(
+            f"UPDATE {CONVERSATIONS_TABLE} SET LastID = %s, LastActivity = %s, LastText = %s "
+            "WHERE SenderNumber = %s",
+            (m.ID, m.ReceivingDateTime or _EPOCH, _preview(m), sender),
+        )
+
+
+def reset(cursor) -> None:
+    cursor.execute(f"DELETE FROM {CONVERSATIONS_TABLE}")
+
+
+def list_conversations(conn, limit: int = 5000) -> List[Dict[str, Any]]:
+    """Senders ordered by last activity, newest first, from the index table only."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            SELECT SenderNumber, LastID, LastActivity, LastText, Total, Unread
+            FROM {CONVERSATIONS_TABLE}
+            ORDER BY LastActivity DESC
+            LIMIT %s
+            """,
+            (limit,),
+        )
+        return [
+            {
+                "sender": sender,
+                "last_id": last_id,
+                "last_activity": last_activity.isoformat() if last_activity else None,
+                "last_text": last_text,
+                "total": total,
+                "unread": unread,
+            }
+            for sender, last_id, last_activity, last_text, total, unread in cursor.fetchall()
+        ]
+    finally:
+        cursor.close()
+
+
+def merge(lists: Iterable[List[Dict[str, Any]]], limit: int = 5000) -> List[Dict[str, Any]]:
+    """
+    Combine per-source indexes into one entry per sender (counts summed,
+    newest preview kept). Spellings of one number (`0912...`, `+98912...`)
+    form one entry: `sender` is the normalized phone number, `numbers` the
+    stored spellings (to query the thread with) and `name` the contact name.
+    """
+    by_sender: Dict[str, Dict[str, Any]] = {}
+    for items in lists:
+        for c in items:
+            key = contacts.normalize(c["sender"])
+            cur = by_sender.get(key)
+            if cur is None:
+                sender = key if key.startswith("+") else c["sender"]
+                by_sender[key] = dict(c, sender=sender, numbers=[c["sender"]], name=contacts.name(key))
+                continue
+            if c["sender"] not in cur["numbers"]:
+                cur["numbers"].append(c["sender"])
+            cur["total"] += c["total"]
+            cur["unread"] += c["unread"]
+            if (c["last_activity"] or "") > (cur["last_activity"] or ""):
+                cur.update(last_id=c["last_id"], last_activity=c["last_activity"], last_text=c["last_text"])
+    merged = sorted(by_sender.values(), key=lambda c: c["last_activity"] or "", reverse=True)
+    return merged[:limit]
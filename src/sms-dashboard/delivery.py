@@ -0,0 +1,321 @@
+"""
+Durable queue of Telegram notifications, between detecting new SMS and sending them.
+
+The bot's poll loop only detects: it writes each new message to the
+`sms_notify_queue` table of its source database and moves the poll cursor,
+in one transaction. A separate delivery loop sends what is due. A slow or
+unreachable Telegram therefore never holds up detection, and no message is
+lost while it is down.
+
+- One entry per message and destination chat (see routing.py). The queue
+  key is the message's inbox ID plus the chat, so a message is queued at
+  most once per chat (an idempotency key per SMS), even if a poll is
+  repeated after a failover.
+- A failed send is retried with exponential backoff (NOTIFY_RETRY_BASE_SECONDS,
+  doubling up to NOTIFY_RETRY_MAX_SECONDS; Telegram's `retry_after` wins
+  when given). After NOTIFY_MAX_ATTEMPTS attempts, or at once for an error
+  that retrying cannot fix, the entry becomes a dead letter. Dead letters
+  stay in the table until they are requeued with `retry_dead()` (the bot's
+  `/queue retry`).
+- Sent entries are kept for NOTIFY_KEEP_SENT_HOURS, then purged.
+
+Like the notifier state (notifier.py), every write is fenced by the
+notifier lease, so only the current leader of a source queues and delivers
+its notifications. Telegram offers no idempotent send: if the leader dies
+between sending and recording it, that one notification is sent again.
+"""
+from __future__ import annotations
+
+import os
+import random
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import storage
+from .multipart import InboxMessage
+from .notifier import LEASE_NAME, LEASE_TABLE, NOTIFIED_TABLE, STATE_TABLE
+from .stats import schema_key
+
+QUEUE_TABLE = "sms_notify_queue"
+PENDING, SENT, DEAD = "pending", "sent", "dead"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+    ID INT UNSIGNED NOT NULL,
+    ChatID VARCHAR(64) NOT NULL,
+    PartIDs TEXT NOT NULL,
+    SenderNumber VARCHAR(64) NOT NULL,
+    TextDecoded TEXT NOT NULL,
+    ReceivingDateTime DATETIME NULL,
+    State VARCHAR(8) NOT NULL,
+    Attempts INT NOT NULL DEFAULT 0,
+    NextAttemptAt DATETIME(3) NOT NULL,
+    LastError VARCHAR(255) NULL,
+    EnqueuedAt DATETIME(3) NOT NULL,
+    SentAt DATETIME(3) NULL,
+    PRIMARY KEY (ID, ChatID),
+    KEY idx_notify_queue_due (State, NextAttemptAt)
+)
+"""
+
+_schema_ready: set = set()
+
+
+def max_attempts() -> int:
+    return int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "8"))
+
+
+def retry_base_seconds() -> float:
+    return float(os.environ.get("NOTIFY_RETRY_BASE_SECONDS", "5"))
+
+
+def retry_max_seconds() -> float:
+    return float(os.environ.get("NOTIFY_RETRY_MAX_SECONDS", "600"))
+
+
+def keep_sent_hours() -> float:
+    return float(os.environ.get("NOTIFY_KEEP_SENT_HOURS", "24"))
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before the next try after `attempts` failures, with ±20% jitter."""
+    delay = min(retry_max_seconds(), retry_base_seconds() * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+@dataclass(frozen=True)
+class Notification:
+    """One queued notification (a row of `sms_notify_queue`)."""
+    ID: int
+    chat_id: str
+    part_ids: tuple
+    SenderNumber: str
+    TextDecoded: str
+    ReceivingDateTime: Any
+    attempts: int
+
+    def message(self, source_id: Optional[str]) -> InboxMessage:
+        """The message as the poll saw it, for formatting and tracing."""
+        return InboxMessage(
+            ID=self.ID, SenderNumber=self.SenderNumber, TextDecoded=self.TextDecoded,
+            ReceivingDateTime=self.ReceivingDateTime, Processed="false",
+            part_ids=self.part_ids if len(self.part_ids) > 1 else None, source=source_id,
+        )
+
+
+def ensure_schema(cursor) -> None:
+    key = schema_key(cursor)
+    if key in _schema_ready:
+        return
+    for statement in storage.dialect(cursor).ddl(SCHEMA):
+        cursor.execute(statement)
+    _schema_ready.add(key)
+
+
+def _holds_lease(cursor, token: int) -> bool:
+    """Lock the lease row for this transaction; True if `token` is still the current term."""
+    d = storage.dialect(cursor)
+    d.begin_write(cursor)
+    cursor.execute(f"SELECT Token FROM {LEASE_TABLE} WHERE Name = %s{d.for_update}", (LEASE_NAME,))
+    row = cursor.fetchone()
+    return bool(row) and row[0] == token
+
+
+def enqueue(conn, token: int, entries: Sequence[Tuple[InboxMessage, str]], last_id: int, new_cursor: int) -> bool:
+    """
+    Queue `entries` (message, chat ID) and move the poll cursor from `last_id`
+    to `new_cursor`, atomically. False (and nothing written) when the lease
+    has moved on.
+    """
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        if not _holds_lease(cursor, token):
+            conn.rollback()
+            return False
+        d = storage.dialect(cursor)
+        if entries:
+            cursor.executemany(
+                f"""
+                {d.insert_ignore} INTO {QUEUE_TABLE}
+                    (ID, ChatID, PartIDs, SenderNumber, TextDecoded, ReceivingDateTime, State, NextAttemptAt,
+                     EnqueuedAt)
+                VALUES (%s, %s, %s, %s, %s, %s, '{PENDING}', {d.now_ms}, {d.now_ms})
+                """,
+                [(m.ID, str(chat_id), ".".join(str(i) for i in m.ids), m.SenderNumber or "", m.TextDecoded or "",
+                  m.ReceivingDateTime) for m, chat_id in entries],
+            )
+        if new_cursor != last_id:
+            cursor.execute(f"UPDATE {STATE_TABLE} SET LastID = %s WHERE Name = %s", (new_cursor, LEASE_NAME))
+            # IDs notified by older versions (see notifier.py) are never read again
+            cursor.execute(f"DELETE FROM {NOTIFIED_TABLE} WHERE ID <= %s", (new_cursor,))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def due(conn, limit: int = 20) -> List[Notification]:
+    """Pending notifications whose next attempt is due, oldest first."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        cursor.execute(
+            f"""
+            SELECT ID, ChatID, PartIDs, SenderNumber, TextDecoded, ReceivingDateTime, Attempts
+            FROM {QUEUE_TABLE}
+            WHERE State = %s AND NextAttemptAt <= {storage.dialect(cursor).now_ms}
+            ORDER BY NextAttemptAt, ID, ChatID
+            LIMIT %s
+            """,
+            (PENDING, limit),
+        )
+        return [
+            Notification(row[0], row[1], tuple(int(i) for i in row[2].split(".")), row[3], row[4],
+                         storage.to_datetime(row[5]), row[6])
+            for row in cursor.fetchall()
+        ]
+    finally:
+        cursor.close()
+
+
+def _fenced_update(conn, token: int, sql: str, params: Sequence[Any]) -> bool:
+    cursor = conn.cursor()
+    try:
+        if not _holds_lease(cursor, token):
+            conn.rollback()
+            return False
+        cursor.execute(sql, tuple(params))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def mark_sent(conn, token: int, notification: Notification) -> bool:
+    """Record a delivered notification; False when the lease has moved on."""
+    d = storage.dialect(conn)
+    return _fenced_update(
+        conn, token,
+        f"UPDATE {QUEUE_TABLE} SET State = %s, Attempts = Attempts + 1, SentAt = {d.now_ms}, LastError = NULL "
+        "WHERE ID = %s AND ChatID = %s",
+        (SENT, notification.ID, notification.chat_id),
+    )
+
+
+def mark_failed(conn, token: int, notification: Notification, error: str,
+                permanent: bool = False, retry_after: Optional[float] = None) -> Optional[str]:
+    """
+    Record a failed attempt: schedule a retry, or dead-letter the entry when
+    the error is permanent or attempts ran out. Returns the new state, or
+    None when the lease has moved on.
+    """
+    attempts = notification.attempts + 1
+    dead = permanent or attempts >= max_attempts()
+    delay = 0.0 if dead else (retry_after if retry_after is not None else backoff(attempts))
+    d = storage.dialect(conn)
+    written = _fenced_update(
+        conn, token,
+        f"UPDATE {QUEUE_TABLE} SET State = %s, Attempts = %s, LastError = %s, "
+        f"NextAttemptAt = {d.now_plus_seconds()} WHERE ID = %s AND ChatID = %s",
+        (DEAD if dead else PENDING, attempts, error[:255], round(delay, 3), notification.ID, notification.chat_id),
+    )
+    if not written:
+        return None
+    return DEAD if dead else PENDING
+
+
+def purge_sent(conn) -> int:
+    """Delete sent entries older than NOTIFY_KEEP_SENT_HOURS; returns the number removed."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        d = storage.dialect(cursor)
+        cursor.execute(
+            f"DELETE FROM {QUEUE_TABLE} WHERE State = %s AND SentAt < {d.now_plus_seconds()}",
+            (SENT, -int(keep_sent_hours() * 3600)),
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def depth(conn) -> Dict[str, Any]:
+    """Queue size: pending and dead entries, and the age in seconds of the oldest pending one."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        cursor.execute(
+            f"SELECT State, COUNT(*), MIN(EnqueuedAt), {storage.dialect(cursor).now_ms} "
+            f"FROM {QUEUE_TABLE} WHERE State IN (%s, %s) GROUP BY State",
+            (PENDING, DEAD),
+        )
+        result: Dict[str, Any] = {PENDING: 0, DEAD: 0, "oldest_seconds": 0.0}
+        for state, count, oldest, now in cursor.fetchall():
+            result[state] = count
+            oldest, now = storage.to_datetime(oldest), storage.to_datetime(now)
+            if state == PENDING and isinstance(oldest, datetime) and isinstance(now, datetime):
+                result["oldest_seconds"] = max(0.0, (now - oldest).total_seconds())
+        return result
+    finally:
+        cursor.close()
+
+
+def dead_letters(conn, limit: int = 5) -> List[Dict[str, Any]]:
+    """The most recent dead letters: ID, chat, sender, attempts and last error."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        cursor.execute(
+            f"SELECT ID, ChatID, SenderNumber, Attempts, LastError FROM {QUEUE_TABLE} "
+            "WHERE State = %s ORDER BY ID DESC, ChatID LIMIT %s",
+            (DEAD, limit),
+        )
+        return [
+            {"ID": r[0], "chat": r[1], "sender": r[2], "attempts": r[3], "error": r[4] or ""}
+            for r in cursor.fetchall()
+        ]
+    finally:
+        cursor.close()
+
+
+def retry_dead(conn) -> int:
+    """Requeue every dead letter for immediate delivery; returns how many."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        cursor.execute(
+            f"UPDATE {QUEUE_TABLE} SET State = %s, Attempts = 0, NextAttemptAt = {storage.dialect(cursor).now_ms} "
+            "WHERE State = %s",
+            (PENDING, DEAD),
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def metrics_lines(depths: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Queue depth per source in Prometheus text format (appended to LAG_METRICS_FILE)."""
+    lines = [
+        "# HELP sms_notify_queue_depth Telegram notifications waiting in the queue.",
+        "# TYPE sms_notify_queue_depth gauge",
+    ]
+    for source_id, d in depths.items():
+        for state in (PENDING, DEAD):
+            lines.append(f'sms_notify_queue_depth{{source="{source_id}",state="{state}"}} {d[state]}')
+    lines += [
+        "# HELP sms_notify_queue_oldest_seconds Age of the oldest pending notification.",
+        "# TYPE sms_notify_queue_oldest_seconds gauge",
+    ]
+    for source_id, d in depths.items():
+        lines.append(f'sms_notify_queue_oldest_seconds{{source="{source_id}"}} {d["oldest_seconds"]:.1f}')
+    return lines
@@ -0,0 +1,234 @@
+"""
+Streaming export of assembled messages as CSV or NDJSON, optionally gzipped.
+
+Each source is read in one pass with an unbuffered cursor. Rows come from the
+server in `fetchmany` batches in (ReceivingDateTime, ID) order, and the
+per-source streams are merged oldest first. Multipart parts are assembled on
+the fly:
+
+- A group (sender, UDH ref, total) is emitted as soon as all its parts have
+  arrived.
+- A group still incomplete GROUP_WINDOW after its first part is emitted with
+  the parts it has.
+- So is any group pushed out by MAX_PENDING_GROUPS.
+
+Output stays in order of each message's first part: later messages wait
+behind a pending group, which the window bounds. Memory therefore depends on
+the batch size and the window, not on how many rows are exported.
+"""
+from __future__ import annotations
+
+import csv
+import heapq
+import io
+import json
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import contacts, storage
+from .multipart import GROUP_WINDOW, INBOX_COLUMNS, InboxMessage, _parse_udh_concat, assemble_inbox_rows
+from .sources import Source, all_sources, get_db_connection, tag
+
+EXPORT_BATCH_SIZE = 2000
+MAX_PENDING_GROUPS = 10000
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+CSV_FIELDS = ("source", "ID", "ids", "SenderNumber", "ReceivingDateTime", "Processed", "TextDecoded")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_time(value: Optional[str], end: bool = False) -> Optional[datetime]:
+    """'2026-03-01' or an ISO datetime; a bare date used as `end` includes that whole day."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) <= 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def build_filter(sender: Optional[str] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, state: str = "all") -> Tuple[str, List[Any]]:
+    """
+    WHERE clause and params for the export filters (`until` is exclusive);
+    `sender` matches every stored spelling of the number (contacts.spellings).
+    """
+    clauses, params = ["1 = 1"], []
+    if sender:
+        forms = contacts.spellings(sender) or [sender]
+        clauses.append(f"SenderNumber IN ({', '.join(['%s'] * len(forms))})")
+        params.extend(forms)
+    if since:
+        clauses.append("ReceivingDateTime >= %s")
+        params.append(since)
+    if until:
+        clauses.append("ReceivingDateTime < %s")
+        params.append(until)
+    if state in ("read", "unread"):
+        clauses.append("Processed = %s")
+        params.append("true" if state == "read" else "false")
+    elif state != "all":
+        raise ValueError(f"Unknown state '{state}' (expected read, unread or all).")
+    return " AND ".join(clauses), params
+
+
+def _open_source(source: Source, where: str, params: Sequence[Any]) -> Tuple[Any, Any]:
+    """Connect and run the export query; (connection, cursor) ready to fetch from."""
+    conn = get_db_connection(source.id, read_only=True)
+    if not conn:
+        raise RuntimeError(f"{source.id}: database connection failed")
+    cursor = conn.cursor(buffered=False)
+    try:
+        storage.dialect(conn).prepare_stream(cursor)
+        cursor.execute(
+            f"SELECT {INBOX_COLUMNS} FROM inbox WHERE {where} ORDER BY ReceivingDateTime, ID",
+            tuple(params),
+        )
+    except storage.Error as err:
+        cursor.close()
+        conn.close()
+        raise RuntimeError(f"{source.id}: {err}") from err
+    return conn, cursor
+
+
+def _read_source(source: Source, conn, cursor) -> Iterator[InboxMessage]:
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield from tag((InboxMessage(*r) for r in rows), source.id)
+    finally:
+        try:
+            cursor.close()
+        except storage.Error:
+            pass  # unread rows left when the consumer stopped early; closing the connection drops them
+        conn.close()
+
+
+def _arrival_key(m: InboxMessage) -> Tuple[datetime, str, int]:
+    return (m.ReceivingDateTime or _EPOCH, m.source or "", m.ID or 0)
+
+
+def assemble_stream(rows: Iterable[InboxMessage], window: timedelta = GROUP_WINDOW,
+                    max_pending: int = MAX_PENDING_GROUPS) -> Iterator[InboxMessage]:
+    """Assemble multipart groups from rows in arrival order, yielding messages in the same order."""
+    # Output slots in first-part order: an InboxMessage, or a list of parts still filling up
+    slots: Deque[Any] = deque()
+    # Open groups: key -> (parts, {seq}, first part time)
+    pending: "OrderedDict[Tuple[str, str, int, int], Tuple[List[InboxMessage], set, datetime]]" = OrderedDict()
+
+    def close(key) -> None:
+        parts, _seqs, _first = pending.pop(key)
+        parts.append(None)  # marks the slot as final
+
+    def drain() -> Iterator[InboxMessage]:
+        while slots:
+            head = slots[0]
+            if isinstance(head, list):
+                if not head or head[-1] is not None:
+                    return
+                slots.popleft()
+                yield from assemble_inbox_rows(head[:-1])
+            else:
+                yield slots.popleft()
+
+    for m in rows:
+        now = m.ReceivingDateTime or _EPOCH
+        while pending:
+            key, (_parts, _seqs, first) = next(iter(pending.items()))
+            if now - first <= window and len(pending) < max_pending:
+                break
+            close(key)
+
+        parsed = _parse_udh_concat(m.UDH)
+        if parsed is None:
+            slots.append(m)
+        else:
+            ref, total, seq = parsed
+            # Grouped like assemble_inbox_rows: one number however it was spelled
+            key = (m.source or "", contacts.normalize(m.SenderNumber), ref, total)
+            if key in pending and seq in pending[key][1]:
+                # Same reference reused by a new message
+                close(key)
+            if key not in pending:
+                parts: List[InboxMessage] = []
+                pending[key] = (parts, set(), now)
+                slots.append(parts)
+            parts, seqs, _first = pending[key]
+            parts.append(m)
+            seqs.add(seq)
+            if len(seqs) == total:
+                close(key)
+        yield from drain()
+
+    for key in list(pending):
+        close(key)
+    yield from drain()
+
+
+def iter_messages(where: str = "1 = 1", params: Sequence[Any] = (),
+                  sources: Optional[Sequence[Source]] = None) -> Iterator[InboxMessage]:
+    """
+    Assembled messages of all sources matching `where`, oldest first.
+
+    Every source is connected and queried before this returns, so a source
+    that is down raises RuntimeError here rather than halfway through a
+    streamed response.
+    """
+    opened: List[Tuple[Source, Any, Any]] = []
+    try:
+        for s in sources or all_sources():
+            opened.append((s, *_open_source(s, where, params)))
+    except RuntimeError:
+        for _s, conn, cursor in opened:
+            cursor.close()
+            conn.close()
+        raise
+    streams = [_read_source(s, conn, cursor) for s, conn, cursor in opened]
+    return assemble_stream(heapq.merge(*streams, key=_arrival_key))
+
+
+def _csv_lines(messages: Iterable[InboxMessage]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_FIELDS)
+    for m in messages:
+        row = m.to_json()
+        row["ids"] = " ".join(str(i) for i in row["ids"])
+        writer.writerow([row[f] for f in CSV_FIELDS])
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _ndjson_lines(messages: Iterable[InboxMessage]) -> Iterator[str]:
+    for m in messages:
+        yield json.dumps(m.to_json(), ensure_ascii=False) + "\n"
+
+
+def _gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def check_format(fmt: str) -> None:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}' (expected {', '.join(FORMATS)}).")
+
+
+def render(messages: Iterable[InboxMessage], fmt: str = "csv", compress: bool = False) -> Iterator[bytes]:
+    """Encode messages as CSV or NDJSON bytes, optionally gzip-compressed, chunk by chunk."""
+    check_format(fmt)
+    lines = _csv_lines(messages) if fmt == "csv" else _ndjson_lines(messages)
+    chunks = (line.encode("utf-8") for line in lines)
+    return _gzip(chunks) if compress else chunks
@@ -0,0 +1,292 @@
+"""
+Extraction of verification codes, amounts and links from incoming SMS.
+
+Every assembled message is scanned once with the precompiled patterns below.
+The results are stored in `sms_extracted` next to the inbox (keyed by the
+message ID, the newest part's for a multipart message). They are shown as
+one-tap copy buttons under the bot's notifications and on the dashboard's
+message cards.
+
+- The poller stores the results for every message it queues for
+  notification (see bot.py).
+- `sms-extract backfill` scans older messages in ID batches. It can be
+  stopped and run again: stored messages are skipped.
+- Readers call `lookup()`: stored results first, then a scan of what is
+  missing. Scans are memoized per message in the process, so a message is
+  not scanned twice, even where nothing can be stored (read replicas).
+
+Digits are normalized first: Persian and Arabic-Indic digits and the Arabic
+thousands separator read like ASCII ones. A code is a run of 4-8 digits (or
+two groups of three, "123-456") in a message that mentions a code, password
+or PIN. Numbers that belong to an amount or a link are not codes. Amounts
+need a currency symbol or name next to them. Links start with http(s):// or
+www.
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from . import storage
+from .multipart import INBOX_COLUMNS, InboxMessage, assemble_inbox_rows, to_messages
+from . import sources
+from .stats import schema_key
+
+TABLE = "sms_extracted"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    ID INT UNSIGNED NOT NULL PRIMARY KEY,
+    Codes VARCHAR(255) NOT NULL,
+    Amounts VARCHAR(255) NOT NULL,
+    Links TEXT NOT NULL,
+    ExtractedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# At most this many values of each kind are kept per message
+MAX_VALUES = 3
+# Scans remembered per process
+MEMO_SIZE = 10000
+
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩٬", "01234567890123456789,")
+
+_CODE_CONTEXT = re.compile(
+    r"(?i)\b(?:code|otp|pin|passcode|password|verification|verify|token|رمز|کد|كد)\b"
+)
+# Not part of a longer number, a time, a date or a decimal
+_CODE = re.compile(r"(?<!\d)(?<!\d[,.:/])(?:\d{4,8}|\d{3}[- ]\d{3})(?!\d|[,.:/]\d)")
+_CURRENCY = r"(?:\$|€|£|usd|eur|irr|irt|rials?|tomans?|ریال|تومان)"
+_NUMBER = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+_AMOUNT = re.compile(
+    rf"(?i)(?<![\w$€£]){_CURRENCY}\s?(?:{_NUMBER})(?!\d)|(?<![\d,.])(?:{_NUMBER})\s?{_CURRENCY}(?!\w)"
+)
+_LINK = re.compile(r"(?i)\b(?:https?://|www\.)[^\s<>\"']+")
+_LINK_TRAILER = ".,;:!?)]}'\""
+
+_schema_ready: set = set()
+_memo: "OrderedDict[Tuple, Extracted]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Extracted:
+    codes: Tuple[str, ...] = ()
+    amounts: Tuple[str, ...] = ()
+    links: Tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.codes or self.amounts or self.links)
+
+    def to_json(self) -> Dict[str, List[str]]:
+        return {"codes": list(self.codes), "amounts": list(self.amounts), "links": list(self.links)}
+
+
+def _unique(values: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(values))[:MAX_VALUES]
+
+
+def scan(text: Optional[str]) -> Extracted:
+    """Codes, amounts and links in one message text."""
+    text = (text or "").translate(_DIGITS)
+    links, taken = [], []
+    for m in _LINK.finditer(text):
+        links.append(m.group().rstrip(_LINK_TRAILER))
+        taken.append(m.span())
+    amounts = []
+    for m in _AMOUNT.finditer(text):
+        if not any(start <= m.start() < end for start, end in taken):
+            amounts.append(" ".join(m.group().split()))
+            taken.append(m.span())
+    codes = []
+    if _CODE_CONTEXT.search(text):
+        for m in _CODE.finditer(text):
+            if not any(start < m.end() and m.start() < end for start, end in taken):
+                codes.append(re.sub(r"[- ]", "", m.group()))
+    return Extracted(_unique(codes), _unique(amounts), _unique(links))
+
+
+def extract(message: InboxMessage) -> Extracted:
+    """`scan()` of a message, memoized per message (source and part IDs)."""
+    key = (message.source, message.ids)
+    with _memo_lock:
+        found = _memo.get(key)
+        if found is not None:
+            _memo.move_to_end(key)
+            return found
+    found = scan(message.TextDecoded)
+    with _memo_lock:
+        _memo[key] = found
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return found
+
+
+def memo_size() -> int:
+    return len(_memo)
+
+
+def ensure_schema(cursor) -> None:
+    key = schema_key(cursor)
+    if key in _schema_ready:
+        return
+    for statement in storage.dialect(cursor).ddl(SCHEMA):
+        cursor.execute(statement)
+    _schema_ready.add(key)
+
+
+def _split(value: str) -> Tuple[str, ...]:
+    return tuple(v for v in value.split("\n") if v)
+
+
+def load(conn, ids: Iterable[int]) -> Dict[int, Extracted]:
+    """Stored results for the given message IDs (absent IDs are not scanned yet)."""
+    ids = list(ids)
+    if not ids:
+        return {}
+    cursor = conn.cursor()
+    try:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"SELECT ID, Codes, Amounts, Links FROM {TABLE} WHERE ID IN ({placeholders})", tuple(ids))
+        return {row[0]: Extracted(_split(row[1]), _split(row[2]), _split(row[3])) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def store(conn, messages: Sequence[InboxMessage]) -> Dict[int, Extracted]:
+    """
+    Scan the messages not stored yet and store them; returns the results for
+    all of them. Messages still missing parts are scanned but not stored.
+    """
+    return _store(conn, messages)[0]
+
+
+def _store(conn, messages: Sequence[InboxMessage]) -> Tuple[Dict[int, Extracted], int]:
+    if not messages:
+        return {}, 0
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+    finally:
+        cursor.close()
+    complete = [m for m in messages if not m.missing_parts]
+    # lookup() trusts a stored row, so one scanned from partial text would
+    # hide the message's codes for good
+    results = {m.ID: extract(m) for m in messages if m.missing_parts}
+    results.update(load(conn, (m.ID for m in complete)))
+    new = [(m.ID, extract(m)) for m in complete if m.ID not in results]
+    if not new:
+        return results, 0
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            f"{storage.dialect(cursor).insert_ignore} INTO {TABLE} (ID, Codes, Amounts, Links) VALUES (%s, %s, %s, %s)",
+            [(mid, "\n".join(e.codes), "\n".join(e.amounts), "\n".join(e.links)) for mid, e in new],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    results.update(new)
+    return results, len(new)
+
+
+def lookup(conn, messages: Sequence[InboxMessage]) -> Dict[int, Extracted]:
+    """
+    Results for the messages of one source: stored ones, else a (memoized)
+    scan. Never writes, so it also works on a read replica or before the
+    table exists.
+    """
+    try:
+        stored = load(conn, (m.ID for m in messages if not m.missing_parts))
+    except storage.Error:
+        conn.rollback()
+        stored = {}
+    return {m.ID: stored[m.ID] if m.ID in stored else extract(m) for m in messages}
+
+
+def lookup_all(messages: Sequence[InboxMessage]) -> Dict[Tuple, Extracted]:
+    """`lookup()` across sources (read-only connections); keyed by (source, ID)."""
+    if not messages:
+        return {}
+    by_source: Dict[Optional[str], List[InboxMessage]] = {}
+    for m in messages:
+        by_source.setdefault(m.source, []).append(m)
+
+    def load_source(conn, source):
+        return lookup(conn, by_source.get(source.id, []))
+
+    targets = [s for s in sources.all_sources() if s.id in by_source]
+    per_source = sources.fan_out(sources.with_connection(load_source, None, read_only=True), targets) if targets else {}
+    results = {}
+    for m in messages:
+        found = (per_source.get(m.source) or {}).get(m.ID)
+        results[(m.source, m.ID)] = found if found is not None else extract(m)
+    return results
+
+
+def backfill(conn, source_id: str, batch: int = 1000, start: int = 0) -> int:
+    """Scan and store every inbox message above ID `start`; returns how many were scanned."""
+    scanned, last_id, unfinished = 0, start, []
+    while True:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ID > %s ORDER BY ID LIMIT %s", (last_id, batch)
+            )
+            rows = sources.tag(to_messages(cursor.fetchall()), source_id)
+        finally:
+            cursor.close()
+        if not rows:
+            return scanned
+        last_id = rows[-1].ID
+        rows = unfinished + rows
+        messages = assemble_inbox_rows(rows)
+        # Parts of a message split across batches are carried into the next one
+        waiting = {i for m in messages if m.missing_parts for i in m.ids}
+        unfinished = [r for r in rows if r.ID in waiting]
+        scanned += _store(conn, messages)[1]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="sms-extract", description="Extract codes, amounts and links from SMS.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("backfill", help="Scan and store the messages received before extraction existed")
+    cmd.add_argument("--source", help="Only this source id (default: all sources)")
+    cmd.add_argument("--batch", type=int, default=1000, help="Inbox rows read per query (default: 1000)")
+    scan_cmd = commands.add_parser("scan", help="Print what would be extracted from a text")
+    scan_cmd.add_argument("text")
+    args = parser.parse_args(argv)
+
+    if args.command == "scan":
+        print(scan(args.text).to_json())
+        return 0
+    load_dotenv()
+    failed = 0
+    for sid in [args.source] if args.source else [s.id for s in sources.all_sources()]:
+        conn = sources.get_db_connection(sid)
+        if not conn:
+            print(f"{sid}: database connection failed", file=sys.stderr)
+            failed += 1
+            continue
+        try:
+            print(f"{sid}: {backfill(conn, sid, args.batch)} message(s) scanned")
+        except storage.Error as err:
+            print(f"{sid}: {err}", file=sys.stderr)
+            failed += 1
+        finally:
+            conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Write actions on inbox messages shared by the dashboard and the bot.
+
+Messages are addressed by references grouped per source
+({source id: [row IDs]}, see `sources.parse_refs`). Each source is updated in
+its own transaction together with its statistics counters, in statements of
+at most BATCH_SIZE IDs, and the shared cache is invalidated once at the end.
+
+"Select all matching" in the dashboard sends a filter instead of IDs;
+`select_matching` turns it back into references, limited to the rows that
+existed when the page was loaded.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from . import stats, storage
+from .cache import shared_cache
+from .sources import Source, fan_out, get_db_connection, note_write, with_connection
+
+BATCH_SIZE = 1000
+
+
+def _apply(action: str, refs: Dict[str, List[int]]) -> Tuple[int, List[str]]:
+    changed, errors = 0, []
+    for source_id, ids in refs.items():
+        if not ids:
+            continue
+        conn = get_db_connection(source_id)
+        if not conn:
+            errors.append(f"{source_id}: database connection failed")
+            continue
+        cursor = conn.cursor()
+        try:
+            for start in range(0, len(ids), BATCH_SIZE):
+                batch = ids[start:start + BATCH_SIZE]
+                placeholders = ', '.join(['%s'] * len(batch))
+                if action == 'read':
+                    stats.record_read(cursor, batch)
+                    cursor.execute(
+                        f"UPDATE inbox SET Processed = 'true' WHERE ID IN ({placeholders}) AND Processed = 'false'",
+                        tuple(batch),
+                    )
+                else:
+                    stats.record_delete(cursor, batch)
+                    cursor.execute(f"DELETE FROM inbox WHERE ID IN ({placeholders})", tuple(batch))
+                changed += cursor.rowcount
+            conn.commit()
+            note_write(source_id)
+        except storage.Error as err:
+            conn.rollback()
+            errors.append(f"{source_id}: {err}")
+        finally:
+            cursor.close()
+            conn.close()
+    if refs:
+        shared_cache.invalidate()
+    return changed, errors
+
+
+def mark_read(refs: Dict[str, List[int]]) -> Tuple[int, List[str]]:
+    """Mark messages as read; returns (rows changed, error strings)."""
+    return _apply('read', refs)
+
+
+def delete(refs: Dict[str, List[int]]) -> Tuple[int, List[str]]:
+    """Delete messages; returns (rows deleted, error strings)."""
+    return _apply('delete', refs)
+
+
+def select_matching(where: str, params: Sequence[Any], snapshot: Mapping[str, int],
+                    exclude: Mapping[str, Iterable[int]]) -> Dict[str, List[int]]:
+    """
+    Row IDs per source matching `where`, up to the newest ID each source had
+    in `snapshot` (sources missing from it are skipped), minus `exclude`.
+    """
+    def query(conn, source: Source) -> List[int]:
+        if source.id not in snapshot:
+            return []
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT ID FROM inbox WHERE ({where}) AND ID <= %s", (*params, int(snapshot[source.id])))
+            skip = set(exclude.get(source.id, ()))
+            return [row[0] for row in cursor.fetchall() if row[0] not in skip]
+        finally:
+            cursor.close()
+
+    # Read from the primary: the rows are about to be changed there
+    return {sid: ids for sid, ids in fan_out(with_connection(query, [])).items() if ids}
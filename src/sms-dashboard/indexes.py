@@ -0,0 +1,362 @@
+"""
+Index advisor for Gammu's inbox table.
+
+Gammu's schema only has the primary key on `inbox`, while the app filters
+and sorts on ReceivingDateTime, SenderNumber and Processed. This command
+runs EXPLAIN on the inbox statements the dashboard and the bot issue
+(`statements()`, kept in step with the queries in sources.py, bot.py,
+stats.py, conversations.py, export.py and inbox.py) and reports full table
+scans and filesorts:
+
+    sms-indexes report            # plans, problems and the DDL that fixes them
+    sms-indexes apply [--dry-run] # create the missing indexes
+    sms-indexes check             # after deploying: every statement uses its index
+
+`apply` adds the indexes in `RECOMMENDED` that no existing index already
+covers. On MySQL/MariaDB it uses online DDL (ALGORITHM=INPLACE, LOCK=NONE),
+so SMSD keeps inserting while an index builds. `--fulltext` also adds the
+FULLTEXT index used by text search (MySQL only; that one needs LOCK=SHARED,
+which pauses inserts while it builds). `check` exits with status 1 when a
+statement does not use the index meant for it. On MySQL it also prints how
+often each inbox index was read since the server started (from
+performance_schema, when enabled).
+
+Statements marked `whole_table` read every row by design (the full inbox
+page, the bot's blank-message cleanup, LIKE text search); they are listed
+but not counted as problems. Multipart grouping by UDH happens in Python
+after the rows are read, so UDH needs no index.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from . import storage
+from .multipart import INBOX_COLUMNS
+from .search import FULLTEXT_INDEX
+from .sources import all_sources, get_db_connection
+
+load_dotenv()
+
+TABLE = "inbox"
+PRIMARY = "PRIMARY"
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    name: str
+    columns: Tuple[str, ...]
+
+
+RECOMMENDED = (
+    # Inbox pages, the bot's last messages, exports by date range
+    IndexSpec("idx_inbox_time", ("ReceivingDateTime", "ID")),
+    # Conversation threads, sender search, preview refresh after deletes
+    IndexSpec("idx_inbox_sender_time", ("SenderNumber", "ReceivingDateTime", "ID")),
+    # The bot's unread poll above its cursor
+    IndexSpec("idx_inbox_processed_id", ("Processed", "ID")),
+)
+
+
+@dataclass(frozen=True)
+class Statement:
+    name: str
+    sql: str
+    params: Tuple[Any, ...] = ()
+    # RECOMMENDED name or PRIMARY expected to serve it; None only rules out full scans
+    index: Optional[str] = None
+    whole_table: bool = False
+
+
+def statements(now: Optional[datetime] = None) -> List[Statement]:
+    """The inbox statements of the app and the bot, with representative parameters."""
+    now = now or datetime.now()
+    page = f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ({{where}}){{extra}} ORDER BY ReceivingDateTime DESC, ID DESC LIMIT %s"
+    older = " AND (ReceivingDateTime < %s OR (ReceivingDateTime = %s AND ID < %s))"
+    return [
+        Statement("inbox page (app index)",
+                  f"SELECT {INBOX_COLUMNS} FROM inbox ORDER BY ReceivingDateTime DESC", whole_table=True),
+        Statement("inbox fingerprint", "SELECT MAX(ID) FROM inbox"),
+        Statement("messages page", page.format(where="1 = 1", extra=""), (70,), index="idx_inbox_time"),
+        Statement("messages page, older", page.format(where="1 = 1", extra=older),
+                  (now, now, 1000, 70), index="idx_inbox_time"),
+        Statement("bot last messages", page.format(where="TextDecoded IS NOT NULL AND TextDecoded != ''", extra=""),
+                  (25,), index="idx_inbox_time"),
+        # Run once per spelling of the number (see contacts.spellings and sources.fetch_page)
+        Statement("conversation thread / sender search", page.format(where="SenderNumber = %s", extra=older),
+                  ("+10000000000", now, now, 1000, 40), index="idx_inbox_sender_time"),
+        Statement("text search (LIKE)", page.format(where="TextDecoded LIKE %s ESCAPE '!'", extra=""),
+                  ("%invoice%", 25), whole_table=True),
+        Statement("preview refresh after delete",
+                  f"SELECT {INBOX_COLUMNS} FROM inbox WHERE SenderNumber = %s AND ID NOT IN (%s) "
+                  "ORDER BY ReceivingDateTime DESC, ID DESC LIMIT 1",
+                  ("+10000000000", 1000), index="idx_inbox_sender_time"),
+        Statement("bot unread poll",
+                  f"SELECT {INBOX_COLUMNS} FROM inbox WHERE Processed = 'false' AND ID > %s ORDER BY ID ASC",
+                  (1000,), index="idx_inbox_processed_id"),
+        Statement("bot blank cleanup",
+                  "SELECT ID FROM inbox WHERE TextDecoded IS NULL OR TRIM(TextDecoded) = ''", whole_table=True),
+        Statement("stats sync",
+                  f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ID > %s ORDER BY ID LIMIT %s", (1000, 500), index=PRIMARY),
+        Statement("export range",
+                  f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ReceivingDateTime >= %s AND ReceivingDateTime < %s "
+                  "ORDER BY ReceivingDateTime, ID", (now - timedelta(days=1), now), index="idx_inbox_time"),
+        Statement("mark read",
+                  "UPDATE inbox SET Processed = 'true' WHERE ID IN (%s, %s) AND Processed = 'false'", (1000, 1001)),
+        Statement("delete", "DELETE FROM inbox WHERE ID IN (%s, %s)", (1000, 1001)),
+    ]
+
+
+@dataclass(frozen=True)
+class Plan:
+    keys: Tuple[str, ...]  # indexes read, PRIMARY for the primary key
+    full_scan: bool
+    filesort: bool
+    rows: Optional[int]  # estimated rows examined (MySQL only)
+    detail: str
+
+
+def _explain_mysql(cursor, sql: str, params: Sequence[Any]) -> Plan:
+    cursor.execute(f"EXPLAIN {sql}", tuple(params))
+    names = [d[0] for d in cursor.description]
+    steps = [dict(zip(names, row)) for row in cursor.fetchall()]
+    inbox = [s for s in steps if s.get("table") == TABLE]
+    extra = "; ".join(str(s.get("Extra") or "") for s in steps)
+    rows = [int(s["rows"]) for s in inbox if s.get("rows") is not None]
+    return Plan(
+        keys=tuple(s["key"] for s in inbox if s.get("key")),
+        full_scan=any(s.get("type") == "ALL" for s in inbox),
+        filesort="Using filesort" in extra,
+        rows=sum(rows) if rows else None,
+        detail="; ".join(f"type={s.get('type')} key={s.get('key')} rows={s.get('rows')} {s.get('Extra') or ''}".strip()
+                         for s in inbox) or extra,
+    )
+
+
+def _explain_sqlite(cursor, sql: str, params: Sequence[Any]) -> Plan:
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", tuple(params))
+    details = [row[3] for row in cursor.fetchall()]
+    keys = []
+    for d in details:
+        if "PRIMARY KEY" in d:
+            keys.append(PRIMARY)
+        elif " INDEX " in d:
+            keys.append(d.split(" INDEX ", 1)[1].split()[0])
+    return Plan(
+        keys=tuple(keys),
+        # "SCAN inbox" reads the table; "SCAN inbox USING INDEX x" walks an index in order
+        full_scan=any(d == f"SCAN {TABLE}" or (d.startswith(f"SCAN {TABLE} ") and " INDEX " not in d)
+                      for d in details),
+        filesort=any("TEMP B-TREE" in d for d in details),
+        rows=None,
+        detail="; ".join(details),
+    )
+
+
+def explain(conn, statement: Statement) -> Plan:
+    cursor = conn.cursor()
+    try:
+        run = _explain_sqlite if storage.dialect(conn).name == "sqlite" else _explain_mysql
+        return run(cursor, statement.sql, statement.params)
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def _covers(existing: Sequence[str], wanted: Sequence[str]) -> bool:
+    # InnoDB and SQLite both append the primary key (ID) to every secondary index
+    have = [c.lower() for c in existing] + ["id"]
+    return have[:len(wanted)] == [c.lower() for c in wanted]
+
+
+def resolve(existing: Dict[str, Tuple[str, ...]]) -> Dict[str, Optional[str]]:
+    """{recommended name: name of an existing index that covers it, or None}."""
+    return {
+        spec.name: next((name for name, cols in existing.items() if _covers(cols, spec.columns)), None)
+        for spec in RECOMMENDED
+    }
+
+
+def problems(statement: Statement, plan: Plan, covering: Dict[str, Optional[str]]) -> List[str]:
+    """What is wrong with a statement's plan; empty when it is served as intended."""
+    if statement.whole_table:
+        return []
+    found = []
+    if plan.full_scan:
+        found.append("full table scan")
+    if plan.filesort:
+        found.append("filesort")
+    if statement.index == PRIMARY:
+        expected = PRIMARY
+    else:
+        expected = covering.get(statement.index) if statement.index else None
+    if statement.index and expected not in plan.keys:
+        found.append(f"does not use {expected or statement.index}")
+    return found
+
+
+def missing_ddl(conn, existing: Dict[str, Tuple[str, ...]], fulltext: bool = False) -> List[str]:
+    d = storage.dialect(conn)
+    covering = resolve(existing)
+    ddl = [d.add_index(TABLE, spec.name, spec.columns) for spec in RECOMMENDED if covering[spec.name] is None]
+    if fulltext and d.name == "mysql" and FULLTEXT_INDEX not in existing:
+        # InnoDB cannot build a FULLTEXT index with LOCK=NONE
+        ddl.append(f"ALTER TABLE {TABLE} ADD FULLTEXT INDEX {FULLTEXT_INDEX} (TextDecoded), "
+                   "ALGORITHM=INPLACE, LOCK=SHARED")
+    return ddl
+
+
+def existing_indexes(conn) -> Dict[str, Tuple[str, ...]]:
+    cursor = conn.cursor()
+    try:
+        return storage.dialect(conn).index_columns(cursor, TABLE)
+    finally:
+        cursor.close()
+
+
+def index_usage(conn) -> Optional[Dict[str, int]]:
+    """MySQL: rows read through each inbox index since server start; None if unavailable."""
+    if storage.dialect(conn).name != "mysql":
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT INDEX_NAME, COUNT_READ FROM performance_schema.table_io_waits_summary_by_index_usage "
+            "WHERE OBJECT_SCHEMA = DATABASE() AND OBJECT_NAME = %s AND INDEX_NAME IS NOT NULL",
+            (TABLE,),
+        )
+        return {name: int(count) for name, count in cursor.fetchall()}
+    except storage.Error:
+        return None
+    finally:
+        cursor.close()
+
+
+def analyze(conn) -> Tuple[List[Tuple[Statement, Plan, List[str]]], Dict[str, Tuple[str, ...]]]:
+    existing = existing_indexes(conn)
+    covering = resolve(existing)
+    results = []
+    for statement in statements():
+        plan = explain(conn, statement)
+        results.append((statement, plan, problems(statement, plan, covering)))
+    return results, existing
+
+
+def print_plans(results: Sequence[Tuple[Statement, Plan, List[str]]]) -> int:
+    """Print one line per statement; returns the number of statements with problems."""
+    bad = 0
+    for statement, plan, found in results:
+        if found:
+            bad += 1
+            status = "PROBLEM: " + ", ".join(found)
+        elif statement.whole_table:
+            status = "reads the whole table by design"
+        else:
+            status = "ok"
+        print(f"  {statement.name}: {status}")
+        print(f"      {plan.detail}")
+    return bad
+
+
+def _connections(source_id: Optional[str]):
+    ids = [source_id] if source_id else [s.id for s in all_sources()]
+    for sid in ids:
+        conn = get_db_connection(sid)  # the primary: replicas may not have the indexes yet
+        if not conn:
+            print(f"{sid}: database connection failed", file=sys.stderr)
+            yield sid, None
+            continue
+        try:
+            yield sid, conn
+        finally:
+            conn.close()
+
+
+def report(source_id: Optional[str] = None, fulltext: bool = False) -> int:
+    failed = 0
+    for sid, conn in _connections(source_id):
+        if conn is None:
+            failed += 1
+            continue
+        print(f"[{sid}]")
+        results, existing = analyze(conn)
+        print_plans(results)
+        ddl = missing_ddl(conn, existing, fulltext)
+        if ddl:
+            print("  Missing indexes (sms-indexes apply):")
+            for statement in ddl:
+                print(f"    {statement};")
+        else:
+            print("  All recommended indexes are present.")
+    return 1 if failed else 0
+
+
+def apply(source_id: Optional[str] = None, fulltext: bool = False, dry_run: bool = False) -> int:
+    failed = 0
+    for sid, conn in _connections(source_id):
+        if conn is None:
+            failed += 1
+            continue
+        ddl = missing_ddl(conn, existing_indexes(conn), fulltext)
+        if not ddl:
+            print(f"{sid}: nothing to do")
+        cursor = conn.cursor()
+        try:
+            for statement in ddl:
+                print(f"{sid}: {statement}")
+                if not dry_run:
+                    cursor.execute(statement)
+                    conn.commit()
+        except storage.Error as err:
+            print(f"{sid}: {err}", file=sys.stderr)
+            failed += 1
+        finally:
+            cursor.close()
+    return 1 if failed else 0
+
+
+def check(source_id: Optional[str] = None) -> int:
+    failed = 0
+    for sid, conn in _connections(source_id):
+        if conn is None:
+            failed += 1
+            continue
+        print(f"[{sid}]")
+        results, existing = analyze(conn)
+        failed += print_plans(results)
+        usage = index_usage(conn)
+        if usage is not None:
+            print("  Rows read per index since server start:")
+            for name in existing:
+                print(f"    {name}: {usage.get(name, 0)}")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="sms-indexes", description="Check and add the inbox indexes the app relies on.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, helptext in (("report", "EXPLAIN the app's statements and list missing indexes"),
+                           ("apply", "Create the missing indexes with online DDL"),
+                           ("check", "Verify every statement uses its index (exit 1 if not)")):
+        cmd = commands.add_parser(name, help=helptext)
+        cmd.add_argument("--source", help="Only this source id (default: all sources)")
+        if name != "check":
+            cmd.add_argument("--fulltext", action="store_true", help="Include the FULLTEXT index for text search")
+        if name == "apply":
+            cmd.add_argument("--dry-run", action="store_true", help="Print the DDL without running it")
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        return report(args.source, args.fulltext)
+    if args.command == "apply":
+        return apply(args.source, args.fulltext, args.dry_run)
+    return check(args.source)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
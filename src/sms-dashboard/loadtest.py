@@ -0,0 +1,647 @@
+"""
+Load-test harness for the dashboard and the bot's notifier.
+
+Run it against a throwaway database, never a live one: it inserts synthetic
+Gammu inbox rows and marks messages read. A disposable MariaDB container is
+enough (see the README). `--create-schema` creates Gammu's `inbox` table when
+it is missing. Every seeded row carries RecipientID='loadtest', so `clear`
+removes only those.
+
+    sms-loadtest seed --rows 200000
+    sms-loadtest http --serve --clients 16 --duration 30
+    sms-loadtest bot --messages 200
+    sms-loadtest soak --hours 3 --max-growth-mb 20
+    sms-loadtest http --serve --baseline loadtest-baseline.json [--save-baseline]
+
+`http` drives the app with concurrent clients. The request mix is the inbox
+page, JSON pages and bulk "mark read". With `--serve` it starts gunicorn
+itself, with the same worker count as production, on a local port. `bot`
+starts the bot against a local fake of the Telegram Bot API. It then inserts
+messages and measures the time from insert to the notification arriving.
+`soak` runs the same bot for hours with memory diagnostics on (see
+memwatch.py). It inserts a steady stream of messages and sends it commands,
+then fails when RSS or traced Python memory kept growing after warm-up.
+
+Every scenario reports p50/p95/p99 latency, throughput and errors. With
+`--baseline`, the results are compared to a stored run. The exit status is
+1 when a p95 got worse than `--tolerance`.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from . import memwatch, storage
+from .segmenter import build_udh_concat
+from .sources import get_db_connection
+from .tracing import percentile
+
+load_dotenv()
+
+RECIPIENT_ID = "loadtest"
+SEED_BATCH_SIZE = 5000
+# Bot token handed to the bot under test; the fake API accepts any token
+FAKE_TOKEN = "123456:loadtest"
+FAKE_CHAT_ID = "1"
+
+# Gammu's inbox table (from the SMSD MySQL schema), for an empty throwaway database
+INBOX_DDL = """
+CREATE TABLE IF NOT EXISTS inbox (
+    UpdatedInDB TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ReceivingDateTime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    Text TEXT NOT NULL,
+    SenderNumber VARCHAR(20) NOT NULL DEFAULT '',
+    Coding ENUM('Default_No_Compression','Unicode_No_Compression','8bit',
+                'Default_Compression','Unicode_Compression') NOT NULL DEFAULT 'Default_No_Compression',
+    UDH TEXT NOT NULL,
+    SMSCNumber VARCHAR(20) NOT NULL DEFAULT '',
+    Class INTEGER NOT NULL DEFAULT -1,
+    TextDecoded TEXT NOT NULL,
+    ID INTEGER UNSIGNED NOT NULL AUTO_INCREMENT,
+    RecipientID TEXT NOT NULL,
+    Processed ENUM('false','true') NOT NULL DEFAULT 'false',
+    Status INTEGER NOT NULL DEFAULT -1,
+    PRIMARY KEY (ID)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+# The same table in Gammu's SQLite schema
+SQLITE_INBOX_DDL = """
+CREATE TABLE IF NOT EXISTS inbox (
+    UpdatedInDB NUMERIC NOT NULL DEFAULT (datetime('now')),
+    ReceivingDateTime NUMERIC NOT NULL DEFAULT (datetime('now')),
+    Text TEXT NOT NULL,
+    SenderNumber TEXT NOT NULL DEFAULT '',
+    Coding TEXT NOT NULL DEFAULT 'Default_No_Compression',
+    UDH TEXT NOT NULL,
+    SMSCNumber TEXT NOT NULL DEFAULT '',
+    Class INTEGER NOT NULL DEFAULT '-1',
+    TextDecoded TEXT NOT NULL DEFAULT '',
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    RecipientID TEXT NOT NULL,
+    Processed TEXT NOT NULL DEFAULT 'false',
+    Status INTEGER NOT NULL DEFAULT '-1'
+)
+"""
+
+WORDS = ("your", "code", "is", "payment", "received", "meeting", "tomorrow", "balance",
+         "order", "shipped", "call", "me", "back", "thanks", "reminder", "invoice")
+
+
+# --- Seeding -----------------------------------------------------------------
+
+def synthetic_rows(count: int, senders: int = 500, multipart_ratio: float = 0.2,
+                   unread_ratio: float = 0.3, days: int = 365,
+                   rng: Optional[random.Random] = None) -> List[Tuple[Any, ...]]:
+    """
+    About `count` inbox rows (ReceivingDateTime, SenderNumber, UDH, TextDecoded,
+    Processed) spread over `days`. Multipart messages take 2-4 rows and reuse
+    8-bit references the way a real modem does.
+    """
+    rng = rng or random.Random(1)
+    end = datetime.now().replace(microsecond=0)
+    refs: Dict[str, int] = {}
+    rows: List[Tuple[Any, ...]] = []
+    while len(rows) < count:
+        sender = f"+1555{rng.randrange(senders):07d}"
+        when = end - timedelta(seconds=rng.randrange(days * 86400))
+        processed = "false" if rng.random() < unread_ratio else "true"
+        if rng.random() < multipart_ratio:
+            ref = refs[sender] = (refs.get(sender, rng.randrange(256)) + 1) % 256
+            total = rng.randint(2, 4)
+            for seq in range(1, total + 1):
+                text = " ".join(rng.choices(WORDS, k=25))
+                rows.append((when + timedelta(seconds=seq), sender, build_udh_concat(ref, total, seq),
+                             text, processed))
+        else:
+            rows.append((when, sender, "", " ".join(rng.choices(WORDS, k=rng.randint(3, 20))), processed))
+    return rows
+
+
+def create_schema(conn) -> None:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQLITE_INBOX_DDL if storage.dialect(conn).name == "sqlite" else INBOX_DDL)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def insert_rows(conn, rows: Sequence[Tuple[Any, ...]]) -> int:
+    """Insert synthetic rows in batches, one commit each; returns the number inserted."""
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(rows), SEED_BATCH_SIZE):
+            cursor.executemany(
+                """
+                INSERT INTO inbox (ReceivingDateTime, SenderNumber, UDH, TextDecoded, Processed, Text, RecipientID)
+                VALUES (%s, %s, %s, %s, %s, '', %s)
+                """,
+                [row + (RECIPIENT_ID,) for row in rows[start:start + SEED_BATCH_SIZE]],
+            )
+            conn.commit()
+        return len(rows)
+    finally:
+        cursor.close()
+
+
+def clear(conn) -> int:
+    """Delete every seeded row (and nothing else); returns the number deleted."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM inbox WHERE RecipientID = %s", (RECIPIENT_ID,))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _connect(source_id: Optional[str]):
+    conn = get_db_connection(source_id)
+    if not conn:
+        raise SystemExit("Database connection failed.")
+    return conn
+
+
+# --- Measurements ------------------------------------------------------------
+
+def summarize(latencies: Sequence[float], errors: int, elapsed: float) -> Dict[str, float]:
+    """Latencies in seconds -> counters with p50/p95/p99 in milliseconds."""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+    }
+
+
+def print_report(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'scenario':<14}{'requests':>10}{'errors':>8}{'per sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['requests']:>10}{r['errors']:>8}{r['throughput']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float = 0.2) -> List[str]:
+    """Scenarios whose p95 is more than `tolerance` above the baseline's, as readable lines."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("p95_ms"):
+            continue
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {r['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+    return regressions
+
+
+# --- HTTP load ---------------------------------------------------------------
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # bulk_action answers with a redirect; time the action, not the page after it
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _request(url: str, data: Optional[bytes] = None) -> bytes:
+    try:
+        with _opener.open(url, data=data, timeout=60) as resp:
+            return resp.read()
+    except urllib.error.HTTPError as err:
+        if 300 <= err.code < 400:
+            return b""
+        raise
+
+
+class HttpLoad:
+    """Concurrent clients issuing a weighted mix of dashboard requests."""
+
+    def __init__(self, base_url: str, weights: Optional[Dict[str, int]] = None):
+        self.base_url = base_url.rstrip("/")
+        self.weights = weights or {"index": 3, "api_messages": 5, "bulk_read": 2}
+        self.refs: List[str] = []
+        self._lock = threading.Lock()
+
+    def index(self) -> None:
+        _request(self.base_url + "/")
+
+    def api_messages(self) -> None:
+        body = json.loads(_request(self.base_url + "/api/messages?limit=50"))
+        refs = [m["ref"] for m in body.get("messages", [])]
+        if refs:
+            with self._lock:
+                self.refs = refs
+
+    def bulk_read(self) -> None:
+        with self._lock:
+            refs = random.sample(self.refs, min(5, len(self.refs)))
+        if not refs:
+            self.api_messages()
+            return
+        form = [("action", "read")] + [("message_ids", r) for r in refs]
+        _request(self.base_url + "/bulk_action", urllib.parse.urlencode(form).encode())
+
+    def run(self, clients: int, duration: float) -> Dict[str, Dict[str, float]]:
+        names = list(self.weights)
+        scenarios: Dict[str, Callable[[], None]] = {n: getattr(self, n) for n in names}
+        latencies: Dict[str, List[float]] = {n: [] for n in names}
+        errors: Dict[str, int] = {n: 0 for n in names}
+        errors_lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def client(seed: int) -> None:
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights=[self.weights[n] for n in names])[0]
+                started = time.perf_counter()
+                try:
+                    scenarios[name]()
+                except Exception:
+                    with errors_lock:
+                        errors[name] += 1
+                    continue
+                latencies[name].append(time.perf_counter() - started)
+
+        self.api_messages()  # warm-up and first refs
+        started = time.monotonic()
+        threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+        return {n: summarize(latencies[n], errors[n], elapsed) for n in names}
+
+
+def _wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _request(url)
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    raise SystemExit(f"{url} did not come up within {timeout:.0f}s")
+
+
+def serve_app(port: int, workers: int = 4) -> subprocess.Popen:
+    """Start gunicorn the way run_production does, on a local port."""
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen([
+        "gunicorn", "--chdir", src, "-w", str(workers), "-b", f"127.0.0.1:{port}", "sms-dashboard.app:app",
+    ])
+    _wait_ready(f"http://127.0.0.1:{port}/api/messages?limit=1")
+    return proc
+
+
+# --- Fake Telegram Bot API ---------------------------------------------------
+
+class _TelegramHandler(BaseHTTPRequestHandler):
+    server: "FakeTelegram"
+
+    def _json(self, result: Any) -> None:
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", "0") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw or b"{}")
+        query = urllib.parse.urlparse(self.path).query
+        return {k: v[0] for k, v in urllib.parse.parse_qs(raw.decode() or query).items()}
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        method = urllib.parse.urlparse(self.path).path.rsplit("/", 1)[-1]
+        params = self._params()
+        if method == "getMe":
+            self._json({"id": 123456, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"})
+        elif method == "getUpdates":
+            # Long polling: hold the request briefly unless an update was queued
+            updates = self.server.take_updates(int(params.get("offset") or 0))
+            if not updates:
+                time.sleep(min(float(params.get("timeout") or 0), 1.0))
+            self._json(updates)
+        elif method in ("sendMessage", "editMessageText"):
+            self._json(self.server.record(params))
+        else:
+            self._json(True)  # setMyCommands, deleteWebhook, answerCallbackQuery, ...
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    """Accepts Bot API calls for any token and records sent messages with their arrival time."""
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("127.0.0.1", port), _TelegramHandler)
+        self.sent: List[Tuple[float, str]] = []
+        self._updates: List[Dict[str, Any]] = []
+        self._update_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.sent.append((time.time(), str(params.get("text", ""))))
+            message_id = len(self.sent)
+        return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+                "text": params.get("text", "")}
+
+    def push_command(self, text: str, chat_id: int = int(FAKE_CHAT_ID)) -> None:
+        """Queue a command message from the operator for the bot's next getUpdates."""
+        command = text.split()[0]
+        with self._lock:
+            self._update_id += 1
+            self._updates.append({"update_id": self._update_id, "message": {
+                "message_id": self._update_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "loadtest"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            }})
+
+    def take_updates(self, offset: int) -> List[Dict[str, Any]]:
+        """Updates from `offset` on; earlier ones are confirmed and dropped."""
+        with self._lock:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            return list(self._updates)
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True).start()
+
+    def handle_error(self, request, client_address):
+        # The bot under test hangs up on its long poll when it is stopped
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def run_bot(messages: int, source_id: Optional[str] = None, timeout: float = 120.0) -> Dict[str, Dict[str, float]]:
+    """
+    Start the bot against FakeTelegram, insert `messages` unread SMS spread
+    over a few seconds, and time each notification from its insert.
+    """
+    fake = FakeTelegram()
+    fake.start()
+    env = dict(os.environ, PYTHONUNBUFFERED="1", TELEGRAM_API_URL=fake.url,
+               TELEGRAM_BOT_TOKEN=FAKE_TOKEN, TELEGRAM_CHAT_ID=FAKE_CHAT_ID, TELEGRAM_MODE="polling")
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    bot = subprocess.Popen([sys.executable, "-m", "sms-dashboard.bot"], cwd=src, env=env)
+    conn = _connect(source_id)
+    try:
+        # Let the bot announce whatever was already unread before measuring
+        idle_since = time.monotonic()
+        seen = 0
+        while time.monotonic() - idle_since < 15:
+            time.sleep(1)
+            if len(fake.sent) != seen:
+                seen, idle_since = len(fake.sent), time.monotonic()
+        baseline = len(fake.sent)
+
+        inserted: Dict[str, float] = {}
+        started = time.time()
+        for n in range(messages):
+            token = f"loadtest-{started:.0f}-{n}"
+            insert_rows(conn, [(datetime.now().replace(microsecond=0), "+15550000000", "", token, "false")])
+            inserted[token] = time.time()
+            time.sleep(5.0 / max(messages, 1))
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and len(fake.sent) - baseline < messages:
+            time.sleep(0.5)
+        latencies = []
+        for at, text in fake.sent[baseline:]:
+            for token in inserted:
+                if token in text:
+                    latencies.append(at - inserted.pop(token))
+                    break
+        elapsed = (max(at for at, _t in fake.sent[baseline:]) - started) if len(fake.sent) > baseline else 0.0
+        return {"bot_notify": summarize(latencies, len(inserted), elapsed)}
+    finally:
+        bot.terminate()
+        bot.wait(timeout=10)
+        conn.close()
+        fake.shutdown()
+
+
+# Commands sent to the bot during a soak, in turn, so the handler stack is exercised too
+SOAK_COMMANDS = ("/stats", "/lag", "/queue", "/last5", "/search code", "/from +15550000001", "/debug")
+
+
+def run_soak(hours: float, per_minute: int = 30, sample_seconds: float = 60.0, warmup_minutes: float = 10.0,
+             source_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run the bot against FakeTelegram for `hours` with memory diagnostics on,
+    inserting `per_minute` synthetic messages (a fifth of them multipart)
+    and a command every half minute. Returns the memory samples and how
+    much RSS and traced memory grew after the first `warmup_minutes`.
+    """
+    fake = FakeTelegram()
+    fake.start()
+    log_path = os.path.join(tempfile.mkdtemp(prefix="sms-soak-"), "memory.jsonl")
+    env = dict(os.environ, PYTHONUNBUFFERED="1", TELEGRAM_API_URL=fake.url,
+               TELEGRAM_BOT_TOKEN=FAKE_TOKEN, TELEGRAM_CHAT_ID=FAKE_CHAT_ID, TELEGRAM_MODE="polling",
+               MEMORY_DIAGNOSTICS="1", MEMORY_SNAPSHOT_SECONDS=str(sample_seconds), MEMORY_LOG_FILE=log_path)
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    bot = subprocess.Popen([sys.executable, "-m", "sms-dashboard.bot"], cwd=src, env=env)
+    conn = _connect(source_id)
+    rng = random.Random(1)
+    inserted = commands = 0
+    started = time.monotonic()
+    deadline = started + hours * 3600
+    try:
+        next_command = started
+        while time.monotonic() < deadline:
+            if bot.poll() is not None:
+                raise SystemExit(f"The bot exited with code {bot.returncode} during the soak.")
+            now = datetime.now().replace(microsecond=0)
+            rows = [(now,) + row[1:] for row in synthetic_rows(max(1, per_minute // 6), senders=50, rng=rng)]
+            inserted += insert_rows(conn, [row[:4] + ("false",) for row in rows])
+            if time.monotonic() >= next_command:
+                fake.push_command(SOAK_COMMANDS[commands % len(SOAK_COMMANDS)])
+                commands += 1
+                next_command += 30
+            time.sleep(10)
+    finally:
+        bot.terminate()
+        bot.wait(timeout=30)
+        conn.close()
+        fake.shutdown()
+
+    samples = []
+    if os.path.exists(log_path):
+        with open(log_path) as f:
+            samples = [json.loads(line) for line in f if line.strip()]
+    warmup = sum(1 for s in samples if s["at"] - samples[0]["at"] < warmup_minutes * 60) if samples else 0
+    return {
+        "samples": samples,
+        "inserted": inserted,
+        "notified": len(fake.sent),
+        "commands": commands,
+        "rss_growth": memwatch.growth([s["rss"] for s in samples], warmup),
+        "traced_growth": memwatch.growth([s["traced"] for s in samples], warmup),
+    }
+
+
+def print_soak(result: Dict[str, Any], max_growth_mb: float) -> int:
+    """Print a soak's memory report; 1 when memory grew more than `max_growth_mb` after warm-up."""
+    samples = result["samples"]
+    print(f"{result['inserted']} rows inserted, {result['notified']} messages sent to the fake Telegram, "
+          f"{result['commands']} commands, {len(samples)} memory samples")
+    if len(samples) < 4:
+        print("Too few memory samples to judge growth; run longer or sample more often.")
+        return 1
+    mb = 1024 * 1024
+    print(f"RSS {samples[0]['rss'] / mb:.1f} MB -> {samples[-1]['rss'] / mb:.1f} MB, "
+          f"growth after warm-up {result['rss_growth'] / mb:+.1f} MB")
+    print(f"Traced {samples[0]['traced'] / mb:.1f} MB -> {samples[-1]['traced'] / mb:.1f} MB, "
+          f"growth after warm-up {result['traced_growth'] / mb:+.1f} MB")
+    print("Top growth since start:")
+    for site in samples[-1]["top"]:
+        print(f"  {site['size'] / 1024:+10.0f} KB {site['count']:+8d} blocks  {site['site']}")
+    worst = max(result["rss_growth"], result["traced_growth"]) / mb
+    if worst > max_growth_mb:
+        print(f"REGRESSION memory grew {worst:.1f} MB after warm-up (limit {max_growth_mb:g} MB)")
+        return 1
+    return 0
+
+
+# --- CLI ---------------------------------------------------------------------
+
+def _finish(results: Dict[str, Dict[str, float]], args) -> int:
+    print_report(results)
+    if not args.baseline:
+        return 0
+    if args.save_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+        stored.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="sms-loadtest", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--source", help="Source database to seed/measure (default: the first)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_cmd = commands.add_parser("seed", help="Insert synthetic inbox rows")
+    seed_cmd.add_argument("--rows", type=int, default=100000)
+    seed_cmd.add_argument("--senders", type=int, default=500)
+    seed_cmd.add_argument("--multipart-ratio", type=float, default=0.2)
+    seed_cmd.add_argument("--unread-ratio", type=float, default=0.3)
+    seed_cmd.add_argument("--create-schema", action="store_true", help="Create Gammu's inbox table if missing")
+    seed_cmd.add_argument("--seed", type=int, default=1, help="Random seed (same seed, same data)")
+
+    commands.add_parser("clear", help="Delete all seeded rows")
+
+    soak_cmd = commands.add_parser("soak", help="Run the bot for hours and check its memory stays bounded")
+    soak_cmd.add_argument("--hours", type=float, default=2.0)
+    soak_cmd.add_argument("--per-minute", type=int, default=30, help="Messages inserted per minute")
+    soak_cmd.add_argument("--sample", type=float, default=60.0, help="Seconds between memory samples")
+    soak_cmd.add_argument("--warmup", type=float, default=10.0, help="Minutes of growth to ignore at the start")
+    soak_cmd.add_argument("--max-growth-mb", type=float, default=20.0)
+
+    for name, helptext in (("http", "Concurrent HTTP clients against the app"),
+                           ("bot", "Notification latency through a fake Telegram API")):
+        cmd = commands.add_parser(name, help=helptext)
+        cmd.add_argument("--baseline", help="JSON file with a stored run to compare against")
+        cmd.add_argument("--save-baseline", action="store_true", help="Store this run in --baseline instead")
+        cmd.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 increase (0.2 = 20%%)")
+        if name == "http":
+            cmd.add_argument("--url", default="http://127.0.0.1:5000")
+            cmd.add_argument("--serve", action="store_true", help="Start gunicorn on --port for the run")
+            cmd.add_argument("--port", type=int, default=5099)
+            cmd.add_argument("--workers", type=int, default=4)
+            cmd.add_argument("--clients", type=int, default=16)
+            cmd.add_argument("--duration", type=float, default=30)
+        else:
+            cmd.add_argument("--messages", type=int, default=100)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "seed":
+        conn = _connect(args.source)
+        try:
+            if args.create_schema:
+                create_schema(conn)
+            rows = synthetic_rows(args.rows, args.senders, args.multipart_ratio, args.unread_ratio,
+                                  rng=random.Random(args.seed))
+            started = time.monotonic()
+            print(f"Inserted {insert_rows(conn, rows)} rows in {time.monotonic() - started:.1f}s.")
+        finally:
+            conn.close()
+        return 0
+
+    if args.command == "clear":
+        conn = _connect(args.source)
+        try:
+            print(f"Deleted {clear(conn)} seeded rows.")
+        finally:
+            conn.close()
+        return 0
+
+    if args.command == "bot":
+        return _finish(run_bot(args.messages, args.source), args)
+
+    if args.command == "soak":
+        print(f"Soaking the bot for {args.hours:g}h...")
+        result = run_soak(args.hours, args.per_minute, args.sample, args.warmup, args.source)
+        return print_soak(result, args.max_growth_mb)
+
+    server = serve_app(args.port, args.workers) if args.serve else None
+    url = f"http://127.0.0.1:{args.port}" if server else args.url
+    try:
+        print(f"Running {args.clients} clients against {url} for {args.duration:.0f}s...")
+        return _finish(HttpLoad(url).run(args.clients, args.duration), args)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
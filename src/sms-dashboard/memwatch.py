@@ -0,0 +1,230 @@
+"""
+Memory diagnostics for the long-running bot process.
+
+Off by default. With MEMORY_DIAGNOSTICS=1 the bot starts `tracemalloc` and,
+every MEMORY_SNAPSHOT_SECONDS (default 300), takes a snapshot and records a
+sample:
+
+- RSS of the process (from /proc; the peak RSS where /proc is missing)
+- memory held by Python allocations (what tracemalloc traces)
+- the MEMORY_TOP (default 10) source lines whose allocations grew most since
+  diagnostics started
+
+Each sample is printed as one line, or appended as a JSON line to
+MEMORY_LOG_FILE when set (the soak test reads that file, see loadtest.py).
+The bot's /debug command shows the RSS history and the current top growth.
+A site that keeps climbing from sample to sample is a leak candidate;
+growth that levels off after warm-up is a cache filling up.
+
+Tracing costs CPU and memory (one frame per allocation here), so leave it
+off in normal operation.
+"""
+from __future__ import annotations
+
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from statistics import median
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Samples kept for /debug (a day at the default interval)
+HISTORY = 288
+
+# The watch's own samples would otherwise top the list
+_FILTERS = (
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def enabled() -> bool:
+    return os.environ.get("MEMORY_DIAGNOSTICS", "").lower() in ("1", "true", "yes")
+
+
+def snapshot_interval() -> float:
+    return float(os.environ.get("MEMORY_SNAPSHOT_SECONDS", "300"))
+
+
+def top_count() -> int:
+    return int(os.environ.get("MEMORY_TOP", "10"))
+
+
+def log_file() -> Optional[str]:
+    return os.environ.get("MEMORY_LOG_FILE") or None
+
+
+def rss_bytes() -> int:
+    """Resident set size now; the peak RSS where /proc is not available."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass(frozen=True)
+class Sample:
+    at: float
+    rss: int
+    traced: int
+    # (file:line, bytes grown since the baseline, allocations grown)
+    top: Tuple[Tuple[str, int, int], ...] = ()
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "at": self.at, "rss": self.rss, "traced": self.traced,
+            "top": [{"site": site, "size": size, "count": count} for site, size, count in self.top],
+        }
+
+
+def growth(values: Sequence[float], warmup: int = 0) -> float:
+    """
+    How much a series rose after its first `warmup` values: the median of
+    its last quarter minus the median of its first quarter, so one spike
+    (a large batch, a GC pause) does not count as growth.
+    """
+    values = list(values)[warmup:]
+    if len(values) < 2:
+        return 0.0
+    quarter = max(1, len(values) // 4)
+    return median(values[-quarter:]) - median(values[:quarter])
+
+
+def _mb(size: float) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def _size(size: int) -> str:
+    sign = "-" if size < 0 else "+"
+    size = abs(size)
+    if size >= 1024 * 1024:
+        return f"{sign}{size / (1024 * 1024):.1f} MB"
+    return f"{sign}{size / 1024:.0f} KB"
+
+
+class MemoryWatch:
+    """Periodic tracemalloc snapshots compared with the one taken at `start()`."""
+
+    def __init__(self, top: int = 10, history: int = HISTORY):
+        self.top = top
+        self.samples: deque[Sample] = deque(maxlen=history)
+        self.started_at: Optional[float] = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        gc.collect()
+        self._baseline = self._snapshot()
+        self.started_at = time.time()
+        self.samples.append(Sample(self.started_at, rss_bytes(), tracemalloc.get_traced_memory()[0]))
+
+    def sample(self) -> Sample:
+        """Take a snapshot and record how it differs from the baseline."""
+        if self._baseline is None:
+            raise RuntimeError("MemoryWatch.start() was not called")
+        gc.collect()
+        stats = self._snapshot().compare_to(self._baseline, "lineno")
+        grown = sorted((s for s in stats if s.size_diff > 0), key=lambda s: s.size_diff, reverse=True)
+        top = tuple(
+            (f"{s.traceback[0].filename}:{s.traceback[0].lineno}", s.size_diff, s.count_diff)
+            for s in grown[:self.top]
+        )
+        sample = Sample(time.time(), rss_bytes(), tracemalloc.get_traced_memory()[0], top)
+        self.samples.append(sample)
+        return sample
+
+    def log(self, sample: Sample, path: Optional[str] = None) -> None:
+        if path:
+            try:
+                with open(path, "a") as f:
+                    f.write(json.dumps(sample.to_json()) + "\n")
+            except OSError as e:
+                print(f"Error writing memory log {path}: {e}")
+            return
+        first = self.samples[0]
+        line = (f"Memory: RSS {_mb(sample.rss)} ({_size(sample.rss - first.rss)}), "
+                f"traced {_mb(sample.traced)} ({_size(sample.traced - first.traced)})")
+        if sample.top:
+            site, size, _count = sample.top[0]
+            line += f"; top growth {site} {_size(size)}"
+        print(line)
+
+    def run(self, stop: threading.Event, interval: Optional[float] = None) -> None:
+        """Sample every `interval` seconds until `stop` is set (the bot runs this in a thread)."""
+        interval = snapshot_interval() if interval is None else interval
+        self.start()
+        print(f"Memory diagnostics on: a snapshot every {interval:g}s.")
+        while not stop.wait(interval):
+            try:
+                self.log(self.sample(), log_file())
+            except Exception as e:
+                print(f"Memory sample failed: {e}")
+
+    def report(self) -> List[str]:
+        """Lines for /debug: RSS over time and the sites that grew most."""
+        samples = list(self.samples)
+        if not samples:
+            return ["Memory diagnostics are starting."]
+        first, last = samples[0], samples[-1]
+        since = datetime.fromtimestamp(first.at).strftime("%Y-%m-%d %H:%M")
+        lines = [
+            f"Since {since}: RSS {_mb(first.rss)} → {_mb(last.rss)} "
+            f"(min {_mb(min(s.rss for s in samples))}, max {_mb(max(s.rss for s in samples))})",
+            f"Traced {_mb(first.traced)} → {_mb(last.traced)}, {len(samples)} sample(s)",
+        ]
+        # A few points of the history, oldest first
+        step = max(1, len(samples) // 6)
+        points = samples[::step][-6:]
+        lines.append("RSS: " + " · ".join(
+            f"{datetime.fromtimestamp(s.at).strftime('%H:%M')} {_mb(s.rss)}" for s in points))
+        if last.top:
+            lines += ["", "Top growth since start:"]
+            for site, size, count in last.top:
+                lines.append(f"• {_shorten(site)} {_size(size)} ({count:+d} blocks)")
+        return lines
+
+
+def _shorten(site: str) -> str:
+    """'…/site-packages/telegram/_bot.py:123' -> 'telegram/_bot.py:123'."""
+    for marker in ("site-packages/", "src/"):
+        if marker in site:
+            return site.split(marker, 1)[1]
+    return site
+
+
+def from_env() -> Optional[MemoryWatch]:
+    """A watch when MEMORY_DIAGNOSTICS is set, else None."""
+    return MemoryWatch(top=top_count()) if enabled() else None
+
+
+def status(watch: Optional[MemoryWatch], counters: Optional[Dict[str, int]] = None) -> str:
+    """Text of the bot's /debug reply."""
+    lines = [f"🧠 Memory: RSS {_mb(rss_bytes())}, {threading.active_count()} thread(s), "
+             f"GC generations {gc.get_count()}"]
+    if counters:
+        lines.append("In-process: " + ", ".join(f"{name} {value}" for name, value in counters.items()))
+    lines.append("")
+    if watch is None:
+        lines.append("Diagnostics are off; set MEMORY_DIAGNOSTICS=1 and restart the bot for growth reports.")
+    else:
+        lines += watch.report()
+    return "\n".join(lines)
@@ -7,17 +7,146 @@ concatenation, group parts, and produce a single combined message, filtering
 out the intermediate empty rows.
 
 This is done purely in application logic; no DB schema changes are required.
+
+Grouping: an 8-bit reference wraps every 256 messages, so on a large inbox
+one sender reuses the same reference many times. Parts therefore join a
+group only when sender, reference and part count match, the part's sequence
+number is not yet in the group, and it arrived within GROUP_WINDOW of the
+group's first part. Parts are bucketed by (sender, reference, part count),
+and each bucket is sorted by time and swept once, so assembly is
+O(n log n) however many references collide.
+
+Rows are held as `InboxMessage` objects: a `__slots__` class with one
+attribute per selected column. Compared to one dict per row this stores no
+per-instance key table, which matters on large inboxes. Callers select
+`INBOX_COLUMNS` with a plain (tuple) cursor and convert each row once.
 """
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import contacts
+
+# Column order used by every inbox SELECT; tuple rows are read positionally.
+INBOX_FIELDS = ("ID", "SenderNumber", "TextDecoded", "ReceivingDateTime", "Processed", "UDH")
+INBOX_COLUMNS = ", ".join(INBOX_FIELDS)
+
+# Parts of one message arrive within seconds; a modem that was offline can
+# deliver them minutes apart, but never as far apart as a reused reference.
+GROUP_WINDOW = timedelta(minutes=10)
+
+
+class InboxMessage:
+    """
+    One logical inbox message (a single row or an assembled multipart group).
+
+    Attribute names match the Gammu columns so templates keep using
+    `message.SenderNumber`; mapping-style access (`m["ID"]`, `m.get(...)`) is
+    kept for older call sites. `part_ids` holds the row IDs of all parts when
+    the message was assembled from several rows, else None; `source` is the id
+    of the Gammu database the row came from (see sources.py).
+    """
+
+    __slots__ = INBOX_FIELDS + ("part_ids", "source")
+
+    def __init__(self, ID: Any = None, SenderNumber: Optional[str] = None,
+                 TextDecoded: Optional[str] = None, ReceivingDateTime: Any = None,
+                 Processed: Optional[str] = None, UDH: Any = None,
+                 part_ids: Optional[Tuple[Any, ...]] = None, source: Optional[str] = None):
+        self.ID = ID
+        self.SenderNumber = SenderNumber
+        self.TextDecoded = TextDecoded
+        self.ReceivingDateTime = ReceivingDateTime
+        self.Processed = Processed
+        self.UDH = UDH
+        self.part_ids = part_ids
+        self.source = source
+
+    @classmethod
+    def from_row(cls, row: Any) -> "InboxMessage":
+        """Build from a tuple in INBOX_FIELDS order, a dict row, or return an InboxMessage as-is."""
+        if isinstance(row, InboxMessage):
+            return row
+        if isinstance(row, dict):
+            return cls(*(row.get(f) for f in INBOX_FIELDS))
+        return cls(*row)
+
+    @property
+    def ids(self) -> Tuple[Any, ...]:
+        """All row IDs backing this message."""
+        return self.part_ids or (self.ID,)
+
+    @property
+    def ref(self) -> str:
+        """Reference used by read/delete actions: 'source:id.id' (no prefix without a source)."""
+        ids = ".".join(str(i) for i in self.ids)
+        return f"{self.source}:{ids}" if self.source else ids
+
+    @property
+    def missing_parts(self) -> int:
+        """Parts of a multipart message not (yet) present, per the UDH part count."""
+        parsed = _parse_udh_concat(self.UDH)
+        return max(0, parsed[1] - len(self.ids)) if parsed else 0
+
+    @property
+    def is_unread(self) -> bool:
+        return str(self.Processed).lower() == "false"
+
+    def _attr(self, key: str) -> str:
+        return "part_ids" if key == "_part_ids" else key
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, self._attr(key))
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        setattr(self, self._attr(key), value)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, self._attr(key), None)
+        return default if value is None else value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.__slots__}
+
+    def to_json(self) -> Dict[str, Any]:
+        """JSON-friendly view used by the API endpoints (no raw UDH, ISO timestamps)."""
+        received = self.ReceivingDateTime
+        return {
+            "ID": self.ID,
+            "ids": list(self.ids),
+            "ref": self.ref,
+            "source": self.source,
+            "SenderNumber": self.SenderNumber,
+            "TextDecoded": self.TextDecoded,
+            "ReceivingDateTime": received.isoformat() if hasattr(received, "isoformat") else received,
+            "Processed": self.Processed,
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, InboxMessage):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"InboxMessage(ID={self.ID!r}, SenderNumber={self.SenderNumber!r}, Processed={self.Processed!r})"
+
+
+def to_messages(rows: Iterable[Sequence[Any]]) -> List[InboxMessage]:
+    """Convert tuple rows (in INBOX_FIELDS order) to InboxMessage objects."""
+    return [InboxMessage(*r) for r in rows]
 
 
 @dataclass(frozen=True)
 class ConcatKey:
     sender: str
     ref: str  # textual reference key extracted from UDH (8/16-bit safe)
+    total: int = 0
+    source: str = ""
 
 
 def _bytes_to_hex(data: bytes) -> str:
@@ -82,57 +211,119 @@ def _parse_udh_concat(udh: bytes | str | None) -> Optional[Tuple[int, int, int]]
     return None
 
 
-def _concat_key(sender: str | None, udh: bytes | str | None) -> Optional[ConcatKey]:
+def _concat_key(sender: str | None, udh: bytes | str | None, source: str | None = None) -> Optional[ConcatKey]:
+    """Candidate group of a part; parts sharing it may still belong to different messages (see group_parts)."""
     parsed = _parse_udh_concat(udh)
     if parsed is None:
         return None
-    ref, _total, _seq = parsed
-    s = sender or ""
-    return ConcatKey(s, f"{ref}")
+    ref, total, _seq = parsed
+    return ConcatKey(contacts.normalize(sender), f"{ref}", total, source or "")
+
+
+# Group key inside the sweep: (source, sender, ref, total). A plain tuple
+# rather than ConcatKey, since it is built and compared once per part.
+PartKey = Tuple[str, str, int, int]
+
 
+def _arrival(part: Tuple[int, InboxMessage]) -> Tuple[Any, ...]:
+    m = part[1]
+    received = m.ReceivingDateTime
+    # Rows without a timestamp sort first, by ID; they never compare to datetimes
+    return (received is not None, received if received is not None else 0, m.ID or 0)
 
 
-def assemble_inbox_rows(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def group_parts(parts: Iterable[Tuple[PartKey, int, InboxMessage]],
+                window: timedelta = GROUP_WINDOW) -> List[List[Tuple[int, InboxMessage]]]:
+    """
+    Split (key, sequence, message) parts into the groups of individual messages.
+
+    Parts are bucketed by key, each bucket is sorted by arrival time and swept
+    once. Each part joins the oldest open group of its bucket that lacks its
+    sequence number; a group closes when complete or once `window` has passed
+    since its first part. This also separates two messages with the same
+    reference whose parts arrived interleaved. Open groups per key are few
+    (messages in flight at once), so the sorts dominate.
+    """
+    buckets: Dict[PartKey, List[Tuple[int, InboxMessage]]] = {}
+    for key, seq, m in parts:
+        buckets.setdefault(key, []).append((seq, m))
+
+    groups: List[List[Tuple[int, InboxMessage]]] = []
+    for key, bucket in buckets.items():
+        total = key[3]
+        if len(bucket) <= total and len({seq for seq, _m in bucket}) == len(bucket):
+            # No collision in this bucket: one group (the window only splits reused references)
+            first = min(bucket, key=_arrival)[1].ReceivingDateTime
+            last = max(bucket, key=_arrival)[1].ReceivingDateTime
+            if first is None or last is None or last - first <= window:
+                groups.append(bucket)
+                continue
+        bucket.sort(key=_arrival)
+        # Open groups in creation order: (first part time, seqs, parts)
+        open_groups: List[Tuple[Any, set, List[Tuple[int, InboxMessage]]]] = []
+        for seq, m in bucket:
+            received = m.ReceivingDateTime
+            if received is not None and open_groups:
+                open_groups = [g for g in open_groups if g[0] is None or received - g[0] <= window]
+            for g in open_groups:
+                if seq not in g[1]:
+                    break
+            else:
+                g = (received, set(), [])
+                open_groups.append(g)
+                groups.append(g[2])
+            g[1].add(seq)
+            g[2].append((seq, m))
+            if len(g[1]) == total:
+                open_groups.remove(g)
+    return groups
+
+
+def assemble_inbox_rows(rows: Iterable[Any]) -> List[InboxMessage]:
     """
     Collapse multipart inbox rows into single combined logical messages.
 
     Strategy:
-    - Detect concatenated parts via UDH; group by (SenderNumber, ref).
+    - Detect concatenated parts via UDH; group by (SenderNumber, ref, part
+      count), split by sequence uniqueness and arrival time (see group_parts).
     - Order parts by sequence from UDH if present, else by ID.
     - Combine TextDecoded from all parts (skip None/empty during join to avoid blank spam).
     - Produce a single synthetic row based on the newest part's metadata and combined text.
     - For non-multipart or messages without UDH, include as-is.
-    - If the combined text is empty after trimming, drop the message.
+    - If the (combined) text is empty after trimming, drop the message.
 
-    Input row keys expected: ID, SenderNumber, TextDecoded, ReceivingDateTime, Processed, UDH.
-    Missing keys are handled gracefully.
+    Rows may be InboxMessage objects, tuples in INBOX_FIELDS order or dicts
+    with keys ID, SenderNumber, TextDecoded, ReceivingDateTime, Processed, UDH.
+    Each row is converted once; missing keys are handled gracefully.
     """
-    singles: List[Dict[str, Any]] = []
-    groups: Dict[ConcatKey, List[Dict[str, Any]]] = {}
+    out: List[InboxMessage] = []
+    # Parts are kept as (key, sequence, message) so the UDH is parsed only once per row.
+    concat_parts: List[Tuple[PartKey, int, InboxMessage]] = []
+    # The same few UDH values repeat across a large inbox; parse each once
+    udh_cache: Dict[Any, Optional[Tuple[int, int, int]]] = {}
 
     for r in rows:
-        key = _concat_key(r.get("SenderNumber"), r.get("UDH"))
-        if key is None:
-            singles.append(r)
+        m = InboxMessage.from_row(r)
+        udh = m.UDH
+        if isinstance(udh, bytearray):
+            udh = bytes(udh)
+        if udh in udh_cache:
+            parsed = udh_cache[udh]
         else:
-            groups.setdefault(key, []).append(r)
-
-    out: List[Dict[str, Any]] = []
-    out.extend(singles)
-
-    def sort_key(item: Dict[str, Any]) -> Tuple[int, Any]:
-        # Prefer UDH sequence if present, else ID
-        udh = item.get("UDH")
-        parsed = _parse_udh_concat(udh)
-        if parsed:
-            return (0, parsed[2])  # sequence
-        return (1, item.get("ID", 0))
+            parsed = udh_cache[udh] = _parse_udh_concat(udh)
+        if parsed is None:
+            if isinstance(m.TextDecoded, str) and not m.TextDecoded.strip():
+                continue  # blank single row
+            out.append(m)
+        else:
+            ref, total, seq = parsed
+            concat_parts.append(((m.source or "", contacts.normalize(m.SenderNumber), ref, total), seq, m))
 
-    for parts in groups.values():
-        parts_sorted = sorted(parts, key=sort_key)
+    for parts in group_parts(concat_parts):
+        parts.sort(key=lambda p: p[0])
         texts: List[str] = []
-        for p in parts_sorted:
-            t = p.get("TextDecoded")
+        for _seq, p in parts:
+            t = p.TextDecoded
             if isinstance(t, str) and t.strip():
                 texts.append(t)
         combined = "".join(texts).strip()
@@ -140,20 +331,17 @@ def assemble_inbox_rows(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
             # nothing meaningful, skip
             continue
         # Use the newest part for metadata (ReceivingDateTime biggest)
-        newest = max(parts_sorted, key=lambda x: x.get("ReceivingDateTime") or 0)
-        # clone and replace text; mark as processed if all are processed
-        merged = dict(newest)
-        merged["TextDecoded"] = combined
+        newest = max((p for _seq, p in parts), key=lambda x: x.ReceivingDateTime or 0)
         # If any part is unread, keep unread; else read
-        try:
-            processed_vals = {str(p.get("Processed", "")).lower() for p in parts_sorted}
-            merged["Processed"] = "false" if "false" in processed_vals else "true"
-        except Exception:
-            pass
-        # store a synthetic list of part IDs for traceability
-        merged["_part_ids"] = [p.get("ID") for p in parts_sorted]
-        out.append(merged)
+        processed = "false" if any(p.is_unread for _seq, p in parts) else "true"
+        out.append(InboxMessage(
+            newest.ID, newest.SenderNumber, combined, newest.ReceivingDateTime,
+            processed, newest.UDH,
+            # keep the part IDs for traceability and for read/delete of the whole message
+            tuple(p.ID for _seq, p in parts),
+            newest.source,
+        ))
 
     # Sort final list by ReceivingDateTime desc if available, else ID desc
-    out.sort(key=lambda x: x.get("ReceivingDateTime") or x.get("ID", 0), reverse=True)
+    out.sort(key=lambda x: x.ReceivingDateTime or x.ID or 0, reverse=True)
     return out
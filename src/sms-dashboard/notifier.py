@@ -0,0 +1,176 @@
+"""
+Database-coordinated notifier state, so several bot replicas can run at once.
+
+Each source database holds a leader lease for the notifier. Only the
+current holder polls that source and sends Telegram notifications. Every
+replica keeps handling commands and buttons.
+
+- `acquire()` takes the lease when it is free or expired, and renews it when
+  already held. Every change of holder (or renewal after expiry) increments
+  the lease's fencing token.
+- The poll cursor (highest inbox ID handled) is stored in the same
+  database, not in a local file, so a new leader continues exactly where
+  the old one stopped.
+
+The leader queues the notifications for new messages and moves the cursor
+in one transaction, which checks that the lease still carries its token
+(`delivery.enqueue()`). A replica that stalled past its lease (GC pause,
+network partition) and wakes up after another replica took over therefore
+cannot queue messages or move the cursor. Sending and recording sends are
+the delivery queue's job (see delivery.py).
+
+`sms_notified` holds the IDs sent by versions without the queue; they are
+skipped once and pruned as the cursor moves past them.
+
+Leases live NOTIFIER_LEASE_SECONDS (default 30) and are renewed on every
+poll, so a standby takes over within one lease period of the leader
+disappearing.
+"""
+from __future__ import annotations
+
+import os
+import secrets
+import socket
+from typing import Iterable, Optional, Set
+
+from . import storage
+from .stats import schema_key
+
+LEASE_TABLE = "sms_notifier_lease"
+STATE_TABLE = "sms_notifier_state"
+NOTIFIED_TABLE = "sms_notified"
+LEASE_NAME = "notifier"
+
+SCHEMA = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {LEASE_TABLE} (
+        Name VARCHAR(32) NOT NULL PRIMARY KEY,
+        Holder VARCHAR(128) NOT NULL,
+        Token BIGINT UNSIGNED NOT NULL,
+        ExpiresAt DATETIME(3) NOT NULL
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        Name VARCHAR(32) NOT NULL PRIMARY KEY,
+        LastID BIGINT NOT NULL
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {NOTIFIED_TABLE} (
+        ID INT UNSIGNED NOT NULL PRIMARY KEY,
+        NotifiedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+)
+
+# Identifies this process as a lease holder
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+_schema_ready: Set[str] = set()
+
+
+def lease_seconds() -> int:
+    return int(os.environ.get("NOTIFIER_LEASE_SECONDS", "30"))
+
+
+def ensure_schema(cursor, initial_cursor: int = 0) -> None:
+    """Create the tables once per process and database; a new cursor row starts at `initial_cursor`."""
+    key = schema_key(cursor)
+    if key in _schema_ready:
+        return
+    d = storage.dialect(cursor)
+    for ddl in SCHEMA:
+        for statement in d.ddl(ddl):
+            cursor.execute(statement)
+    cursor.execute(
+        f"{d.insert_ignore} INTO {LEASE_TABLE} (Name, Holder, Token, ExpiresAt) "
+        "VALUES (%s, '', 0, '1970-01-01 00:00:00')",
+        (LEASE_NAME,),
+    )
+    cursor.execute(
+        f"{d.insert_ignore} INTO {STATE_TABLE} (Name, LastID) VALUES (%s, %s)", (LEASE_NAME, initial_cursor)
+    )
+    _schema_ready.add(key)
+
+
+def acquire(conn, holder: str = HOLDER_ID, initial_cursor: int = 0) -> Optional[int]:
+    """Take or renew the notifier lease; returns the fencing token, or None if another replica holds it."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor, initial_cursor)
+        d = storage.dialect(cursor)
+        d.begin_write(cursor)
+        cursor.execute(
+            f"SELECT Holder, Token, ExpiresAt > {d.now_ms} FROM {LEASE_TABLE} WHERE Name = %s{d.for_update}",
+            (LEASE_NAME,),
+        )
+        current, token, live = cursor.fetchone()
+        if live and current != holder:
+            conn.commit()
+            return None
+        if current != holder or not live:
+            token += 1  # new term: fence off anything the previous term still has in flight
+        cursor.execute(
+            f"UPDATE {LEASE_TABLE} SET Holder = %s, Token = %s, "
+            f"ExpiresAt = {d.now_plus_seconds()} WHERE Name = %s",
+            (holder, token, lease_seconds(), LEASE_NAME),
+        )
+        conn.commit()
+        return token
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def holds(conn, token: int, holder: str = HOLDER_ID) -> bool:
+    """True while `holder` has the lease under `token` and it has not expired (a plain read)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT 1 FROM {LEASE_TABLE} WHERE Name = %s AND Holder = %s AND Token = %s "
+            f"AND ExpiresAt > {storage.dialect(cursor).now_ms}",
+            (LEASE_NAME, holder, token),
+        )
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+
+
+def release(conn, holder: str = HOLDER_ID) -> None:
+    """Give the lease up (on shutdown) so a standby can take over immediately."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"UPDATE {LEASE_TABLE} SET ExpiresAt = {storage.dialect(cursor).now_ms} WHERE Name = %s AND Holder = %s",
+            (LEASE_NAME, holder),
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def load_cursor(conn) -> int:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT LastID FROM {STATE_TABLE} WHERE Name = %s", (LEASE_NAME,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    finally:
+        cursor.close()
+
+
+def already_notified(conn, ids: Iterable[int]) -> Set[int]:
+    ids = list(ids)
+    if not ids:
+        return set()
+    cursor = conn.cursor()
+    try:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"SELECT ID FROM {NOTIFIED_TABLE} WHERE ID IN ({placeholders})", tuple(ids))
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
@@ -0,0 +1,183 @@
+"""
+Outbound SMS queue: messages are written to Gammu's `outbox` and
+`outbox_multipart` tables and SMSD sends them.
+
+Text is split by `segmenter.segment`. A single SMS is one `outbox` row; a
+concatenated one puts its first part in `outbox` (MultiPart='true') and the
+remaining parts in `outbox_multipart` under the same ID. Single-part messages
+are inserted with one `executemany` per batch. Multipart ones need their
+auto-increment ID, so each is inserted individually, but within the same
+transaction; their extra parts still go in one `executemany`. One
+transaction covers OUTBOX_BATCH_SIZE messages.
+
+Throttle: SMSD sends everything in `outbox` whose SendingDateTime has passed,
+so a large broadcast would otherwise tie up the modem (and often trip the
+operator's flood limits). Each source (one modem) is given
+OUTBOX_RATE_PER_MINUTE SMS parts per minute. Every queued message gets a
+SendingDateTime slot after the last one already waiting in that database.
+Slot allocation runs under a named lock (on SQLite, the database write lock),
+so concurrent workers never hand out the same slots. Set
+OUTBOX_RATE_PER_MINUTE=0 to send as fast as SMSD can.
+"""
+from __future__ import annotations
+
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from . import storage
+from .segmenter import Segment, segment
+from .sources import get_db_connection
+
+OUTBOX_BATCH_SIZE = 500
+DEFAULT_RATE_PER_MINUTE = 20
+# Written to outbox.CreatorID so queued messages can be told apart from gammu-smsd-inject ones
+CREATOR_ID = "sms-dashboard"
+# Named lock (per database) held while allocating send slots
+LOCK_NAME = "sms_dashboard_outbox:"
+LOCK_TIMEOUT = 10
+
+_NUMBER_RE = re.compile(r"^\+?\d{3,20}$")
+
+
+def rate_per_minute() -> int:
+    return int(os.environ.get("OUTBOX_RATE_PER_MINUTE", DEFAULT_RATE_PER_MINUTE))
+
+
+def normalize_number(value: str) -> Optional[str]:
+    """Strip spaces, dashes, dots and brackets; None when it is not a phone number."""
+    number = re.sub(r"[\s\-().]", "", value or "")
+    return number if _NUMBER_RE.match(number) else None
+
+
+def parse_numbers(value: str) -> Tuple[List[str], List[str]]:
+    """Split a comma/semicolon/newline separated list into (valid numbers, invalid entries)."""
+    valid, invalid = [], []
+    for entry in re.split(r"[,;\n]", value or ""):
+        entry = entry.strip()
+        if not entry:
+            continue
+        number = normalize_number(entry)
+        if number is None:
+            invalid.append(entry)
+        elif number not in valid:
+            valid.append(number)
+    return valid, invalid
+
+
+def _reserve_slots(cursor, weights: Sequence[int]) -> List[datetime]:
+    """SendingDateTime for each message, spaced by its number of parts at the configured rate."""
+    cursor.execute(f"SELECT {storage.dialect(cursor).now}, MAX(SendingDateTime) FROM outbox")
+    now, last = (storage.to_datetime(v) for v in cursor.fetchone())
+    rate = rate_per_minute()
+    if rate <= 0:
+        return [now] * len(weights)
+    step = 60.0 / rate
+    start = max(now, last + timedelta(seconds=step)) if last else now
+    slots, offset = [], 0.0
+    for weight in weights:
+        slots.append(start + timedelta(seconds=offset))
+        offset += weight * step
+    return slots
+
+
+def _insert_batch(cursor, batch: Sequence[Tuple[str, str, List[Segment]]], creator: str) -> None:
+    d = storage.dialect(cursor)
+    d.begin_write(cursor)
+    slots = _reserve_slots(cursor, [len(parts) for _n, _c, parts in batch])
+    singles, extra_parts = [], []
+    for (number, coding, parts), when in zip(batch, slots):
+        if len(parts) == 1:
+            singles.append((when, number, coding, parts[0].text, creator))
+            continue
+        first = parts[0]
+        cursor.execute(
+            f"""
+            INSERT INTO outbox
+                (InsertIntoDB, SendingDateTime, DestinationNumber, Coding, UDH, TextDecoded, MultiPart, CreatorID)
+            VALUES ({d.now}, %s, %s, %s, %s, %s, 'true', %s)
+            """,
+            (when, number, coding, first.udh, first.text, creator),
+        )
+        outbox_id = cursor.lastrowid
+        extra_parts.extend(
+            (coding, p.udh, p.text, outbox_id, seq) for seq, p in enumerate(parts[1:], start=2)
+        )
+    if singles:
+        cursor.executemany(
+            f"""
+            INSERT INTO outbox
+                (InsertIntoDB, SendingDateTime, DestinationNumber, Coding, TextDecoded, MultiPart, CreatorID)
+            VALUES ({d.now}, %s, %s, %s, %s, 'false', %s)
+            """,
+            singles,
+        )
+    if extra_parts:
+        cursor.executemany(
+            """
+            INSERT INTO outbox_multipart (Coding, UDH, TextDecoded, ID, SequencePosition)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            extra_parts,
+        )
+
+
+def queue(conn, messages: Iterable[Tuple[str, str]], creator: str = CREATOR_ID) -> int:
+    """
+    Queue (number, text) pairs in one source's outbox; returns the number queued.
+
+    Text is segmented once per distinct text, so a broadcast of one text to
+    many numbers is split only once. Each batch is committed on its own.
+    On a database error the current batch is rolled back and the error
+    re-raised; earlier batches stay queued.
+    """
+    segmented = {}
+    batch: List[Tuple[str, str, List[Segment]]] = []
+    queued = 0
+    cursor = conn.cursor()
+    try:
+        d = storage.dialect(cursor)
+        if not d.named_lock(cursor, LOCK_NAME, LOCK_TIMEOUT):
+            raise RuntimeError("Timed out waiting for the outbox lock.")
+        try:
+            for number, text in messages:
+                if text not in segmented:
+                    segmented[text] = segment(text)
+                coding, parts = segmented[text]
+                batch.append((number, coding, parts))
+                if len(batch) >= OUTBOX_BATCH_SIZE:
+                    _insert_batch(cursor, batch, creator)
+                    conn.commit()
+                    queued += len(batch)
+                    batch = []
+            if batch:
+                _insert_batch(cursor, batch, creator)
+                conn.commit()
+                queued += len(batch)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            d.release_named_lock(cursor, LOCK_NAME)
+    finally:
+        cursor.close()
+    return queued
+
+
+def send(numbers: Sequence[str], text: str, source_id: Optional[str] = None) -> Tuple[int, List[str]]:
+    """Queue `text` to every number through one source (the first by default); returns (queued, errors)."""
+    text = (text or "").strip()
+    if not text:
+        return 0, ["Message text is empty."]
+    if not numbers:
+        return 0, ["No recipients."]
+    conn = get_db_connection(source_id)
+    if not conn:
+        return 0, [f"{source_id or 'default'}: database connection failed"]
+    try:
+        return queue(conn, ((n, text) for n in numbers)), []
+    except (*storage.Error, RuntimeError, ValueError) as err:
+        return 0, [str(err)]
+    finally:
+        conn.close()
@@ -0,0 +1,315 @@
+"""
+Hourly and daily traffic rollups.
+
+`sms_traffic_hourly` and `sms_traffic_daily` hold one row per (sender,
+bucket) with the number of messages received in that hour or day and how
+many of them are still unread. A row with the sender `*` holds the total of
+each bucket, so the overall series is a short range read on the primary key
+instead of a `GROUP BY` over `inbox`.
+
+The tables are fed by the same incremental hooks as the statistics summary
+(see `stats.py`): arrivals by `sync()`, reads and deletes in the transaction
+that makes them. Like the other counters, a multipart message counts once,
+in the bucket of its first part.
+
+Installations that had messages before the rollups existed fill them with
+`sms-rollups backfill`; `stats.rebuild()` recomputes them along with the
+other counters.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from . import contacts, sources, storage
+from .multipart import INBOX_COLUMNS, InboxMessage, _parse_udh_concat
+
+HOURLY_TABLE = "sms_traffic_hourly"
+DAILY_TABLE = "sms_traffic_daily"
+
+SCHEMA = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {HOURLY_TABLE} (
+        SenderNumber VARCHAR(20) NOT NULL,
+        Bucket DATETIME NOT NULL,
+        Total INT NOT NULL DEFAULT 0,
+        Unread INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (SenderNumber, Bucket),
+        KEY idx_sms_traffic_hourly_bucket (Bucket)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+        SenderNumber VARCHAR(20) NOT NULL,
+        Bucket DATE NOT NULL,
+        Total INT NOT NULL DEFAULT 0,
+        Unread INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (SenderNumber, Bucket),
+        KEY idx_sms_traffic_daily_bucket (Bucket)
+    )
+    """,
+)
+
+# Sender of the per-bucket totals rows
+ALL = "*"
+
+TABLES = {"hour": HOURLY_TABLE, "day": DAILY_TABLE}
+
+# Longest range one request may ask for, in buckets
+MAX_BUCKETS = {"hour": 24 * 31, "day": 366 * 3}
+
+# Rows read per round trip in backfill()
+BATCH_SIZE = 5000
+
+RollupKey = Tuple[str, Any]
+
+
+def _hour(value: Any) -> datetime:
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time()) if isinstance(value, date) else datetime.now()
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket(value: Any, granularity: str) -> Any:
+    """Start of the hour (a datetime) or the day (a date) that `value` falls in."""
+    hour = _hour(value)
+    return hour if granularity == "hour" else hour.date()
+
+
+def step(granularity: str) -> timedelta:
+    return timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+
+
+def compute_deltas(rows: Iterable[InboxMessage], sign: int = 1,
+                   unread_only: bool = False) -> Dict[RollupKey, List[int]]:
+    """
+    Hourly changes: {(sender, hour): [total, unread]}, including the `*`
+    totals. With `unread_only` (rows being marked read) only unread changes.
+    """
+    deltas: Dict[RollupKey, List[int]] = {}
+    for m in rows:
+        parsed = _parse_udh_concat(m.UDH)
+        if parsed is not None and parsed[2] != 1:
+            continue
+        unread = 1 if m.is_unread else 0
+        if unread_only and not unread:
+            continue
+        hour = _hour(m.ReceivingDateTime)
+        for sender in (m.SenderNumber or "", ALL):
+            d = deltas.setdefault((sender, hour), [0, 0])
+            if not unread_only:
+                d[0] += sign
+            d[1] += sign * unread
+    return deltas
+
+
+def daily(hourly: Dict[RollupKey, List[int]]) -> Dict[RollupKey, List[int]]:
+    """Fold hourly deltas into day buckets."""
+    out: Dict[RollupKey, List[int]] = {}
+    for (sender, hour), (total, unread) in hourly.items():
+        d = out.setdefault((sender, hour.date()), [0, 0])
+        d[0] += total
+        d[1] += unread
+    return out
+
+
+def ensure_schema(cursor) -> None:
+    d = storage.dialect(cursor)
+    for ddl in SCHEMA:
+        for statement in d.ddl(ddl):
+            cursor.execute(statement)
+
+
+def _apply(cursor, table: str, deltas: Dict[RollupKey, List[int]]) -> None:
+    if not deltas:
+        return
+    d = storage.dialect(cursor)
+    cursor.executemany(
+        f"""
+        INSERT INTO {table} (SenderNumber, Bucket, Total, Unread)
+        VALUES (%s, %s, %s, %s)
+        {d.upsert("SenderNumber, Bucket")}
+            Total = Total + {d.new("Total")},
+            Unread = Unread + {d.new("Unread")}
+        """,
+        [(s, b, t, u) for (s, b), (t, u) in deltas.items()],
+    )
+
+
+def apply_rows(cursor, rows: Sequence[InboxMessage], sign: int = 1, unread_only: bool = False) -> None:
+    """Fold inbox rows into both rollups (arrivals, or reads/deletes with sign=-1)."""
+    hourly = compute_deltas(rows, sign=sign, unread_only=unread_only)
+    _apply(cursor, HOURLY_TABLE, hourly)
+    _apply(cursor, DAILY_TABLE, daily(hourly))
+
+
+def reset(cursor) -> None:
+    for table in TABLES.values():
+        cursor.execute(f"DELETE FROM {table}")
+
+
+def backfill(conn) -> int:
+    """
+    Recompute the rollups from the rows `stats.sync()` has already ingested;
+    returns the number of rows read. Newer rows are added by the next sync.
+
+    Holds the statistics state lock, which `stats.sync()`, `record_read()`
+    and `record_delete()` also take, so they wait until it commits and no
+    change is counted twice or lost.
+    """
+    from . import stats  # stats imports this module to feed it
+
+    cursor = conn.cursor()
+    try:
+        stats.ensure_schema(cursor)
+        last_id = stats._last_id(cursor, lock=True)
+        reset(cursor)
+        after, seen = 0, 0
+        while after < last_id:
+            cursor.execute(
+                f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ID > %s AND ID <= %s ORDER BY ID LIMIT %s",
+                (after, last_id, BATCH_SIZE),
+            )
+            rows = [InboxMessage(*r) for r in cursor.fetchall()]
+            if not rows:
+                break
+            apply_rows(cursor, rows)
+            after = rows[-1].ID
+            seen += len(rows)
+        conn.commit()
+        return seen
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def series(conn, granularity: str, start: Any, end: Any,
+           senders: Optional[Sequence[str]] = None) -> Dict[Any, List[int]]:
+    """
+    {bucket: [total, unread]} for buckets in [start, end) that have traffic,
+    for all senders or only `senders` (every stored spelling of one number).
+    """
+    table = TABLES[granularity]
+    senders = list(senders) if senders else [ALL]
+    placeholders = ", ".join(["%s"] * len(senders))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            SELECT Bucket, SUM(Total), SUM(Unread) FROM {table}
+            WHERE SenderNumber IN ({placeholders}) AND Bucket >= %s AND Bucket < %s
+            GROUP BY Bucket
+            """,
+            (*senders, start, end),
+        )
+        return {b: [int(t), int(u)] for b, t, u in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def top_senders(conn, granularity: str, start: Any, end: Any, top: int = 10,
+                senders: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Busiest senders in [start, end), read from the rollup of `granularity`;
+    with `senders`, only those (the spellings of the number being charted).
+    """
+    if senders:
+        condition, params = f"SenderNumber IN ({', '.join(['%s'] * len(senders))})", tuple(senders)
+    else:
+        condition, params = "SenderNumber <> %s", (ALL,)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            SELECT SenderNumber, SUM(Total) AS total, SUM(Unread) AS unread
+            FROM {TABLES[granularity]}
+            WHERE Bucket >= %s AND Bucket < %s AND {condition}
+            GROUP BY SenderNumber
+            ORDER BY total DESC
+            LIMIT %s
+            """,
+            (start, end, *params, top),
+        )
+        return [{"sender": s, "total": int(t), "unread": int(u)} for s, t, u in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def window(granularity: str, count: int, now: Optional[datetime] = None) -> Tuple[Any, Any]:
+    """[start, end) of the last `count` buckets, the current one included."""
+    count = max(1, min(count, MAX_BUCKETS[granularity]))
+    end = bucket(now or datetime.now(), granularity) + step(granularity)
+    return end - count * step(granularity), end
+
+
+def combine(per_source: Iterable[Tuple[Dict[Any, List[int]], List[Dict[str, Any]]]],
+            granularity: str, start: Any, end: Any, top: int = 10) -> Dict[str, Any]:
+    """
+    Add up (series, top senders) from several sources. Every bucket of the
+    range is listed, empty ones with zeros, so a modem outage shows as a gap
+    in the chart; spellings of one number are ranked as one sender.
+    """
+    points: Dict[Any, List[int]] = {}
+    senders: Dict[str, Dict[str, Any]] = {}
+    for counts, ranked in per_source:
+        for b, (total, unread) in counts.items():
+            cur = points.setdefault(b, [0, 0])
+            cur[0] += total
+            cur[1] += unread
+        for s in ranked:
+            key = contacts.normalize(s["sender"])
+            cur = senders.setdefault(key, {
+                "sender": key if key.startswith("+") else s["sender"],
+                "name": contacts.name(key), "total": 0, "unread": 0,
+            })
+            cur["total"] += s["total"]
+            cur["unread"] += s["unread"]
+    buckets = []
+    b = start
+    while b < end:
+        total, unread = points.get(b, (0, 0))
+        buckets.append({"t": b.isoformat(), "total": total, "unread": unread, "read": total - unread})
+        b += step(granularity)
+    return {
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "buckets": buckets,
+        "total": sum(p["total"] for p in buckets),
+        "top_senders": sorted(senders.values(), key=lambda s: s["total"], reverse=True)[:top],
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="sms-rollups", description="Maintain the hourly and daily traffic rollups.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("backfill", help="Recompute the rollups from the messages already counted")
+    cmd.add_argument("--source", help="Only this source id (default: all sources)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    failed = 0
+    for sid in [args.source] if args.source else [s.id for s in sources.all_sources()]:
+        conn = sources.get_db_connection(sid)
+        if not conn:
+            print(f"{sid}: database connection failed", file=sys.stderr)
+            failed += 1
+            continue
+        try:
+            print(f"{sid}: {backfill(conn)} message row(s) rolled up")
+        except storage.Error as err:
+            print(f"{sid}: {err}", file=sys.stderr)
+            failed += 1
+        finally:
+            conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+"""
+Rule-based routing of SMS notifications to Telegram chats.
+
+Rules come from the JSON file named by ROUTING_FILE:
+
+    {
+      "default": ["-1001000000001"],
+      "rules": [
+        {"name": "otp", "regex": "(?i)\\\\b(code|otp)\\\\b.*\\\\d{4,8}", "chats": ["-1001000000002"], "stop": true},
+        {"name": "bank", "senders": ["BANKCO", "+98912*"], "keywords": ["withdrawal", "deposit"],
+         "chats": ["-1001000000003"]},
+        {"name": "ads", "senders": ["+98990*"], "chats": [], "stop": true}
+      ]
+    }
+
+A rule matches when its sender condition and its text condition both hold;
+a rule without one of them skips that check:
+
+- `senders`: exact numbers or names, or prefixes ending in `*`. Numbers
+  are compared in their normalized form (see contacts.py), so `0912*`
+  also matches `+98912...` with DEFAULT_COUNTRY_CODE=98; letters compare
+  case-insensitively.
+- `keywords` (case-insensitive substrings) and `regex` (one pattern or a
+  list): the text condition holds when any of them is found.
+
+A message goes to the chats of every matching rule, in rule order, up to and
+including the first matching rule with `"stop": true`. A rule with no chats
+therefore mutes what it matches when it stops. Messages no rule matches go
+to `default`; without that key, to TELEGRAM_CHAT_ID. `"default": []` mutes
+everything else.
+
+Routing cost does not grow with the number of rules. All sender patterns
+form one prefix trie, walked once per sender. All keywords, plus a literal
+that every match of each regex must contain, form one Aho-Corasick
+automaton, run once over the text. A regex is only evaluated when its
+literal was found. Regexes without such a literal (a top-level `|`, or no
+two literal characters in a row) run on every message.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+
+from . import contacts
+
+# A regex literal shorter than this finds too many candidates to be worth it
+MIN_LITERAL = 2
+
+
+def normalize_sender(value: str) -> str:
+    return contacts.normalize(value).casefold()
+
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    chats: Tuple[str, ...]
+    senders: Tuple[str, ...] = ()
+    keywords: Tuple[str, ...] = ()
+    patterns: Tuple[str, ...] = ()
+    stop: bool = False
+
+    @property
+    def has_text_condition(self) -> bool:
+        return bool(self.keywords or self.patterns)
+
+
+def required_literal(pattern: str) -> str:
+    """
+    The longest run of literal characters that every match of `pattern` must
+    contain, lowercased; '' when none can be found safely.
+
+    Conservative: literals inside groups and character classes are ignored,
+    and a top-level alternation or a verbose pattern yields ''.
+    """
+    if "(?x" in pattern:
+        return ""
+    best, run, depth, i = "", "", 0, 0
+
+    def commit():
+        nonlocal best, run
+        if depth == 0 and len(run) > len(best):
+            best = run
+        run = ""
+
+    while i < len(pattern):
+        ch = pattern[i]
+        literal = None
+        if ch == "\\":
+            escaped = pattern[i + 1:i + 2]
+            i += 2
+            if escaped and not escaped.isalnum():
+                literal = escaped  # \. \+ \( ...
+            else:
+                commit()  # \d \w \b \1 ...: not a literal character
+                continue
+        elif ch == "[":
+            commit()
+            i += 1
+            if pattern[i:i + 1] == "^":
+                i += 1
+            if pattern[i:i + 1] == "]":
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            continue
+        elif ch in "*?{":
+            # The previous character may be absent (or its count is unknown)
+            run = run[:-1]
+            commit()
+            if ch == "{":
+                end = pattern.find("}", i)
+                i = end + 1 if end != -1 else len(pattern)
+            else:
+                i += 1
+            continue
+        elif ch == "|":
+            if depth == 0:
+                return ""
+            commit()
+            i += 1
+            continue
+        elif ch in "()":
+            commit()
+            depth += 1 if ch == "(" else -1
+            i += 1
+            continue
+        elif ch in ".^$+":
+            # "+" keeps the previous character (it occurs at least once) but ends the run
+            commit()
+            i += 1
+            continue
+        else:
+            literal = ch
+            i += 1
+        if depth == 0:
+            run += literal.lower()
+        else:
+            commit()
+    commit()
+    return best if len(best) >= MIN_LITERAL else ""
+
+
+class _Automaton:
+    """Aho-Corasick automaton: finds every added word in one pass over a text."""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Any]] = [[]]
+
+    def add(self, word: str, value: Any) -> None:
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = nxt
+        self.out[node].append(value)
+
+    def build(self) -> None:
+        queue = deque(self.goto[0].values())  # depth 1: fail back to the root
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def search(self, text: str) -> Set[Any]:
+        found: Set[Any] = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.out[node]:
+                found.update(self.out[node])
+        return found
+
+
+class _SenderTrie:
+    """Exact and prefix sender patterns; one walk over a sender finds all that match."""
+
+    def __init__(self):
+        self.children: List[Dict[str, int]] = [{}]
+        self.exact: List[List[int]] = [[]]
+        self.prefix: List[List[int]] = [[]]
+
+    def add(self, pattern: str, rule: int) -> None:
+        is_prefix = pattern.endswith("*")
+        node = 0
+        for ch in normalize_sender(pattern.rstrip("*")):
+            nxt = self.children[node].get(ch)
+            if nxt is None:
+                nxt = len(self.children)
+                self.children[node][ch] = nxt
+                self.children.append({})
+                self.exact.append([])
+                self.prefix.append([])
+            node = nxt
+        (self.prefix if is_prefix else self.exact)[node].append(rule)
+
+    def match(self, sender: str) -> Set[int]:
+        node = 0
+        found = set(self.prefix[0])
+        for ch in normalize_sender(sender):
+            node = self.children[node].get(ch)
+            if node is None:
+                return found
+            found.update(self.prefix[node])
+        found.update(self.exact[node])
+        return found
+
+
+class Router:
+    """Rules compiled into one sender trie and one text automaton (see the module docstring)."""
+
+    def __init__(self, rules: Sequence[Rule], default: Sequence[str]):
+        self.rules = list(rules)
+        self.default = tuple(default)
+        self._senders = _SenderTrie()
+        self._text = _Automaton()
+        self._regexes: Dict[int, List[Pattern]] = {}
+        self._unfiltered: List[int] = []  # rules with a regex that has no usable literal
+        self._catch_all: List[int] = []  # rules without conditions
+        for index, rule in enumerate(self.rules):
+            for sender in rule.senders:
+                self._senders.add(sender, index)
+            for keyword in rule.keywords:
+                self._text.add(keyword.lower(), ("keyword", index))
+            compiled = []
+            for pattern in rule.patterns:
+                try:
+                    compiled.append(re.compile(pattern))
+                except re.error as err:
+                    raise ValueError(f"Rule '{rule.name}': invalid regex {pattern!r}: {err}")
+                literal = required_literal(pattern)
+                if literal:
+                    self._text.add(literal, ("regex", index))
+                elif index not in self._unfiltered:
+                    self._unfiltered.append(index)
+            if compiled:
+                self._regexes[index] = compiled
+            if not rule.senders and not rule.has_text_condition:
+                self._catch_all.append(index)
+        self._text.build()
+
+    def matching_rules(self, sender: str, text: str) -> List[Rule]:
+        """Rules whose conditions hold for the message, in rule order."""
+        by_sender = self._senders.match(sender or "")
+        text_ok: Set[int] = set()
+        to_check: Set[int] = set(self._unfiltered)
+        for kind, index in self._text.search((text or "").lower()):
+            if kind == "keyword":
+                text_ok.add(index)
+            else:
+                to_check.add(index)
+        for index in to_check - text_ok:
+            if any(p.search(text or "") for p in self._regexes[index]):
+                text_ok.add(index)
+        matched = []
+        for index in sorted(by_sender | text_ok | set(self._catch_all)):
+            rule = self.rules[index]
+            if rule.senders and index not in by_sender:
+                continue
+            if rule.has_text_condition and index not in text_ok:
+                continue
+            matched.append(rule)
+        return matched
+
+    def route(self, sender: str, text: str) -> List[str]:
+        """Chats to notify about a message (no duplicates, first mention first); [] mutes it."""
+        matched = self.matching_rules(sender, text)
+        if not matched:
+            return list(self.default)
+        chats: List[str] = []
+        for rule in matched:
+            chats.extend(c for c in rule.chats if c not in chats)
+            if rule.stop:
+                break
+        return chats
+
+    def chats(self) -> Set[str]:
+        """Every chat some message may be sent to (the default and all rules)."""
+        return set(self.default).union(*(rule.chats for rule in self.rules))
+
+
+def _strings(value: Any, field: str, rule: str) -> Tuple[str, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, (str, int)):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, (str, int)) for v in value):
+        raise ValueError(f"Rule '{rule}': '{field}' must be a string or a list of strings.")
+    return tuple(str(v) for v in value)
+
+
+def parse(config: Dict[str, Any], default_chats: Iterable[str] = ()) -> Router:
+    """Router from a parsed config file; raises ValueError for an invalid one."""
+    if not isinstance(config, dict) or not isinstance(config.get("rules", []), list):
+        raise ValueError("The routing config must be an object with a 'rules' list.")
+    rules = []
+    for i, entry in enumerate(config.get("rules", [])):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Rule #{i + 1} must be an object.")
+        name = str(entry.get("name") or f"#{i + 1}")
+        if "chats" not in entry:
+            raise ValueError(f"Rule '{name}' has no 'chats' (use [] to mute).")
+        unknown = set(entry) - {"name", "senders", "keywords", "regex", "chats", "stop"}
+        if unknown:
+            raise ValueError(f"Rule '{name}': unknown key(s) {', '.join(sorted(unknown))}.")
+        rules.append(Rule(
+            name=name,
+            chats=_strings(entry["chats"], "chats", name),
+            senders=_strings(entry.get("senders"), "senders", name),
+            keywords=tuple(k for k in _strings(entry.get("keywords"), "keywords", name) if k),
+            patterns=_strings(entry.get("regex"), "regex", name),
+            stop=bool(entry.get("stop", False)),
+        ))
+    default = config.get("default")
+    default = _strings(default, "default", "default") if default is not None else tuple(default_chats)
+    return Router(rules, default)
+
+
+def load(path: str, default_chats: Iterable[str] = ()) -> Router:
+    with open(path, "r") as f:
+        return parse(json.load(f), default_chats)
+
+
+class RouterFile:
+    """
+    The router of a config file, reloaded when the file changes. A file that
+    fails to load keeps the previous rules (or, at first, sends everything
+    to `default_chats`).
+    """
+
+    def __init__(self, path: Optional[str], default_chats: Iterable[str] = ()):
+        self.path = path
+        self.default_chats = tuple(c for c in default_chats if c)
+        self._router = Router([], self.default_chats)
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Router:
+        if not self.path:
+            return self._router
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self._mtime is not None:
+                print(f"Routing config unavailable, keeping the loaded rules: {e}")
+                self._mtime = None
+            return self._router
+        if mtime == self._mtime:
+            return self._router
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    self._router = load(self.path, self.default_chats)
+                    print(f"Loaded {len(self._router.rules)} routing rule(s) from {self.path}")
+                except (OSError, ValueError) as e:
+                    print(f"Error loading routing config {self.path}: {e}")
+                self._mtime = mtime
+        return self._router
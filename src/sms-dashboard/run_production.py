@@ -1,88 +1,299 @@
+"""
+Production supervisor: Gunicorn for the dashboard and, with TELEGRAM_BOT_TOKEN
+set, the Telegram bot.
+
+- A child that exits is restarted on its own; the other services keep
+  running. The pause before a restart doubles with every crash, from
+  RESTART_BACKOFF_BASE up to RESTART_BACKOFF_MAX seconds, and resets once
+  the child has been healthy for STABLE_SECONDS.
+- Every HEALTH_INTERVAL seconds each child is probed: Gunicorn with
+  GET /healthz, the bot through a heartbeat file its poll loop touches
+  (HEALTH_FILE). A child that fails HEALTH_FAILURES probes in a row, or is
+  not healthy START_TIMEOUT seconds after starting, is restarted.
+- SIGHUP reloads without downtime (deploy, then `kill -HUP <pid>` or
+  `systemctl reload`). .env is read again. Gunicorn gets a SIGHUP: its
+  master keeps the listening socket, starts workers on the new code and
+  lets the old ones finish their requests. A new bot is started next to
+  the old one, which is only stopped once the new one is healthy. The old
+  bot finishes its current poll and delivery pass, records what it sent
+  and hands the notifier lease back (see notifier.py); the new one takes
+  over from the saved cursor. A replacement that does not become healthy
+  is dropped and the old process keeps running.
+- SIGINT/SIGTERM stop everything gracefully.
+"""
 import os
+import shutil
 import signal
 import subprocess
 import sys
+import tempfile
 import time
-from typing import List
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
 from dotenv import load_dotenv
 
 
 # Load .env to check for Telegram config
 load_dotenv()
 
+PORT = 5000
+# Seconds between supervisor passes and between probes of one child
+TICK_SECONDS = 0.5
+HEALTH_INTERVAL = 5.0
+PROBE_TIMEOUT = 2.0
+# Failed probes in a row before a running child is restarted
+HEALTH_FAILURES = 3
+# How long a new child may take to pass its first probe
+START_TIMEOUT = 60.0
+# A heartbeat older than this means the bot's poll loop is stuck
+HEARTBEAT_STALE_SECONDS = 120.0
+RESTART_BACKOFF_BASE = 1.0
+RESTART_BACKOFF_MAX = 60.0
+STABLE_SECONDS = 60.0
+# How long a stopping child may take to finish in-flight work before it is killed
+STOP_TIMEOUT = 30.0
 
-def _spawn(cmd: List[str]) -> subprocess.Popen:
-    env = os.environ.copy()
-    # Use unbuffered output for logging
-    env["PYTHONUNBUFFERED"] = "1"
-    return subprocess.Popen(cmd, env=env)
 
+def backoff(restarts: int) -> float:
+    """Pause before restarting a child that has already been restarted `restarts` times."""
+    return min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** min(restarts, 16))
 
-def main() -> int:
-    print("Starting production server...")
-    py = sys.executable
-    procs: list[subprocess.Popen] = []
 
+@dataclass
+class Process:
+    """One running instance of a service."""
+    popen: subprocess.Popen
+    started: float
+    health_file: str
+    healthy: bool = False
+    failures: int = 0
+    next_probe: float = 0.0
+
+
+@dataclass
+class Service:
+    name: str
+    cmd: List[str]
+    probe: Callable[[Process], bool]
+    # True: reload in place with SIGHUP (Gunicorn); False: start a replacement, then stop the old one
+    reload_in_place: bool = False
+    env: Dict[str, str] = field(default_factory=dict)
+
+
+def http_probe(url: str) -> Callable[[Process], bool]:
+    def probe(_process: Process) -> bool:
+        try:
+            with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT) as resp:
+                return resp.status == 200
+        except (OSError, ValueError):
+            return False
+    return probe
+
+
+def heartbeat_probe(process: Process) -> bool:
     try:
-        # Gunicorn command for Flask app.
-        # We change directory to `src` to ensure Python can find the package.
-        gunicorn_cmd = [
-            "gunicorn",
-            "--chdir", "src",
-            "-w", "4",
-            "-b", "0.0.0.0:5000",
-            "sms-dashboard.app:app"
-        ]
-        gunicorn_proc = _spawn(gunicorn_cmd)
-        procs.append(gunicorn_proc)
-        print(f"Started Gunicorn server (PID: {gunicorn_proc.pid})")
-
-        # Conditionally start Telegram bot
-        if os.environ.get("TELEGRAM_BOT_TOKEN"):
-            bot_cmd = [py, "-m", "sms-dashboard.bot"]
-            bot_proc = _spawn(bot_cmd)
-            procs.append(bot_proc)
-            print(f"Started Telegram bot (PID: {bot_proc.pid})")
+        return time.time() - os.stat(process.health_file).st_mtime < HEARTBEAT_STALE_SECONDS
+    except OSError:
+        return False
+
+
+class Supervisor:
+    """Keeps each service running and healthy, and replaces them on reload (see the module docstring)."""
+
+    def __init__(self, services: List[Service]):
+        self.services = services
+        self.current: Dict[str, Optional[Process]] = {s.name: None for s in services}
+        # Replacements started by a reload, waiting to pass their first probe
+        self.pending: Dict[str, Process] = {}
+        # Processes asked to stop: (process, monotonic deadline for a kill)
+        self.retiring: List[tuple] = []
+        self.restarts: Dict[str, int] = {s.name: 0 for s in services}
+        self.restart_at: Dict[str, float] = {s.name: 0.0 for s in services}
+        self.health_dir = tempfile.mkdtemp(prefix="sms-health-")
+        self.reload_requested = False
+        self.stop_requested = False
+        self._started = 0
+
+    def _start(self, service: Service, now: float, reload: bool = False) -> Process:
+        self._started += 1
+        health_file = os.path.join(self.health_dir, f"{service.name}-{self._started}")
+        env = os.environ.copy()
+        env.update(service.env)
+        # Use unbuffered output for logging
+        env["PYTHONUNBUFFERED"] = "1"
+        env["HEALTH_FILE"] = health_file
+        if reload:
+            env["SUPERVISOR_RELOAD"] = "1"
+        else:
+            env.pop("SUPERVISOR_RELOAD", None)
+        popen = subprocess.Popen(service.cmd, env=env)
+        print(f"Started {service.name} (PID: {popen.pid})")
+        return Process(popen, now, health_file, next_probe=now)
+
+    def _retire(self, process: Optional[Process], now: float) -> None:
+        if process is None:
+            return
+        if process.popen.poll() is None:
+            try:
+                process.popen.send_signal(signal.SIGTERM)
+            except OSError:
+                pass
+        self.retiring.append((process, now + STOP_TIMEOUT))
+
+    def _fail(self, service: Service, reason: str, now: float) -> None:
+        delay = backoff(self.restarts[service.name])
+        print(f"{service.name} {reason}; restarting in {delay:g}s.")
+        self._retire(self.current[service.name], now)
+        self.current[service.name] = None
+        self.restarts[service.name] += 1
+        self.restart_at[service.name] = now + delay
+
+    def _probe(self, service: Service, process: Process, now: float) -> Optional[bool]:
+        """The probe's result when one is due, else None."""
+        if now < process.next_probe:
+            return None
+        process.next_probe = now + HEALTH_INTERVAL
+        return service.probe(process)
+
+    def _check(self, service: Service, now: float) -> None:
+        process = self.current[service.name]
+        if process is None:
+            if service.name not in self.pending and now >= self.restart_at[service.name]:
+                self.current[service.name] = self._start(service, now)
+            return
+        code = process.popen.poll()
+        if code is not None:
+            self._fail(service, f"(PID {process.popen.pid}) exited with code {code}", now)
+            return
+        ok = self._probe(service, process, now)
+        if ok:
+            process.healthy, process.failures = True, 0
+            if now - process.started >= STABLE_SECONDS:
+                self.restarts[service.name] = 0
+        elif ok is None:
+            return
+        elif not process.healthy:
+            if now - process.started > START_TIMEOUT:
+                self._fail(service, f"was not healthy within {START_TIMEOUT:g}s", now)
         else:
-            print("TELEGRAM_BOT_TOKEN not found, skipping bot.")
-
-        print("Press Ctrl+C to stop all services.")
-
-        # Wait for any process to exit
-        while True:
-            for p in procs:
-                if p.poll() is not None:
-                    print(f"Process {p.pid} exited with code {p.returncode}. Stopping all services.")
-                    # If one process fails, stop them all
-                    return 1
-            time.sleep(0.5)
-
-    except KeyboardInterrupt:
-        print("\nStopping all services...")
-        return 0
-    finally:
-        # Terminate all children gracefully
-        for p in reversed(procs):
-            if p.poll() is None:
-                try:
-                    p.send_signal(signal.SIGINT)
-                except Exception:
-                    pass
-        
-        # Wait a moment for graceful shutdown
-        time.sleep(3)
-
-        # Force kill any that are still running
-        for p in reversed(procs):
-            if p.poll() is None:
-                try:
-                    p.terminate()
-                    time.sleep(1)
-                    if p.poll() is None:
-                        p.kill()
-                except Exception:
-                    pass
-        print("All services stopped.")
+            process.failures += 1
+            if process.failures >= HEALTH_FAILURES:
+                self._fail(service, f"failed {process.failures} health probes", now)
+
+    def _check_pending(self, service: Service, now: float) -> None:
+        process = self.pending.get(service.name)
+        if process is None:
+            return
+        code = process.popen.poll()
+        if code is not None:
+            del self.pending[service.name]
+            print(f"Reload of {service.name} aborted: the new process exited with code {code}.")
+            return
+        ok = self._probe(service, process, now)
+        if ok:
+            del self.pending[service.name]
+            process.healthy = True
+            old, self.current[service.name] = self.current[service.name], process
+            self._retire(old, now)
+            print(f"Reloaded {service.name} (PID: {process.popen.pid})")
+        elif ok is not None and now - process.started > START_TIMEOUT:
+            del self.pending[service.name]
+            self._retire(process, now)
+            print(f"Reload of {service.name} aborted: not healthy within {START_TIMEOUT:g}s; keeping the old process.")
+
+    def _reap(self, now: float) -> None:
+        still = []
+        for process, deadline in self.retiring:
+            if process.popen.poll() is not None:
+                continue
+            if now >= deadline:
+                print(f"PID {process.popen.pid} did not stop within {STOP_TIMEOUT:g}s; killing it.")
+                process.popen.kill()
+                continue
+            still.append((process, deadline))
+        self.retiring = still
+
+    def reload(self, now: float) -> None:
+        print("Reloading services...")
+        load_dotenv(override=True)
+        for service in self.services:
+            process = self.current[service.name]
+            if process is None:
+                self.restart_at[service.name] = now  # waiting out a backoff: start now
+            elif service.reload_in_place:
+                process.popen.send_signal(signal.SIGHUP)
+            elif service.name not in self.pending:
+                self.pending[service.name] = self._start(service, now, reload=True)
+
+    def tick(self, now: float) -> None:
+        if self.reload_requested:
+            self.reload_requested = False
+            self.reload(now)
+        for service in self.services:
+            self._check(service, now)
+            self._check_pending(service, now)
+        self._reap(now)
+
+    def stop(self) -> None:
+        """Stop every child gracefully, killing those still running after STOP_TIMEOUT."""
+        now = time.monotonic()
+        for service in reversed(self.services):
+            self._retire(self.pending.pop(service.name, None), now)
+            self._retire(self.current[service.name], now)
+            self.current[service.name] = None
+        while self.retiring:
+            self._reap(time.monotonic())
+            time.sleep(0.1)
+        shutil.rmtree(self.health_dir, ignore_errors=True)
+
+    def run(self) -> None:
+        def request_reload(signum, frame):
+            self.reload_requested = True
+
+        def request_stop(signum, frame):
+            self.stop_requested = True
+
+        signal.signal(signal.SIGHUP, request_reload)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+        try:
+            while not self.stop_requested:
+                self.tick(time.monotonic())
+                time.sleep(TICK_SECONDS)
+        finally:
+            print("\nStopping all services...")
+            self.stop()
+            print("All services stopped.")
+
+
+def services() -> List[Service]:
+    # Gunicorn command for Flask app.
+    # We change directory to `src` to ensure Python can find the package.
+    gunicorn_cmd = [
+        "gunicorn",
+        "--chdir", "src",
+        "-w", "4",
+        "-b", f"0.0.0.0:{PORT}",
+        "--graceful-timeout", str(int(STOP_TIMEOUT)),
+        "sms-dashboard.app:app"
+    ]
+    result = [Service("Gunicorn server", gunicorn_cmd, http_probe(f"http://127.0.0.1:{PORT}/healthz"),
+                      reload_in_place=True)]
+    # Conditionally start Telegram bot
+    if os.environ.get("TELEGRAM_BOT_TOKEN"):
+        result.append(Service("Telegram bot", [sys.executable, "-m", "sms-dashboard.bot"], heartbeat_probe))
+    else:
+        print("TELEGRAM_BOT_TOKEN not found, skipping bot.")
+    return result
+
+
+def main() -> int:
+    print("Starting production server...")
+    supervisor = Supervisor(services())
+    print(f"Supervisor PID {os.getpid()}: SIGHUP reloads, Ctrl+C stops all services.")
+    supervisor.run()
+    return 0
 
 
 if __name__ == "__main__":
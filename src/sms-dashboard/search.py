@@ -0,0 +1,77 @@
+"""
+Message search by sender or text, read page by page with keyset cursors.
+
+Sender lookups are an equality on SenderNumber, one per spelling of the
+number; the (SenderNumber, ReceivingDateTime, ID) index added by
+`sms-indexes apply` turns each of them into a short range read. Text search
+uses a FULLTEXT index on inbox.TextDecoded (`ft_inbox_text`) in boolean mode
+when every source has one, and falls back to LIKE otherwise (always with an
+SQLite source). Index availability is checked once per source per process.
+
+Pages come from `sources.fetch_page`, so a "next" or "prev" request continues
+from an opaque cursor instead of re-reading earlier rows with OFFSET.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from . import contacts, sources, storage
+from .multipart import InboxMessage
+from .outbox import normalize_number
+
+FULLTEXT_INDEX = "ft_inbox_text"
+# InnoDB ignores shorter words (innodb_ft_min_token_size)
+MIN_TOKEN_LENGTH = 3
+PAGE_SIZE = 5
+
+_fulltext: Dict[str, bool] = {}
+
+
+def _has_fulltext(conn, source: sources.Source) -> bool:
+    if source.id not in _fulltext:
+        cursor = conn.cursor()
+        try:
+            _fulltext[source.id] = storage.dialect(conn).has_fulltext(cursor)
+        finally:
+            cursor.close()
+    return _fulltext[source.id]
+
+
+def fulltext_available() -> bool:
+    known = [_fulltext.get(s.id) for s in sources.all_sources()]
+    if all(k is not None for k in known):
+        return all(known)
+    checks = sources.fan_out(sources.with_connection(_has_fulltext, False, read_only=True))
+    return all(checks.values())
+
+
+def sender_filter(number: str) -> Tuple[List[str], List[List[Any]]]:
+    """
+    Messages from `number`, however the network spelled it (see
+    contacts.spellings): one condition per spelling, for sources.fetch_page.
+    """
+    forms = contacts.spellings(number)
+    return ["SenderNumber = %s"] * len(forms), [[f] for f in forms]
+
+
+def text_filter(text: str) -> Tuple[str, List[Any]]:
+    words = re.findall(r"\w+", text)
+    if words and all(len(w) >= MIN_TOKEN_LENGTH for w in words) and fulltext_available():
+        # Every word required, prefix match: '+invoice* +march*'
+        return "MATCH(TextDecoded) AGAINST (%s IN BOOLEAN MODE)", [" ".join(f"+{w}*" for w in words)]
+    # '!' rather than the backslash: it means the same in MySQL and SQLite string literals
+    escaped = text.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+    return "TextDecoded LIKE %s ESCAPE '!'", [f"%{escaped}%"]
+
+
+def parse_query(query: str) -> Tuple[Union[str, List[str]], List[Any]]:
+    """A phone number searches by sender; anything else searches the text."""
+    number = normalize_number(query)
+    return sender_filter(number) if number else text_filter(query.strip())
+
+
+def search_page(where: Union[str, Sequence[str]], params: List[Any], before: Optional[str] = None,
+                limit: int = PAGE_SIZE) -> Tuple[List[InboxMessage], Optional[str]]:
+    """One page of matching messages, newest first, and the cursor for the next one."""
+    return sources.fetch_page(limit=limit, before=before or None, where=where, params=params)
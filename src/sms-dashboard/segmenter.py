@@ -0,0 +1,106 @@
+"""
+Split outgoing text into SMS parts the way a phone does.
+
+Text that fits the GSM 03.38 default alphabet is sent as GSM-7 (160
+characters in a single SMS, 153 per part of a concatenated one); anything
+else is sent as UCS-2 (70, or 67 per part). Characters from the GSM
+extension table (`{`, `€`, ...) cost two septets and are never split from
+their escape, and UTF-16 surrogate pairs are never split either.
+
+Each part of a concatenated message carries an 8-bit concatenation UDH
+(`05 00 03 ref total seq`), the inverse of `multipart._parse_udh_concat`.
+Codings are returned as Gammu's `outbox.Coding` values.
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+GSM7_CODING = "Default_No_Compression"
+UCS2_CODING = "Unicode_No_Compression"
+
+# GSM 03.38 basic character set (the escape 0x1B is left out on purpose)
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Extension table: sent as ESC + char, so each costs two septets
+GSM7_EXTENDED = frozenset("\f^{}\\[~]|€")
+
+# (single SMS, per part when concatenated), in septets / UTF-16 code units
+LIMITS = {GSM7_CODING: (160, 153), UCS2_CODING: (70, 67)}
+
+MAX_PARTS = 255
+
+
+@dataclass(frozen=True)
+class Segment:
+    udh: Optional[str]  # hex UDH as stored by Gammu, None for a single SMS
+    text: str
+
+
+def build_udh_concat(ref: int, total: int, seq: int) -> str:
+    """Hex UDH for part `seq` of `total` with 8-bit reference `ref` (e.g. '050003A40201')."""
+    if not (0 <= ref <= 0xFF and 1 <= seq <= total <= MAX_PARTS):
+        raise ValueError(f"Invalid concatenation header: ref={ref} total={total} seq={seq}")
+    return bytes((0x05, 0x00, 0x03, ref, total, seq)).hex().upper()
+
+
+def is_gsm7(text: str) -> bool:
+    return all(ch in GSM7_BASIC or ch in GSM7_EXTENDED for ch in text)
+
+
+def coding_for(text: str) -> str:
+    return GSM7_CODING if is_gsm7(text) else UCS2_CODING
+
+
+def _cost(ch: str, coding: str) -> int:
+    if coding == GSM7_CODING:
+        return 2 if ch in GSM7_EXTENDED else 1
+    return 2 if ord(ch) > 0xFFFF else 1
+
+
+def _split(text: str, coding: str, size: int) -> List[str]:
+    chunks: List[str] = []
+    start, used = 0, 0
+    for i, ch in enumerate(text):
+        cost = _cost(ch, coding)
+        if used + cost > size:
+            chunks.append(text[start:i])
+            start, used = i, 0
+        used += cost
+    chunks.append(text[start:])
+    return chunks
+
+
+def count_parts(text: str) -> Tuple[str, int]:
+    """(coding, number of SMS parts) for `text`."""
+    coding = coding_for(text)
+    single, per_part = LIMITS[coding]
+    if sum(_cost(ch, coding) for ch in text) <= single:
+        return coding, 1
+    return coding, len(_split(text, coding, per_part))
+
+
+def segment(text: str, ref: Optional[int] = None) -> Tuple[str, List[Segment]]:
+    """
+    Split `text` into SMS parts; returns (Gammu coding, segments).
+
+    A message that fits a single SMS gets one segment without UDH. Longer
+    messages are split into parts carrying a concatenation UDH with reference
+    `ref` (random when not given).
+    """
+    if not text:
+        raise ValueError("Message text is empty.")
+    coding = coding_for(text)
+    single, per_part = LIMITS[coding]
+    if sum(_cost(ch, coding) for ch in text) <= single:
+        return coding, [Segment(None, text)]
+    chunks = _split(text, coding, per_part)
+    if len(chunks) > MAX_PARTS:
+        raise ValueError(f"Message too long: {len(chunks)} parts (max {MAX_PARTS}).")
+    if ref is None:
+        ref = random.randrange(256)
+    total = len(chunks)
+    return coding, [Segment(build_udh_concat(ref, total, i), chunk) for i, chunk in enumerate(chunks, start=1)]
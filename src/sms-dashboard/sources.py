@@ -0,0 +1,458 @@
+"""
+Gammu database sources (one per modem/SIM) and parallel, merged inbox reads.
+
+By default there is a single source built from DB_HOST/DB_USER/DB_PASSWORD/
+DB_NAME. Several SMSD databases can be declared with DB_SOURCES (a JSON list)
+or DB_SOURCES_FILE (path to the same JSON):
+
+    [{"id": "sim1", "host": "10.0.0.5", "database": "gammu_sim1"},
+     {"id": "sim2", "host": "10.0.0.6", "database": "gammu_sim2", "port": 3307}]
+
+A source can also be a Gammu SQLite database: {"id": "sim3", "driver":
+"sqlite", "path": "/var/lib/gammu/smsd.db"}, or DB_DRIVER=sqlite with DB_PATH
+(see storage.py).
+
+Missing fields fall back to the DB_* variables. Row IDs are only unique within
+one source, so every InboxMessage carries its `source` and read/delete
+actions are grouped per source.
+
+Each source may list read replicas ("replicas": ["10.0.0.7", "10.0.0.8:3307"],
+or DB_REPLICAS for the single-source setup). Read-only paths ask for
+`get_db_connection(..., read_only=True)` and are spread round-robin over the
+replicas of that source. A replica that refuses connections is skipped for
+REPLICA_RETRY_SECONDS, and one lagging more than REPLICA_MAX_LAG seconds
+behind is skipped until it catches up. When no replica qualifies, the read
+goes to the primary. Writes always go to the primary. After a write, reads
+from the same process (or from a request that called `prefer_primary`)
+stay on the primary for REPLICA_MAX_LAG seconds so users see their own
+changes. Lag is read from SHOW REPLICA STATUS, which needs the REPLICATION
+CLIENT privilege; a replica whose lag cannot be read is assumed current.
+
+Inbox reads fan out to all sources concurrently. Each source returns its rows
+newest first and the streams are combined with a k-way merge on
+(ReceivingDateTime, source, ID); pages continue from a keyset cursor on that
+same key, so no source is ever asked for an OFFSET.
+"""
+from __future__ import annotations
+
+import contextvars
+import dataclasses
+import heapq
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from . import contacts, storage
+from .multipart import INBOX_COLUMNS, InboxMessage, _parse_udh_concat, assemble_inbox_rows
+
+T = TypeVar("T")
+
+# Extra rows read past a page boundary to complete a multipart message
+BOUNDARY_WINDOW = 10
+
+_EPOCH = datetime(1970, 1, 1)
+
+# How long a replica that refused a connection is left out of the rotation
+REPLICA_RETRY_SECONDS = 30
+# How often each replica's lag is re-read
+LAG_CHECK_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class Source:
+    id: str
+    host: str
+    user: Optional[str]
+    password: Optional[str]
+    database: Optional[str]
+    port: int = 3306
+    replicas: Tuple[Tuple[str, int], ...] = ()
+    driver: str = "mysql"
+    path: Optional[str] = None
+
+    def connect(self, host: Optional[str] = None, port: Optional[int] = None):
+        if self.driver == "sqlite":
+            return storage.sqlite_connect(self.path)
+        return storage.mysql_connect(
+            host=host or self.host,
+            port=port or self.port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+        )
+
+
+def _parse_hosts(value: Any, default_port: int) -> Tuple[Tuple[str, int], ...]:
+    """'a, b:3307' or ['a', 'b:3307'] -> (('a', default_port), ('b', 3307))."""
+    entries = value.split(",") if isinstance(value, str) else (value or [])
+    hosts = []
+    for entry in entries:
+        host, _, port = str(entry).strip().partition(":")
+        if host:
+            hosts.append((host, int(port) if port else default_port))
+    return tuple(hosts)
+
+
+def load_sources() -> List[Source]:
+    """Read source declarations from DB_SOURCES / DB_SOURCES_FILE, else the DB_* variables."""
+    defaults = {
+        "host": os.environ.get("DB_HOST", "localhost"),
+        "user": os.environ.get("DB_USER"),
+        "password": os.environ.get("DB_PASSWORD"),
+        "database": os.environ.get("DB_NAME"),
+        "port": int(os.environ.get("DB_PORT", "3306")),
+        "driver": os.environ.get("DB_DRIVER", "mysql").lower(),
+        "path": os.environ.get("DB_PATH"),
+    }
+    raw = os.environ.get("DB_SOURCES")
+    path = os.environ.get("DB_SOURCES_FILE")
+    if not raw and path:
+        with open(path, "r") as f:
+            raw = f.read()
+    if not raw:
+        replicas = _parse_hosts(os.environ.get("DB_REPLICAS", ""), defaults["port"])
+        return [Source(id="default", replicas=replicas, **defaults)]
+    sources = []
+    for i, entry in enumerate(json.loads(raw)):
+        merged = {**defaults, **{k: v for k, v in entry.items() if k != "id"}}
+        merged["port"] = int(merged["port"])
+        merged["replicas"] = _parse_hosts(merged.get("replicas"), merged["port"])
+        sources.append(Source(id=str(entry.get("id") or f"source{i + 1}"), **merged))
+    if len({s.id for s in sources}) != len(sources):
+        raise RuntimeError("DB_SOURCES contains duplicate source ids.")
+    return sources
+
+
+def _check(source: Source) -> Source:
+    if source.driver not in storage.DRIVERS:
+        raise RuntimeError(f"Source '{source.id}': unknown driver '{source.driver}'.")
+    if source.driver == "sqlite":
+        if not source.path:
+            raise RuntimeError(f"Source '{source.id}': the sqlite driver needs a path (DB_PATH).")
+        # A database file has no replicas; every read goes to it
+        return dataclasses.replace(source, replicas=())
+    return source
+
+
+_sources: Optional[List[Source]] = None
+
+
+def all_sources() -> List[Source]:
+    """Configured sources, read on first use (after the entry point has loaded .env)."""
+    global _sources
+    if _sources is None:
+        _sources = [_check(s) for s in load_sources()]
+    return _sources
+
+
+def default_source_id() -> str:
+    return all_sources()[0].id
+
+
+def get_source(source_id: Optional[str] = None) -> Source:
+    if source_id is None:
+        return all_sources()[0]
+    for s in all_sources():
+        if s.id == source_id:
+            return s
+    raise KeyError(f"Unknown source '{source_id}'")
+
+
+def replica_max_lag() -> int:
+    return int(os.environ.get("REPLICA_MAX_LAG", "30"))
+
+
+# Replica health, kept per process: {(source id, host, port): monotonic time}
+_down_until: Dict[Tuple[str, str, int], float] = {}
+_lag_checked: Dict[Tuple[str, str, int], Tuple[float, bool]] = {}
+_rotation: Dict[str, Iterator[int]] = {}
+# Last write per source in this process, for read-your-own-writes
+_last_write: Dict[str, float] = {}
+# Set per request/context by callers that must read their own writes (e.g. after a redirect)
+_primary_until: contextvars.ContextVar[float] = contextvars.ContextVar("primary_until", default=0.0)
+
+
+def note_write(source_id: Optional[str] = None) -> None:
+    """Record a write so this process reads `source_id` from the primary for a while."""
+    _last_write[source_id or default_source_id()] = time.monotonic()
+
+
+def prefer_primary(until: float) -> None:
+    """Route reads in the current context to the primaries until wall-clock time `until`."""
+    _primary_until.set(until)
+
+
+def _primary_required(source_id: str) -> bool:
+    if _primary_until.get() > time.time():
+        return True
+    last = _last_write.get(source_id)
+    return last is not None and time.monotonic() - last < replica_max_lag()
+
+
+def reads_may_lag() -> bool:
+    """True when read_only connections in this context could land on a replica."""
+    return any(s.replicas and not _primary_required(s.id) for s in all_sources())
+
+
+def _lag_ok(conn, key: Tuple[str, str, int]) -> bool:
+    now = time.monotonic()
+    checked = _lag_checked.get(key)
+    if checked and now - checked[0] < LAG_CHECK_SECONDS:
+        return checked[1]
+    lag: Optional[int] = 0
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for statement in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+            try:
+                cursor.execute(statement)
+            except storage.Error:
+                continue
+            row = cursor.fetchone()
+            cursor.fetchall()
+            if row:
+                lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+            break
+    finally:
+        cursor.close()
+    # NULL lag means replication is stopped
+    ok = lag is not None and lag <= replica_max_lag()
+    if not ok:
+        print(f"Replica {key[1]}:{key[2]} of '{key[0]}' is lagging ({lag}s); using another server.")
+    _lag_checked[key] = (now, ok)
+    return ok
+
+
+def _replica_connection(source: Source):
+    """Connect to the next healthy, current replica of `source`, or None."""
+    start = next(_rotation.setdefault(source.id, itertools.count()))
+    now = time.monotonic()
+    for i in range(len(source.replicas)):
+        host, port = source.replicas[(start + i) % len(source.replicas)]
+        key = (source.id, host, port)
+        if _down_until.get(key, 0) > now:
+            continue
+        try:
+            conn = source.connect(host, port)
+        except storage.Error as err:
+            print(f"Replica {host}:{port} of '{source.id}' unavailable: {err}")
+            _down_until[key] = now + REPLICA_RETRY_SECONDS
+            continue
+        try:
+            if _lag_ok(conn, key):
+                return conn
+        except storage.Error as err:
+            print(f"Replica {host}:{port} of '{source.id}' failed a health check: {err}")
+            _down_until[key] = now + REPLICA_RETRY_SECONDS
+        conn.close()
+    return None
+
+
+def get_db_connection(source_id: Optional[str] = None, read_only: bool = False):
+    """
+    Establishes a connection to one source's database (the first source by default).
+
+    With read_only=True a healthy replica is used when one is configured and
+    the caller has not written to the source recently.
+    """
+    try:
+        source = get_source(source_id)
+        if read_only and source.replicas and not _primary_required(source.id):
+            conn = _replica_connection(source)
+            if conn is not None:
+                return conn
+        return source.connect()
+    except (*storage.Error, KeyError) as err:
+        print(f"Error connecting to database: {err}")
+        return None
+
+
+def fan_out(fn: Callable[[Source], T], sources: Optional[Sequence[Source]] = None) -> Dict[str, T]:
+    """Run `fn(source)` for every source concurrently; returns {source id: result}."""
+    sources = list(sources or all_sources())
+    if len(sources) == 1:
+        return {sources[0].id: fn(sources[0])}
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        # Each task runs in a copy of the caller's context (keeps prefer_primary)
+        futures = {s.id: pool.submit(contextvars.copy_context().run, fn, s) for s in sources}
+        return {sid: f.result() for sid, f in futures.items()}
+
+
+def with_connection(fn: Callable[[Any, Source], T], default: T,
+                    read_only: bool = False) -> Callable[[Source], T]:
+    """Wrap `fn(conn, source)` for fan_out: opens/closes a connection, returns `default` on DB errors."""
+    def run(source: Source) -> T:
+        conn = get_db_connection(source.id, read_only=read_only)
+        if not conn:
+            return default
+        try:
+            return fn(conn, source)
+        except storage.Error as err:
+            print(f"Query failed on source '{source.id}': {err}")
+            return default
+        finally:
+            conn.close()
+    return run
+
+
+def _order_key(m: InboxMessage) -> Tuple[datetime, str, int]:
+    return (m.ReceivingDateTime or _EPOCH, m.source or "", m.ID or 0)
+
+
+def merge_newest_first(streams: Iterable[Iterable[InboxMessage]]) -> Iterable[InboxMessage]:
+    """k-way merge of per-source lists that are each sorted newest first."""
+    return heapq.merge(*streams, key=_order_key, reverse=True)
+
+
+def tag(messages: Iterable[InboxMessage], source_id: str) -> List[InboxMessage]:
+    out = list(messages)
+    for m in out:
+        m.source = source_id
+    return out
+
+
+def encode_cursor(m: InboxMessage) -> str:
+    """
+    Opaque keyset cursor: the (time, source, ID) of the last row on a page.
+    A row without a time sorts as _EPOCH, as in _order_key.
+    """
+    return f"{(m.ReceivingDateTime or _EPOCH).strftime('%Y%m%d%H%M%S')}.{m.source or ''}.{m.ID}"
+
+
+def decode_cursor(value: Optional[str]) -> Optional[Tuple[datetime, str, int]]:
+    if not value:
+        return None
+    try:
+        ts, _, rest = value.partition(".")
+        source_id, _, id_ = rest.rpartition(".")
+        return datetime.strptime(ts, "%Y%m%d%H%M%S"), source_id, int(id_)
+    except ValueError:
+        return None
+
+
+def _before_clause(source_id: str, position: Optional[Tuple[datetime, str, int]]) -> Tuple[str, List[Any]]:
+    """SQL for rows of `source_id` that sort after `position` in the merged newest-first order."""
+    if position is None:
+        return "", []
+    ts, cursor_source, cursor_id = position
+    if source_id < cursor_source:
+        return " AND ReceivingDateTime <= %s", [ts]
+    if source_id > cursor_source:
+        return " AND ReceivingDateTime < %s", [ts]
+    return " AND (ReceivingDateTime < %s OR (ReceivingDateTime = %s AND ID < %s))", [ts, ts, cursor_id]
+
+
+def _group_key(m: InboxMessage) -> Optional[Tuple[str, str, int, int]]:
+    """(source, sender, ref, total) of a multipart part, grouped like assemble_inbox_rows."""
+    parsed = _parse_udh_concat(m.UDH)
+    if parsed is None:
+        return None
+    return (m.source or "", contacts.normalize(m.SenderNumber), parsed[0], parsed[1])
+
+
+def _incomplete_groups(rows: Sequence[InboxMessage]) -> Dict[Tuple[str, str, int, int], int]:
+    """Multipart groups missing parts: {(source, sender, ref, total): parts seen}."""
+    seen: Dict[Tuple[str, str, int, int], int] = {}
+    for m in rows:
+        key = _group_key(m)
+        if key is not None:
+            seen[key] = seen.get(key, 0) + 1
+    return {k: n for k, n in seen.items() if n < k[3]}
+
+
+def fetch_page(limit: int = 50, before: Optional[str] = None, where: Union[str, Sequence[str]] = "1 = 1",
+               params: Sequence[Any] = (), sources: Optional[Sequence[Source]] = None,
+               ) -> Tuple[List[InboxMessage], Optional[str]]:
+    """
+    One page of assembled messages across all sources, newest first.
+
+    `where` filters raw inbox rows (with %s `params`). A list of disjoint
+    conditions (with a list of parameter lists) selects the rows matching
+    any of them; each is queried on its own, so `SenderNumber = %s` per
+    spelling of a number keeps using the index order an IN list would lose.
+    Each source is asked for at most limit + BOUNDARY_WINDOW rows past the
+    cursor; the merged stream is cut after `limit` rows, extended up to the
+    last row within that window that belongs to a multipart message already
+    on the page (rows in between come along).
+    Assembly happens per source so parts of different modems are never
+    combined.
+    Returns (messages, next_cursor); next_cursor is None on the last page.
+    """
+    position = decode_cursor(before)
+    want = limit + BOUNDARY_WINDOW
+    branches = [(where, params)] if isinstance(where, str) else list(zip(where, params))
+
+    def query(conn, source):
+        extra, extra_params = _before_clause(source.id, position)
+        cursor = conn.cursor()
+        try:
+            results = []
+            for clause, clause_params in branches:
+                cursor.execute(
+                    f"""
+                    SELECT {INBOX_COLUMNS} FROM inbox
+                    WHERE ({clause}){extra}
+                    ORDER BY ReceivingDateTime DESC, ID DESC
+                    LIMIT %s
+                    """,
+                    (*clause_params, *extra_params, want),
+                )
+                results.append(tag((InboxMessage(*r) for r in cursor.fetchall()), source.id))
+            if len(results) == 1:
+                return results[0]
+            return list(merge_newest_first(results))[:want]
+        finally:
+            cursor.close()
+
+    per_source = fan_out(with_connection(query, [], read_only=True), sources)
+    merged = list(merge_newest_first(per_source.values()))
+
+    # Parts of one message may be interleaved with other rows past the limit;
+    # the page is a prefix of the merged order, so it takes those rows too
+    end = min(limit, len(merged))
+    missing = _incomplete_groups(merged[:end])
+    while missing:
+        found = [i for i in range(end, len(merged)) if _group_key(merged[i]) in missing]
+        if not found:
+            break
+        end = found[-1] + 1
+        missing = _incomplete_groups(merged[:end])
+    page = merged[:end]
+    # A source that filled its whole window may have more rows than we saw.
+    has_more = len(merged) > len(page) or any(len(rows) == want for rows in per_source.values())
+    next_cursor = encode_cursor(page[-1]) if page and has_more else None
+    return assemble_by_source(page), next_cursor
+
+
+def assemble_by_source(rows: Iterable[InboxMessage]) -> List[InboxMessage]:
+    """assemble_inbox_rows per source, then merged newest first."""
+    by_source: Dict[str, List[InboxMessage]] = {}
+    for m in rows:
+        by_source.setdefault(m.source or default_source_id(), []).append(m)
+    assembled = [
+        sorted(tag(assemble_inbox_rows(rs), sid), key=_order_key, reverse=True)
+        for sid, rs in by_source.items()
+    ]
+    return list(merge_newest_first(assembled))
+
+
+def parse_refs(values: Iterable[str]) -> Dict[str, List[int]]:
+    """
+    Group message references by source: 'sim1:40,41' or '40.41' -> {source: [ids]}.
+
+    References without a source prefix belong to the default source.
+    """
+    grouped: Dict[str, List[int]] = {}
+    for value in values:
+        source_id, sep, ids = str(value).rpartition(":")
+        if not sep:
+            source_id = default_source_id()
+        for part in ids.replace(".", ",").split(","):
+            part = part.strip()
+            if part.isdigit():
+                grouped.setdefault(source_id, []).append(int(part))
+    return grouped
@@ -0,0 +1,46 @@
+// Conversation view: loads a sender's thread page by page from the JSON endpoint.
+document.addEventListener('DOMContentLoaded', function () {
+    const thread = document.getElementById('thread');
+    const threadUrl = thread.dataset.url;
+    const title = document.getElementById('thread-title');
+    const loadMore = document.getElementById('load-more');
+    let current = null;
+    let nextCursor = null;
+
+    function renderMessage(m) {
+        const card = document.createElement('div');
+        card.className = 'bg-white rounded-xl shadow p-4 border-l-4 ' + (m.Processed === 'false' ? 'border-indigo-500' : 'border-gray-200');
+        const text = document.createElement('p');
+        text.className = 'text-gray-700 break-words';
+        text.textContent = m.TextDecoded;
+        const when = document.createElement('p');
+        when.className = 'text-xs text-gray-400 mt-2';
+        when.textContent = new Date(m.ReceivingDateTime).toLocaleString();
+        card.append(text, when);
+        return card;
+    }
+
+    async function loadPage() {
+        const params = new URLSearchParams();
+        current.forEach(sender => params.append('sender', sender));
+        if (nextCursor) params.set('before', nextCursor);
+        const resp = await fetch(`${threadUrl}?${params}`);
+        if (!resp.ok) return;
+        const data = await resp.json();
+        data.messages.forEach(m => thread.appendChild(renderMessage(m)));
+        nextCursor = data.next;
+        loadMore.classList.toggle('hidden', !nextCursor);
+    }
+
+    document.querySelectorAll('.sender-item').forEach(btn => {
+        btn.addEventListener('click', function () {
+            current = JSON.parse(btn.dataset.senders);  // every stored spelling of the number
+            nextCursor = null;
+            thread.replaceChildren();
+            title.textContent = btn.dataset.title;
+            loadPage();
+        });
+    });
+
+    loadMore.addEventListener('click', loadPage);
+});
@@ -0,0 +1,289 @@
+// Inbox page: a windowed message list, selection kept as a set of references,
+// the floating action bar and the delete confirmation modal.
+//
+// Only the cards in (and just around) the viewport exist in the DOM; they are
+// recycled while scrolling, and further pages come from /api/messages as the
+// user nears the end of what is loaded. "Select all matching" is sent to the
+// server as the list filter plus the references unticked since, so neither
+// the DOM nor the form grows with the inbox.
+document.addEventListener('DOMContentLoaded', function () {
+    const PAGE_SIZE = 100;
+    const OVERSCAN_ROWS = 3;
+    const GAP = 24;  // gap-6
+
+    const list = document.getElementById('message-list');
+    const cardTemplate = document.getElementById('message-card');
+    const emptyState = document.getElementById('empty-state');
+    const data = JSON.parse(document.getElementById('inbox-data').textContent);
+    const selectAllCheckbox = document.getElementById('select-all');
+    const floatingBar = document.getElementById('floating-bar');
+    const selectionCount = document.getElementById('selection-count');
+    const bulkActionForm = document.getElementById('bulk-action-form');
+    const deleteModal = document.getElementById('delete-modal');
+    const modalOverlay = deleteModal.querySelector('.modal-overlay');
+    const modalPanel = deleteModal.querySelector('.modal-panel');
+    const deleteConfirmForm = document.getElementById('delete-confirm-form');
+
+    const items = data.page.messages;
+    let nextCursor = data.page.next;
+    let loading = false;
+
+    // --- Selection: explicit references, or everything matching minus exclusions ---
+    const selection = { all: false, refs: new Set(), excluded: new Set() };
+
+    function isSelected(ref) {
+        return selection.all ? !selection.excluded.has(ref) : selection.refs.has(ref);
+    }
+
+    function setSelected(ref, on) {
+        const set = selection.all ? selection.excluded : selection.refs;
+        if (on !== selection.all) set.add(ref); else set.delete(ref);
+    }
+
+    function updateFloatingBar() {
+        const any = selection.all || selection.refs.size > 0;
+        if (any) {
+            floatingBar.classList.remove('hidden');
+            floatingBar.classList.remove('translate-y-full');
+        } else {
+            floatingBar.classList.add('translate-y-full');
+        }
+        if (selection.all) {
+            const excluded = selection.excluded.size;
+            selectionCount.textContent = 'All matching messages selected' + (excluded ? ` (${excluded} excluded)` : '');
+        } else {
+            const n = selection.refs.size;
+            selectionCount.textContent = `${n} item${n > 1 ? 's' : ''} selected`;
+        }
+        selectAllCheckbox.checked = selection.all;
+        selectAllCheckbox.indeterminate = selection.all && selection.excluded.size > 0;
+    }
+
+    // --- Windowed rendering ---
+    const mounted = new Map();  // item index -> card element
+    const spare = [];
+    let columns = 1;
+    let rowHeight = 0;
+    let cardWidth = 0;
+
+    function columnCount() {
+        // Same breakpoints as the former md:grid-cols-2 lg:grid-cols-3 grid
+        return window.innerWidth >= 1024 ? 3 : window.innerWidth >= 768 ? 2 : 1;
+    }
+
+    function fill(card, m) {
+        const unread = m.Processed === 'false';
+        card.dataset.ref = m.ref;
+        card.classList.toggle('border-indigo-500', unread);
+        card.classList.toggle('border-gray-200', !unread);
+        card.querySelector('[data-field="sender"]').textContent = m.sender || m.SenderNumber;
+        const source = card.querySelector('[data-field="source"]');
+        if (source) source.textContent = m.source;
+        const text = card.querySelector('[data-field="text"]');
+        text.textContent = m.TextDecoded;
+        text.title = m.TextDecoded;
+        const found = m.extracted || {};
+        const values = [...(found.codes || []), ...(found.amounts || []), ...(found.links || [])];
+        const chips = card.querySelector('[data-field="extracted"]');
+        chips.replaceChildren(...values.map(value => {
+            const chip = document.createElement('button');
+            chip.type = 'button';
+            chip.className = 'text-xs bg-gray-100 text-gray-700 hover:bg-gray-50 py-1 px-2 rounded-full';
+            chip.dataset.copy = value;
+            chip.textContent = `📋 ${value}`;
+            chip.title = 'Copy';
+            return chip;
+        }));
+        chips.classList.toggle('hidden', !values.length);
+        text.classList.toggle('line-clamp-2', values.length > 0);
+        card.querySelector('[data-field="time"]').textContent =
+            new Date(m.ReceivingDateTime).toLocaleString(undefined, { dateStyle: 'long', timeStyle: 'short' });
+        card.querySelector('[data-field="unread"]').classList.toggle('hidden', !unread);
+        card.querySelector('[data-field="read"]').classList.toggle('hidden', unread);
+        const reply = new URLSearchParams({ to: m.SenderNumber });
+        if (m.source) reply.set('source', m.source);
+        card.querySelector('[data-field="reply"]').href = `${list.dataset.sendUrl}?${reply}`;
+        card.querySelector('[data-field="mark-read"]').href = list.dataset.readUrl.replace('REF', encodeURIComponent(m.ref));
+        card.querySelector('.message-checkbox').checked = isSelected(m.ref);
+    }
+
+    function place(card, index) {
+        const row = Math.floor(index / columns);
+        const col = index % columns;
+        card.style.width = `${cardWidth}px`;
+        card.style.transform = `translate(${col * (cardWidth + GAP)}px, ${row * rowHeight}px)`;
+    }
+
+    function takeCard() {
+        const card = spare.pop() || cardTemplate.content.firstElementChild.cloneNode(true);
+        if (!card.isConnected) list.appendChild(card);
+        card.classList.remove('hidden');
+        return card;
+    }
+
+    function layout() {
+        columns = columnCount();
+        cardWidth = (list.clientWidth - (columns - 1) * GAP) / columns;
+        if (!rowHeight) {
+            const probe = takeCard();
+            rowHeight = probe.offsetHeight + GAP;
+            probe.classList.add('hidden');
+            spare.push(probe);
+        }
+        const rows = Math.ceil(items.length / columns) + (nextCursor ? 1 : 0);
+        list.style.height = `${rows * rowHeight}px`;
+        emptyState.classList.toggle('hidden', items.length > 0 || Boolean(nextCursor));
+        mounted.forEach((card, index) => place(card, index));
+        render();
+    }
+
+    function render() {
+        const top = window.scrollY - (list.getBoundingClientRect().top + window.scrollY);
+        const firstRow = Math.max(0, Math.floor(top / rowHeight) - OVERSCAN_ROWS);
+        const lastRow = Math.floor((top + window.innerHeight) / rowHeight) + OVERSCAN_ROWS;
+        const first = firstRow * columns;
+        const last = Math.min(items.length, (lastRow + 1) * columns);
+
+        mounted.forEach((card, index) => {
+            if (index < first || index >= last) {
+                mounted.delete(index);
+                card.classList.add('hidden');
+                spare.push(card);
+            }
+        });
+        for (let index = first; index < last; index++) {
+            if (mounted.has(index)) continue;
+            const card = takeCard();
+            fill(card, items[index]);
+            place(card, index);
+            mounted.set(index, card);
+        }
+        if (nextCursor && last + PAGE_SIZE / 2 >= items.length) loadMore();
+    }
+
+    async function loadMore() {
+        if (loading || !nextCursor) return;
+        loading = true;
+        try {
+            const params = new URLSearchParams({ limit: PAGE_SIZE, before: nextCursor, state: data.filters.state });
+            if (data.filters.sender) params.set('sender', data.filters.sender);
+            const resp = await fetch(`${list.dataset.api}?${params}`);
+            if (!resp.ok) return;
+            const page = await resp.json();
+            items.push(...page.messages);
+            nextCursor = page.next;
+        } finally {
+            loading = false;
+        }
+        layout();
+    }
+
+    let frame = null;
+    function schedule(fn) {
+        if (frame) return;
+        frame = requestAnimationFrame(() => { frame = null; fn(); });
+    }
+    window.addEventListener('scroll', () => schedule(render), { passive: true });
+    window.addEventListener('resize', () => schedule(layout));
+
+    // --- Events (delegated: cards come and go) ---
+    list.addEventListener('change', function (event) {
+        if (!event.target.matches('.message-checkbox')) return;
+        setSelected(event.target.closest('.message-card').dataset.ref, event.target.checked);
+        updateFloatingBar();
+    });
+
+    list.addEventListener('click', function (event) {
+        const chip = event.target.closest('[data-copy]');
+        if (chip) {
+            navigator.clipboard.writeText(chip.dataset.copy).then(() => {
+                const label = chip.textContent;
+                chip.textContent = '✅ Copied';
+                setTimeout(() => { chip.textContent = label; }, 1200);
+            });
+            return;
+        }
+        const button = event.target.closest('[data-field="delete"]');
+        if (!button) return;
+        const ref = button.closest('.message-card').dataset.ref;
+        showDeleteModal(list.dataset.deleteUrl.replace('REF', encodeURIComponent(ref)));
+    });
+
+    selectAllCheckbox.addEventListener('change', function () {
+        selection.all = selectAllCheckbox.checked;
+        selection.refs.clear();
+        selection.excluded.clear();
+        mounted.forEach(card => { card.querySelector('.message-checkbox').checked = selection.all; });
+        updateFloatingBar();
+    });
+
+    document.getElementById('state-filter').addEventListener('change', function () {
+        document.getElementById('filter-form').submit();
+    });
+
+    // --- Bulk actions ---
+    function addField(name, value) {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = name;
+        input.value = value;
+        bulkActionForm.appendChild(input);
+    }
+
+    function submitBulk(action) {
+        bulkActionForm.replaceChildren();
+        addField('action', action);
+        if (selection.all) {
+            addField('select_all', '1');
+            addField('state', data.filters.state);
+            addField('sender', data.filters.sender);
+            addField('snapshot', JSON.stringify(data.snapshot));
+            selection.excluded.forEach(ref => addField('exclude', ref));
+        } else {
+            selection.refs.forEach(ref => addField('message_ids', ref));
+        }
+        bulkActionForm.submit();
+    }
+
+    let pendingBulkDelete = false;
+
+    function openModal() {
+        deleteModal.classList.remove('hidden');
+        deleteModal.classList.add('flex');
+        setTimeout(() => {
+            modalOverlay.classList.remove('opacity-0');
+            modalPanel.classList.remove('opacity-0', 'scale-95');
+        }, 10);
+    }
+
+    function showDeleteModal(deleteUrl) {
+        pendingBulkDelete = false;
+        deleteConfirmForm.action = deleteUrl;
+        openModal();
+    }
+
+    function hideDeleteModal() {
+        modalOverlay.classList.add('opacity-0');
+        modalPanel.classList.add('opacity-0', 'scale-95');
+        setTimeout(() => {
+            deleteModal.classList.add('hidden');
+            deleteModal.classList.remove('flex');
+        }, 300);
+    }
+
+    document.getElementById('bulk-read').addEventListener('click', () => submitBulk('read'));
+    document.getElementById('bulk-delete').addEventListener('click', function () {
+        pendingBulkDelete = true;
+        openModal();
+    });
+    deleteConfirmForm.addEventListener('submit', function (event) {
+        if (!pendingBulkDelete) return;
+        event.preventDefault();
+        submitBulk('delete');
+    });
+    modalOverlay.addEventListener('click', hideDeleteModal);
+    document.getElementById('delete-cancel').addEventListener('click', hideDeleteModal);
+
+    layout();
+    updateFloatingBar();
+});
@@ -0,0 +1,21 @@
+// Send form: live GSM-7 / UCS-2 part counter (mirrors segmenter.py).
+document.addEventListener('DOMContentLoaded', function () {
+    const basic = "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà";
+    const extended = "\f^{}\\[~]|€";
+    const text = document.getElementById('text');
+    const counter = document.getElementById('part-count');
+
+    function update() {
+        const chars = Array.from(text.value);
+        const gsm = chars.every(c => basic.includes(c) || extended.includes(c));
+        const units = gsm
+            ? chars.reduce((n, c) => n + (extended.includes(c) ? 2 : 1), 0)
+            : text.value.length;
+        const [single, perPart] = gsm ? [160, 153] : [70, 67];
+        const parts = units <= single ? 1 : Math.ceil(units / perPart);
+        counter.textContent = `${units} ${gsm ? 'GSM-7' : 'UCS-2'} characters · ${units ? parts : 0} SMS`;
+    }
+
+    text.addEventListener('input', update);
+    update();
+});
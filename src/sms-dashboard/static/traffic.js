@@ -0,0 +1,70 @@
+// Traffic page: draws per-hour/per-day bars (unread on top of read) from /api/traffic.
+document.addEventListener('DOMContentLoaded', function () {
+    const form = document.getElementById('traffic-form');
+    const chart = document.getElementById('traffic-chart');
+    const title = document.getElementById('traffic-title');
+    const senderList = document.getElementById('traffic-senders');
+
+    function label(t, granularity) {
+        const d = new Date(t);
+        return granularity === 'hour' ? d.toLocaleString([], {month: 'short', day: 'numeric', hour: '2-digit'})
+                                      : d.toLocaleDateString();
+    }
+
+    function segment(className, count, peak) {
+        const part = document.createElement('div');
+        part.className = className;
+        part.style.height = (100 * count / peak) + '%';
+        return part;
+    }
+
+    function renderChart(data) {
+        const peak = Math.max(1, ...data.buckets.map(b => b.total));
+        chart.replaceChildren(...data.buckets.map(b => {
+            const bar = document.createElement('div');
+            bar.className = 'traffic-bar';
+            // A bucket without any message (a modem outage) stays visible as an empty slot
+            bar.title = `${label(b.t, data.granularity)}: ${b.total} (${b.unread} unread)`;
+            bar.append(segment('traffic-unread', b.unread, peak), segment('traffic-read', b.read, peak));
+            return bar;
+        }));
+        document.getElementById('traffic-start').textContent = label(data.start, data.granularity);
+        document.getElementById('traffic-end').textContent = label(data.buckets[data.buckets.length - 1].t, data.granularity);
+    }
+
+    function renderSenders(senders) {
+        senderList.replaceChildren(...senders.map(s => {
+            const item = document.createElement('li');
+            item.className = 'flex justify-between items-center py-2';
+            const link = document.createElement('a');
+            link.className = 'text-gray-800 hover:text-indigo-600';
+            link.href = `?sender=${encodeURIComponent(s.sender)}`;
+            link.textContent = s.name ? `${s.name} · ${s.sender}` : s.sender;
+            const counts = document.createElement('span');
+            counts.className = 'text-sm text-gray-500';
+            counts.textContent = `${s.total} (${s.unread} unread)`;
+            item.append(link, counts);
+            return item;
+        }));
+    }
+
+    async function load() {
+        const [granularity, count] = form.elements.range.value.split(':');
+        const params = new URLSearchParams({granularity, count});
+        const sender = form.elements.sender.value.trim();
+        if (sender) params.set('sender', sender);
+        const resp = await fetch(`${form.dataset.api}?${params}`);
+        if (!resp.ok) return;
+        const data = await resp.json();
+        title.textContent = `${sender || 'All senders'}: ${data.total} message(s)`;
+        renderChart(data);
+        renderSenders(data.top_senders);
+    }
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        load();
+    });
+    form.elements.range.addEventListener('change', load);
+    load();
+});
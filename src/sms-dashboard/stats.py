@@ -0,0 +1,365 @@
+"""
+Incrementally maintained inbox statistics.
+
+Counters live in a summary table keyed by (SenderNumber, Day), with running
+per-sender totals beside it (a `*` row holds the grand total), so the
+dashboard and bot can show "N unread, M today, top senders" without a
+`COUNT(*)` over `inbox` or a `GROUP BY` over the summary:
+
+- New rows are ingested by `sync()`, which reads only rows above a stored
+  high-water mark (a primary-key range scan) and adds them to the counters.
+- Reads and deletes are recorded by `record_read()` / `record_delete()` in the
+  same transaction as the UPDATE/DELETE they describe. They take the same
+  state row lock as `sync()`, so a row is either already counted or left to
+  the next sync, never both.
+- `rebuild()` recomputes everything from `inbox` to repair drift.
+
+The per-sender conversation index (`conversations.py`) and the hourly/daily
+traffic rollups (`rollups.py`) are fed from the same hooks, so all of them
+stay consistent with one high-water mark.
+
+Counters are per logical message: a multipart SMS is counted once, through
+its first part (UDH sequence 1), so reads and deletes must cover all parts of
+a message (see `InboxMessage.ids`).
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from . import conversations, rollups, storage
+from .multipart import INBOX_COLUMNS, InboxMessage, _parse_udh_concat
+
+STATS_TABLE = "sms_stats"
+SENDERS_TABLE = "sms_stats_senders"
+STATE_TABLE = "sms_stats_state"
+
+SCHEMA = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+        SenderNumber VARCHAR(20) NOT NULL,
+        Day DATE NOT NULL,
+        Total INT NOT NULL DEFAULT 0,
+        Unread INT NOT NULL DEFAULT 0,
+        Multipart INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (SenderNumber, Day),
+        KEY idx_sms_stats_day (Day)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {SENDERS_TABLE} (
+        SenderNumber VARCHAR(20) NOT NULL PRIMARY KEY,
+        Total INT NOT NULL DEFAULT 0,
+        Unread INT NOT NULL DEFAULT 0,
+        Multipart INT NOT NULL DEFAULT 0,
+        KEY idx_sms_stats_senders_total (Total)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        Name VARCHAR(32) NOT NULL PRIMARY KEY,
+        Value BIGINT NOT NULL
+    )
+    """,
+)
+
+# Sender of the grand total row in SENDERS_TABLE
+ALL = "*"
+
+# Rows ingested per round trip in sync()/rebuild()
+BATCH_SIZE = 5000
+
+StatsKey = Tuple[str, date]
+
+
+def _day(value: Any) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.today()
+
+
+def compute_deltas(rows: Iterable[InboxMessage], sign: int = 1,
+                   unread_only: bool = False) -> Dict[StatsKey, List[int]]:
+    """
+    Turn inbox rows into counter deltas: {(sender, day): [total, unread, multipart]}.
+
+    Only the first part of a multipart message counts. With `unread_only`
+    (used when rows are marked read) just the unread column changes.
+    """
+    deltas: Dict[StatsKey, List[int]] = {}
+    for m in rows:
+        parsed = _parse_udh_concat(m.UDH)
+        if parsed is not None and parsed[2] != 1:
+            continue
+        unread = 1 if m.is_unread else 0
+        if unread_only and not unread:
+            continue
+        d = deltas.setdefault((m.SenderNumber or "", _day(m.ReceivingDateTime)), [0, 0, 0])
+        if unread_only:
+            d[1] += sign
+            continue
+        d[0] += sign
+        d[1] += sign * unread
+        d[2] += sign if parsed is not None else 0
+    return deltas
+
+
+def sender_totals(deltas: Dict[StatsKey, List[int]]) -> Dict[str, List[int]]:
+    """Fold (sender, day) deltas into per-sender ones, plus the `*` grand total."""
+    out: Dict[str, List[int]] = {}
+    for (sender, _), changes in deltas.items():
+        for key in (sender, ALL):
+            cur = out.setdefault(key, [0, 0, 0])
+            for i, change in enumerate(changes):
+                cur[i] += change
+    return out
+
+
+def _seed_senders(cursor) -> None:
+    """Fill the per-sender totals of a database counted before they existed."""
+    d = storage.dialect(cursor)
+    cursor.execute(f"SELECT 1 FROM {SENDERS_TABLE} WHERE SenderNumber = %s", (ALL,))
+    if cursor.fetchone():
+        return
+    cursor.execute(
+        f"""
+        {d.insert_ignore} INTO {SENDERS_TABLE} (SenderNumber, Total, Unread, Multipart)
+        SELECT SenderNumber, SUM(Total), SUM(Unread), SUM(Multipart) FROM {STATS_TABLE}
+        GROUP BY SenderNumber
+        """
+    )
+    cursor.execute(
+        f"""
+        {d.insert_ignore} INTO {SENDERS_TABLE} (SenderNumber, Total, Unread, Multipart)
+        SELECT %s, COALESCE(SUM(Total), 0), COALESCE(SUM(Unread), 0), COALESCE(SUM(Multipart), 0)
+        FROM {STATS_TABLE}
+        """,
+        (ALL,),
+    )
+
+
+# Databases (server/port/schema) whose tables this process has already created;
+# every source has its own database.
+_schema_ready: set = set()
+
+
+def schema_key(cursor) -> str:
+    return storage.dialect(cursor).schema_key(cursor)
+
+
+def ensure_schema(cursor) -> None:
+    """Create the summary tables once per process and database."""
+    key = schema_key(cursor)
+    if key in _schema_ready:
+        return
+    d = storage.dialect(cursor)
+    for ddl in SCHEMA:
+        for statement in d.ddl(ddl):
+            cursor.execute(statement)
+    conversations.ensure_schema(cursor)
+    rollups.ensure_schema(cursor)
+    # Seed the state row so sync() always has a row to lock.
+    cursor.execute(f"{d.insert_ignore} INTO {STATE_TABLE} (Name, Value) VALUES ('last_id', 0)")
+    _seed_senders(cursor)
+    _schema_ready.add(key)
+
+
+def _apply(cursor, deltas: Dict[StatsKey, List[int]]) -> None:
+    if not deltas:
+        return
+    d = storage.dialect(cursor)
+    cursor.executemany(
+        f"""
+        INSERT INTO {STATS_TABLE} (SenderNumber, Day, Total, Unread, Multipart)
+        VALUES (%s, %s, %s, %s, %s)
+        {d.upsert("SenderNumber, Day")}
+            Total = Total + {d.new("Total")},
+            Unread = Unread + {d.new("Unread")},
+            Multipart = Multipart + {d.new("Multipart")}
+        """,
+        [(s, d, t, u, mp) for (s, d), (t, u, mp) in deltas.items()],
+    )
+    cursor.executemany(
+        f"""
+        INSERT INTO {SENDERS_TABLE} (SenderNumber, Total, Unread, Multipart)
+        VALUES (%s, %s, %s, %s)
+        {d.upsert("SenderNumber")}
+            Total = Total + {d.new("Total")},
+            Unread = Unread + {d.new("Unread")},
+            Multipart = Multipart + {d.new("Multipart")}
+        """,
+        [(s, t, u, mp) for s, (t, u, mp) in sender_totals(deltas).items()],
+    )
+
+
+def _apply_rows(cursor, rows: Sequence[InboxMessage], sign: int = 1, unread_only: bool = False) -> None:
+    """Feed rows into every aggregate maintained from inbox changes."""
+    _apply(cursor, compute_deltas(rows, sign=sign, unread_only=unread_only))
+    conversations.apply_rows(cursor, rows, sign=sign, unread_only=unread_only)
+    rollups.apply_rows(cursor, rows, sign=sign, unread_only=unread_only)
+
+
+def _last_id(cursor, lock: bool = False) -> int:
+    d = storage.dialect(cursor)
+    if lock:
+        d.begin_write(cursor)
+    cursor.execute(
+        f"SELECT Value FROM {STATE_TABLE} WHERE Name = 'last_id'" + (d.for_update if lock else "")
+    )
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _set_last_id(cursor, last_id: int) -> None:
+    d = storage.dialect(cursor)
+    cursor.execute(
+        f"INSERT INTO {STATE_TABLE} (Name, Value) VALUES ('last_id', %s) "
+        f"{d.upsert('Name')} Value = {d.new('Value')}",
+        (last_id,),
+    )
+
+
+def _select_ids(cursor, ids: Sequence[Any], last_id: int) -> List[InboxMessage]:
+    """Rows for `ids` that were already ingested (newer rows are not counted yet)."""
+    if not ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(
+        f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ID IN ({placeholders}) AND ID <= %s",
+        (*ids, last_id),
+    )
+    return [InboxMessage(*r) for r in cursor.fetchall()]
+
+
+def _ingest(cursor, last_id: int) -> Tuple[int, int]:
+    """Add rows with ID > last_id in batches; returns (new last_id, rows read)."""
+    seen = 0
+    while True:
+        cursor.execute(
+            f"SELECT {INBOX_COLUMNS} FROM inbox WHERE ID > %s ORDER BY ID LIMIT %s",
+            (last_id, BATCH_SIZE),
+        )
+        rows = [InboxMessage(*r) for r in cursor.fetchall()]
+        if not rows:
+            break
+        _apply_rows(cursor, rows)
+        last_id = rows[-1].ID
+        seen += len(rows)
+    return last_id, seen
+
+
+def sync(conn) -> int:
+    """Ingest rows added since the last sync; returns the number of rows read."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        # The state row lock serialises concurrent syncs from workers and the bot.
+        last_id = _last_id(cursor, lock=True)
+        last_id, seen = _ingest(cursor, last_id)
+        if seen:
+            _set_last_id(cursor, last_id)
+        conn.commit()
+        return seen
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def record_read(cursor, ids: Sequence[Any]) -> None:
+    """Call before `UPDATE inbox SET Processed = 'true'` for `ids`, in the same transaction."""
+    ensure_schema(cursor)
+    # Held until the caller commits, so a sync cannot count these rows meanwhile
+    last_id = _last_id(cursor, lock=True)
+    rows = [m for m in _select_ids(cursor, ids, last_id) if m.is_unread]
+    _apply_rows(cursor, rows, sign=-1, unread_only=True)
+
+
+def record_delete(cursor, ids: Sequence[Any]) -> None:
+    """Call before `DELETE FROM inbox` for `ids`, in the same transaction."""
+    ensure_schema(cursor)
+    last_id = _last_id(cursor, lock=True)
+    _apply_rows(cursor, _select_ids(cursor, ids, last_id), sign=-1)
+
+
+def rebuild(conn) -> int:
+    """Recompute all counters from `inbox`; returns the number of rows scanned."""
+    cursor = conn.cursor()
+    try:
+        ensure_schema(cursor)
+        _last_id(cursor, lock=True)
+        cursor.execute(f"DELETE FROM {STATS_TABLE}")
+        cursor.execute(f"DELETE FROM {SENDERS_TABLE}")
+        conversations.reset(cursor)
+        rollups.reset(cursor)
+        last_id, seen = _ingest(cursor, 0)
+        _set_last_id(cursor, last_id)
+        _seed_senders(cursor)  # an empty inbox still gets its `*` row
+        conn.commit()
+        return seen
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def summary(conn, top: int = 5) -> Dict[str, Any]:
+    """
+    Totals, today's count and top senders, read from the running totals and
+    today's rows of the summary table.
+
+    Pure read (it may run on a replica): call `sync()` on the primary first so
+    the tables exist.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT Total, Unread, Multipart FROM {SENDERS_TABLE} WHERE SenderNumber = %s", (ALL,)
+        )
+        total, unread, multipart = cursor.fetchone() or (0, 0, 0)
+        cursor.execute(
+            f"SELECT COALESCE(SUM(Total), 0), COALESCE(SUM(Unread), 0) FROM {STATS_TABLE} WHERE Day = %s",
+            (date.today(),),
+        )
+        today, today_unread = cursor.fetchone()
+        cursor.execute(
+            f"""
+            SELECT SenderNumber, Total, Unread FROM {SENDERS_TABLE}
+            WHERE SenderNumber <> %s
+            ORDER BY Total DESC
+            LIMIT %s
+            """,
+            (ALL, top),
+        )
+        senders = [
+            {"sender": s, "total": int(t), "unread": int(u)} for s, t, u in cursor.fetchall()
+        ]
+    finally:
+        cursor.close()
+    return {
+        "total": int(total),
+        "unread": int(unread),
+        "multipart": int(multipart),
+        "today": int(today),
+        "today_unread": int(today_unread),
+        "top_senders": senders,
+    }
+
+
+def combine(summaries: Iterable[Dict[str, Any]], top: int = 5) -> Dict[str, Any]:
+    """Add up summaries from several sources; top senders are re-ranked across them."""
+    out: Dict[str, Any] = {"total": 0, "unread": 0, "multipart": 0, "today": 0, "today_unread": 0}
+    senders: Dict[str, Dict[str, Any]] = {}
+    for s in summaries:
+        for k in out:
+            out[k] += s[k]
+        for t in s["top_senders"]:
+            cur = senders.setdefault(t["sender"], {"sender": t["sender"], "total": 0, "unread": 0})
+            cur["total"] += t["total"]
+            cur["unread"] += t["unread"]
+    out["top_senders"] = sorted(senders.values(), key=lambda t: t["total"], reverse=True)[:top]
+    return out
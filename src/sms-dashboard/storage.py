@@ -0,0 +1,304 @@
+"""
+Database drivers: MySQL/MariaDB (mysql.connector) and SQLite.
+
+A source selects its driver with "driver" in DB_SOURCES, or DB_DRIVER for the
+single-source setup. The default is "mysql". With "sqlite", "path" (or
+DB_PATH) is the database file Gammu SMSD writes to. Every query keeps
+mysql.connector's `%s` placeholders; the SQLite connection rewrites them.
+The statements that differ between the two ask the connection's dialect
+(`dialect(conn)`): upserts, INSERT IGNORE, the current time, row and named
+locks, DDL and full-text support.
+
+SQLite connections are set up for several processes sharing one file (SMSD,
+gunicorn workers, the bot):
+
+- journal_mode=WAL, so readers never block the writer and vice versa.
+- busy_timeout (SQLITE_BUSY_TIMEOUT ms, default 5000), so a writer waits for
+  a lock instead of failing at once.
+- synchronous=NORMAL, safe under WAL: a power loss can drop the last commits
+  but never corrupts the file.
+- One connection per thread and file, reused: `close()` only ends the open
+  transaction.
+
+Read-modify-write paths (stats sync, notifier lease, outbox slots) call
+`begin_write()`. On SQLite that takes the write lock up front (BEGIN
+IMMEDIATE), which stands in for the row locks and named locks used on MySQL.
+Timestamps are stored as 'YYYY-MM-DD HH:MM:SS' text in local time, as Gammu
+does, and read back as datetime. mysql-connector-python is only needed for
+MySQL sources.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import mysql.connector
+except ImportError:  # SQLite-only deployment
+    mysql = None
+
+# Errors any driver raises for a failed connection or query
+Error = (mysql.connector.Error, sqlite3.Error) if mysql else (sqlite3.Error,)
+
+DRIVERS = ("mysql", "sqlite")
+
+
+def busy_timeout() -> int:
+    return int(os.environ.get("SQLITE_BUSY_TIMEOUT", "5000"))
+
+
+def to_datetime(value: Any) -> Any:
+    """Datetime from a driver value; SQLite returns computed timestamps (e.g. MAX(col)) as text."""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _convert_datetime(raw: bytes) -> Any:
+    return to_datetime(raw.decode())
+
+
+def _convert_numeric(raw: bytes) -> Any:
+    # Gammu declares its timestamp columns NUMERIC
+    text = raw.decode()
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return to_datetime(text)
+
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("DATETIME", _convert_datetime)
+sqlite3.register_converter("TIMESTAMP", _convert_datetime)
+sqlite3.register_converter("NUMERIC", _convert_numeric)
+sqlite3.register_converter("DATE", lambda raw: date.fromisoformat(raw.decode()[:10]))
+
+
+class MySQLDialect:
+    name = "mysql"
+    insert_ignore = "INSERT IGNORE"
+    for_update = " FOR UPDATE"
+    now = "NOW()"
+    now_ms = "NOW(3)"
+
+    def upsert(self, keys: str) -> str:
+        """Conflict clause of an INSERT; follow it with `col = expr` assignments."""
+        return "ON DUPLICATE KEY UPDATE"
+
+    def new(self, column: str) -> str:
+        """The value an upsert tried to insert into `column`."""
+        return f"VALUES({column})"
+
+    def now_plus_seconds(self) -> str:
+        """Current time plus a number of seconds given as one %s parameter."""
+        return "NOW(3) + INTERVAL %s SECOND"
+
+    def ddl(self, statement: str) -> List[str]:
+        return [statement]
+
+    def begin_write(self, cursor) -> None:
+        pass  # InnoDB locks rows as they are read FOR UPDATE
+
+    def named_lock(self, cursor, name: str, timeout: int) -> bool:
+        cursor.execute("SELECT GET_LOCK(CONCAT(%s, DATABASE()), %s)", (name, timeout))
+        return cursor.fetchone()[0] == 1
+
+    def release_named_lock(self, cursor, name: str) -> None:
+        cursor.execute("SELECT RELEASE_LOCK(CONCAT(%s, DATABASE()))", (name,))
+        cursor.fetchone()
+
+    def schema_key(self, cursor) -> str:
+        cursor.execute("SELECT CONCAT(@@hostname, ':', @@port, '/', DATABASE())")
+        return cursor.fetchone()[0]
+
+    def prepare_stream(self, cursor) -> None:
+        # A slow download must not make the server drop a half-read result set
+        cursor.execute("SET SESSION net_write_timeout = 3600")
+
+    def has_fulltext(self, cursor) -> bool:
+        cursor.execute("SHOW INDEX FROM inbox WHERE Index_type = 'FULLTEXT' AND Column_name = 'TextDecoded'")
+        return bool(cursor.fetchall())
+
+    def index_columns(self, cursor, table: str) -> Dict[str, Tuple[str, ...]]:
+        """Indexes of `table`: {name: (column, ...)} in index order."""
+        cursor.execute(f"SHOW INDEX FROM {table}")
+        names = [d[0] for d in cursor.description]
+        columns: Dict[str, List[Tuple[int, str]]] = {}
+        for row in cursor.fetchall():
+            r = dict(zip(names, row))
+            columns.setdefault(r["Key_name"], []).append((r["Seq_in_index"], r["Column_name"]))
+        return {name: tuple(c for _seq, c in sorted(cols)) for name, cols in columns.items()}
+
+    def add_index(self, table: str, name: str, columns: Sequence[str]) -> str:
+        # Online DDL: reads and Gammu's inserts continue while the index builds
+        return f"ALTER TABLE {table} ADD INDEX {name} ({', '.join(columns)}), ALGORITHM=INPLACE, LOCK=NONE"
+
+
+_INLINE_KEY = re.compile(r",\s*(UNIQUE\s+)?KEY\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+_TABLE_NAME = re.compile(r"CREATE TABLE IF NOT EXISTS (\w+)", re.IGNORECASE)
+
+
+class SQLiteDialect(MySQLDialect):
+    name = "sqlite"
+    insert_ignore = "INSERT OR IGNORE"
+    for_update = ""
+    now = "datetime('now', 'localtime')"
+    now_ms = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+    def upsert(self, keys: str) -> str:
+        return f"ON CONFLICT ({keys}) DO UPDATE SET"
+
+    def new(self, column: str) -> str:
+        return f"excluded.{column}"
+
+    def now_plus_seconds(self) -> str:
+        return "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', %s || ' seconds')"
+
+    def ddl(self, statement: str) -> List[str]:
+        """MySQL CREATE TABLE -> SQLite: inline KEY definitions become CREATE INDEX statements."""
+        table = _TABLE_NAME.search(statement).group(1)
+        indexes = [
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+            for unique, name, columns in _INLINE_KEY.findall(statement)
+        ]
+        return [_INLINE_KEY.sub("", statement)] + indexes
+
+    def begin_write(self, cursor) -> None:
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+
+    def named_lock(self, cursor, name: str, timeout: int) -> bool:
+        return True  # writers are serialised by begin_write()
+
+    def release_named_lock(self, cursor, name: str) -> None:
+        pass
+
+    def schema_key(self, cursor) -> str:
+        cursor.execute("PRAGMA database_list")
+        return next(row[2] for row in cursor.fetchall() if row[1] == "main")
+
+    def prepare_stream(self, cursor) -> None:
+        pass
+
+    def has_fulltext(self, cursor) -> bool:
+        return False  # text search uses LIKE
+
+    def index_columns(self, cursor, table: str) -> Dict[str, Tuple[str, ...]]:
+        cursor.execute(f"PRAGMA index_list({table})")
+        names = [row[1] for row in cursor.fetchall()]
+        indexes = {}
+        for name in names:
+            cursor.execute(f"PRAGMA index_info({name})")
+            indexes[name] = tuple(row[2] for row in sorted(cursor.fetchall()))
+        return indexes
+
+    def add_index(self, table: str, name: str, columns: Sequence[str]) -> str:
+        # Blocks writers while it runs; SMSD retries on SQLITE_BUSY
+        return f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+
+
+MYSQL = MySQLDialect()
+SQLITE = SQLiteDialect()
+
+
+class SQLiteCursor:
+    """The subset of the mysql.connector cursor API the app uses, over sqlite3."""
+
+    def __init__(self, connection: "SQLiteConnection", dictionary: bool = False):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> None:
+        self._cursor.execute(sql.replace("%s", "?"), tuple(params))
+
+    def executemany(self, sql: str, seq_of_params) -> None:
+        self._cursor.executemany(sql.replace("%s", "?"), seq_of_params)
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        return self._cursor.lastrowid
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """A cached per-thread sqlite3 connection; `close()` ends the transaction but keeps it open."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.raw = sqlite3.connect(path, timeout=busy_timeout() / 1000,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        self.raw.execute(f"PRAGMA busy_timeout = {busy_timeout()}")
+        self.raw.execute("PRAGMA journal_mode = WAL")
+        self.raw.execute("PRAGMA synchronous = NORMAL")
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.in_transaction
+
+    def cursor(self, buffered: bool = True, dictionary: bool = False) -> SQLiteCursor:
+        # Results are read lazily either way; `buffered` only exists for the MySQL API
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    def commit(self) -> None:
+        self.raw.commit()
+
+    def rollback(self) -> None:
+        self.raw.rollback()
+
+    def close(self) -> None:
+        if self.raw.in_transaction:
+            self.raw.rollback()
+
+
+def mysql_connect(**kwargs):
+    if mysql is None:
+        raise RuntimeError("MySQL sources need mysql-connector-python.")
+    return mysql.connector.connect(**kwargs)
+
+
+_local = threading.local()
+
+
+def sqlite_connect(path: str) -> SQLiteConnection:
+    """This thread's connection to `path`, opened on first use."""
+    cache: Dict[str, SQLiteConnection] = _local.__dict__.setdefault("connections", {})
+    conn = cache.get(path)
+    if conn is None:
+        conn = cache[path] = SQLiteConnection(path)
+    return conn
+
+
+def dialect(conn_or_cursor: Any) -> MySQLDialect:
+    """SQL dialect of a connection or cursor."""
+    return SQLITE if isinstance(conn_or_cursor, (SQLiteConnection, SQLiteCursor)) else MYSQL
@@ -0,0 +1,341 @@
+"""
+Delivery-lag tracing: how long an SMS takes from the modem to the operator.
+
+Every notification sent by the bot gets one trace. A trace records the time
+of each step:
+
+- received: ReceivingDateTime, written by Gammu when the modem got the SMS
+- picked up: the first poll that read the row (for a multipart message, its
+  first part)
+- assembled: the poll that found the message ready and queued it
+- sent: the last Telegram sendMessage attempt started
+- acked: Telegram answered it
+
+The gaps between them are the stages "pickup" (poll interval), "assembly"
+(mostly the multipart grace period), "queue" (waiting in the notification
+queue, including failed attempts; see delivery.py), "send" (the Bot API
+round trip) and "total". ReceivingDateTime
+is in the database server's local time with one-second resolution, so
+"pickup" and "total" assume the bot and the database agree on the clock.
+
+Finished traces are kept in memory (the last LAG_WINDOW, for the bot's /lag
+command) and counted into cumulative histograms per stage. `flush()`, called
+by the delivery loop, exports what finished since the previous call:
+
+- TRACE_FILE: OpenTelemetry spans appended as OTLP/JSON lines, the format the
+  collector's file exporter writes and its otlpjsonfile receiver reads.
+- OTEL_EXPORTER_OTLP_ENDPOINT: the same spans posted to a collector's
+  OTLP/HTTP endpoint (`<endpoint>/v1/traces`).
+- LAG_METRICS_FILE: the histograms in Prometheus text format, rewritten in
+  place (for node_exporter's textfile collector).
+
+All three are optional; without them only /lag reports the traces.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+STAGES = ("pickup", "assembly", "queue", "send", "total")
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600)
+# Rows and messages waiting for their next step; the oldest are forgotten
+# first (a message marked read on the dashboard never reaches "sent")
+MAX_PENDING = 10000
+SERVICE_NAME = "sms-dashboard-bot"
+
+
+def lag_window() -> int:
+    return int(os.environ.get("LAG_WINDOW", "500"))
+
+
+def metrics_file() -> Optional[str]:
+    return os.environ.get("LAG_METRICS_FILE") or None
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending sequence (0 when empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(len(sorted_values) * pct / 100))
+    return sorted_values[rank - 1]
+
+
+def _epoch(value: Any) -> Optional[float]:
+    # Naive datetimes from the database are local time, like datetime.now()
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return None
+
+
+@dataclass
+class Trace:
+    source: Optional[str]
+    ref: str
+    parts: int
+    received: Optional[float]
+    picked_up: float
+    assembled: float
+    sent: Optional[float] = None
+    acked: Optional[float] = None
+    ok: bool = False
+
+    def stages(self) -> Dict[str, float]:
+        """Stage durations in seconds; clock skew never makes one negative."""
+        marks = (self.received, self.picked_up, self.assembled, self.sent, self.acked)
+        durations = {}
+        for stage, start, end in zip(STAGES, marks, marks[1:]):
+            if start is not None and end is not None:
+                durations[stage] = max(0.0, end - start)
+        if self.received is not None and self.acked is not None:
+            durations["total"] = max(0.0, self.acked - self.received)
+        return durations
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus and OpenTelemetry export them."""
+
+    def __init__(self, bounds: Sequence[float] = BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total, rows = 0, []
+        for bound, n in zip((*(f"{b:g}" for b in self.bounds), "+Inf"), self.counts):
+            total += n
+            rows.append((bound, total))
+        return rows
+
+
+class Tracer:
+    """Traces of one bot process. Thread-safe: sources are polled concurrently."""
+
+    def __init__(self, window: Optional[int] = None):
+        self._lock = threading.Lock()
+        self._first_seen: OrderedDict[Tuple[Optional[str], Any], float] = OrderedDict()
+        self._pending: OrderedDict[Tuple[Optional[str], Any], Trace] = OrderedDict()
+        self.recent: deque[Trace] = deque(maxlen=window or lag_window())
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.failed = 0
+        self._unexported: List[Trace] = []
+
+    @staticmethod
+    def _bound(entries: OrderedDict) -> None:
+        while len(entries) > MAX_PENDING:
+            entries.popitem(last=False)
+
+    def picked_up(self, source: Optional[str], ids: Iterable[Any], at: Optional[float] = None) -> None:
+        """Rows a poll read; only the first sighting of each row counts."""
+        at = time.time() if at is None else at
+        with self._lock:
+            for row_id in ids:
+                self._first_seen.setdefault((source, row_id), at)
+            self._bound(self._first_seen)
+
+    def assembled(self, message, at: Optional[float] = None) -> None:
+        """A message is ready to be notified; starts its trace."""
+        at = time.time() if at is None else at
+        with self._lock:
+            seen = [self._first_seen.pop((message.source, i), at) for i in message.ids]
+            self._pending[(message.source, message.ID)] = Trace(
+                source=message.source, ref=message.ref, parts=len(message.ids),
+                received=_epoch(message.ReceivingDateTime), picked_up=min(seen), assembled=at,
+            )
+            self._bound(self._pending)
+
+    def sending(self, message) -> Optional[Trace]:
+        """The notification request for `message` starts now."""
+        with self._lock:
+            trace = self._pending.pop((message.source, message.ID), None)
+        if trace is not None:
+            trace.sent = time.time()
+        return trace
+
+    def retry(self, message, trace: Optional[Trace]) -> None:
+        """The send failed and will be retried: the trace waits for the next attempt."""
+        if trace is None:
+            return
+        trace.sent = None
+        with self._lock:
+            self._pending[(message.source, message.ID)] = trace
+            self._bound(self._pending)
+
+    def finish(self, trace: Optional[Trace], ok: bool) -> None:
+        """Telegram accepted the message (ok), or it was given up on."""
+        if trace is None:
+            return
+        trace.acked = time.time()
+        trace.ok = ok
+        with self._lock:
+            self.recent.append(trace)
+            self._unexported.append(trace)
+            if not ok:
+                self.failed += 1
+                return
+            for stage, seconds in trace.stages().items():
+                self.histograms[stage].observe(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        """Percentiles per stage over the recent traces (successful deliveries only)."""
+        with self._lock:
+            traces = list(self.recent)
+        delivered = [t.stages() for t in traces if t.ok]
+        stages = {}
+        for stage in STAGES:
+            values = sorted(d[stage] for d in delivered if stage in d)
+            stages[stage] = {
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1] if values else 0.0,
+            }
+        return {
+            "count": len(delivered),
+            "failed": len(traces) - len(delivered),
+            "since": traces[0].acked if traces else None,
+            "stages": stages,
+        }
+
+    def flush(self, extra_metrics: Sequence[str] = ()) -> None:
+        """
+        Export the traces finished since the last call (see the module
+        docstring); `extra_metrics` lines are added to LAG_METRICS_FILE.
+        """
+        with self._lock:
+            traces, self._unexported = self._unexported, []
+            metrics = prometheus_text(self.histograms, self.failed)
+        if extra_metrics:
+            metrics += "\n".join(extra_metrics) + "\n"
+        trace_file = os.environ.get("TRACE_FILE")
+        endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+        metrics_path = metrics_file()
+        if traces and (trace_file or endpoint):
+            body = json.dumps(otlp_spans(traces))
+            if trace_file:
+                try:
+                    with open(trace_file, "a") as f:
+                        f.write(body + "\n")
+                except OSError as e:
+                    print(f"Error writing traces: {e}")
+            if endpoint:
+                request = urllib.request.Request(
+                    endpoint.rstrip("/") + "/v1/traces", data=body.encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                )
+                try:
+                    with urllib.request.urlopen(request, timeout=5):
+                        pass
+                except Exception as e:
+                    print(f"Error exporting traces: {e}")
+        if (traces or extra_metrics) and metrics_path:
+            try:
+                # Write aside and rename, so a scrape never reads half a file
+                with open(metrics_path + ".tmp", "w") as f:
+                    f.write(metrics)
+                os.replace(metrics_path + ".tmp", metrics_path)
+            except OSError as e:
+                print(f"Error writing lag metrics: {e}")
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _nanos(seconds: float) -> str:
+    return str(int(seconds * 1_000_000_000))
+
+
+def otlp_spans(traces: Iterable[Trace]) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest: per trace an `sms.delivery` span with one child per stage."""
+    spans = []
+    for t in traces:
+        trace_id = secrets.token_hex(16)
+        root_id = secrets.token_hex(8)
+        start = t.received if t.received is not None else t.picked_up
+        status = {"code": 1} if t.ok else {"code": 2, "message": "Telegram sendMessage failed"}
+        spans.append({
+            "traceId": trace_id, "spanId": root_id, "name": "sms.delivery", "kind": 1,
+            "startTimeUnixNano": _nanos(min(start, t.acked)), "endTimeUnixNano": _nanos(t.acked),
+            "attributes": [_attribute("sms.source", t.source or ""), _attribute("sms.ref", t.ref),
+                           _attribute("sms.parts", t.parts), _attribute("telegram.ok", t.ok)],
+            "status": status,
+        })
+        marks = (t.received, t.picked_up, t.assembled, t.sent, t.acked)
+        for stage, begin, end in zip(STAGES, marks, marks[1:]):
+            if begin is None or end is None:
+                continue
+            spans.append({
+                "traceId": trace_id, "spanId": secrets.token_hex(8), "parentSpanId": root_id,
+                "name": f"sms.{stage}", "kind": 3 if stage == "send" else 1,
+                "startTimeUnixNano": _nanos(min(begin, end)), "endTimeUnixNano": _nanos(end),
+                **({"status": status} if stage == "send" else {}),
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "sms-dashboard.tracing"}, "spans": spans}],
+    }]}
+
+
+def prometheus_text(histograms: Dict[str, Histogram], failed: int = 0) -> str:
+    """The stage histograms as `sms_delivery_lag_seconds{stage=...}` in Prometheus text format."""
+    lines = [
+        "# HELP sms_delivery_lag_seconds Time from SMS receipt to Telegram notification, per stage.",
+        "# TYPE sms_delivery_lag_seconds histogram",
+    ]
+    for stage, h in histograms.items():
+        for bound, count in h.cumulative():
+            lines.append(f'sms_delivery_lag_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'sms_delivery_lag_seconds_sum{{stage="{stage}"}} {h.sum:.3f}')
+        lines.append(f'sms_delivery_lag_seconds_count{{stage="{stage}"}} {h.count}')
+    lines += [
+        "# HELP sms_notifications_failed_total Telegram notifications that were not acknowledged.",
+        "# TYPE sms_notifications_failed_total counter",
+        f"sms_notifications_failed_total {failed}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def format_lag(summary: Dict[str, Any]) -> str:
+    """Text of the bot's /lag reply."""
+    if not summary["count"] and not summary["failed"]:
+        return "⏱ No notifications traced by this bot process yet."
+    since = datetime.fromtimestamp(summary["since"]).strftime("%Y-%m-%d %H:%M") if summary["since"] else "?"
+    lines = [f"⏱ Delivery lag, last {summary['count']} notification(s) since {since}", ""]
+    for stage, p in summary["stages"].items():
+        lines.append(f"{stage}: " + " · ".join(f"{k} {_duration(p[k])}" for k in ("p50", "p95", "p99", "max")))
+    if summary["failed"]:
+        lines += ["", f"Failed sends: {summary['failed']}"]
+    return "\n".join(lines)
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 10:
+        return f"{seconds:.2f}s"
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    return f"{seconds / 60:.0f}m"
@@ -0,0 +1,137 @@
+"""
+Local HTTP listener for Telegram webhook updates.
+
+Telegram POSTs each update as JSON to the configured path. The
+X-Telegram-Bot-Api-Secret-Token header must match WEBHOOK_SECRET, which is
+registered together with the webhook. A request is acknowledged as soon as
+its update has been handed to `dispatch`, so Telegram can push the next one
+right away. Processing (and how many updates run at once) is up to the
+application behind `dispatch`.
+
+The listener uses only the standard library. Put a TLS-terminating reverse
+proxy in front of it, or test it locally by POSTing recorded updates:
+
+    curl -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' \\
+         -H 'Content-Type: application/json' \\
+         --data @update.json http://127.0.0.1:8443/telegram
+"""
+from __future__ import annotations
+
+import hmac
+import json
+import os
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Updates are small; anything bigger is not from Telegram
+MAX_BODY_BYTES = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class WebhookConfig:
+    listen: str
+    port: int
+    path: str
+    secret: str
+    public_url: Optional[str]
+    concurrency: int
+
+    @property
+    def webhook_url(self) -> Optional[str]:
+        """Public URL registered with Telegram, or None to leave the registration alone (local testing)."""
+        if not self.public_url:
+            return None
+        return self.public_url.rstrip("/") + self.path
+
+
+def load_config() -> WebhookConfig:
+    secret = os.environ.get("WEBHOOK_SECRET", "")
+    if not secret:
+        raise SystemExit("WEBHOOK_SECRET must be set in webhook mode")
+    path = os.environ.get("WEBHOOK_PATH", "/telegram")
+    return WebhookConfig(
+        listen=os.environ.get("WEBHOOK_LISTEN", "127.0.0.1"),
+        port=int(os.environ.get("WEBHOOK_PORT", "8443")),
+        path=path if path.startswith("/") else "/" + path,
+        secret=secret,
+        public_url=os.environ.get("WEBHOOK_URL") or None,
+        concurrency=int(os.environ.get("WEBHOOK_CONCURRENCY", "8")),
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+
+    def _reply(self, status: int, body: bytes = b"") -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        # Health check for the reverse proxy / service manager
+        self._reply(200 if self.path == "/healthz" else 404, b"ok" if self.path == "/healthz" else b"")
+
+    def do_POST(self):
+        if self.path != self.server.url_path:
+            self._reply(404)
+            return
+        token = self.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.server.secret.encode()):
+            self._reply(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_BODY_BYTES:
+            self._reply(413 if length > MAX_BODY_BYTES else 400)
+            return
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400)
+            return
+        if not isinstance(update, dict):
+            self._reply(400)
+            return
+        try:
+            self.server.dispatch(update)
+        except Exception as e:
+            print(f"Webhook dispatch failed: {e}")
+            self._reply(500)
+            return
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        pass  # one line per update is too noisy; errors are printed above
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Threaded listener passing each authenticated update (a dict) to `dispatch`."""
+
+    daemon_threads = True
+    # A replacement bot binds the same port while the old one drains (see run_production.py)
+    allow_reuse_port = True
+
+    def __init__(self, listen: str, port: int, path: str, secret: str,
+                 dispatch: Callable[[Dict[str, Any]], None]):
+        super().__init__((listen, port), _Handler)
+        self.url_path = path
+        self.secret = secret
+        self.dispatch = dispatch
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name="telegram-webhook", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
@@ -0,0 +1,74 @@
+import gzip
+import importlib
+import os
+import re
+import sys
+
+# Import through the package (the name contains a hyphen)
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+assets = importlib.import_module("sms-dashboard.assets")
+
+PACKAGE = os.path.join(ROOT, "src", "sms-dashboard")
+# Classes only used as hooks by the scripts
+HOOK_CLASSES = {"message-checkbox", "sender-item"}
+
+
+def test_hashed_names_follow_content_and_outdated_hashes_still_resolve(tmp_path):
+    (tmp_path / "app.css").write_text("body { color: red; }" * 50)
+    first = assets.Manifest(str(tmp_path))
+    url_name = first.url_name("app.css")
+    assert re.fullmatch(r"app\.[0-9a-f]{12}\.css", url_name)
+    asset, current = first.lookup(url_name)
+    assert current and asset.mimetype == "text/css"
+    assert gzip.decompress(asset.variant("gzip")[0]) == asset.body
+    assert asset.variant("identity") == (asset.body, None)
+
+    (tmp_path / "app.css").write_text("body { color: blue; }")
+    second = assets.Manifest(str(tmp_path))
+    assert second.url_name("app.css") != url_name
+    stale, current = second.lookup(url_name)
+    assert stale.body == b"body { color: blue; }" and not current
+    assert second.lookup("other.0123456789ab.css") == (None, False)
+
+
+def test_accept_encoding_negotiation():
+    assert assets.choose_encoding("gzip, deflate, br", ("br", "gzip")) == "br"
+    assert assets.choose_encoding("gzip, br;q=0", ("br", "gzip")) == "gzip"
+    assert assets.choose_encoding("*", ("gzip",)) == "gzip"
+    assert assets.choose_encoding("identity", ("br", "gzip")) is None
+    assert assets.choose_encoding("", ("gzip",)) is None
+
+
+def _css_classes():
+    with open(os.path.join(PACKAGE, "static", "app.css")) as f:
+        css = f.read()
+    return {re.sub(r"\\(.)", r"\1", m) for m in re.findall(r"\.((?:\\.|[\w-])+)", css)}
+
+
+def test_every_template_class_and_icon_is_defined():
+    with open(os.path.join(PACKAGE, "app.py")) as f:
+        source = f.read()
+    used = set()
+    for value in re.findall(r'class="([^"]*)"', source):
+        # Literal classes plus the ones a template expression picks: {{ 'a b' if x else 'c' }}
+        used.update(re.sub(r"\{\{.*?\}\}|\{%.*?%\}", " ", value).split())
+        for expr in re.findall(r"\{\{(.*?)\}\}", value):
+            for literal in re.findall(r"'([^']*)' if|else '([^']*)'", expr):
+                used.update(" ".join(literal).split())
+    for name in os.listdir(os.path.join(PACKAGE, "static")):
+        if name.endswith(".js"):
+            with open(os.path.join(PACKAGE, "static", name)) as f:
+                script = f.read()
+            for call in re.findall(r"className = ([^;]*);|classList\.\w+\(([^)]*)\)", script):
+                for literal in re.findall(r"'([^']*)'", re.sub(r"===? '[^']*'", "", " ".join(call))):
+                    used.update(literal.split())
+    used = {c for c in used if re.fullmatch(r"[\w:/\[\].-]+", c)}  # not the icon() markup
+    assert sorted(used - _css_classes() - HOOK_CLASSES) == []
+
+    with open(os.path.join(PACKAGE, "static", "icons.svg")) as f:
+        symbols = set(re.findall(r'<symbol id="([\w-]+)"', f.read()))
+    icons = set()
+    for call in re.findall(r"icon\((.*?)(?:, '[^']*')?\)", source):
+        icons.update(re.findall(r"'([\w-]+)'", re.sub(r"== '[^']*'", "", call)))
+    assert icons and icons <= symbols
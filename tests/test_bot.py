@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime
+import importlib
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler
+
+# Import through the package (the name contains a hyphen)
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+bot = importlib.import_module("sms-dashboard.bot")
+routing = importlib.import_module("sms-dashboard.routing")
+sources = importlib.import_module("sms-dashboard.sources")
+InboxMessage = importlib.import_module("sms-dashboard.multipart").InboxMessage
+
+
+def _command(app, chat_id, text="/reply +15550001111 hi"):
+    return Update.de_json({
+        "update_id": 1,
+        "message": {
+            "message_id": 1, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "x"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }, app.bot)
+
+
+def test_commands_are_refused_outside_the_configured_chats(tmp_path, monkeypatch):
+    rules = tmp_path / "routing.json"
+    rules.write_text(json.dumps({"rules": [{"senders": ["+98*"], "chats": ["-1002", "@alerts"]}]}))
+    chats = bot.AuthorizedChats(routing.RouterFile(str(rules), ["100"]), ("100",))
+    monkeypatch.setattr(bot, "authorized_chats", chats)
+    app = Application.builder().token("1:test").build()
+    bot.add_handlers(app)
+    handlers = app.handlers[0]
+    reply = next(h for h in handlers if isinstance(h, CommandHandler) and "reply" in h.commands)
+    rejected = handlers[-1]
+
+    # The filters decide; the command name itself is matched against the bot's username
+    for chat_id in (100, -1002):
+        assert reply.filters.check_update(_command(app, chat_id))
+        assert not rejected.check_update(_command(app, chat_id))
+    stranger = _command(app, 555)
+    assert not any(h.filters.check_update(stranger) for h in handlers if isinstance(h, CommandHandler))
+    assert rejected.check_update(stranger)
+
+    # A chat added to the routing file is allowed once the file is reloaded
+    rules.write_text(json.dumps({"rules": [{"senders": ["+98*"], "chats": ["555"]}]}))
+    os.utime(rules, (1, 1))
+    assert reply.filters.check_update(_command(app, 555))
+
+
+class _Message:
+    """The parts of a Telegram message cmd_reply uses."""
+
+    def __init__(self, text, reply_to=None):
+        self.text = text
+        self.reply_to_message = SimpleNamespace(text=reply_to) if reply_to is not None else None
+        self.replies = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+
+def _reply(monkeypatch, text, reply_to=None):
+    sent = []
+    monkeypatch.setattr(bot.outbox, "send", lambda numbers, body, source_id: sent.append((numbers, body, source_id)) or (1, []))
+    message = _Message(text, reply_to)
+    asyncio.run(bot.cmd_reply(SimpleNamespace(effective_message=message), None))
+    return sent, message.replies
+
+
+def test_reply_to_a_notification_answers_its_sender(monkeypatch):
+    monkeypatch.delenv("CONTACTS_FILE", raising=False)
+    sims = [sources.Source(sid, "db", None, None, "smsd") for sid in ("sim1", "sim2")]
+    monkeypatch.setattr(sources, "all_sources", lambda: sims)
+    sms = InboxMessage(7, "+15550001111", "Your code is 1234\nVia: sim1", datetime(2026, 3, 1, 9, 30), "false", None)
+    sms.source = "sim2"
+    text = bot.notification_text(sms)
+    assert bot.notification_origin(text) == ("+15550001111", "sim2")
+
+    sent, _replies = _reply(monkeypatch, "/reply 1234 is the code", reply_to=text)
+    assert sent == [(["+15550001111"], "1234 is the code", "sim2")]
+    sent, _replies = _reply(monkeypatch, "/reply +15550002222 hello")
+    assert sent == [(["+15550002222"], "hello", None)]
+
+
+def test_reply_to_another_message_is_refused(monkeypatch):
+    sent, replies = _reply(monkeypatch, "/reply 1234 is the code", reply_to="just a chat message")
+    assert sent == [] and replies == [bot.REPLY_USAGE]
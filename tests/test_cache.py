@@ -0,0 +1,87 @@
+import os
+from importlib.machinery import SourceFileLoader
+
+import pytest
+
+# Load module directly from file because the package name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+MODULE_PATH = os.path.join(ROOT, "src", "sms-dashboard", "cache.py")
+cache = SourceFileLoader("cache", MODULE_PATH).load_module()
+
+
+class FakeRedis:
+    """Minimal local stand-in for a Redis client (get/set/incr)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = cache.SQLiteCache(path)
+    worker_b = cache.SQLiteCache(path)
+    worker_a.set("inbox:5", {"counts": {"total": 3}})
+    assert worker_b.get("inbox:5") == {"counts": {"total": 3}}
+
+
+def test_sqlite_invalidate_reaches_other_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = cache.SQLiteCache(path)
+    worker_b = cache.SQLiteCache(path)
+    worker_a.set("inbox:5", [1, 2, 3])
+    assert worker_b.invalidate() == 1
+    assert worker_a.get("inbox:5") is None
+    assert worker_a.version() == 1
+
+
+def test_sqlite_entries_expire(tmp_path):
+    c = cache.SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    c.set("k", "v", ttl=-1)
+    assert c.get("k", "miss") == "miss"
+
+
+def test_redis_cache_with_local_stand_in():
+    client = FakeRedis()
+    worker_a = cache.RedisCache(client=client)
+    worker_b = cache.RedisCache(client=client)
+    worker_a.set("inbox:1", "payload")
+    assert worker_b.get("inbox:1") == "payload"
+    worker_b.invalidate()
+    assert worker_a.get("inbox:1") is None
+
+
+def test_value_read_before_an_invalidation_is_not_stored(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = cache.SQLiteCache(path)
+    worker_b = cache.SQLiteCache(path)
+    generation = worker_a.version()  # A starts reading the inbox
+    worker_b.invalidate()  # B marks messages read meanwhile
+    worker_a.set("inbox:5", "stale page", version=generation)
+    assert worker_b.get("inbox:5") is None
+
+    client = FakeRedis()
+    worker_a, worker_b = cache.RedisCache(client=client), cache.RedisCache(client=client)
+    generation = worker_a.version()
+    worker_b.invalidate()
+    worker_a.set("inbox:5", "stale page", version=generation)
+    assert worker_b.get("inbox:5") is None
+
+
+def test_default_path_is_a_private_runtime_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache.tempfile, "gettempdir", lambda: str(tmp_path))
+    path = cache.default_cache_path()
+    assert path.startswith(str(tmp_path)) and not path.startswith(ROOT)
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    os.chmod(os.path.dirname(path), 0o777)
+    with pytest.raises(PermissionError):
+        cache.default_cache_path()
@@ -0,0 +1,91 @@
+import importlib
+import os
+import sys
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+contacts = importlib.import_module("sms-dashboard.contacts")
+conversations = importlib.import_module("sms-dashboard.conversations")
+routing = importlib.import_module("sms-dashboard.routing")
+
+VCARDS = """BEGIN:VCARD
+VERSION:3.0
+N:Rezaei;Ali;;;
+TEL;TYPE=CELL:0912 123 4567
+item1.TEL:+1 (555) 000-1111
+END:VCARD
+BEGIN:VCARD
+VERSION:2.1
+FN:Bank
+TEL;WORK:00989900000000
+END:VCARD
+"""
+
+GOOGLE_CSV = """Given Name,Family Name,Phone 1 - Type,Phone 1 - Value
+Sara,Karimi,Mobile,+98 935 111 2222 ::: 0935-111-3333
+"""
+
+
+def test_spellings_of_one_number_normalize_alike(monkeypatch):
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    for raw in ("+989121234567", "09121234567", "989121234567", "00989121234567", "+98 912-123-4567"):
+        assert contacts.normalize(raw) == "+989121234567"
+    assert contacts.normalize("BANK CO") == "BANKCO"
+    assert contacts.normalize("3000") == "3000"  # short code
+    assert contacts.spellings("0912 123 4567") == [
+        "09121234567", "+989121234567", "989121234567", "00989121234567",
+    ]
+    # Without a country code a national number cannot be told apart from a short one
+    monkeypatch.delenv("DEFAULT_COUNTRY_CODE")
+    assert contacts.normalize("09121234567") == "09121234567"
+
+
+def test_vcard_and_csv_exports_are_parsed(monkeypatch):
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    assert contacts.parse(VCARDS) == {
+        "+989121234567": "Ali Rezaei", "+15550001111": "Ali Rezaei", "+989900000000": "Bank",
+    }
+    assert contacts.parse(GOOGLE_CSV) == {"+989351112222": "Sara Karimi", "+989351113333": "Sara Karimi"}
+
+
+def test_directory_labels_keep_the_number_first(monkeypatch):
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    directory = contacts.Directory(contacts.parse(VCARDS))
+    assert directory.label("09121234567") == "+989121234567 (Ali Rezaei)"
+    assert directory.label("989350000000") == "+989350000000"
+    assert directory.label("BANKCO") == "BANKCO"
+    assert directory.name("+1 555 000 1111") == "Ali Rezaei"
+
+
+def test_import_merges_and_the_file_is_reloaded(tmp_path, monkeypatch):
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    monkeypatch.setattr(contacts, "RELOAD_CHECK_SECONDS", 0)
+    vcf, target = tmp_path / "phone.vcf", tmp_path / "contacts.csv"
+    vcf.write_text(VCARDS)
+    assert contacts.import_files([str(vcf)], str(target)) == (3, 0)
+    shared = contacts.ContactsFile(str(target))
+    assert shared.current().name("09121234567") == "Ali Rezaei"
+
+    vcf.write_text(VCARDS.replace("N:Rezaei;Ali;;;", "FN:Ali R."))
+    assert contacts.import_files([str(vcf)], str(target)) == (0, 2)
+    os.utime(target, (1, 1))
+    assert shared.current().name("09121234567") == "Ali R."
+    assert contacts.ContactsFile(None).current().name("09121234567") is None
+
+
+def test_conversations_and_routing_treat_spellings_as_one_sender(monkeypatch):
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    monkeypatch.delenv("CONTACTS_FILE", raising=False)
+    entry = {"last_id": 1, "last_activity": "2026-03-01T09:00:00", "last_text": "a", "total": 2, "unread": 1}
+    merged = conversations.merge([
+        [dict(entry, sender="09121234567")],
+        [dict(entry, sender="+989121234567", last_id=7, last_activity="2026-03-02T09:00:00", last_text="b")],
+    ])
+    assert len(merged) == 1
+    assert (merged[0]["sender"], merged[0]["total"], merged[0]["last_text"]) == ("+989121234567", 4, "b")
+    assert merged[0]["numbers"] == ["09121234567", "+989121234567"]
+
+    router = routing.parse({"rules": [{"senders": ["0912*"], "chats": ["mine"]}], "default": []})
+    assert router.route("+989121234567", "hi") == ["mine"]
+    assert router.route("989121234567", "hi") == ["mine"]
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+import importlib
+import os
+import sys
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+conversations = importlib.import_module("sms-dashboard.conversations")
+InboxMessage = importlib.import_module("sms-dashboard.multipart").InboxMessage
+
+
+def test_deltas_count_messages_and_pick_newest_preview():
+    base = datetime(2026, 3, 1, 9, 30)
+    rows = [
+        InboxMessage(1, "+111", "Part1-", base, "false", "0003A40201"),
+        InboxMessage(2, "+111", "Part2", base + timedelta(seconds=1), "false", "0003A40202"),
+        InboxMessage(3, "+222", "Hi", base - timedelta(hours=1), "true", None),
+    ]
+    deltas = conversations.compute_deltas(rows)
+    counts, newest = deltas["+111"]
+    assert counts == [1, 1]
+    assert newest.ID == 2
+    assert deltas["+222"][0] == [1, 0]
+
+
+def test_merge_combines_senders_across_sources():
+    sim1 = [{"sender": "+111", "last_id": 5, "last_activity": "2026-03-01T09:00:00", "last_text": "old", "total": 2, "unread": 1}]
+    sim2 = [
+        {"sender": "+111", "last_id": 9, "last_activity": "2026-03-02T10:00:00", "last_text": "new", "total": 1, "unread": 1},
+        {"sender": "+222", "last_id": 3, "last_activity": "2026-03-01T12:00:00", "last_text": "hi", "total": 1, "unread": 0},
+    ]
+    merged = conversations.merge([sim1, sim2])
+    assert [c["sender"] for c in merged] == ["+111", "+222"]
+    assert merged[0]["total"] == 3 and merged[0]["unread"] == 2
+    assert merged[0]["last_text"] == "new"
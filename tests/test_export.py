@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+import gzip
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+export = importlib.import_module("sms-dashboard.export")
+InboxMessage = importlib.import_module("sms-dashboard.multipart").InboxMessage
+
+BASE = datetime(2026, 3, 1, 9, 0)
+
+
+def _row(id_, text, minutes, udh=None, sender="+111"):
+    m = InboxMessage(id_, sender, text, BASE + timedelta(minutes=minutes), "false", udh)
+    m.source = "default"
+    return m
+
+
+def test_stream_assembles_groups_in_first_part_order():
+    rows = [
+        _row(1, "Hello ", 0, "050003A40201"),
+        _row(2, "single", 1, sender="+222"),
+        _row(3, "world", 2, "050003A40202"),
+        _row(4, "after", 3, sender="+222"),
+    ]
+    out = list(export.assemble_stream(rows))
+    assert [(m.TextDecoded, m.ids) for m in out] == [
+        ("Hello world", (1, 3)), ("single", (2,)), ("after", (4,)),
+    ]
+
+
+def test_sender_filter_and_groups_cover_every_spelling(monkeypatch):
+    monkeypatch.delenv("CONTACTS_FILE", raising=False)
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    where, params = export.build_filter(sender="09121234567")
+    assert where == "1 = 1 AND SenderNumber IN (%s, %s, %s, %s)"
+    assert sorted(params) == sorted(["09121234567", "+989121234567", "989121234567", "00989121234567"])
+    rows = [_row(1, "Hello ", 0, "050003A40201", sender="09121234567"),
+            _row(2, "world", 1, "050003A40202", sender="+989121234567")]
+    assert [(m.TextDecoded, m.ids) for m in export.assemble_stream(rows)] == [("Hello world", (1, 2))]
+
+
+def test_incomplete_group_is_released_after_the_window():
+    rows = [_row(1, "Part one ", 0, "050003A40301")] + [_row(10 + i, f"s{i}", 20 + i) for i in range(3)]
+    out = list(export.assemble_stream(iter(rows), window=timedelta(minutes=10)))
+    assert [m.TextDecoded for m in out] == ["Part one", "s0", "s1", "s2"]
+
+
+def test_render_ndjson_gzip_round_trip():
+    body = b"".join(export.render([_row(1, "hi", 0)], fmt="ndjson", compress=True))
+    record = json.loads(gzip.decompress(body).decode("utf-8"))
+    assert record["TextDecoded"] == "hi" and record["ref"] == "default:1"
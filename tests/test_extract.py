@@ -0,0 +1,43 @@
+import importlib
+import os
+import sys
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+extract = importlib.import_module("sms-dashboard.extract")
+multipart = importlib.import_module("sms-dashboard.multipart")
+
+
+def test_codes_need_context_and_skip_amounts_dates_and_links():
+    assert extract.scan("Your verification code is 482913.").codes == ("482913",)
+    assert extract.scan("کد تایید شما: ۱۲۳۴۵۶").codes == ("123456",)
+    assert extract.scan("G-123 456 is your Google verification code").codes == ("123456",)
+    assert extract.scan("Your PIN is 1234, valid for 5 minutes").codes == ("1234",)
+    assert extract.scan("Meeting code at 10:30 on 2026/05/01").codes == ()
+    assert extract.scan("Order 483920 has shipped").codes == ()  # no code keyword
+    found = extract.scan("Code 7788 to pay $25.50 at https://pay.example.com/x?id=9999.")
+    assert found.codes == ("7788",)
+    assert found.amounts == ("$25.50",)
+    assert found.links == ("https://pay.example.com/x?id=9999",)
+
+
+def test_amounts_need_a_currency():
+    found = extract.scan("Withdrawal 1,250,000 Rials from 6037-9912. Balance: ۳٬۰۰۰٬۰۰۰ IRR")
+    assert found.amounts == ("1,250,000 Rials", "3,000,000 IRR")
+    assert extract.scan("Total 15000 تومان").amounts == ("15000 تومان",)
+    assert not extract.scan("Call me at 5 pm")
+    assert extract.scan("").to_json() == {"codes": [], "amounts": [], "links": []}
+
+
+def test_messages_are_scanned_once(monkeypatch):
+    scanned = []
+    monkeypatch.setattr(extract, "_memo", extract.OrderedDict())
+    monkeypatch.setattr(extract, "scan", lambda text, scan=extract.scan: scanned.append(text) or scan(text))
+    message = multipart.InboxMessage(5, "+1", "OTP 1234", None, "false", source="sim1")
+    assert extract.extract(message).codes == ("1234",)
+    assert extract.extract(message).codes == ("1234",)
+    assert scanned == ["OTP 1234"]
+    # More parts of the same message are a new text
+    extract.extract(multipart.InboxMessage(5, "+1", "OTP 1234 ok", None, "false", part_ids=(4, 5), source="sim1"))
+    assert len(scanned) == 2
@@ -0,0 +1,77 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+storage = importlib.import_module("sms-dashboard.storage")
+sources = importlib.import_module("sms-dashboard.sources")
+indexes = importlib.import_module("sms-dashboard.indexes")
+
+from .test_storage import GAMMU_SCHEMA
+
+
+@pytest.fixture
+def sqlite_inbox(tmp_path, monkeypatch):
+    path = str(tmp_path / "smsd.db")
+    storage.sqlite_connect(path).raw.executescript(GAMMU_SCHEMA)
+    monkeypatch.setenv("DB_DRIVER", "sqlite")
+    monkeypatch.setenv("DB_PATH", path)
+    monkeypatch.delenv("DB_SOURCES", raising=False)
+    monkeypatch.setattr(sources, "_sources", None)
+    return sources.get_db_connection()
+
+
+def test_stock_schema_is_reported_then_fixed(sqlite_inbox, capsys):
+    results, existing = indexes.analyze(sqlite_inbox)
+    bad = {s.name: found for s, _plan, found in results if found}
+    assert "full table scan" in bad["messages page"] and "filesort" in bad["messages page"]
+    assert "bot unread poll" in bad and "stats sync" not in bad
+    assert len(indexes.missing_ddl(sqlite_inbox, existing)) == len(indexes.RECOMMENDED)
+
+    assert indexes.check() == 1
+    assert indexes.apply(dry_run=True) == 0
+    assert indexes.existing_indexes(sqlite_inbox) == {}
+    assert indexes.apply() == 0
+    assert indexes.check() == 0
+    assert indexes.missing_ddl(sqlite_inbox, indexes.existing_indexes(sqlite_inbox)) == []
+    capsys.readouterr()
+    indexes.apply()
+    assert "nothing to do" in capsys.readouterr().out
+
+
+def test_existing_index_covers_recommendation_through_implicit_id():
+    covering = indexes.resolve({"by_time": ("ReceivingDateTime",), "by_sender": ("SenderNumber",)})
+    assert covering["idx_inbox_time"] == "by_time"
+    assert covering["idx_inbox_sender_time"] is None
+
+
+class _ExplainCursor:
+    description = [(c,) for c in ("id", "select_type", "table", "type", "key", "rows", "Extra")]
+
+    def __init__(self, rows):
+        self.rows, self.executed = rows, []
+
+    def execute(self, sql, params=()):
+        self.executed.append(sql)
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_mysql_explain_rows_are_parsed():
+    cursor = _ExplainCursor([(1, "SIMPLE", "inbox", "ALL", None, 120000, "Using where; Using filesort")])
+    plan = indexes._explain_mysql(cursor, "SELECT 1 FROM inbox", ())
+    assert cursor.executed == ["EXPLAIN SELECT 1 FROM inbox"]
+    assert (plan.full_scan, plan.filesort, plan.keys, plan.rows) == (True, True, (), 120000)
+
+    cursor = _ExplainCursor([(1, "SIMPLE", "inbox", "range", "idx_inbox_time", 50, "Using where")])
+    plan = indexes._explain_mysql(cursor, "SELECT 1 FROM inbox", ())
+    statement = indexes.Statement("page", "SELECT 1", index="idx_inbox_time")
+    assert indexes.problems(statement, plan, {"idx_inbox_time": "idx_inbox_time"}) == []
+    assert indexes.problems(statement, plan, {"idx_inbox_time": "by_time"}) == ["does not use by_time"]
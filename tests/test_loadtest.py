@@ -0,0 +1,64 @@
+import importlib
+import json
+import os
+import sys
+import urllib.request
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("dotenv")
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+loadtest = importlib.import_module("sms-dashboard.loadtest")
+
+
+def test_percentiles_and_baseline_comparison():
+    report = loadtest.summarize([i / 1000 for i in range(1, 101)], errors=2, elapsed=10)
+    assert (report["p50_ms"], report["p95_ms"], report["p99_ms"]) == (50.0, 95.0, 99.0)
+    assert report["throughput"] == 10.0
+    baseline = {"index": {"p95_ms": 70.0}, "gone": {"p95_ms": 1.0}}
+    assert loadtest.compare({"index": report}, baseline, tolerance=0.5) == []
+    assert loadtest.compare({"index": report}, baseline, tolerance=0.2) == [
+        "index: p95 95.0 ms vs baseline 70.0 ms"
+    ]
+
+
+def test_fake_telegram_records_sent_messages():
+    fake = loadtest.FakeTelegram()
+    fake.start()
+    try:
+        request = urllib.request.Request(
+            f"{fake.url}/bot{loadtest.FAKE_TOKEN}/sendMessage",
+            data=json.dumps({"chat_id": 1, "text": "New SMS from: +1"}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            body = json.load(resp)
+        assert body["ok"] and body["result"]["message_id"] == 1
+        assert [text for _at, text in fake.sent] == ["New SMS from: +1"]
+    finally:
+        fake.shutdown()
+
+
+def test_fake_telegram_hands_out_queued_commands_until_confirmed():
+    fake = loadtest.FakeTelegram()
+    fake.push_command("/stats")
+    fake.push_command("/search code")
+    first, second = fake.take_updates(0)
+    assert first["message"]["text"] == "/stats"
+    assert second["message"]["entities"] == [{"type": "bot_command", "offset": 0, "length": 7}]
+    # getUpdates with offset = last id + 1 confirms them
+    assert fake.take_updates(second["update_id"] + 1) == []
+    fake.server_close()
+
+
+def test_synthetic_rows_are_reproducible():
+    import random
+
+    rows = loadtest.synthetic_rows(1000, rng=random.Random(3))
+    assert len(rows) >= 1000
+    assert rows == loadtest.synthetic_rows(1000, rng=random.Random(3))
+    assert any(udh for _t, _s, udh, _x, _p in rows)
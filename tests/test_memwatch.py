@@ -0,0 +1,44 @@
+import importlib
+import os
+import sys
+import tracemalloc
+
+# Import through the package (the name contains a hyphen)
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+memwatch = importlib.import_module("sms-dashboard.memwatch")
+
+_hoard = []
+
+
+def _leak(n):
+    _hoard.extend(f"leaked-{i}" * 10 for i in range(n))
+
+
+def test_growth_ignores_warmup_and_single_spikes():
+    assert memwatch.growth([100, 100, 110, 900, 100, 110, 100, 100]) == 0
+    assert memwatch.growth([100, 100, 200, 300, 400, 500], warmup=2) == 300
+    assert memwatch.growth([5]) == 0
+
+
+def test_growing_site_is_reported():
+    watch = memwatch.MemoryWatch(top=3)
+    try:
+        watch.start()
+        _leak(20000)
+        sample = watch.sample()
+    finally:
+        tracemalloc.stop()
+        _hoard.clear()
+    site, size, count = sample.top[0]
+    assert site.startswith(__file__.rstrip("c")) and size > 1024 * 1024 and count >= 20000
+    assert sample.rss > 0 and sample.traced > 0
+    report = "\n".join(watch.report())
+    assert "tests/test_memwatch.py" in report and "2 sample(s)" in report
+
+
+def test_status_without_diagnostics(monkeypatch):
+    monkeypatch.delenv("MEMORY_DIAGNOSTICS", raising=False)
+    assert memwatch.from_env() is None
+    text = memwatch.status(None, {"extraction memo": 3})
+    assert "extraction memo 3" in text and "MEMORY_DIAGNOSTICS=1" in text
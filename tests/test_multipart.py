@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta
+import importlib
 import os
-from importlib.machinery import SourceFileLoader
+import sys
 
-# Load module directly from file because the package name contains a hyphen
+# Import through the package (the module uses relative imports); the name contains a hyphen
 ROOT = os.path.dirname(os.path.dirname(__file__))
-MODULE_PATH = os.path.join(ROOT, "src", "sms-dashboard", "multipart.py")
-multipart = SourceFileLoader("multipart", MODULE_PATH).load_module()
+sys.path.insert(0, os.path.join(ROOT, "src"))
+multipart = importlib.import_module("sms-dashboard.multipart")
 assemble_inbox_rows = multipart.assemble_inbox_rows
 
 
@@ -70,3 +71,96 @@ def test_discard_when_combined_is_empty():
     part2 = {"ID": 31, "SenderNumber": "+333", "TextDecoded": "\t", "ReceivingDateTime": base, "Processed": "true", "UDH": "0003A40102"}
     out = assemble_inbox_rows([part1, part2])
     assert out == []
+
+
+def test_tuple_rows_are_converted_to_slotted_messages():
+    base = datetime.now()
+    rows = [
+        (40, "+444", "Part1-", base, "true", "0003B70201"),
+        (41, "+444", "Part2", base + timedelta(seconds=1), "false", "0003B70202"),
+        (42, "+555", "Single", base - timedelta(seconds=5), "true", None),
+    ]
+    out = assemble_inbox_rows(multipart.to_messages(rows))
+    assert [m.ID for m in out] == [41, 42]
+    assert all(isinstance(m, multipart.InboxMessage) for m in out)
+    assert not hasattr(out[0], "__dict__")
+    assert out[0].TextDecoded == "Part1-Part2"
+    assert out[0].is_unread
+    assert out[0].ids == (40, 41)
+    assert out[1].ids == (42,)
+    # Mapping-style access stays available for templates and older callers
+    assert out[1]["SenderNumber"] == "+555"
+    assert out[1].get("_part_ids") is None
+
+
+def test_blank_single_rows_are_dropped():
+    base = datetime.now()
+    rows = [(50, "+666", " \n", base, "false", None), (51, "+666", "Hi", base, "false", None)]
+    assert [m.ID for m in assemble_inbox_rows(rows)] == [51]
+
+
+def test_reused_reference_is_split_by_sequence_and_time():
+    base = datetime(2026, 1, 1, 12, 0)
+    rows = [
+        # Two messages with the same 8-bit reference, parts interleaved
+        (60, "+777", "A1-", base, "true", "0003100201"),
+        (61, "+777", "B1-", base + timedelta(seconds=1), "true", "0003100201"),
+        (62, "+777", "A2", base + timedelta(seconds=2), "true", "0003100202"),
+        (63, "+777", "B2", base + timedelta(seconds=3), "true", "0003100202"),
+        # The reference wrapped around days later; only its first part arrived
+        (64, "+777", "C1-", base + timedelta(days=2), "false", "0003100201"),
+        # Same reference but a different part count is another message
+        (65, "+777", "D1-", base + timedelta(seconds=4), "true", "0003100301"),
+    ]
+    out = {m.TextDecoded: m.ids for m in assemble_inbox_rows(rows)}
+    assert out == {"A1-A2": (60, 62), "B1-B2": (61, 63), "C1-": (64,), "D1-": (65,)}
+
+
+def test_parts_outside_the_window_are_not_merged():
+    base = datetime(2026, 1, 1, 12, 0)
+    rows = [
+        (70, "+888", "Old1-", base, "true", "0003200201"),
+        (71, "+888", "New2", base + multipart.GROUP_WINDOW + timedelta(seconds=1), "true", "0003200202"),
+    ]
+    assert sorted(m.ids for m in assemble_inbox_rows(rows)) == [(70,), (71,)]
+
+
+def make_colliding_inbox(messages, senders=5, seed=7):
+    """
+    Multipart messages from a few senders cycling through only two references,
+    so the same (sender, ref, count) recurs constantly, often while an earlier
+    message's parts are still arriving. Rows are shuffled.
+    """
+    import random
+
+    rng = random.Random(seed)
+    base = datetime(2026, 1, 1)
+    rows, expected, next_id = [], {}, 1
+    for n in range(messages):
+        sender = f"+98{n % senders:04d}"
+        ref, total = rng.randrange(2), rng.choice((2, 3))
+        start = base + timedelta(seconds=20 * n)
+        ids = []
+        for seq in range(1, total + 1):
+            udh = f"0003{ref:02X}{total:02X}{seq:02X}"
+            # Parts a minute apart: the next message of the sender starts before this one ends
+            rows.append((next_id, sender, f"m{n}p{seq} ", start + timedelta(minutes=seq), "true", udh))
+            ids.append(next_id)
+            next_id += 1
+        expected[tuple(ids)] = n
+    rng.shuffle(rows)
+    return rows, expected
+
+
+def test_assembly_at_scale_with_reference_collisions():
+    # MULTIPART_BENCH_ROWS=1000000 turns this into the full benchmark
+    import time
+
+    target = int(os.environ.get("MULTIPART_BENCH_ROWS", "20000"))
+    rows, expected = make_colliding_inbox(target * 2 // 5)  # 2.5 parts per message
+    started = time.perf_counter()
+    out = assemble_inbox_rows(multipart.to_messages(rows))
+    elapsed = time.perf_counter() - started
+    print(f"\nassembled {len(rows)} rows into {len(out)} messages in {elapsed:.2f}s")
+    assert len(out) == len(expected)
+    assert all(tuple(sorted(m.ids)) in expected for m in out)
@@ -0,0 +1,51 @@
+import importlib
+import os
+import sys
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+notifier = importlib.import_module("sms-dashboard.notifier")
+
+
+class FakeLease:
+    """Just enough of a connection to run acquire() against one lease row."""
+
+    def __init__(self, holder="", token=0, live=False):
+        self.row = [holder, token, live]
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.sql, self.params = sql, params
+        if sql.lstrip().startswith("UPDATE"):
+            holder, token, _seconds, _name = params
+            self.row = [holder, token, True]
+
+    def fetchone(self):
+        if "@@hostname" in self.sql:
+            return ("db:3306/smsd",)
+        return tuple(self.row)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_lease_terms_and_standby():
+    conn = FakeLease()
+    first = notifier.acquire(conn, holder="a")
+    assert first == 1
+    # Renewal keeps the term; another replica stands by while it is live
+    assert notifier.acquire(conn, holder="a") == first
+    assert notifier.acquire(conn, holder="b") is None
+    # Once expired, the next holder starts a new term and fences off the old one
+    conn.row[2] = False
+    assert notifier.acquire(conn, holder="b") == first + 1
@@ -0,0 +1,52 @@
+from datetime import date, datetime, timedelta
+import importlib
+import os
+import sys
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+rollups = importlib.import_module("sms-dashboard.rollups")
+InboxMessage = importlib.import_module("sms-dashboard.multipart").InboxMessage
+
+
+def test_deltas_per_hour_with_totals_row_and_day_folding():
+    t = datetime(2026, 3, 1, 9, 30)
+    rows = [
+        InboxMessage(1, "+111", "Part1-", t, "false", "0003A40201"),
+        InboxMessage(2, "+111", "Part2", t + timedelta(hours=1), "false", "0003A40202"),
+        InboxMessage(3, "+111", "Seen", t + timedelta(minutes=20), "true", None),
+        InboxMessage(4, "+222", "Later", t + timedelta(hours=1), "false", None),
+    ]
+    nine, ten = datetime(2026, 3, 1, 9), datetime(2026, 3, 1, 10)
+    deltas = rollups.compute_deltas(rows)
+    assert deltas == {
+        ("+111", nine): [2, 1],
+        ("*", nine): [2, 1],
+        ("+222", ten): [1, 1],
+        ("*", ten): [1, 1],
+    }
+    assert rollups.daily(deltas) == {("+111", date(2026, 3, 1)): [2, 1], ("+222", date(2026, 3, 1)): [1, 1],
+                                     ("*", date(2026, 3, 1)): [3, 2]}
+    # Marking read only moves unread; deleting moves both
+    assert rollups.compute_deltas(rows[2:], sign=-1, unread_only=True) == {("+222", ten): [0, -1], ("*", ten): [0, -1]}
+    assert rollups.compute_deltas(rows[2:3], sign=-1) == {("+111", nine): [-1, 0], ("*", nine): [-1, 0]}
+
+
+def test_window_and_combine_fill_empty_buckets(monkeypatch):
+    monkeypatch.delenv("CONTACTS_FILE", raising=False)
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    start, end = rollups.window("hour", 3, now=datetime(2026, 3, 1, 10, 45))
+    assert (start, end) == (datetime(2026, 3, 1, 8), datetime(2026, 3, 1, 11))
+    assert rollups.window("day", 10_000, now=datetime(2026, 3, 1, 10))[0] == date(2026, 3, 2) - timedelta(
+        days=rollups.MAX_BUCKETS["day"])
+
+    sim1 = ({datetime(2026, 3, 1, 8): [4, 1]}, [{"sender": "09121234567", "total": 4, "unread": 1}])
+    sim2 = ({datetime(2026, 3, 1, 8): [1, 0], datetime(2026, 3, 1, 10): [2, 2]},
+            [{"sender": "+989121234567", "total": 1, "unread": 0}, {"sender": "BANK", "total": 2, "unread": 2}])
+    out = rollups.combine([sim1, sim2], "hour", start, end)
+    assert [(b["t"], b["total"], b["read"]) for b in out["buckets"]] == [
+        ("2026-03-01T08:00:00", 5, 4), ("2026-03-01T09:00:00", 0, 0), ("2026-03-01T10:00:00", 2, 0),
+    ]
+    assert out["total"] == 7
+    assert [(s["sender"], s["total"]) for s in out["top_senders"]] == [("+989121234567", 5), ("BANK", 2)]
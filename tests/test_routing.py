@@ -0,0 +1,84 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+routing = importlib.import_module("sms-dashboard.routing")
+
+CONFIG = {
+    "default": ["main"],
+    "rules": [
+        {"name": "otp", "regex": r"(?i)(code|otp)\D*\d{4,8}", "chats": ["otp"], "stop": True},
+        {"name": "bank", "senders": ["BANKCO", "+98912*"], "keywords": ["Withdrawal", "deposit"],
+         "chats": ["bank"]},
+        {"name": "bank-copy", "senders": ["bankco"], "chats": ["audit", "bank"]},
+        {"name": "ads", "senders": ["+98 990*"], "chats": [], "stop": True},
+        {"name": "ads-fallback", "senders": ["+98990*"], "chats": ["never"]},
+    ],
+}
+
+
+def test_required_literal_is_conservative():
+    assert routing.required_literal(r"Your code is \d+") == "your code is "
+    assert routing.required_literal(r"ab?cdef") == "cdef"
+    assert routing.required_literal(r"x\.y{2}z") == "x."
+    assert routing.required_literal(r"(?i)(code|otp)\D*\d{4,8}") == ""
+    assert routing.required_literal(r"deposit|withdrawal") == ""
+    assert routing.required_literal(r"[abc]+ refund") == " refund"
+
+
+def test_automaton_finds_overlapping_words():
+    automaton = routing._Automaton()
+    for word in ("he", "she", "hers", "his"):
+        automaton.add(word, word)
+    automaton.build()
+    assert automaton.search("ushers") == {"he", "she", "hers"}
+    assert automaton.search("xyz") == set()
+
+
+def test_routes_follow_rule_order_and_stop():
+    router = routing.parse(CONFIG)
+    # Matches otp and stops before the bank rules
+    assert router.route("BANKCO", "Your OTP: 123456") == ["otp"]
+    # Sender and keyword must both hold; chats are merged without duplicates
+    assert router.route("bankco", "DEPOSIT of 100") == ["bank", "audit"]
+    assert router.route("+98-912-555-0000", "withdrawal 5") == ["bank"]
+    assert router.route("+98912", "hello") == ["main"]  # sender only: the keyword is missing
+    # A stopping rule without chats mutes
+    assert router.route("+98990123", "Sale!") == []
+    assert router.route("+1555", "hello") == ["main"]
+
+
+def test_default_falls_back_to_the_configured_chat():
+    assert routing.parse({"rules": []}, ["env-chat"]).route("+1", "x") == ["env-chat"]
+    assert routing.parse({"default": [], "rules": []}, ["env-chat"]).route("+1", "x") == []
+    catch_all = routing.parse({"rules": [{"chats": ["all"]}]}, ["env-chat"])
+    assert catch_all.route("+1", "x") == ["all"]
+
+
+def test_invalid_configs_are_rejected():
+    with pytest.raises(ValueError):
+        routing.parse({"rules": [{"name": "x", "senders": ["+1"]}]})  # no chats
+    with pytest.raises(ValueError):
+        routing.parse({"rules": [{"name": "x", "regex": "(", "chats": []}]})
+    with pytest.raises(ValueError):
+        routing.parse({"rules": [{"name": "x", "sender": "+1", "chats": []}]})
+
+
+def test_router_file_reloads_and_keeps_rules_on_errors(tmp_path):
+    path = tmp_path / "routing.json"
+    path.write_text(json.dumps(CONFIG))
+    rules = routing.RouterFile(str(path), ["env-chat"])
+    assert rules.current().route("+1", "hi") == ["main"]
+    path.write_text("{not json")
+    os.utime(path, (1, 1))
+    assert rules.current().route("+1", "hi") == ["main"]
+    path.write_text(json.dumps({"rules": []}))
+    os.utime(path, (2, 2))
+    assert rules.current().route("+1", "hi") == ["env-chat"]
+    assert routing.RouterFile(None, ["env-chat"]).current().route("+1", "hi") == ["env-chat"]
@@ -0,0 +1,88 @@
+import importlib
+import os
+import sys
+import time
+
+import pytest
+
+# Import through the package (the name contains a hyphen)
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+run_production = importlib.import_module("sms-dashboard.run_production")
+
+# Touches HEALTH_FILE like the bot's poll loop, and exits when asked to stop
+BEATING = (
+    "import os, signal, sys, time\n"
+    "signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))\n"
+    "while True:\n"
+    "    open(os.environ['HEALTH_FILE'], 'a').close(); os.utime(os.environ['HEALTH_FILE']); time.sleep(0.05)\n"
+)
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    monkeypatch.setattr(run_production, "HEALTH_INTERVAL", 0.0)
+    monkeypatch.setattr(run_production, "START_TIMEOUT", 5.0)
+    monkeypatch.setattr(run_production, "STOP_TIMEOUT", 5.0)
+
+
+def _run_until(supervisor, condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        supervisor.tick(time.monotonic())
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError("condition not reached")
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert [run_production.backoff(n) for n in range(4)] == [1.0, 2.0, 4.0, 8.0]
+    assert run_production.backoff(50) == run_production.RESTART_BACKOFF_MAX
+
+
+def test_crashed_child_is_restarted_and_the_others_keep_running(fast):
+    crashing = run_production.Service("crashing", [sys.executable, "-c", "import sys; sys.exit(3)"],
+                                      lambda p: True)
+    steady = run_production.Service("steady", [sys.executable, "-c", BEATING], run_production.heartbeat_probe)
+    supervisor = run_production.Supervisor([crashing, steady])
+    try:
+        _run_until(supervisor, lambda: supervisor.restarts["crashing"] == 1)
+        first_steady = supervisor.current["steady"]
+        assert supervisor.current["crashing"] is None
+        assert supervisor.restart_at["crashing"] > time.monotonic()  # waiting out the backoff
+        _run_until(supervisor, lambda: supervisor.restarts["crashing"] == 2)
+        assert supervisor.current["steady"] is first_steady
+        assert first_steady.popen.poll() is None and first_steady.healthy
+    finally:
+        supervisor.stop()
+
+
+def test_reload_stops_the_old_process_only_once_the_new_one_is_healthy(fast):
+    bot = run_production.Service("bot", [sys.executable, "-c", BEATING], run_production.heartbeat_probe)
+    supervisor = run_production.Supervisor([bot])
+    try:
+        _run_until(supervisor, lambda: supervisor.current["bot"] is not None and supervisor.current["bot"].healthy)
+        old = supervisor.current["bot"]
+        supervisor.reload_requested = True
+        supervisor.tick(time.monotonic())
+        assert "bot" in supervisor.pending and old.popen.poll() is None
+        _run_until(supervisor, lambda: supervisor.current["bot"] is not old and not supervisor.retiring)
+        assert old.popen.returncode == 0  # stopped gracefully
+        assert supervisor.current["bot"].popen.poll() is None
+    finally:
+        supervisor.stop()
+
+
+def test_failed_replacement_keeps_the_old_process(fast):
+    bot = run_production.Service("bot", [sys.executable, "-c", BEATING], run_production.heartbeat_probe)
+    supervisor = run_production.Supervisor([bot])
+    try:
+        _run_until(supervisor, lambda: supervisor.current["bot"] is not None and supervisor.current["bot"].healthy)
+        old = supervisor.current["bot"]
+        bot.cmd = [sys.executable, "-c", "raise SystemExit(1)"]  # a broken deploy
+        supervisor.reload_requested = True
+        _run_until(supervisor, lambda: "bot" not in supervisor.pending and supervisor._started == 2)
+        assert supervisor.current["bot"] is old and old.popen.poll() is None
+    finally:
+        supervisor.stop()
@@ -0,0 +1,32 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+search = importlib.import_module("sms-dashboard.search")
+
+
+def test_numbers_search_by_sender(monkeypatch):
+    monkeypatch.delenv("DEFAULT_COUNTRY_CODE", raising=False)
+    assert search.parse_query("+1 555-123 4567") == (
+        ["SenderNumber = %s"] * 3, [["+15551234567"], ["15551234567"], ["0015551234567"]]
+    )
+    # Every spelling of one number, each its own index range
+    monkeypatch.setenv("DEFAULT_COUNTRY_CODE", "98")
+    _where, params = search.parse_query("0912 123 4567")
+    assert params == [["09121234567"], ["+989121234567"], ["989121234567"], ["00989121234567"]]
+
+
+def test_text_uses_fulltext_when_indexed(monkeypatch):
+    monkeypatch.setattr(search, "fulltext_available", lambda: True)
+    assert search.parse_query("invoice march") == (
+        "MATCH(TextDecoded) AGAINST (%s IN BOOLEAN MODE)", ["+invoice* +march*"],
+    )
+    # Words below the InnoDB token size cannot be found through the index
+    assert search.parse_query("50% off") == ("TextDecoded LIKE %s ESCAPE '!'", ["%50!% off%"])
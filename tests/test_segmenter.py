@@ -0,0 +1,44 @@
+import importlib
+import os
+import sys
+
+# Import through the package (the name contains a hyphen)
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+segmenter = importlib.import_module("sms-dashboard.segmenter")
+multipart = importlib.import_module("sms-dashboard.multipart")
+
+
+def test_single_gsm7_message_has_no_udh():
+    coding, parts = segmenter.segment("x" * 160)
+    assert coding == segmenter.GSM7_CODING
+    assert parts == [segmenter.Segment(None, "x" * 160)]
+
+
+def test_long_gsm7_message_is_split_with_concat_udh():
+    text = "a" * 153 + "b" * 153 + "c"
+    coding, parts = segmenter.segment(text, ref=0xA4)
+    assert coding == segmenter.GSM7_CODING
+    assert [p.text for p in parts] == ["a" * 153, "b" * 153, "c"]
+    assert [multipart._parse_udh_concat(p.udh) for p in parts] == [(0xA4, 3, 1), (0xA4, 3, 2), (0xA4, 3, 3)]
+    assert "".join(p.text for p in parts) == text
+
+
+def test_extended_characters_count_double_and_are_not_split():
+    # 152 septets + '€' (2 septets) does not fit a 153-septet part
+    coding, parts = segmenter.segment("a" * 152 + "€" + "b" * 10, ref=1)
+    assert coding == segmenter.GSM7_CODING
+    assert [p.text for p in parts] == ["a" * 152, "€" + "b" * 10]
+
+
+def test_non_gsm_text_uses_ucs2_limits():
+    assert segmenter.count_parts("سلام" * 17) == (segmenter.UCS2_CODING, 1)  # 68 chars
+    coding, parts = segmenter.segment("س" * 140, ref=7)
+    assert coding == segmenter.UCS2_CODING
+    assert [len(p.text) for p in parts] == [67, 67, 6]
+
+
+def test_surrogate_pairs_stay_in_one_part():
+    coding, parts = segmenter.segment("x" * 66 + "😀" + "y" * 10, ref=2)
+    assert coding == segmenter.UCS2_CODING
+    assert [p.text for p in parts] == ["x" * 66, "😀" + "y" * 10]
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sources = importlib.import_module("sms-dashboard.sources")
+InboxMessage = importlib.import_module("sms-dashboard.multipart").InboxMessage
+
+
+def _msg(id_, source, seconds):
+    m = InboxMessage(id_, "+111", f"m{id_}", datetime(2026, 3, 1) + timedelta(seconds=seconds), "false", None)
+    m.source = source
+    return m
+
+
+def test_k_way_merge_orders_by_time_then_source():
+    sim1 = [_msg(3, "sim1", 30), _msg(2, "sim1", 10)]
+    sim2 = [_msg(7, "sim2", 20), _msg(6, "sim2", 10)]
+    merged = list(sources.merge_newest_first([sim1, sim2]))
+    assert [(m.source, m.ID) for m in merged] == [("sim1", 3), ("sim2", 7), ("sim2", 6), ("sim1", 2)]
+
+
+def test_cursor_round_trip():
+    m = InboxMessage(42, "+111", "x", datetime(2026, 3, 1, 9, 30, 5), "false", None)
+    token = sources.encode_cursor(m)
+    assert sources.decode_cursor(token) == (datetime(2026, 3, 1, 9, 30, 5), "", 42)
+    m.source = "default"
+    assert sources.decode_cursor(sources.encode_cursor(m)) == (datetime(2026, 3, 1, 9, 30, 5), "default", 42)
+    assert sources.decode_cursor("garbage") is None
+    assert sources.decode_cursor(None) is None and sources.decode_cursor("") is None
+    # A row without a time sorts (and pages) as the epoch
+    m.ReceivingDateTime = None
+    assert sources.decode_cursor(sources.encode_cursor(m)) == (datetime(1970, 1, 1), "default", 42)
+
+
+def test_cursor_round_trip_and_before_clause():
+    m = _msg(42, "sim.1", 5)
+    position = sources.decode_cursor(sources.encode_cursor(m))
+    assert position == (datetime(2026, 3, 1, 0, 0, 5), "sim.1", 42)
+    # Same timestamp: lower source ids sort later, higher ones earlier
+    assert sources._before_clause("sim.0", position)[0] == " AND ReceivingDateTime <= %s"
+    assert sources._before_clause("sim.2", position)[0] == " AND ReceivingDateTime < %s"
+    assert sources.decode_cursor("garbage") is None
+
+
+def test_parse_refs_groups_by_source(monkeypatch):
+    monkeypatch.setattr(sources, "_sources", [sources.Source("default", "localhost", None, None, None)])
+    refs = sources.parse_refs(["sim1:40.41", "sim2:7", "12,13"])
+    assert refs == {"sim1": [40, 41], "sim2": [7], "default": [12, 13]}
+
+
+class _FakeConn:
+    def __init__(self, host):
+        self.host = host
+
+    def close(self):
+        pass
+
+
+def test_read_only_connections_fail_over_and_respect_own_writes(monkeypatch):
+    source = sources.Source("default", "primary", None, None, None,
+                            replicas=sources._parse_hosts("r1, r2:3307", 3306))
+    assert source.replicas == (("r1", 3306), ("r2", 3307))
+    for name, value in (("_sources", [source]), ("_down_until", {}), ("_lag_checked", {}),
+                        ("_rotation", {}), ("_last_write", {})):
+        monkeypatch.setattr(sources, name, value)
+
+    def connect(self, host=None, port=None):
+        if host == "r1":
+            raise sources.storage.mysql.connector.Error("connection refused")
+        return _FakeConn(host or self.host)
+
+    monkeypatch.setattr(sources.Source, "connect", connect)
+    monkeypatch.setattr(sources, "_lag_ok", lambda conn, key: key[1] != "lagging")
+
+    assert [sources.get_db_connection(read_only=True).host for _ in range(3)] == ["r2", "r2", "r2"]
+    assert ("default", "r1", 3306) in sources._down_until
+    assert sources.get_db_connection().host == "primary"
+    sources.note_write("default")
+    assert sources.get_db_connection(read_only=True).host == "primary"
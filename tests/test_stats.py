@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+import importlib
+import os
+import sys
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+stats = importlib.import_module("sms-dashboard.stats")
+InboxMessage = importlib.import_module("sms-dashboard.multipart").InboxMessage
+
+
+def test_multipart_message_counted_once_via_first_part():
+    day = datetime(2026, 3, 1, 9, 30)
+    rows = [
+        InboxMessage(1, "+111", "Part1-", day, "false", "0003A40201"),
+        InboxMessage(2, "+111", "Part2", day + timedelta(seconds=1), "false", "0003A40202"),
+        InboxMessage(3, "+111", "Single", day, "true", None),
+        InboxMessage(4, "+222", "Other day", day + timedelta(days=1), "false", None),
+    ]
+    deltas = stats.compute_deltas(rows)
+    assert deltas == {
+        ("+111", day.date()): [2, 1, 1],
+        ("+222", (day + timedelta(days=1)).date()): [1, 1, 0],
+    }
+
+
+def test_read_and_delete_deltas_are_negative():
+    day = datetime(2026, 3, 1, 9, 30)
+    rows = [
+        InboxMessage(5, "+333", "Hi", day, "false", None),
+        InboxMessage(6, "+333", "Seen", day, "true", None),
+    ]
+    assert stats.compute_deltas(rows, sign=-1, unread_only=True) == {("+333", day.date()): [0, -1, 0]}
+    assert stats.compute_deltas(rows, sign=-1) == {("+333", day.date()): [-2, -1, 0]}
@@ -0,0 +1,348 @@
+from collections import Counter
+from datetime import datetime, timedelta
+import importlib
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+storage = importlib.import_module("sms-dashboard.storage")
+sources = importlib.import_module("sms-dashboard.sources")
+stats = importlib.import_module("sms-dashboard.stats")
+conversations = importlib.import_module("sms-dashboard.conversations")
+notifier = importlib.import_module("sms-dashboard.notifier")
+outbox = importlib.import_module("sms-dashboard.outbox")
+inbox = importlib.import_module("sms-dashboard.inbox")
+export = importlib.import_module("sms-dashboard.export")
+delivery = importlib.import_module("sms-dashboard.delivery")
+multipart = importlib.import_module("sms-dashboard.multipart")
+extract = importlib.import_module("sms-dashboard.extract")
+rollups = importlib.import_module("sms-dashboard.rollups")
+
+# Gammu's SQLite tables, trimmed to the columns the app uses
+GAMMU_SCHEMA = """
+CREATE TABLE inbox (
+    ReceivingDateTime NUMERIC NOT NULL DEFAULT (datetime('now')),
+    Text TEXT NOT NULL DEFAULT '',
+    SenderNumber TEXT NOT NULL DEFAULT '',
+    UDH TEXT NOT NULL DEFAULT '',
+    TextDecoded TEXT NOT NULL DEFAULT '',
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    RecipientID TEXT NOT NULL DEFAULT '',
+    Processed TEXT NOT NULL DEFAULT 'false'
+);
+CREATE TABLE outbox (
+    InsertIntoDB NUMERIC NOT NULL DEFAULT (datetime('now')),
+    SendingDateTime NUMERIC NOT NULL DEFAULT (datetime('now')),
+    Text TEXT,
+    DestinationNumber TEXT NOT NULL DEFAULT '',
+    Coding TEXT NOT NULL DEFAULT 'Default_No_Compression',
+    UDH TEXT,
+    TextDecoded TEXT NOT NULL DEFAULT '',
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    MultiPart TEXT NOT NULL DEFAULT 'false',
+    CreatorID TEXT NOT NULL
+);
+CREATE TABLE outbox_multipart (
+    Text TEXT,
+    Coding TEXT NOT NULL DEFAULT 'Default_No_Compression',
+    UDH TEXT,
+    TextDecoded TEXT,
+    ID INTEGER,
+    SequencePosition INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (ID, SequencePosition)
+);
+"""
+
+
+@pytest.fixture
+def sqlite_source(tmp_path, monkeypatch):
+    path = str(tmp_path / "smsd.db")
+    storage.sqlite_connect(path).raw.executescript(GAMMU_SCHEMA)
+    monkeypatch.setenv("DB_DRIVER", "sqlite")
+    monkeypatch.setenv("DB_PATH", path)
+    monkeypatch.delenv("DB_SOURCES", raising=False)
+    monkeypatch.setattr(sources, "_sources", None)
+    monkeypatch.setattr(stats, "_schema_ready", set())
+    monkeypatch.setattr(notifier, "_schema_ready", set())
+    monkeypatch.setattr(delivery, "_schema_ready", set())
+    monkeypatch.setattr(extract, "_schema_ready", set())
+    return sources.get_db_connection()
+
+
+def test_sqlite_connection_is_wal_and_cached_per_thread(sqlite_source):
+    conn = sqlite_source
+    assert conn.raw.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.raw.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    conn.close()
+    assert sources.get_db_connection() is conn
+
+
+def test_stats_and_conversations_on_sqlite(sqlite_source):
+    conn = sqlite_source
+    base = datetime(2026, 3, 1, 9, 30)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO inbox (ReceivingDateTime, SenderNumber, UDH, TextDecoded, Processed) VALUES (%s, %s, %s, %s, %s)",
+        [
+            (base, "+1", "", "hello", "false"),
+            (base + timedelta(minutes=1), "+1", "050003A40201", "part one ", "true"),
+            (base + timedelta(minutes=1), "+1", "050003A40202", "part two", "true"),
+            (base + timedelta(minutes=5), "+2", "", "later", "false"),
+        ],
+    )
+    conn.commit()
+
+    assert stats.sync(conn) == 4
+    assert stats.sync(conn) == 0
+    summary = stats.summary(conn)
+    assert (summary["total"], summary["unread"], summary["multipart"]) == (3, 2, 1)
+    listed = conversations.list_conversations(conn)
+    assert [(c["sender"], c["total"], c["unread"]) for c in listed] == [("+2", 1, 1), ("+1", 2, 1)]
+    assert listed[1]["last_text"] == "part two"
+
+    # Rows read back through the page reader are datetimes again
+    page, _next = sources.fetch_page(limit=10)
+    assert [m.TextDecoded for m in page] == ["later", "part one part two", "hello"]
+    assert page[0].ReceivingDateTime == base + timedelta(minutes=5)
+    # Several disjoint conditions are read separately and merged newest first
+    page, next_cursor = sources.fetch_page(limit=1, where=["SenderNumber = %s"] * 2, params=[["+2"], ["+1"]])
+    assert [m.TextDecoded for m in page] == ["later"]
+    page, _next = sources.fetch_page(limit=5, before=next_cursor, where=["SenderNumber = %s"] * 2,
+                                     params=[["+2"], ["+1"]])
+    assert [m.TextDecoded for m in page] == ["part one part two", "hello"]
+
+
+def test_stats_totals_follow_reads_and_deletes_on_sqlite(sqlite_source):
+    conn = sqlite_source
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO inbox (SenderNumber, TextDecoded, Processed) VALUES (%s, %s, %s)",
+        [("+1", "a", "false"), ("+1", "b", "false"), ("+2", "c", "false")],
+    )
+    conn.commit()
+    stats.sync(conn)
+    # Row 4 arrives after the last sync: reading or deleting it must not be
+    # subtracted now and added again by the next sync
+    cursor.execute("INSERT INTO inbox (SenderNumber, TextDecoded, Processed) VALUES ('+2', 'd', 'false')")
+    conn.commit()
+    assert inbox.mark_read({"default": [1, 4]}) == (2, [])
+    assert inbox.delete({"default": [2]}) == (1, [])
+    stats.sync(conn)
+    summary = stats.summary(conn)
+    assert (summary["total"], summary["unread"]) == (3, 1)
+    assert [(s["sender"], s["total"], s["unread"]) for s in summary["top_senders"]] == [("+2", 2, 1), ("+1", 1, 0)]
+    # The running totals match a recount
+    stats.rebuild(conn)
+    assert stats.summary(conn) == summary
+
+def test_page_takes_interleaved_parts_past_the_limit_on_sqlite(sqlite_source):
+    conn = sqlite_source
+    base = datetime(2026, 3, 1, 9, 30)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO inbox (ReceivingDateTime, SenderNumber, UDH, TextDecoded) VALUES (%s, %s, %s, %s)",
+        [
+            (base, "+1", "", "oldest"),
+            (base + timedelta(seconds=1), "+1", "050003A40201", "part one "),
+            (base + timedelta(seconds=2), "+2", "", "between"),
+            (base + timedelta(seconds=3), "+1", "050003A40202", "part two"),
+            (base + timedelta(seconds=4), "+2", "", "newest"),
+        ],
+    )
+    conn.commit()
+    # The limit cuts between the two parts, with another message in between
+    page, next_cursor = sources.fetch_page(limit=2)
+    assert [m.TextDecoded for m in page] == ["newest", "part one part two", "between"]
+    page, next_cursor = sources.fetch_page(limit=2, before=next_cursor)
+    assert [m.TextDecoded for m in page] == ["oldest"] and next_cursor is None
+
+def test_notification_queue_on_sqlite(sqlite_source, monkeypatch):
+    monkeypatch.setenv("NOTIFY_MAX_ATTEMPTS", "2")
+    conn = sqlite_source
+    token = notifier.acquire(conn, holder=notifier.HOLDER_ID)
+    received = datetime(2026, 3, 1, 9, 30)
+    one = multipart.InboxMessage(4, "+1", "one", received, "false")
+    two = multipart.InboxMessage(6, "+2", "two parts", received, "false", part_ids=(5, 6))
+    entries = [(one, "100"), (two, "100"), (two, "200")]
+    assert delivery.enqueue(conn, token, entries, 0, 6)
+    # Queued once per SMS and chat, even when a poll is repeated
+    assert delivery.enqueue(conn, token, entries, 6, 6)
+    assert notifier.load_cursor(conn) == 6
+    first, second, copy = delivery.due(conn)
+    assert second.message("sim1").ref == "sim1:5.6" and second.ReceivingDateTime == received
+    assert (second.chat_id, copy.chat_id) == ("100", "200")
+    assert delivery.mark_sent(conn, token, copy)
+
+    assert delivery.mark_failed(conn, token, first, "timed out") == delivery.PENDING
+    assert [n.ID for n in delivery.due(conn)] == [6]  # the retry waits for its backoff
+    assert delivery.mark_failed(conn, token, second, "HTTP 400: message is too long", permanent=True) == delivery.DEAD
+    assert delivery.depth(conn)["pending"] == 1 and delivery.depth(conn)["dead"] == 1
+    assert delivery.dead_letters(conn)[0]["error"] == "HTTP 400: message is too long"
+
+    assert delivery.retry_dead(conn) == 1
+    assert delivery.mark_sent(conn, token, delivery.due(conn)[0])
+    depth = delivery.depth(conn)
+    assert (depth["pending"], depth["dead"]) == (1, 0)
+    # A stale term writes nothing
+    assert not delivery.enqueue(conn, token + 1, [(multipart.InboxMessage(9, "+3", "x", received, "false"), "100")], 6, 9)
+    assert notifier.load_cursor(conn) == 6 and not notifier.holds(conn, token + 1)
+    assert notifier.holds(conn, token)
+
+
+def test_extraction_is_stored_once_and_backfilled_on_sqlite(sqlite_source, monkeypatch):
+    conn = sqlite_source
+    base = datetime(2026, 3, 1, 9, 30)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO inbox (ReceivingDateTime, SenderNumber, UDH, TextDecoded, Processed) VALUES (%s, %s, %s, %s, %s)",
+        [
+            (base, "+1", "", "Your code is 4821", "false"),
+            (base, "BANK", "050003A40201", "Deposit of 1,500 ", "false"),
+            (base + timedelta(seconds=2), "BANK", "050003A40202", "USD. Details: https://bank.example/t/1", "false"),
+        ],
+    )
+    conn.commit()
+    cursor.close()
+    scanned = []
+    monkeypatch.setattr(extract, "_memo", extract.OrderedDict())
+    monkeypatch.setattr(extract, "scan", lambda text, scan=extract.scan: scanned.append(text) or scan(text))
+
+    assert extract.backfill(conn, "sim1", batch=10) == 2
+    assert extract.backfill(conn, "sim1", batch=10) == 0  # stored messages are skipped
+    assert len(scanned) == 2
+    found = extract.load(conn, [1, 3])
+    assert found[1].codes == ("4821",)
+    assert found[3].amounts == ("1,500 USD",) and found[3].links == ("https://bank.example/t/1",)
+
+    page, _next = sources.fetch_page(limit=10)
+    results = extract.lookup_all(page)
+    assert results[(page[0].source, 3)] == found[3] and len(scanned) == 2
+
+    # A message split across two batches is stored once, from its whole text
+    conn.cursor().execute(f"DELETE FROM {extract.TABLE}")
+    conn.commit()
+    assert extract.backfill(conn, "sim1", batch=2) == 2
+    found = extract.load(conn, [1, 2, 3])
+    assert sorted(found) == [1, 3] and found[3].links == ("https://bank.example/t/1",)
+
+
+def test_export_checks_every_source_before_streaming(sqlite_source):
+    down = sources.Source("down", None, None, None, None, driver="sqlite")
+    with pytest.raises(RuntimeError, match="down: database connection failed"):
+        export.iter_messages(sources=[sources.get_source(), down])
+    assert list(export.iter_messages(sources=[sources.get_source()])) == []
+
+def test_outbox_queue_on_sqlite(sqlite_source, monkeypatch):
+    monkeypatch.setenv("OUTBOX_RATE_PER_MINUTE", "20")
+    conn = sqlite_source
+    assert outbox.queue(conn, [("+1", "hi"), ("+2", "x" * 200)]) == 2
+    cursor = conn.cursor()
+    cursor.execute("SELECT DestinationNumber, MultiPart, SendingDateTime FROM outbox ORDER BY SendingDateTime")
+    rows = cursor.fetchall()
+    assert [(n, mp) for n, mp, _t in rows] == [("+1", "false"), ("+2", "true")]
+    assert rows[1][2] - rows[0][2] == timedelta(seconds=3)
+    cursor.execute("SELECT COUNT(*) FROM outbox_multipart")
+    assert cursor.fetchone()[0] == 1
+
+
+def test_select_all_matching_is_bounded_by_the_snapshot(sqlite_source, monkeypatch):
+    monkeypatch.setattr(inbox, "BATCH_SIZE", 2)
+    conn = sqlite_source
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO inbox (SenderNumber, TextDecoded, Processed) VALUES (%s, %s, %s)",
+        [("+1", "a", "false"), ("+2", "b", "false"), ("+1", "c", "true"), ("+1", "d", "false"), ("+1", "e", "false")],
+    )
+    conn.commit()
+    where, params = export.build_filter(state="unread")
+    # Row 5 arrived after the page was loaded; row 4 was unticked
+    refs = inbox.select_matching(where, params, {"default": 4}, {"default": [4]})
+    assert refs == {"default": [1, 2]}
+    assert inbox.select_matching(where, params, {"other": 9}, {}) == {}
+
+    # Marked in batches of two, with the counters kept in step
+    stats.sync(conn)
+    assert inbox.mark_read(inbox.select_matching(where, params, {"default": 5}, {})) == (4, [])
+    assert stats.summary(sources.get_db_connection())["unread"] == 0
+
+
+def test_traffic_rollups_follow_arrivals_reads_and_backfill_on_sqlite(sqlite_source):
+    conn = sqlite_source
+    base = datetime(2026, 3, 1, 9, 30)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO inbox (ReceivingDateTime, SenderNumber, UDH, TextDecoded, Processed) VALUES (%s, %s, %s, %s, %s)",
+        [
+            (base, "+1", "", "hello", "false"),
+            (base + timedelta(minutes=40), "+1", "050003A40201", "part one ", "false"),
+            (base + timedelta(minutes=40), "+1", "050003A40202", "part two", "false"),
+            (base + timedelta(hours=3), "+2", "", "later", "false"),
+        ],
+    )
+    conn.commit()
+    stats.sync(conn)
+    start, end = datetime(2026, 3, 1, 9), datetime(2026, 3, 1, 13)
+    hourly = rollups.series(conn, "hour", start, end)
+    assert hourly == {datetime(2026, 3, 1, 9): [1, 1], datetime(2026, 3, 1, 10): [1, 1],
+                      datetime(2026, 3, 1, 12): [1, 1]}
+    assert rollups.series(conn, "day", start.date(), end.date() + timedelta(days=1), ["+1"]) == {
+        start.date(): [2, 2]}
+
+    # Marking the multipart message read moves it from unread to read in its hour
+    assert inbox.mark_read({"default": [2, 3]}) == (2, [])
+    assert rollups.series(conn, "hour", start, end, ["+1"])[datetime(2026, 3, 1, 10)] == [1, 0]
+    assert rollups.top_senders(conn, "day", start.date(), end.date() + timedelta(days=1)) == [
+        {"sender": "+1", "total": 2, "unread": 1}, {"sender": "+2", "total": 1, "unread": 1}]
+    assert rollups.top_senders(conn, "hour", start, end, senders=["+2", "2"]) == [
+        {"sender": "+2", "total": 1, "unread": 1}]
+
+    # A backfill recomputes the same rollups from inbox
+    before = rollups.series(conn, "hour", start, end)
+    rollups.reset(cursor)
+    conn.commit()
+    assert rollups.backfill(conn) == 4
+    assert rollups.series(conn, "hour", start, end) == before
+    buckets = rollups.combine([(before, [])], "hour", start, end)["buckets"]
+    assert [b["total"] for b in buckets] == [1, 1, 0, 1]
+
+
+def test_notifier_memory_stays_bounded_on_sqlite(sqlite_source, monkeypatch):
+    """A short soak of the poll and delivery passes (see `sms-loadtest soak` for hours)."""
+    pytest.importorskip("telegram")
+    bot = importlib.import_module("sms-dashboard.bot")
+    memwatch = importlib.import_module("sms-dashboard.memwatch")
+    routing = importlib.import_module("sms-dashboard.routing")
+    tracing = importlib.import_module("sms-dashboard.tracing")
+    sent = Counter()  # a list of every send would itself grow
+    monkeypatch.setattr(bot, "send_message_to_telegram", lambda message, chat_id, found=None: sent.update([chat_id]))
+    monkeypatch.setattr(bot, "router", routing.RouterFile(None, ["1"]))
+    # Bounded caches are filled quickly, so what grows afterwards is a leak
+    monkeypatch.setattr(bot, "lag_tracer", tracing.Tracer(window=20))
+    monkeypatch.setattr(extract, "MEMO_SIZE", 20)
+    conn, source = sqlite_source, sources.get_source()
+    watch = memwatch.MemoryWatch()
+    traced = []
+    watch.start()
+    try:
+        for cycle in range(120):
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO inbox (ReceivingDateTime, SenderNumber, TextDecoded) VALUES (%s, %s, %s)",
+                [(datetime.now(), f"+1555{cycle % 7}", f"Your code is {cycle:06d}") for _ in range(3)],
+            )
+            conn.commit()
+            bot.poll_as_leader(conn, source, {})
+            while bot.deliver_due(conn, source):
+                pass
+            bot.lag_tracer.flush()  # as the delivery loop does after each pass
+            if cycle % 10 == 9:
+                traced.append(watch.sample().traced)
+    finally:
+        tracemalloc.stop()
+    assert sent == {"1": 360}
+    assert memwatch.growth(traced, warmup=4) < 128 * 1024, traced
@@ -0,0 +1,86 @@
+import importlib
+import json
+import os
+import sys
+from datetime import datetime
+
+# Import through the package (the module uses relative imports); the name contains a hyphen
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+tracing = importlib.import_module("sms-dashboard.tracing")
+multipart = importlib.import_module("sms-dashboard.multipart")
+
+
+def _message(ids, received, source="sim1"):
+    return multipart.InboxMessage(ID=ids[-1], SenderNumber="+1", TextDecoded="hi", ReceivingDateTime=received,
+                                  Processed="false", part_ids=tuple(ids) if len(ids) > 1 else None, source=source)
+
+
+def test_stages_follow_the_first_sighting_of_each_part():
+    received = datetime(2026, 5, 1, 12, 0, 0)
+    t0 = received.timestamp()
+    tracer = tracing.Tracer(window=10)
+    # The first part is read 3 s after receipt, the second one a poll later
+    tracer.picked_up("sim1", [7], at=t0 + 3)
+    tracer.picked_up("sim1", [7, 8], at=t0 + 13)
+    message = _message([7, 8], received)
+    tracer.assembled(message, at=t0 + 13)
+    trace = tracer.sending(message)
+    trace.sent = t0 + 14
+    tracer.finish(trace, ok=True)
+    trace.acked = t0 + 14.5  # pin the clock for the assertions
+
+    assert trace.stages() == {"pickup": 3.0, "assembly": 10.0, "queue": 1.0, "send": 0.5, "total": 14.5}
+    assert tracer.sending(message) is None  # one trace per notification
+
+    summary = tracer.summary()
+    assert summary["count"] == 1 and summary["failed"] == 0
+    assert summary["stages"]["pickup"]["p95"] == 3.0
+    text = tracing.format_lag(summary)
+    assert "pickup: p50 3.00s" in text and "assembly: p50 10s" in text
+
+
+def test_failed_sends_are_counted_but_not_measured():
+    tracer = tracing.Tracer(window=10)
+    message = _message([1], datetime.now())
+    tracer.picked_up("sim1", [1])
+    tracer.assembled(message)
+    tracer.finish(tracer.sending(message), ok=False)
+    assert tracer.failed == 1 and tracer.histograms["total"].count == 0
+    assert tracer.summary()["count"] == 0
+    assert "Failed sends: 1" in tracing.format_lag(tracer.summary())
+    assert "No notifications" in tracing.format_lag(tracing.Tracer(window=10).summary())
+
+
+def test_histogram_buckets_and_prometheus_text():
+    h = tracing.Histogram((1, 5))
+    for value in (0.5, 1, 3, 60):
+        h.observe(value)
+    assert h.cumulative() == [("1", 2), ("5", 3), ("+Inf", 4)]
+    text = tracing.prometheus_text({"total": h}, failed=2)
+    assert 'sms_delivery_lag_seconds_bucket{stage="total",le="+Inf"} 4' in text
+    assert 'sms_delivery_lag_seconds_sum{stage="total"} 64.500' in text
+    assert "sms_notifications_failed_total 2" in text
+
+
+def test_flush_exports_otlp_spans_and_metrics(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    monkeypatch.setenv("LAG_METRICS_FILE", str(tmp_path / "lag.prom"))
+    monkeypatch.delenv("OTEL_EXPORTER_OTLP_ENDPOINT", raising=False)
+    tracer = tracing.Tracer(window=10)
+    message = _message([3], datetime.now())
+    tracer.picked_up("sim1", [3])
+    tracer.assembled(message)
+    tracer.finish(tracer.sending(message), ok=True)
+    tracer.flush()
+    tracer.flush()  # nothing new: no second line
+
+    lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert len(lines) == 1
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root = spans[0]
+    assert root["name"] == "sms.delivery" and root["status"] == {"code": 1}
+    assert [s["name"] for s in spans[1:]] == ["sms.pickup", "sms.assembly", "sms.queue", "sms.send"]
+    assert {s["parentSpanId"] for s in spans[1:]} == {root["spanId"]}
+    assert all(int(s["startTimeUnixNano"]) <= int(s["endTimeUnixNano"]) for s in spans)
+    assert 'sms_delivery_lag_seconds_count{stage="send"} 1' in (tmp_path / "lag.prom").read_text()
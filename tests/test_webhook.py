@@ -0,0 +1,40 @@
+import importlib
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+# Import through the package (the name contains a hyphen)
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+webhook = importlib.import_module("sms-dashboard.webhook")
+
+UPDATE = {"update_id": 1, "callback_query": {"id": "7", "data": "read_default:40.41"}}
+
+
+def _post(port, body, secret):
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{port}/telegram",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json", webhook.SECRET_HEADER: secret},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status
+    except urllib.error.HTTPError as err:
+        return err.code
+
+
+def test_listener_checks_secret_and_dispatches_recorded_update():
+    received = []
+    server = webhook.WebhookServer("127.0.0.1", 0, "/telegram", "s3cret", received.append)
+    server.start()
+    try:
+        port = server.server_address[1]
+        assert _post(port, UPDATE, "wrong") == 403
+        assert received == []
+        assert _post(port, UPDATE, "s3cret") == 200
+        assert received == [UPDATE]
+    finally:
+        server.stop()